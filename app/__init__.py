@@ -19,6 +19,8 @@ socketio = SocketIO(app, cors_allowed_origins="*", async_mode='eventlet')
 def init_db():
     with app.app_context():
         db.create_all()
+        from app.migrations import apply_migrations
+        apply_migrations()
 
 # Only initialize database if being run directly
 if __name__ == "__main__":
@@ -31,10 +33,32 @@ try:
 except Exception as e:
     print(f"⚠️  Warning: Could not import routes: {e}")
 
+# Register Flask CLI commands
+from app import cli
+
 # Import and initialize WebSocket manager
 from app.websocket_manager import init_websocket_manager
 init_websocket_manager()
 
+# Bring existing databases up to the current schema
+with app.app_context():
+    try:
+        db.create_all()
+        from app.migrations import apply_migrations
+        apply_migrations()
+    except Exception as e:
+        print(f"⚠️  Warning: Could not apply database migrations: {e}")
+
+# Build the address allocators of all pools from the database
+with app.app_context():
+    try:
+        from app.ip_allocator import get_ip_allocator
+        from app.utils import get_pool_networks
+        for network in get_pool_networks():
+            get_ip_allocator().rebuild(network)
+    except Exception as e:
+        print(f"⚠️  Warning: Could not build IP allocator: {e}")
+
 # Generate initial wg0.conf file on startup
 with app.app_context():
     try:
@@ -0,0 +1,539 @@
+"""
+Bulk peer provisioning and lifecycle operations
+Validates a whole batch with set-based queries, allocates addresses in one
+pass over the allocator bitmaps, inserts in batches inside one transaction
+and regenerates wg0.conf once, instead of N single-peer round trips.
+
+Modes:
+  atomic       any invalid row rejects the whole batch (nothing is written)
+  best_effort  valid rows are created, invalid rows are reported
+
+Activate/deactivate/delete select peers by ids, name pattern and/or tag and
+run as set-based statements with one commit, one wg0.conf regeneration
+and one WebSocket event. Firewall templates are applied to such a selection
+the same way, followed by one incremental firewall apply.
+"""
+
+import csv
+import io
+import ipaddress
+import os
+import re
+
+from sqlalchemy import func, insert
+from sqlalchemy.exc import IntegrityError
+
+from app import db, socketio
+from app.cidr import find_overlapping_pairs, network_interval
+from app.ip_allocator import get_ip_allocator
+from app.keygen import generate_preshared_key, get_keypair
+from app.firewall_compiler import TEMPLATE_PRIORITY
+from app.models import AllowedIP, FirewallRule, FirewallTemplate, Peer, PeerStatistics, PeerTag
+from app.network_index import get_network_index
+from app.utils import (apply_firewall_changes, generate_wg0_conf, get_pool_networks, resolve_pool_network,
+                       validate_wireguard_key)
+
+BULK_MAX_PEERS = int(os.getenv("BULK_MAX_PEERS", "5000"))
+BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", "500"))
+QUERY_CHUNK_SIZE = 500  # stay below SQLite's bound-parameter limit in IN (...) lists
+
+MODES = ('atomic', 'best_effort')
+CSV_FIELDS = ('name', 'public_key', 'endpoint', 'persistent_keepalive', 'allowed_ips', 'address_pool', 'address_pool_v6', 'tags')
+ACTIONS = ('activate', 'deactivate', 'delete')
+TEMPLATE_MODES = ('copy', 'link', 'unlink')
+
+
+def parse_csv_rows(text):
+    """Rows of a CSV upload; allowed_ips may hold several networks separated by ';' or spaces"""
+    reader = csv.DictReader(io.StringIO(text))
+    if not reader.fieldnames or 'name' not in reader.fieldnames:
+        raise ValueError("CSV must have a header row with at least a 'name' column")
+    rows = []
+    for record in reader:
+        row = {field: (record.get(field) or '').strip() for field in CSV_FIELDS}
+        row['allowed_ips'] = [network for network in re.split(r'[;,\s]+', row['allowed_ips']) if network]
+        row['tags'] = [tag for tag in re.split(r'[;,\s]+', row['tags']) if tag]
+        rows.append({key: value for key, value in row.items() if value not in ('', [])})
+    return rows
+
+
+def _existing_values(column, values):
+    """Which of the given values already exist in a column, in chunked IN queries"""
+    values = list(values)
+    found = set()
+    for offset in range(0, len(values), QUERY_CHUNK_SIZE):
+        chunk = values[offset:offset + QUERY_CHUNK_SIZE]
+        found.update(value for (value,) in db.session.query(column).filter(column.in_(chunk)).all())
+    return found
+
+
+def _normalize_row(row):
+    """Field-level validation of one row; returns (cleaned row, errors)"""
+    errors = []
+    if not isinstance(row, dict):
+        return None, ['Row must be an object']
+
+    name = str(row.get('name') or '').strip()
+    if not name:
+        errors.append('Name is required')
+    elif len(name) > 50:
+        errors.append('Name cannot be longer than 50 characters')
+    elif not re.match(r'^[a-zA-Z0-9_-]+$', name):
+        errors.append('Name can only contain letters, numbers, hyphens and underscores')
+
+    public_key = str(row.get('public_key') or '').strip() or None
+    if public_key and not validate_wireguard_key(public_key):
+        errors.append('Invalid WireGuard public key format')
+
+    endpoint = str(row.get('endpoint') or '').strip() or None
+    if endpoint:
+        match = re.match(r'^[a-zA-Z0-9.-]+:(\d+)$', endpoint)
+        if not match:
+            errors.append('Endpoint must be in format host:port (e.g., example.com:51820)')
+        elif not 1 <= int(match.group(1)) <= 65535:
+            errors.append('Endpoint port must be between 1 and 65535')
+
+    keepalive = row.get('persistent_keepalive', 25)
+    try:
+        keepalive = int(keepalive) if keepalive not in (None, '') else None
+        if keepalive is not None and not 0 <= keepalive <= 65535:
+            errors.append('Persistent keepalive must be between 0 and 65535')
+    except (ValueError, TypeError):
+        errors.append('Persistent keepalive must be a valid number')
+
+    allowed_ips = row.get('allowed_ips') or []
+    if isinstance(allowed_ips, str):
+        allowed_ips = [network for network in re.split(r'[;,\s]+', allowed_ips) if network]
+    networks = []
+    for network in allowed_ips:
+        try:
+            networks.append(str(ipaddress.ip_network(str(network).strip(), strict=False)))
+        except ValueError:
+            errors.append(f"Invalid IP network format: {network}")
+
+    tags = row.get('tags') or []
+    if isinstance(tags, str):
+        tags = [tag for tag in re.split(r'[;,\s]+', tags) if tag]
+    tags = sorted({str(tag).strip() for tag in tags if str(tag).strip()})
+    if any(len(tag) > 50 for tag in tags):
+        errors.append('Tags cannot be longer than 50 characters')
+
+    return {
+        'name': name,
+        'public_key': public_key,
+        'endpoint': endpoint,
+        'persistent_keepalive': keepalive,
+        'allowed_ips': networks,
+        'address_pool': row.get('address_pool') or None,
+        'address_pool_v6': row.get('address_pool_v6') or None,
+        'tags': tags,
+    }, errors
+
+
+def _validate(rows):
+    """Validate the batch; returns (cleaned rows, per-row error lists)"""
+    cleaned, errors = [], []
+    for row in rows:
+        values, row_errors = _normalize_row(row)
+        cleaned.append(values)
+        errors.append(row_errors)
+
+    # Duplicates inside the batch, then against the database (one query per chunk)
+    for field, column, label in (('name', Peer.name, 'name'), ('public_key', Peer.public_key, 'public key')):
+        seen = {}
+        for index, values in enumerate(cleaned):
+            value = values and values[field]
+            if not value:
+                continue
+            if value in seen:
+                errors[index].append(f"Duplicate {label} in batch (row {seen[value]})")
+            else:
+                seen[value] = index
+        for value in _existing_values(column, seen):
+            errors[seen[value]].append(f"Peer with this {label} already exists")
+
+    # Allowed IPs: pools and existing peers through the network index, then overlaps inside the batch
+    pool_networks = [ipaddress.ip_network(network, strict=False) for network in get_pool_networks()]
+    index_overlaps = get_network_index().overlapping
+    intervals = []
+    for index, values in enumerate(cleaned):
+        if values is None:
+            continue
+        for network in values['allowed_ips']:
+            parsed = ipaddress.ip_network(network)
+            pool = next((pool for pool in pool_networks if parsed.overlaps(pool)), None)
+            taken = next((entry for entry in index_overlaps(parsed) if entry.kind != 'pool'), None)
+            if pool is not None:
+                errors[index].append(f"IP network {network} overlaps with VPN subnet {pool}")
+            elif taken is not None:
+                errors[index].append(f"IP network {network} overlaps with peer '{taken.peer_name}' {taken.kind} IP {taken.network}")
+            else:
+                intervals.append(network_interval(network) + ((index, network),))
+    for pair in find_overlapping_pairs(intervals):
+        (first_row, first_network), (row, network) = sorted(pair)
+        errors[row].append(f"IP network {network} overlaps with {first_network} of row {first_row}")
+
+    # Address pools must exist (one lookup per distinct pool name)
+    pools = {}
+    for index, values in enumerate(cleaned):
+        if values is None:
+            continue
+        for family, key in ((4, 'address_pool'), (6, 'address_pool_v6')):
+            if (family, values[key]) not in pools:
+                try:
+                    resolve_pool_network(family, values[key])
+                    pools[(family, values[key])] = None
+                except ValueError as e:
+                    pools[(family, values[key])] = str(e)
+            if pools[(family, values[key])]:
+                errors[index].append(pools[(family, values[key])])
+
+    return cleaned, errors
+
+
+def _allocate(cleaned, indexes, errors=None):
+    """
+    Assign addresses for the given rows in one pass; reserves them in the allocator bitmaps
+    An exhausted pool raises ValueError, or with errors (best_effort) is
+    recorded on the row, which is left out of the result.
+    """
+    allocator = get_ip_allocator()
+    networks = {}
+    addresses = {}
+    for index in indexes:
+        values = cleaned[index]
+        assigned = []
+        for family, key in ((4, 'address_pool'), (6, 'address_pool_v6')):
+            cache_key = (family, values[key])
+            if cache_key not in networks:
+                networks[cache_key] = resolve_pool_network(family, values[key])
+            network = networks[cache_key]
+            if network is None:
+                assigned.append(None)
+                continue
+            address = allocator.next_available(network)
+            if address is None:
+                if errors is None:
+                    raise ValueError(f"No available IP addresses in subnet {network}")
+                errors[index].append(f"No available IP addresses in subnet {network}")
+                for reserved in filter(None, assigned):
+                    allocator.release(reserved)
+                break
+            allocator.reserve(address)
+            assigned.append(address)
+        else:
+            addresses[index] = tuple(assigned)
+    return addresses
+
+
+def _build_peer(values, addresses):
+    private_key = None
+    public_key = values['public_key']
+    if not public_key:
+        private_key, public_key = get_keypair()
+    peer = Peer(
+        name=values['name'],
+        public_key=public_key,
+        preshared_key=generate_preshared_key(),
+        assigned_ip=addresses[0],
+        assigned_ipv6=addresses[1],
+        endpoint=values['endpoint'],
+        persistent_keepalive=values['persistent_keepalive'],
+        is_active=True
+    )
+    return peer, private_key
+
+
+def _insert(cleaned, indexes, addresses):
+    """Insert one batch of rows and their allowed IPs; returns {row index: (peer, private key)}"""
+    created = {}
+    for index in indexes:
+        created[index] = _build_peer(cleaned[index], addresses[index])
+    db.session.add_all(peer for peer, _ in created.values())
+    db.session.flush()
+    db.session.add_all(
+        AllowedIP(peer_id=created[index][0].id, ip_network=network)
+        for index in indexes for network in cleaned[index]['allowed_ips']
+    )
+    db.session.add_all(
+        PeerTag(peer_id=created[index][0].id, tag=tag)
+        for index in indexes for tag in cleaned[index]['tags']
+    )
+    db.session.flush()
+    return created
+
+
+def _row_result(index, values, errors=None, peer=None, private_key=None):
+    result = {'row': index, 'name': values['name'] if values else None}
+    if peer is None:
+        result.update({'status': 'error' if errors else 'skipped', 'errors': errors or []})
+        return result
+    result.update({
+        'status': 'created',
+        'id': peer.id,
+        'public_key': peer.public_key,
+        'assigned_ip': peer.assigned_ip,
+        'assigned_ipv6': peer.assigned_ipv6,
+        'allowed_ips': values['allowed_ips'],
+        'tags': values['tags'],
+    })
+    if private_key:
+        result['private_key'] = private_key  # generated server-side; only ever returned here
+    return result
+
+
+def provision_peers(rows, mode='atomic', regenerate_config=True):
+    """
+    Create many peers in one transaction and one config reload
+    Returns {"status", "message", "mode", "summary", "results"}; results hold
+    one entry per input row in input order.
+    """
+    if mode not in MODES:
+        raise ValueError(f"mode must be one of: {', '.join(MODES)}")
+    if not isinstance(rows, list) or not rows:
+        raise ValueError("At least one peer is required")
+    if len(rows) > BULK_MAX_PEERS:
+        raise ValueError(f"At most {BULK_MAX_PEERS} peers can be provisioned per request")
+
+    cleaned, errors = _validate(rows)
+    invalid = [index for index, row_errors in enumerate(errors) if row_errors]
+    valid = [index for index, row_errors in enumerate(errors) if not row_errors]
+
+    if invalid and mode == 'atomic':
+        return {
+            'status': 'error',
+            'message': f'Validation failed for {len(invalid)} of {len(rows)} peers; nothing was created',
+            'mode': mode,
+            'summary': {'requested': len(rows), 'created': 0, 'failed': len(invalid)},
+            'results': [_row_result(index, cleaned[index], errors[index]) for index in range(len(rows))],
+        }
+
+    allocator = get_ip_allocator()
+    created = {}
+    try:
+        addresses = _allocate(cleaned, valid, errors if mode == 'best_effort' else None)
+        valid = [index for index in valid if index in addresses]
+        for offset in range(0, len(valid), BULK_BATCH_SIZE):
+            batch = valid[offset:offset + BULK_BATCH_SIZE]
+            if mode == 'atomic':
+                created.update(_insert(cleaned, batch, addresses))
+                continue
+            try:
+                with db.session.begin_nested():
+                    created.update(_insert(cleaned, batch, addresses))
+            except IntegrityError:
+                # A concurrent writer took a name, key or address: retry row by row to isolate it
+                for index in batch:
+                    try:
+                        with db.session.begin_nested():
+                            created.update(_insert(cleaned, [index], addresses))
+                    except IntegrityError as e:
+                        errors[index].append(f"Database constraint violated: {e.orig}")
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        allocator.invalidate()  # drop reservations for rows that were never written
+        raise
+
+    for index in range(len(rows)):
+        if index not in created and index in addresses:
+            for address in addresses[index]:
+                allocator.release(address)
+
+    if created and regenerate_config:
+        generate_wg0_conf()
+
+    failed = len(rows) - len(created)
+    return {
+        'status': 'success' if not failed else 'partial' if created else 'error',
+        'message': f'Created {len(created)} of {len(rows)} peers',
+        'mode': mode,
+        'summary': {'requested': len(rows), 'created': len(created), 'failed': failed},
+        'results': [
+            _row_result(index, cleaned[index], errors[index], *created.get(index, (None, None)))
+            for index in range(len(rows))
+        ],
+    }
+
+
+def _chunks(values):
+    for offset in range(0, len(values), QUERY_CHUNK_SIZE):
+        yield values[offset:offset + QUERY_CHUNK_SIZE]
+
+
+def _like_pattern(pattern):
+    """Translate a shell-style name pattern (* and ?) into a LIKE pattern with '\\' as escape"""
+    escaped = pattern.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return escaped.replace('*', '%').replace('?', '_')
+
+
+def select_peer_ids(ids=None, name_pattern=None, tag=None):
+    """
+    Ids of the peers matching every given selector, in one query
+    ids: list of peer ids; name_pattern: shell-style glob ('sales-*'); tag: tag name
+    """
+    if not ids and not name_pattern and not tag:
+        raise ValueError("Select peers by ids, name_pattern and/or tag")
+
+    query = db.session.query(Peer.id)
+    if ids:
+        try:
+            ids = sorted({int(peer_id) for peer_id in ids})
+        except (TypeError, ValueError):
+            raise ValueError("ids must be a list of peer ids")
+        query = query.filter(Peer.id.in_(ids))
+    if name_pattern:
+        query = query.filter(Peer.name.like(_like_pattern(name_pattern), escape='\\'))
+    if tag:
+        query = query.filter(Peer.id.in_(db.session.query(PeerTag.peer_id).filter(PeerTag.tag == tag)))
+    return [peer_id for (peer_id,) in query.order_by(Peer.id).all()]
+
+
+def bulk_peer_action(action, ids=None, name_pattern=None, tag=None, regenerate_config=True):
+    """
+    Activate, deactivate or delete every selected peer with one commit, one
+    reload and one firewall apply
+    Emits a single consolidated peer_action_result event.
+    """
+    if action not in ACTIONS:
+        raise ValueError(f"action must be one of: {', '.join(ACTIONS)}")
+
+    peer_ids = select_peer_ids(ids, name_pattern, tag)
+    changed_ids = peer_ids
+    try:
+        if action == 'delete':
+            # Dependent rows first: set-based deletes bypass the ORM cascades
+            for chunk in _chunks(peer_ids):
+                for model in (AllowedIP, FirewallRule, PeerStatistics, PeerTag):
+                    model.query.filter(model.peer_id.in_(chunk)).delete(synchronize_session=False)
+                Peer.query.filter(Peer.id.in_(chunk)).delete(synchronize_session=False)
+        else:
+            is_active = action == 'activate'
+            changed_ids = [peer_id for chunk in _chunks(peer_ids) for (peer_id,) in
+                           db.session.query(Peer.id).filter(Peer.id.in_(chunk), Peer.is_active != is_active).all()]
+            for chunk in _chunks(changed_ids):
+                Peer.query.filter(Peer.id.in_(chunk)).update({'is_active': is_active}, synchronize_session=False)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    db.session.expire_all()
+
+    if changed_ids and regenerate_config:
+        generate_wg0_conf()
+
+    past_tense = {'activate': 'activated', 'deactivate': 'deactivated', 'delete': 'deleted'}[action]
+    result = {
+        'status': 'success',
+        'action': action,
+        'peer_ids': peer_ids,
+        'changed_peer_ids': changed_ids,
+        'matched': len(peer_ids),
+        'changed': len(changed_ids),
+        'message': f'{len(changed_ids)} of {len(peer_ids)} selected peers {past_tense}',
+    }
+    if action != 'delete':
+        result['is_active'] = action == 'activate'
+    if changed_ids:
+        # Deleted or deactivated peers lose their chains and jumps before a new peer can take the address
+        firewall = apply_firewall_changes(changed_ids)
+        if firewall is not None:
+            result['firewall'] = firewall
+    socketio.emit('peer_action_result', result)
+    return result
+
+
+def _linked_counts(peer_ids):
+    """template_id -> how many of the peers are linked to it"""
+    counts = {}
+    for chunk in _chunks(peer_ids):
+        rows = db.session.query(Peer.firewall_template_id, func.count(Peer.id)).filter(
+            Peer.id.in_(chunk), Peer.firewall_template_id.isnot(None)).group_by(Peer.firewall_template_id)
+        for template_id, count in rows:
+            counts[template_id] = counts.get(template_id, 0) + count
+    return counts
+
+
+def _add_usage(template_id, count):
+    if count:
+        FirewallTemplate.query.filter(FirewallTemplate.id == template_id).update(
+            {'usage_count': FirewallTemplate.usage_count + count}, synchronize_session=False)
+
+
+def apply_firewall_template(template, mode='copy', ids=None, name_pattern=None, tag=None, replace=False,
+                            apply_firewall=True):
+    """
+    Apply a firewall template to every selected peer in one transaction
+    copy: insert the template's rules as FirewallRule rows for every peer in
+          batched multi-row inserts; replace deletes the peers' rules first
+    link: point the peers at the template; the firewall plan adds its rules
+          on load, so template edits reach every linked peer without copies
+    unlink: remove the peers' link to this template
+    usage_count is updated once per template; afterwards the firewall is
+    reconciled once for the changed peers.
+    """
+    if mode not in TEMPLATE_MODES:
+        raise ValueError(f"mode must be one of: {', '.join(TEMPLATE_MODES)}")
+    if mode != 'unlink' and not template.is_active:
+        raise ValueError(f"Template {template.name} is not active")
+
+    peer_ids = select_peer_ids(ids, name_pattern, tag)
+    template_rules = template.rules.all() if mode == 'copy' else []
+    changed_ids, inserted = peer_ids, 0
+    try:
+        if mode == 'copy':
+            if replace:
+                for chunk in _chunks(peer_ids):
+                    FirewallRule.query.filter(FirewallRule.peer_id.in_(chunk)).delete(synchronize_session=False)
+            rows = [{
+                'peer_id': peer_id, 'name': rule.name, 'description': rule.description,
+                'rule_type': rule.rule_type, 'action': rule.action, 'source': rule.source,
+                'destination': rule.destination, 'protocol': rule.protocol, 'port_range': rule.port_range,
+                'priority': TEMPLATE_PRIORITY + rule.order,
+            } for peer_id in peer_ids for rule in template_rules]
+            for offset in range(0, len(rows), BULK_BATCH_SIZE):
+                db.session.execute(insert(FirewallRule), rows[offset:offset + BULK_BATCH_SIZE])
+            inserted = len(rows)
+            template.increment_usage(len(peer_ids))
+        elif mode == 'link':
+            previous = _linked_counts(peer_ids)
+            changed_ids = [peer_id for chunk in _chunks(peer_ids) for (peer_id,) in db.session.query(Peer.id).filter(
+                Peer.id.in_(chunk),
+                (Peer.firewall_template_id != template.id) | Peer.firewall_template_id.is_(None)).all()]
+            for chunk in _chunks(changed_ids):
+                Peer.query.filter(Peer.id.in_(chunk)).update({'firewall_template_id': template.id},
+                                                             synchronize_session=False)
+            for template_id, count in previous.items():
+                if template_id != template.id:
+                    _add_usage(template_id, -count)
+            template.increment_usage(len(changed_ids))
+        else:
+            changed_ids = [peer_id for chunk in _chunks(peer_ids) for (peer_id,) in db.session.query(Peer.id).filter(
+                Peer.id.in_(chunk), Peer.firewall_template_id == template.id).all()]
+            for chunk in _chunks(changed_ids):
+                Peer.query.filter(Peer.id.in_(chunk)).update({'firewall_template_id': None},
+                                                             synchronize_session=False)
+            template.increment_usage(-len(changed_ids))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    db.session.expire_all()
+
+    result = {
+        'status': 'success',
+        'mode': mode,
+        'template_id': template.id,
+        'peer_ids': peer_ids,
+        'changed_peer_ids': changed_ids,
+        'matched': len(peer_ids),
+        'changed': len(changed_ids),
+        'rules_created': inserted,
+        'message': f"Template {template.name} applied to {len(changed_ids)} of {len(peer_ids)} selected peers "
+                   f"({mode})",
+    }
+    if changed_ids and apply_firewall:
+        firewall = apply_firewall_changes(changed_ids)
+        if firewall is not None:
+            result['firewall'] = firewall
+    return result
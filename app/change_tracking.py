@@ -0,0 +1,135 @@
+"""
+Commit-time change tracking
+Records what each transaction inserted, updated and deleted and hands it to
+registered listeners once the commit succeeded, so in-memory indexes (IP
+allocator, lookup structures, caches) can be maintained incrementally instead
+of being rebuilt from the database on every request.
+
+Bulk statements that bypass the unit of work (query.update(), delete(),
+insert() executed through the session) and rolled-back flushes are reported
+as a 'bulk' change for the table, which listeners treat as "rebuild".
+"""
+
+from typing import Callable, Dict, Iterable, List, Optional
+
+from sqlalchemy import event, inspect as sa_inspect
+
+from app import db
+
+SESSION_KEY = 'tracked_changes'
+UNKNOWN = object()  # previous value of an attribute that was never loaded before it was set
+
+
+class Change:
+    """One row-level change (op is 'insert', 'update', 'delete' or 'bulk')"""
+    __slots__ = ('table', 'op', 'identity', 'values', 'previous')
+
+    def __init__(self, table: str, op: str, identity=None, values: Optional[Dict] = None,
+                 previous: Optional[Dict] = None):
+        self.table = table
+        self.op = op
+        self.identity = identity
+        self.values = values or {}
+        self.previous = previous or {}  # old values of changed columns (updates only)
+
+    def __repr__(self):
+        return f"<Change {self.op} {self.table} {self.identity}>"
+
+
+_listeners: List = []
+
+
+def register_listener(callback: Callable[[List[Change]], None], tables: Optional[Iterable[str]] = None):
+    """Call `callback(changes)` after every commit that touched one of `tables` (None = any)"""
+    _listeners.append((callback, set(tables) if tables else None))
+    return callback
+
+
+def _snapshot(obj, op: str) -> Optional[Change]:
+    state = sa_inspect(obj)
+    mapper = state.mapper
+    if mapper.local_table is None:
+        return None
+
+    values = {}
+    previous = {}
+    for attr in mapper.column_attrs:
+        key = attr.key
+        if key in state.dict:
+            values[key] = state.dict[key]
+        if op == 'update':
+            history = state.attrs[key].history
+            if history.has_changes():
+                previous[key] = history.deleted[0] if history.deleted else UNKNOWN
+
+    if op == 'update' and not previous:
+        return None
+    identity = state.identity[0] if state.identity and len(state.identity) == 1 else state.identity
+    return Change(mapper.local_table.name, op, identity, values, previous)
+
+
+def _pending(session) -> List[Change]:
+    return session.info.setdefault(SESSION_KEY, [])
+
+
+def _after_flush(session, flush_context):
+    # Object state and attribute history still describe this flush here
+    pending = _pending(session)
+    for op, objects in (('insert', session.new), ('update', session.dirty), ('delete', session.deleted)):
+        for obj in objects:
+            change = _snapshot(obj, op)
+            if change is not None:
+                pending.append(change)
+
+
+def _do_orm_execute(orm_execute_state):
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    table = getattr(orm_execute_state.statement, 'table', None)
+    if table is not None and getattr(table, 'name', None):
+        _pending(orm_execute_state.session).append(Change(table.name, 'bulk'))
+
+
+def _as_bulk(changes: List[Change]) -> List[Change]:
+    return [Change(table, 'bulk') for table in sorted({change.table for change in changes})]
+
+
+def _after_soft_rollback(session, previous_transaction):
+    pending = session.info.get(SESSION_KEY)
+    if not pending:
+        return
+    # Anything flushed in the rolled-back scope may or may not have reached
+    # the database state other readers saw: downgrade it to "rebuild"
+    session.info[SESSION_KEY] = _as_bulk(pending)
+    if not previous_transaction.nested and previous_transaction.parent is None:
+        dispatch(session.info.pop(SESSION_KEY))
+
+
+def _after_commit(session):
+    changes = session.info.pop(SESSION_KEY, None)
+    if changes:
+        dispatch(changes)
+
+
+def dispatch(changes: List[Change]):
+    """Deliver changes to the interested listeners; listener errors never break a commit"""
+    for callback, tables in list(_listeners):
+        relevant = changes if tables is None else [change for change in changes if change.table in tables]
+        if not relevant:
+            continue
+        try:
+            callback(relevant)
+        except Exception as e:
+            print(f"⚠️  Change listener {getattr(callback, '__name__', callback)} failed: {e}")
+
+
+def install(session=None):
+    """Attach the tracking hooks to the (scoped) session; safe to call more than once"""
+    session = session or db.session
+    for name, handler in (('after_flush', _after_flush), ('do_orm_execute', _do_orm_execute),
+                          ('after_soft_rollback', _after_soft_rollback), ('after_commit', _after_commit)):
+        if not event.contains(session, name, handler):
+            event.listen(session, name, handler)
+
+
+install()
@@ -0,0 +1,170 @@
+"""
+CIDR helpers for WireGuard address management
+Aggregation, range complement and overlap detection on integer address intervals
+"""
+
+import heapq
+import ipaddress
+from functools import lru_cache
+from typing import Dict, Iterable, List, Tuple
+
+ADDRESS_CLASSES = {4: ipaddress.IPv4Address, 6: ipaddress.IPv6Address}
+MAX_ADDRESS = {4: 2 ** 32 - 1, 6: 2 ** 128 - 1}
+
+
+def parse_network(value):
+    """Parse an address or CIDR string into a network (bare addresses become host routes)"""
+    if isinstance(value, (ipaddress.IPv4Network, ipaddress.IPv6Network)):
+        return value
+    return ipaddress.ip_network(str(value).strip(), strict=False)
+
+
+def network_interval(value) -> Tuple[int, int, int]:
+    """Return (family, first address, last address) of a network as integers"""
+    network = parse_network(value)
+    return network.version, int(network.network_address), int(network.broadcast_address)
+
+
+def address_key(value: int) -> bytes:
+    """Fixed-width big-endian encoding of an address; byte order matches numeric order for both families"""
+    return value.to_bytes(16, 'big')
+
+
+def network_keys(value) -> Tuple[int, bytes, bytes]:
+    """Return (family, start key, end key) of a network for indexed range queries"""
+    family, start, end = network_interval(value)
+    return family, address_key(start), address_key(end)
+
+
+def aggregate_networks(networks: Iterable) -> List:
+    """Collapse adjacent and contained networks into the minimal CIDR list (IPv4 first, then IPv6)"""
+    ipv4, ipv6 = [], []
+    for value in networks:
+        network = parse_network(value)
+        (ipv4 if network.version == 4 else ipv6).append(network)
+    return list(ipaddress.collapse_addresses(ipv4)) + list(ipaddress.collapse_addresses(ipv6))
+
+
+def find_overlapping_pairs(intervals: Iterable[Tuple[int, int, int, object]]) -> List[Tuple[object, object]]:
+    """
+    Sort-and-sweep overlap detection
+
+    intervals: iterable of (family, start, end, payload) tuples
+    Returns every (payload_a, payload_b) pair whose intervals overlap, in
+    O(n log n + k) for k reported pairs.
+    """
+    ordered = sorted(intervals, key=lambda item: (item[0], item[1], -item[2]))
+    pairs = []
+    active = []  # min-heap of (end, sequence, payload) for the current family
+    current_family = None
+
+    for sequence, (family, start, end, payload) in enumerate(ordered):
+        if family != current_family:
+            active = []
+            current_family = family
+
+        # Drop intervals that ended before this one starts
+        while active and active[0][0] < start:
+            heapq.heappop(active)
+
+        for _, _, other in active:
+            pairs.append((other, payload))
+
+        heapq.heappush(active, (end, sequence, payload))
+
+    return pairs
+
+
+def aggregate_peer_networks(peer_networks: Dict[object, List[str]]) -> Tuple[Dict[object, List[str]], Dict]:
+    """
+    Aggregate the AllowedIPs of every peer and validate that no range crosses peers
+
+    peer_networks: mapping of peer key -> list of CIDR strings
+    Returns (mapping of peer key -> aggregated CIDR strings, report dict)
+    """
+    aggregated = {}
+    per_peer = []
+    intervals = []
+    entries_before = 0
+    entries_after = 0
+
+    for peer_key, networks in peer_networks.items():
+        collapsed = aggregate_networks(networks)
+        aggregated[peer_key] = [str(network) for network in collapsed]
+
+        entries_before += len(networks)
+        entries_after += len(collapsed)
+        if len(collapsed) < len(networks):
+            per_peer.append({
+                'peer': peer_key,
+                'entries_before': len(networks),
+                'entries_after': len(collapsed),
+            })
+
+        for network in collapsed:
+            intervals.append((network.version, int(network.network_address),
+                              int(network.broadcast_address), (peer_key, str(network))))
+
+    conflicts = [
+        {'peer_a': a[0], 'network_a': a[1], 'peer_b': b[0], 'network_b': b[1]}
+        for a, b in find_overlapping_pairs(intervals)
+        if a[0] != b[0]
+    ]
+
+    report = {
+        'peers': len(peer_networks),
+        'entries_before': entries_before,
+        'entries_after': entries_after,
+        'entries_saved': entries_before - entries_after,
+        'aggregated_peers': per_peer,
+        'conflicts': conflicts,
+    }
+    return aggregated, report
+
+
+def _canonical(networks: Iterable) -> Tuple[str, ...]:
+    """Normalise a network list into a hashable, order-independent cache key"""
+    return tuple(str(network) for network in aggregate_networks(networks))
+
+
+@lru_cache(maxsize=256)
+def _complement(family: int, excluded: Tuple[str, ...]) -> Tuple[str, ...]:
+    """Minimal CIDR cover of the whole address family minus the (collapsed) excluded networks"""
+    address = ADDRESS_CLASSES[family]
+    result = []
+    cursor = 0
+
+    # Walk the gaps between the sorted, non-overlapping exclusions
+    for value in excluded:
+        network = ipaddress.ip_network(value)
+        if network.version != family:
+            continue
+        start = int(network.network_address)
+        if start > cursor:
+            result.extend(ipaddress.summarize_address_range(address(cursor), address(start - 1)))
+        cursor = int(network.broadcast_address) + 1
+
+    if cursor <= MAX_ADDRESS[family]:
+        result.extend(ipaddress.summarize_address_range(address(cursor), address(MAX_ADDRESS[family])))
+
+    return tuple(str(network) for network in result)
+
+
+@lru_cache(maxsize=256)
+def _route_set(excluded: Tuple[str, ...], included: Tuple[str, ...], families: Tuple[int, ...]) -> Tuple[str, ...]:
+    routes = []
+    for family in families:
+        routes.extend(_complement(family, excluded))
+    routes.extend(network for network in included if parse_network(network).version in families)
+    return _canonical(routes)
+
+
+def exclude_networks(excluded: Iterable, include: Iterable = (), families: Iterable[int] = (4, 6)) -> List[str]:
+    """
+    Route everything except the excluded ranges
+
+    Returns the minimal CIDR list covering the requested address families
+    minus `excluded`, plus any `include` networks (e.g. the VPN subnet, which
+    must stay routed through the tunnel). Results are memoized per profile.
+    """
+    return list(_route_set(_canonical(excluded), _canonical(include), tuple(sorted(set(families)))))
@@ -0,0 +1,35 @@
+"""
+Flask CLI commands (run with `flask --app app <command>`)
+"""
+
+import json
+import sys
+
+import click
+
+from app import app
+
+
+@app.cli.command('scan-conflicts')
+@click.option('--json', 'as_json', is_flag=True, help='Print the full report as JSON')
+@click.option('--warnings/--no-warnings', default=True, help='Include warnings in the listing')
+def scan_conflicts_command(as_json, warnings):
+    """Report overlapping pools, peer addresses and allowed IP ranges (exit code 1 on errors)"""
+    from app.conflict_scanner import scan_conflicts
+
+    report = scan_conflicts()
+    if not warnings:
+        report['conflicts'] = [conflict for conflict in report['conflicts'] if conflict['severity'] != 'warning']
+
+    if as_json:
+        click.echo(json.dumps(report, indent=2))
+    else:
+        click.echo(f"🔍 Scanned {report['networks']} networks in {report['duration_ms']} ms: "
+                   f"{report['errors']} errors, {report['warnings']} warnings")
+        for conflict in report['conflicts']:
+            a, b = conflict['a'], conflict['b']
+            icon = '❌' if conflict['severity'] == 'error' else '⚠️ '
+            click.echo(f"{icon} {conflict['type']}: {a['kind']} {a['network']} ({a['peer_name'] or 'pool'}) "
+                       f"<-> {b['kind']} {b['network']} ({b['peer_name'] or 'pool'})")
+
+    sys.exit(1 if report['errors'] else 0)
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+WireGuard Configuration Reconciler
+Watches wg0.conf with inotify (polling fallback), debounces bursts of writes
+adaptively and applies a new revision only when its content hash changed.
+Apply latency and outcome are persisted to a state file and published to the
+web app, which forwards them to WebSocket clients.
+
+Runs as its own supervisord program and deliberately does not import the
+`app` package, so it keeps working while the web app restarts.
+"""
+
+import ctypes
+import ctypes.util
+import hashlib
+import json
+import os
+import select
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from datetime import datetime, timezone
+
+CONFIG_PATH = os.getenv("WG_WATCH_CONFIG", "/app/wg0.conf")
+SYSTEM_CONFIG = os.getenv("WG_SYSTEM_CONFIG", "/etc/wireguard/wg0.conf")
+INTERFACE = os.getenv("VPN_INTERFACE", "wg0")
+STATE_FILE = os.getenv("WG_APPLY_STATE_FILE", "instance/wg-apply-state.json")
+NOTIFY_URL = os.getenv("WG_APPLY_NOTIFY_URL", "http://127.0.0.1:5000/api/v1/wireguard/apply-events")
+
+DEBOUNCE_MIN = float(os.getenv("WG_WATCH_DEBOUNCE_MIN", "0.1"))  # seconds
+DEBOUNCE_MAX = float(os.getenv("WG_WATCH_DEBOUNCE_MAX", "2.0"))  # seconds
+MAX_DELAY = float(os.getenv("WG_WATCH_MAX_DELAY", "5.0"))  # upper bound from first event to apply
+POLL_INTERVAL = float(os.getenv("WG_WATCH_POLL_INTERVAL", "2.0"))  # polling fallback only
+
+# inotify constants (linux/inotify.h)
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = 0o4000
+EVENT_HEADER = struct.Struct("iIII")
+
+
+def log(message):
+    print(f"{datetime.now().isoformat(timespec='seconds')} {message}", flush=True)
+
+
+def config_revision(path=CONFIG_PATH):
+    """SHA-256 of the config file content, or None if it does not exist"""
+    try:
+        with open(path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+
+def load_state(path=STATE_FILE):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def save_state(state, path=STATE_FILE):
+    """Write the state file atomically so readers never see a partial document"""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".wg-apply-")
+    with os.fdopen(fd, "w") as f:
+        json.dump(state, f, indent=2)
+    os.chmod(tmp_path, 0o644)  # read by the unprivileged web app
+    os.replace(tmp_path, path)
+
+
+class AdaptiveDebouncer:
+    """
+    Quiet-period debounce that adapts to the writer
+    Bursty writers (several events per window) push the quiet period up
+    towards DEBOUNCE_MAX; single writes let it decay back to DEBOUNCE_MIN.
+    """
+
+    def __init__(self, minimum=DEBOUNCE_MIN, maximum=DEBOUNCE_MAX, max_delay=MAX_DELAY):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.max_delay = max_delay
+        self.window = minimum
+        self.first_event = None
+        self.last_event = None
+        self.events = 0
+
+    def event(self, now=None):
+        now = time.monotonic() if now is None else now
+        if self.first_event is None:
+            self.first_event = now
+        self.last_event = now
+        self.events += 1
+
+    @property
+    def pending(self):
+        return self.first_event is not None
+
+    def timeout(self, now=None):
+        """Seconds until the pending burst is due, or None if nothing is pending"""
+        if not self.pending:
+            return None
+        now = time.monotonic() if now is None else now
+        due = min(self.last_event + self.window, self.first_event + self.max_delay)
+        return max(0.0, due - now)
+
+    def settle(self):
+        """Close the current burst; returns its first event timestamp"""
+        first_event = self.first_event
+        if self.events > 1:
+            self.window = min(self.maximum, self.window * 2)
+        else:
+            self.window = max(self.minimum, self.window / 2)
+        self.first_event = None
+        self.last_event = None
+        self.events = 0
+        return first_event
+
+
+class InotifyWatcher:
+    """Minimal inotify binding via ctypes watching the config's directory"""
+
+    def __init__(self, path):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        # Watch the directory so atomic replaces (rename over the file) are seen
+        directory = os.path.dirname(os.path.abspath(path)).encode()
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_MODIFY
+        if libc.inotify_add_watch(self.fd, directory, mask) < 0:
+            raise OSError(ctypes.get_errno(), "inotify_add_watch failed")
+        self.filename = os.path.basename(path).encode()
+
+    def wait(self, timeout):
+        """Block up to `timeout` seconds (None = forever); True if the config changed"""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return False
+
+        changed = False
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return False
+        offset = 0
+        while offset < len(data):
+            _, _, _, name_len = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + name_len].rstrip(b"\0")
+            offset += name_len
+            if name == self.filename:
+                changed = True
+        return changed
+
+
+class PollingWatcher:
+    """Fallback when inotify is unavailable: compare mtime/size periodically"""
+
+    def __init__(self, path, interval=POLL_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.signature = self._signature()
+
+    def _signature(self):
+        try:
+            stat = os.stat(self.path)
+            return stat.st_mtime_ns, stat.st_size
+        except FileNotFoundError:
+            return None
+
+    def wait(self, timeout):
+        time.sleep(self.interval if timeout is None else min(timeout, self.interval))
+        signature = self._signature()
+        changed = signature != self.signature
+        self.signature = signature
+        return changed
+
+
+def _run(argv, timeout=30):
+    return subprocess.run(argv, capture_output=True, text=True, timeout=timeout)
+
+
+def apply_config():
+    """
+    Install the config and bring the interface in line with it
+    Uses `wg syncconf` so established sessions survive; falls back to a full
+    wg-quick restart when the interface is down or syncconf fails.
+    Returns (method, error message or None)
+    """
+    if os.path.abspath(CONFIG_PATH) != os.path.abspath(SYSTEM_CONFIG):
+        os.makedirs(os.path.dirname(SYSTEM_CONFIG), exist_ok=True)
+        shutil.copyfile(CONFIG_PATH, SYSTEM_CONFIG)
+        os.chmod(SYSTEM_CONFIG, 0o600)
+
+    if _run(["wg", "show", INTERFACE]).returncode == 0:
+        stripped = _run(["wg-quick", "strip", INTERFACE])
+        if stripped.returncode == 0:
+            with tempfile.NamedTemporaryFile("w", suffix=".conf") as tmp:
+                tmp.write(stripped.stdout)
+                tmp.flush()
+                synced = _run(["wg", "syncconf", INTERFACE, tmp.name])
+            if synced.returncode == 0:
+                return "syncconf", None
+        log(f"⚠️  syncconf failed, restarting {INTERFACE}")
+
+    _run(["wg-quick", "down", INTERFACE])
+    result = _run(["wg-quick", "up", INTERFACE])
+    if result.returncode == 0:
+        return "restart", None
+    return "restart", result.stderr.strip() or f"wg-quick up exited with {result.returncode}"
+
+
+class Reconciler:
+    """Applies config revisions and reports the outcome"""
+
+    def __init__(self, apply=apply_config, notify_url=NOTIFY_URL, state_file=STATE_FILE):
+        self.apply = apply
+        self.notify_url = notify_url
+        self.state_file = state_file
+        self.state = load_state(state_file)
+        self.unsent = []  # results the web app has not acknowledged yet
+
+    def reconcile(self, first_event=None, force=False):
+        """Apply the current config if its revision differs from the last applied one"""
+        revision = config_revision(CONFIG_PATH)
+        if revision is None:
+            log(f"❌ Configuration file not found: {CONFIG_PATH}")
+            return None
+        if not force and revision == self.state.get("applied_revision"):
+            log(f"🔇 Revision {revision[:12]} already applied, skipping")
+            return None
+
+        started = time.monotonic()
+        try:
+            method, error = self.apply()
+        except Exception as e:
+            method, error = "error", str(e)
+        finished = time.monotonic()
+
+        result = {
+            "status": "success" if error is None else "error",
+            "revision": revision,
+            "method": method,
+            "message": error or f"{INTERFACE} reconciled via {method}",
+            "apply_ms": round((finished - started) * 1000, 1),
+            "latency_ms": round((finished - (first_event or started)) * 1000, 1),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+        }
+        if error is None:
+            self.state["applied_revision"] = revision
+        self.state["last_result"] = result
+        save_state(self.state, self.state_file)
+        log(f"{'✅' if error is None else '❌'} {result['message']} "
+            f"(revision {revision[:12]}, apply {result['apply_ms']}ms, latency {result['latency_ms']}ms)")
+
+        self.unsent.append(result)
+        self.flush_notifications()
+        return result
+
+    def flush_notifications(self):
+        """Deliver queued results to the web app; keep them if it is unreachable"""
+        while self.unsent:
+            body = json.dumps(self.unsent[0]).encode()
+            request = urllib.request.Request(self.notify_url, data=body,
+                                             headers={"Content-Type": "application/json"})
+            try:
+                urllib.request.urlopen(request, timeout=2).close()
+            except Exception:
+                del self.unsent[:-20]  # bounded backlog while the app is down
+                return
+            self.unsent.pop(0)
+
+
+def main():
+    log("Starting WireGuard configuration reconciler...")
+    reconciler = Reconciler()
+    debouncer = AdaptiveDebouncer()
+
+    try:
+        watcher = InotifyWatcher(CONFIG_PATH)
+        log(f"Using inotify for {CONFIG_PATH}")
+    except (OSError, AttributeError) as e:
+        watcher = PollingWatcher(CONFIG_PATH)
+        log(f"inotify unavailable ({e}), polling every {POLL_INTERVAL}s")
+
+    # The interface state is unknown after a (container) restart, so always apply once
+    reconciler.reconcile(force=True)
+    watch(watcher, debouncer, reconciler)
+
+
+def watch(watcher, debouncer, reconciler, running=lambda: True):
+    """Turn config events into debounced reconciles while running() holds"""
+    while running():
+        timeout = debouncer.timeout()
+        if reconciler.unsent and (timeout is None or timeout > POLL_INTERVAL):
+            timeout = POLL_INTERVAL  # wake up to retry notifications
+
+        changed = watcher.wait(timeout)
+        if changed:
+            debouncer.event()
+        # Checked after every wakeup: under a steady stream of writes the
+        # burst is still applied once max_delay has passed since its start
+        if debouncer.pending and debouncer.timeout() == 0:
+            reconciler.reconcile(first_event=debouncer.settle())
+        elif reconciler.unsent and not changed:
+            reconciler.flush_notifications()
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit(0)
@@ -0,0 +1,89 @@
+"""
+Fleet-wide address conflict scanner
+Runs one sort-and-sweep pass over every network in use (address pools,
+assigned peer addresses, allowed IP ranges) and classifies each overlapping
+pair. Catches conflicts that predate validation or were written by scripts
+that bypass it. O(n log n + k) for k overlapping pairs.
+"""
+
+import time
+from collections import Counter
+from typing import Dict, Iterable, Optional
+
+from app.cidr import find_overlapping_pairs, network_interval
+from app.network_index import IndexedNetwork, get_network_index
+from app.utils import get_pool_networks
+
+ERROR = 'error'
+WARNING = 'warning'
+
+
+def classify(a: IndexedNetwork, b: IndexedNetwork):
+    """Return (type, severity) for an overlapping pair, or None if the overlap is expected"""
+    kinds = tuple(sorted((a.kind, b.kind)))
+    same_peer = a.peer_id is not None and a.peer_id == b.peer_id
+
+    if kinds == ('pool', 'pool'):
+        return 'pool_overlap', ERROR
+    if kinds == ('assigned', 'pool'):
+        return None  # peer addresses are supposed to live inside a pool
+    if kinds == ('allowed', 'pool'):
+        return 'allowed_range_in_pool', ERROR
+    if kinds == ('assigned', 'assigned'):
+        return ('duplicate_address', ERROR) if not same_peer else None
+    if kinds == ('allowed', 'assigned'):
+        return ('address_routed_to_other_peer', ERROR) if not same_peer else None
+    if same_peer:
+        return 'redundant_allowed_range', WARNING
+    return 'allowed_range_overlap', ERROR
+
+
+def _describe(entry: IndexedNetwork) -> Dict:
+    return {
+        'kind': entry.kind,
+        'network': entry.network,
+        'peer_id': entry.peer_id,
+        'peer_name': entry.peer_name,
+    }
+
+
+def _current_intervals():
+    """Peer networks from the network index plus every pool, including the VPN_SUBNET fallback"""
+    intervals = [entry for entry in get_network_index().get().entries() if entry[3].kind != 'pool']
+    for network in get_pool_networks():
+        intervals.append(network_interval(network) + (IndexedNetwork('pool', network),))
+    return intervals
+
+
+def scan_conflicts(intervals: Optional[Iterable] = None) -> Dict:
+    """
+    Build the conflict report
+
+    intervals: iterable of (family, start, end, IndexedNetwork); defaults to
+    every network currently in use
+    """
+    started = time.perf_counter()
+    intervals = list(_current_intervals() if intervals is None else intervals)
+
+    conflicts = []
+    for a, b in find_overlapping_pairs(intervals):
+        verdict = classify(a, b)
+        if verdict is None:
+            continue
+        conflict_type, severity = verdict
+        conflicts.append({
+            'type': conflict_type,
+            'severity': severity,
+            'a': _describe(a),
+            'b': _describe(b),
+        })
+
+    severities = Counter(conflict['severity'] for conflict in conflicts)
+    return {
+        'networks': len(intervals),
+        'conflicts': conflicts,
+        'summary': dict(Counter(conflict['type'] for conflict in conflicts)),
+        'errors': severities[ERROR],
+        'warnings': severities[WARNING],
+        'duration_ms': round((time.perf_counter() - started) * 1000, 2),
+    }
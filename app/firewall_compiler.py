@@ -0,0 +1,783 @@
+"""
+Firewall rule compiler
+Loads the desired firewall state (active peers and their active rules) into
+an in-memory plan with two queries and renders it as `iptables-restore
+--noflush` input for the app's own chains. Every peer has its own chain,
+reached through a jump tree over address prefixes, so a packet is matched
+against O(log peers) dispatch rules. Rules with an explicit source also
+apply to traffic between two non-peer addresses: after the jump trees, such
+traffic enters the chains of the peers whose rules name its source. Chains
+are stamped with a fingerprint and an apply only rewrites the ones that
+changed, in one atomic kernel commit: if any line is rejected nothing
+changes.
+
+Output is deterministic: peers in id order, each peer's rules in
+FirewallRule.priority order (ties broken by id), so the same database state
+always compiles to the same text. Before rendering, each rule list goes
+through the passes in app.firewall_optimizer (shadowed rules dropped,
+neighbouring rules merged into port sets and collapsed prefixes).
+
+Peers linked to a FirewallTemplate get its rules next to their own, with
+priority TEMPLATE_PRIORITY + FirewallTemplateRule.order. In the plan (and
+in rule comments, counters and evaluator results) such a rule has the
+negated template rule id, so it never collides with a FirewallRule id.
+"""
+
+import hashlib
+import ipaddress
+import logging
+import os
+import re
+import shlex
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from app import db
+from app.firewall_optimizer import PortSet, optimize_rules
+from app.models import FirewallRule, FirewallTemplate, FirewallTemplateRule, Peer
+
+# built-in chain -> chain owned by the app (flushed and rebuilt on every apply)
+CHAINS = {
+    'FORWARD': 'WIREGUARD_FORWARD',
+    'INPUT': 'WIREGUARD_INPUT',
+    'OUTPUT': 'WIREGUARD_OUTPUT',
+}
+FORWARD_CHAIN = CHAINS['FORWARD']
+PEER_CHAIN_PREFIX = 'WGP-'
+SOURCE_TREE_PREFIX = 'WGS-'
+DESTINATION_TREE_PREFIX = 'WGD-'
+POLICY_CHAIN_PREFIX = 'WGX-'
+POLICY_SET_PREFIX = 'wgx-'
+# Per-peer traffic accounting: ipsets with per-member counters, matched by source / destination
+ACCOUNTING_SETS = {'tx': f'{POLICY_SET_PREFIX}acct-tx', 'rx': f'{POLICY_SET_PREFIX}acct-rx'}
+APP_CHAIN_PREFIXES = (PEER_CHAIN_PREFIX, SOURCE_TREE_PREFIX, DESTINATION_TREE_PREFIX, POLICY_CHAIN_PREFIX)
+# Most peer jumps in one dispatch chain before it is split by address prefix
+DISPATCH_LEAF_SIZE = max(int(os.getenv("FIREWALL_DISPATCH_LEAF_SIZE", "8")), 2)
+# Peers sharing a rule list are grouped into an ipset from this many on
+IPSET_MIN_GROUP = max(int(os.getenv("FIREWALL_IPSET_MIN_GROUP", "2")), 2)
+OPTIMIZE = os.getenv("FIREWALL_OPTIMIZE", "true").lower() == "true"
+# Priority of template rules, linked or copied: this plus the rule's order in the template
+TEMPLATE_PRIORITY = 100
+# Commits touching these tables change the plan
+PLAN_TABLES = (Peer.__tablename__, FirewallRule.__tablename__, FirewallTemplate.__tablename__,
+               FirewallTemplateRule.__tablename__)
+FINGERPRINT = re.compile(r'--comment "?fp:([0-9a-f]+)')
+
+COMMENT_MAX = 256  # xt_comment limit
+# Comments written by the python-iptables backend directly into built-in chains
+LEGACY_COMMENT = re.compile(r'--comment "?(Rule:|Default-Allow:|Default-Drop:|WireGuard)')
+
+
+class PlannedRule(NamedTuple):
+    id: int
+    name: str
+    rule_type: str
+    action: str
+    source: Optional[str]
+    destination: Optional[str]
+    protocol: str
+    port_range: Optional[str]
+    priority: int
+    merged_ids: Tuple[int, ...] = ()  # rules the optimizer folded into this one
+
+
+def rule_label(rule: PlannedRule, position: Optional[int] = None) -> str:
+    """
+    Comment naming the FirewallRule ids behind a rule, read back by app.firewall_counters
+    In a shared policy chain (position given) the rule stands for every
+    member's rule at that position, so the comment names the position and
+    the chain stays the same when members come and go.
+    """
+    if position is not None:
+        return f"Policy:{position}:{rule.name}"
+    return f"Rule:{','.join(str(rule_id) for rule_id in (rule.id,) + rule.merged_ids)}:{rule.name}"
+
+
+class PlannedPeer(NamedTuple):
+    id: int
+    name: str
+    address: str
+    rules: Tuple[PlannedRule, ...]
+
+
+class OptimizationReport(NamedTuple):
+    rules_in: int
+    rules_out: int
+    removed: Tuple[dict, ...]  # {peer_id, rule_id, name, reason, kept_rule_id} per rule folded away
+    duration_ms: float
+
+    def to_dict(self, limit: Optional[int] = 100) -> dict:
+        """Summary for API responses, listing at most `limit` removed rules"""
+        removed = self.removed if limit is None else self.removed[:limit]
+        return {
+            "rules_in": self.rules_in,
+            "rules_out": self.rules_out,
+            "rules_removed": len(self.removed),
+            "removed": list(removed),
+            "duration_ms": self.duration_ms,
+        }
+
+
+class FirewallPlan(NamedTuple):
+    peers: Tuple[PlannedPeer, ...]
+    vpn_interface: str
+    vpn_subnet: str
+    optimization: Optional[OptimizationReport] = None
+    skipped: Tuple[dict, ...] = ()  # {peer_id, rule_id, name, reason} per rule that cannot be rendered
+
+    @property
+    def rule_count(self):
+        return sum(len(peer.rules) for peer in self.peers)
+
+
+def planned_rule(rule) -> PlannedRule:
+    """A FirewallRule, or a query row with the same columns, in planned form"""
+    return PlannedRule(
+        rule.id, rule.name, rule.rule_type.value, rule.action.value, rule.source or None,
+        rule.destination or None, rule.protocol.value if rule.protocol else 'any',
+        rule.port_range, rule.priority,
+    )
+
+
+def ipv4_prefix(text: Optional[str]) -> Optional[str]:
+    """Canonical IPv4 prefix of a rule address; ValueError for anything else"""
+    if not text:
+        return None
+    network = ipaddress.ip_network(text, strict=False)
+    if network.version != 4:
+        raise ValueError(f"Not an IPv4 network: {text}")
+    return str(network)
+
+
+def checked_rule(rule: PlannedRule) -> PlannedRule:
+    """
+    The rule with canonical addresses, or ValueError if it cannot be rendered
+    Addresses and ports end up verbatim in iptables-restore and nft input,
+    so anything that does not parse is refused here rather than emitted.
+    """
+    if rule.protocol in ('tcp', 'udp'):
+        PortSet.parse(rule.port_range)
+    return rule._replace(source=ipv4_prefix(rule.source), destination=ipv4_prefix(rule.destination))
+
+
+def load_firewall_plan(peer_ids=None, vpn_interface='wg0', vpn_subnet=None, optimize=None) -> FirewallPlan:
+    """
+    Active peers with an address and their active rules (their own plus
+    those of a linked active template), in two queries
+    optimize (default FIREWALL_OPTIMIZE) runs the rule lists through optimize_plan.
+    """
+    peers = db.session.query(Peer.id, Peer.name, Peer.assigned_ip).filter(
+        Peer.is_active.is_(True), Peer.assigned_ip.isnot(None))
+    if peer_ids is not None:
+        peers = peers.filter(Peer.id.in_(list(peer_ids)))
+    peers = peers.order_by(Peer.id).all()
+
+    rules: Dict[int, List[PlannedRule]] = {peer.id: [] for peer in peers}
+    skipped = []
+    if rules:
+        rows = db.session.query(
+            FirewallRule.peer_id, FirewallRule.id, FirewallRule.name, FirewallRule.rule_type,
+            FirewallRule.action, FirewallRule.source, FirewallRule.destination, FirewallRule.protocol,
+            FirewallRule.port_range, FirewallRule.priority,
+        ).join(Peer, Peer.id == FirewallRule.peer_id).filter(
+            FirewallRule.is_active.is_(True), Peer.is_active.is_(True), Peer.assigned_ip.isnot(None),
+        )
+        linked = db.session.query(
+            Peer.id, -FirewallTemplateRule.id, FirewallTemplateRule.name, FirewallTemplateRule.rule_type,
+            FirewallTemplateRule.action, FirewallTemplateRule.source, FirewallTemplateRule.destination,
+            FirewallTemplateRule.protocol, FirewallTemplateRule.port_range,
+            TEMPLATE_PRIORITY + FirewallTemplateRule.order,
+        ).join(FirewallTemplate, FirewallTemplate.id == Peer.firewall_template_id).join(
+            FirewallTemplateRule, FirewallTemplateRule.template_id == FirewallTemplate.id,
+        ).filter(FirewallTemplate.is_active.is_(True), Peer.is_active.is_(True), Peer.assigned_ip.isnot(None))
+        if peer_ids is not None:
+            rows = rows.filter(FirewallRule.peer_id.in_(list(rules)))
+            linked = linked.filter(Peer.id.in_(list(rules)))
+        for row in rows.union_all(linked).order_by(FirewallRule.peer_id, FirewallRule.priority, FirewallRule.id):
+            rule = planned_rule(row)
+            try:
+                rules[row.peer_id].append(checked_rule(rule))
+            except ValueError as e:
+                skipped.append({"peer_id": row.peer_id, "rule_id": rule.id, "name": rule.name, "reason": str(e)})
+        if skipped:
+            logging.warning(f"Skipped {len(skipped)} firewall rules that cannot be rendered: {skipped[:5]}")
+
+    plan = FirewallPlan(
+        peers=tuple(PlannedPeer(peer.id, peer.name, peer.assigned_ip, tuple(rules[peer.id])) for peer in peers),
+        vpn_interface=vpn_interface,
+        vpn_subnet=vpn_subnet or os.getenv("VPN_SUBNET", "10.0.0.0/24"),
+        skipped=tuple(skipped),
+    )
+    return optimize_plan(plan) if (OPTIMIZE if optimize is None else optimize) else plan
+
+
+def _lower(ir, rules: Tuple[PlannedRule, ...]) -> PlannedRule:
+    """An optimized rule back in planned form, named after every rule folded into it"""
+    first = rules[ir.members[0]]
+    if ir.opaque or len(ir.members) == 1:
+        return first
+    names = dict.fromkeys(rules[position].name for position in ir.members)
+    return first._replace(
+        name='+'.join(names),
+        merged_ids=tuple(rules[position].id for position in ir.members[1:]),
+        destination=str(ir.destination) if ir.destination is not None else first.destination,
+        port_range=ir.ports.render() if ir.ports is not None else first.port_range,
+    )
+
+
+def optimize_plan(plan: FirewallPlan) -> FirewallPlan:
+    """
+    The plan with every peer's rules optimized, plus a report of the rules
+    that were dropped or merged. Peers with the same rule list share one
+    optimizer run.
+    """
+    started = time.perf_counter()
+    results: Dict[tuple, tuple] = {}
+    peers, removed = [], []
+    for peer in plan.peers:
+        key = policy_key(peer)
+        if key not in results:
+            results[key] = optimize_rules(peer.rules, plan.vpn_subnet)
+        optimized, removals = results[key]
+        peers.append(peer._replace(rules=tuple(_lower(ir, peer.rules) for ir in optimized)))
+        removed += [{
+            "peer_id": peer.id,
+            "rule_id": peer.rules[removal.position].id,
+            "name": peer.rules[removal.position].name,
+            "reason": removal.reason,
+            "kept_rule_id": peer.rules[removal.by].id,
+        } for removal in removals]
+    optimized_plan = plan._replace(peers=tuple(peers))
+    return optimized_plan._replace(optimization=OptimizationReport(
+        plan.rule_count, optimized_plan.rule_count, tuple(removed),
+        round((time.perf_counter() - started) * 1000, 2),
+    ))
+
+
+def load_peer_addresses() -> List[Tuple[int, str]]:
+    """(peer_id, address) of every active peer with an address, for dispatch"""
+    return [tuple(row) for row in db.session.query(Peer.id, Peer.assigned_ip).filter(
+        Peer.is_active.is_(True), Peer.assigned_ip.isnot(None)).order_by(Peer.id)]
+
+
+def load_rule_sources(vpn_interface='wg0', vpn_subnet=None) -> List[Tuple[int, str]]:
+    """
+    (peer_id, source) of every explicit-source rule, for the source dispatch
+    of a partial plan. The rule lists of the peers that have such rules are
+    loaded and optimized like a full plan, so both dispatch the same sources.
+    """
+    own = db.session.query(FirewallRule.peer_id).filter(
+        FirewallRule.is_active.is_(True), FirewallRule.source.isnot(None), FirewallRule.source != '')
+    linked = db.session.query(Peer.id).join(
+        FirewallTemplateRule, FirewallTemplateRule.template_id == Peer.firewall_template_id).filter(
+        FirewallTemplateRule.source.isnot(None), FirewallTemplateRule.source != '')
+    peer_ids = {peer_id for (peer_id,) in own.union(linked)}
+    return rule_sources(load_firewall_plan(peer_ids, vpn_interface, vpn_subnet)) if peer_ids else []
+
+
+def rule_sources(plan: FirewallPlan) -> List[Tuple[int, str]]:
+    """(peer_id, source) of every planned rule with an explicit source, in plan order"""
+    return [(peer.id, rule.source) for peer in plan.peers for rule in peer.rules if rule.source]
+
+
+def quote_comment(text: str) -> str:
+    """Comment argument safe for iptables-restore's quoting rules"""
+    text = re.sub(r'["\\\r\n]', "'", text)[:COMMENT_MAX]
+    return f'"{text}"'
+
+
+def _port_args(protocol: str, port_range: Optional[str]) -> List[str]:
+    if not port_range or port_range == 'any' or protocol not in ('tcp', 'udp'):
+        return []
+    ports = port_range.replace(' ', '').replace('-', ':')
+    if ',' in ports:
+        return ['-m', 'multiport', '--dports', ports]
+    return ['--dport', ports]
+
+
+def _address_match(peer: PlannedPeer, direction: str, address_set: Optional[str]) -> List[str]:
+    """The peer's own address as source/destination, or membership of its policy's ipset"""
+    if address_set:
+        return ['-m', 'set', '--match-set', address_set, direction]
+    return ['-s' if direction == 'src' else '-d', f"{peer.address}/32"]
+
+
+def rule_args(rule: PlannedRule, peer: PlannedPeer, plan: FirewallPlan, address_set: Optional[str] = None,
+              position: Optional[int] = None) -> List[str]:
+    """Match and target arguments of one FirewallRule (same semantics as the python-iptables backend)"""
+    args = ['-s', ipv4_prefix(rule.source)] if rule.source else _address_match(peer, 'src', address_set)
+
+    if rule.destination:
+        args += ['-d', ipv4_prefix(rule.destination)]
+    elif rule.rule_type == 'peer_comm':
+        args += ['-d', plan.vpn_subnet]
+
+    if rule.protocol != 'any':
+        args += ['-p', rule.protocol] + _port_args(rule.protocol, rule.port_range)
+
+    if rule.rule_type == 'internet':
+        args += ['!', '-o', plan.vpn_interface]
+    else:
+        args += ['-i', plan.vpn_interface]
+
+    args += ['-m', 'comment', '--comment', quote_comment(rule_label(rule, position))]
+    args += ['-j', 'ACCEPT' if rule.action == 'ALLOW' else 'DROP']
+    return args
+
+
+def base_rule_lines(plan: FirewallPlan) -> List[str]:
+    interface = plan.vpn_interface
+    return [
+        f"-A {FORWARD_CHAIN} -i {interface} -m conntrack --ctstate ESTABLISHED,RELATED -j ACCEPT",
+        f"-A {FORWARD_CHAIN} -o {interface} -m conntrack --ctstate ESTABLISHED,RELATED -j ACCEPT",
+        f"-A {CHAINS['INPUT']} -i lo -j ACCEPT",
+        f"-A {CHAINS['OUTPUT']} -o lo -j ACCEPT",
+    ]
+
+
+def peer_rule_lines(peer: PlannedPeer, plan: FirewallPlan, chain: str = FORWARD_CHAIN,
+                    address_set: Optional[str] = None) -> List[str]:
+    """
+    A peer's rules in priority order, closed by its default verdict
+    With address_set the lines serve every peer in that ipset (a shared policy).
+    """
+    lines = [f"-A {chain} " + ' '.join(rule_args(rule, peer, plan, address_set, position if address_set else None))
+             for position, rule in enumerate(peer.rules)]
+    if peer.rules:
+        verdict, label = 'DROP', 'Default-Drop'
+    else:
+        verdict, label = 'ACCEPT', 'Default-Allow'
+    comment = quote_comment(f"{label}:{chain if address_set else peer.name}")
+    for direction in ('src', 'dst'):
+        match = ' '.join(_address_match(peer, direction, address_set))
+        lines.append(f"-A {chain} {match} -m comment --comment {comment} -j {verdict}")
+    return lines
+
+
+class PolicyGroup(NamedTuple):
+    chain: str
+    address_set: str
+    peers: Tuple[PlannedPeer, ...]
+
+
+def policy_key(peer: PlannedPeer) -> tuple:
+    """Everything about a peer's rules except its own address"""
+    return tuple((rule.name, rule.rule_type, rule.action, rule.source, rule.destination, rule.protocol,
+                  rule.port_range) for rule in peer.rules)
+
+
+def group_policies(plan: FirewallPlan) -> Dict[str, PolicyGroup]:
+    """Peers with identical effective rule lists, IPSET_MIN_GROUP or more per policy, by policy chain"""
+    members: Dict[tuple, List[PlannedPeer]] = {}
+    for peer in plan.peers:
+        members.setdefault(policy_key(peer), []).append(peer)
+    groups = {}
+    for key, peers in members.items():
+        if len(peers) < IPSET_MIN_GROUP:
+            continue
+        digest = hashlib.sha256(repr(key).encode()).hexdigest()[:10]
+        chain = f"{POLICY_CHAIN_PREFIX}{digest}"
+        groups[chain] = PolicyGroup(chain, f"{POLICY_SET_PREFIX}{digest}", tuple(peers))
+    return groups
+
+
+def parse_ipset_state(saved: str) -> Dict[str, frozenset]:
+    """Members of the app's sets from `ipset save` output"""
+    sets: Dict[str, set] = {}
+    for line in (saved or '').splitlines():
+        parts = line.split()
+        if len(parts) >= 2 and parts[1].startswith(POLICY_SET_PREFIX):
+            if parts[0] == 'create':
+                sets.setdefault(parts[1], set())
+            elif parts[0] == 'add' and len(parts) >= 3:
+                sets.setdefault(parts[1], set()).add(parts[2])
+    return {name: frozenset(members) for name, members in sets.items()}
+
+
+def _is_legacy_rule(spec: str, vpn_interface: str) -> bool:
+    """Rules the python-iptables backend inserted directly into FORWARD"""
+    if LEGACY_COMMENT.search(spec):
+        return True
+    try:
+        tokens = shlex.split(spec)
+    except ValueError:
+        return False
+    pairs = set(zip(tokens, tokens[1:]))
+    on_interface = ('-i', vpn_interface) in pairs or ('-o', vpn_interface) in pairs
+    return on_interface and '--ctstate' in tokens and tokens[-2:] == ['-j', 'ACCEPT']
+
+
+class LiveState(NamedTuple):
+    """What the reconciler needs to know about the installed filter table"""
+    chains: frozenset  # every chain in the filter table
+    fingerprints: Dict[str, str]  # app chain -> fingerprint of its installed contents
+    deletions: List[str]  # rules of the old backend to remove from FORWARD
+    jumps: List[str]  # missing jumps from the built-in chains into the app chains
+    sets: Dict[str, frozenset] = {}  # app ipsets -> members
+
+
+def parse_live_state(saved: Optional[str], vpn_interface: str = 'wg0', ipset_saved: Optional[str] = None) -> LiveState:
+    """Read `iptables-save -t filter` (and `ipset save`) output; None means nothing is known (dry run)"""
+    if saved is None:
+        return LiveState(frozenset(), {}, [], [f"-I {chain} 1 -j {target}" for chain, target in CHAINS.items()])
+
+    chains, fingerprints, deletions, present = set(), {}, [], set()
+    in_filter = False
+    for line in saved.splitlines():
+        line = line.strip()
+        if line.startswith('*'):
+            in_filter = line == '*filter'
+            continue
+        if not in_filter:
+            continue
+        if line.startswith(':'):
+            chains.add(line[1:].split()[0])
+            continue
+        if not line.startswith('-A '):
+            continue
+        chain, _, spec = line[3:].partition(' ')
+        match = FINGERPRINT.search(spec)
+        if match and chain not in fingerprints:
+            fingerprints[chain] = match.group(1)
+        elif spec == f"-j {CHAINS.get(chain)}":
+            present.add(chain)
+        elif chain == 'FORWARD' and _is_legacy_rule(spec, vpn_interface):
+            deletions.append(f"-D {chain} {spec}")
+    jumps = [f"-I {chain} 1 -j {target}" for chain, target in CHAINS.items() if chain not in present]
+    return LiveState(frozenset(chains), fingerprints, deletions, jumps, parse_ipset_state(ipset_saved))
+
+
+def peer_chain(peer_id: int) -> str:
+    return f"{PEER_CHAIN_PREFIX}{peer_id}"
+
+
+def fingerprint(lines: List[str]) -> str:
+    return hashlib.sha256('\n'.join(lines).encode()).hexdigest()[:16]
+
+
+def _fingerprint_line(chain: str, lines: List[str]) -> str:
+    """No-target rule at the top of a chain recording what was installed"""
+    return f'-A {chain} -m comment --comment "fp:{fingerprint(lines)}"'
+
+
+def _tree_chain(prefix: str, network: int, prefixlen: int) -> str:
+    return f"{prefix}{network:08x}-{prefixlen}"
+
+
+def _dispatch_tree(chain: str, flag: str, tree_prefix: str, entries, chains: Dict[str, List[str]],
+                   targets: Dict[int, str]) -> List[str]:
+    """
+    Rules of one node of a binary jump tree over peer addresses
+    entries: sorted [(address as int, peer_id)]. A node with more than
+    DISPATCH_LEAF_SIZE peers splits at the first bit in which its addresses
+    differ and jumps to one sub-chain per half, so a packet is matched
+    against O(log peers) rules instead of every peer address.
+    """
+    first, last = entries[0][0], entries[-1][0]
+    if len(entries) <= DISPATCH_LEAF_SIZE or first == last:
+        return [f"-A {chain} {flag} {ipaddress.IPv4Address(address)}/32 -j {targets.get(peer_id) or peer_chain(peer_id)}"
+                for address, peer_id in entries]
+
+    prefixlen = 33 - (first ^ last).bit_length()  # length of each half's network
+    mask = (0xFFFFFFFF << (32 - prefixlen)) & 0xFFFFFFFF
+    lines = []
+    for network in sorted({address & mask for address, _ in entries}):
+        half = [entry for entry in entries if entry[0] & mask == network]
+        sub = _tree_chain(tree_prefix, network, prefixlen)
+        lines.append(f"-A {chain} {flag} {ipaddress.IPv4Address(network)}/{prefixlen} -j {sub}")
+        chains[sub] = _dispatch_tree(sub, flag, tree_prefix, half, chains, targets)
+    return lines
+
+
+def accounting_lines() -> List[str]:
+    """No-target rules at the top of the forward chain; the matched set member counts the packet"""
+    return [f'-A {FORWARD_CHAIN} -m set --match-set {ACCOUNTING_SETS[direction]} {flag} '
+            f'-m comment --comment "Acct:{direction}"' for direction, flag in (('tx', 'src'), ('rx', 'dst'))]
+
+
+def source_targets(sources: List[Tuple[int, str]], targets: Dict[int, str]) -> List[Tuple[str, str]]:
+    """(source, chain) jumps for explicit-source rules, in peer order, each pair once"""
+    return list(dict.fromkeys((source, targets.get(peer_id) or peer_chain(peer_id)) for peer_id, source in sources))
+
+
+def dispatch_chains(addresses: List[Tuple[int, str]], plan: FirewallPlan,
+                    targets: Optional[Dict[int, str]] = None, accounting: bool = False,
+                    sources: Optional[List[Tuple[int, str]]] = None) -> Dict[str, List[str]]:
+    """
+    The app's built-in-facing chains and the jump trees into the peer chains
+    Traffic from a peer is dispatched by source first, so the sender's rules
+    decide; traffic only to a peer is dispatched by destination. Every peer
+    chain ends in a verdict for its own address, so only traffic between
+    non-peer addresses gets past the trees: it is dispatched by the explicit
+    sources of rules (sources: [(peer_id, source)], default from the plan),
+    where only those rules can match it.
+    targets: peer_id -> chain for peers that share a policy chain.
+    accounting counts every forwarded packet per peer before any verdict.
+    """
+    targets = targets or {}
+    sources = rule_sources(plan) if sources is None else sources
+    entries = sorted((int(ipaddress.IPv4Address(address)), peer_id) for peer_id, address in addresses)
+    chains: Dict[str, List[str]] = {}
+    forward = accounting_lines() if accounting else []
+    forward += [line for line in base_rule_lines(plan) if line.startswith(f"-A {FORWARD_CHAIN} ")]
+    if entries:
+        forward += _dispatch_tree(FORWARD_CHAIN, '-s', SOURCE_TREE_PREFIX, entries, chains, targets)
+        forward += _dispatch_tree(FORWARD_CHAIN, '-d', DESTINATION_TREE_PREFIX, entries, chains, targets)
+    forward += [f"-A {FORWARD_CHAIN} -s {source} -j {chain}" for source, chain in source_targets(sources, targets)]
+    chains[FORWARD_CHAIN] = forward
+    for chain in (CHAINS['INPUT'], CHAINS['OUTPUT']):
+        chains[chain] = [line for line in base_rule_lines(plan) if line.startswith(f"-A {chain} ")]
+    return chains
+
+
+class ReconcilePlan(NamedTuple):
+    text: Optional[str]  # None when the installed rules already match
+    changed_peers: List[int]
+    removed_chains: List[str]
+    dispatch_changed: bool  # any dispatch or base chain was rewritten
+    changed_policies: List[str] = []
+    ipset_prepare: Optional[str] = None  # `ipset restore` input to run before the iptables commit
+    ipset_cleanup: Optional[str] = None  # ... and after it, once nothing references the removed members
+    optimization: Optional[OptimizationReport] = None
+    skipped: Tuple[dict, ...] = ()
+
+    @property
+    def empty(self):
+        return self.text is None and self.ipset_prepare is None and self.ipset_cleanup is None
+
+
+def _ipset_changes(groups: Dict[str, PolicyGroup], live: LiveState, accounting: Optional[set] = None):
+    """
+    Set updates split around the iptables commit: sets are created and
+    members added first, so rules never reference a missing set; members are
+    removed and sets destroyed afterwards, once the dispatch no longer
+    sends those peers to the old policy.
+    accounting: addresses for the accounting sets (None: no accounting).
+    Members that stay keep their counters.
+    """
+    prepare, cleanup = [], []
+    wanted = {group.address_set: {peer.address for peer in group.peers} for group in groups.values()}
+    if accounting is not None:
+        wanted.update({name: set(accounting) for name in ACCOUNTING_SETS.values()})
+    for name, members in wanted.items():
+        installed = live.sets.get(name)
+        if installed is None:
+            counters = ' counters' if name in ACCOUNTING_SETS.values() else ''
+            prepare.append(f"create {name} hash:ip family inet{counters}")
+            installed = frozenset()
+        prepare += [f"add {name} {address}" for address in sorted(members - installed)]
+        cleanup += [f"del {name} {address}" for address in sorted(installed - members)]
+    cleanup += [f"destroy {name}" for name in sorted(live.sets) if name not in wanted]
+    return ('\n'.join(prepare) + '\n' if prepare else None), ('\n'.join(cleanup) + '\n' if cleanup else None)
+
+
+def compile_reconcile(plan: FirewallPlan, live: LiveState, addresses=None, force: bool = False,
+                      use_ipsets: bool = False, accounting: bool = False, sources=None) -> ReconcilePlan:
+    """
+    iptables-restore --noflush input that brings the installed rules to the plan
+
+    Each peer's rules live in their own chain (WGP-<id>), reached through
+    jump trees by source (WGS-*) and destination (WGD-*) address. Every app
+    chain starts with a rule carrying a fingerprint of its contents, and
+    only chains whose fingerprint differs are rewritten: an edited peer
+    rewrites its own chain, an added or removed peer the tree chains on its
+    path. Chains that are no longer wanted are removed after the jumps to them.
+
+    With use_ipsets, peers with identical rule lists share one policy chain
+    (WGX-*) whose rules match the policy's ipset instead of a single address,
+    so the ruleset grows with the number of distinct policies rather than
+    peers x rules. The plan must then hold every peer. accounting (needs
+    use_ipsets) adds per-peer packet/byte counters kept by two ipsets.
+
+    addresses: [(peer_id, address)] of every peer that should be dispatched
+    to; defaults to the peers in the plan. Peers outside the plan keep their
+    installed chains. sources: [(peer_id, source)] of every explicit-source
+    rule, needed with a partial plan (see load_rule_sources).
+    force rewrites every chain regardless of fingerprints.
+    """
+    if addresses is None:
+        addresses = [(peer.id, peer.address) for peer in plan.peers]
+    declarations, body, changed, changed_policies = [], [], [], []
+    groups = group_policies(plan) if use_ipsets else {}
+    targets = {peer.id: group.chain for group in groups.values() for peer in group.peers}
+    accounting = accounting and use_ipsets
+
+    def rewrite(chain, lines, heading=None):
+        if not force and live.fingerprints.get(chain) == fingerprint(lines):
+            return False
+        declarations.append(f":{chain} - [0:0]")
+        body.extend([f"-F {chain}"] + ([heading] if heading else []) + [_fingerprint_line(chain, lines)] + lines)
+        return True
+
+    for peer in plan.peers:
+        if peer.id in targets:
+            continue
+        heading = re.sub(r'[\r\n]', ' ', f"# {peer.name} ({peer.address})")
+        if rewrite(peer_chain(peer.id), peer_rule_lines(peer, plan, peer_chain(peer.id)), heading):
+            changed.append(peer.id)
+
+    for chain, group in groups.items():
+        lines = peer_rule_lines(group.peers[0], plan, chain, group.address_set)
+        if rewrite(chain, lines, f"# policy shared by {len(group.peers)} peers"):
+            changed_policies.append(chain)
+
+    dispatch = dispatch_chains(addresses, plan, targets, accounting, sources)
+    dispatch_changed = False
+    for chain, lines in dispatch.items():
+        dispatch_changed = rewrite(chain, lines) or dispatch_changed
+
+    wanted = set(dispatch) | set(groups) | {peer_chain(peer_id) for peer_id, _ in addresses if peer_id not in targets}
+    stale = sorted(chain for chain in live.chains if chain.startswith(APP_CHAIN_PREFIXES) and chain not in wanted)
+
+    body += live.deletions + live.jumps
+    for chain in stale:
+        body += [f"-F {chain}", f"-X {chain}"]
+
+    ipset_prepare, ipset_cleanup = (None, None)
+    if use_ipsets:
+        members = {address for _, address in addresses} if accounting else None
+        ipset_prepare, ipset_cleanup = _ipset_changes(groups, live, members)
+    text = '\n'.join(['*filter'] + declarations + body + ['COMMIT']) + '\n' if declarations or body else None
+    return ReconcilePlan(text, changed, stale, dispatch_changed, changed_policies, ipset_prepare, ipset_cleanup,
+                         plan.optimization, plan.skipped)
+
+
+def compile_restore(plan: FirewallPlan, saved: Optional[str] = None, use_ipsets: bool = False,
+                    accounting: bool = False) -> str:
+    """Full ruleset for the plan (every chain rewritten); saved as in parse_live_state"""
+    compiled = compile_reconcile(plan, parse_live_state(saved, plan.vpn_interface), force=True, use_ipsets=use_ipsets,
+                                 accounting=accounting)
+    if compiled.ipset_prepare:
+        return ''.join(f"# ipset {line}\n" for line in compiled.ipset_prepare.splitlines()) + compiled.text
+    return compiled.text
+
+
+def count_rules(text: str) -> int:
+    """Rules appended by a restore input, excluding fingerprint markers"""
+    return sum(1 for line in (text or '').splitlines() if line.startswith('-A ') and '"fp:' not in line)
+
+
+# nftables
+
+NFT_TABLE = 'wireguard_admin'
+NFT_COMMENT_MAX = 128
+
+
+def _nft_comment(text: str) -> str:
+    text = re.sub(r'["\\\r\n]', "'", text)[:NFT_COMMENT_MAX]
+    return f'comment "{text}"'
+
+
+def _nft_ports(protocol: str, port_range: Optional[str]) -> str:
+    ports = PortSet.parse(port_range)
+    if ports is None:
+        return f"meta l4proto {protocol}"
+    ports = ports.render().split(',')
+    if len(ports) == 1:
+        return f"{protocol} dport {ports[0]}"
+    return f"{protocol} dport {{ {', '.join(ports)} }}"
+
+
+def _nft_address(peer: PlannedPeer, direction: str, address_set: Optional[str]) -> str:
+    field = 'saddr' if direction == 'src' else 'daddr'
+    return f"ip {field} @{address_set}" if address_set else f"ip {field} {peer.address}"
+
+
+def nft_rule(rule: PlannedRule, peer: PlannedPeer, plan: FirewallPlan, address_set: Optional[str] = None,
+             position: Optional[int] = None) -> str:
+    """One FirewallRule as an nft rule statement (same semantics as rule_args)"""
+    parts = [f"ip saddr {ipv4_prefix(rule.source)}" if rule.source else _nft_address(peer, 'src', address_set)]
+    if rule.destination:
+        parts.append(f"ip daddr {ipv4_prefix(rule.destination)}")
+    elif rule.rule_type == 'peer_comm':
+        parts.append(f"ip daddr {plan.vpn_subnet}")
+    if rule.protocol in ('tcp', 'udp'):
+        parts.append(_nft_ports(rule.protocol, rule.port_range))
+    elif rule.protocol != 'any':
+        parts.append(f"meta l4proto {rule.protocol}")
+    if rule.rule_type == 'internet':
+        parts.append(f'oifname != "{plan.vpn_interface}"')
+    else:
+        parts.append(f'iifname "{plan.vpn_interface}"')
+    parts += ['counter', 'accept' if rule.action == 'ALLOW' else 'drop', _nft_comment(rule_label(rule, position))]
+    return ' '.join(parts)
+
+
+def nft_peer_rules(peer: PlannedPeer, plan: FirewallPlan, label: str, address_set: Optional[str] = None) -> List[str]:
+    lines = [nft_rule(rule, peer, plan, address_set, position if address_set else None)
+             for position, rule in enumerate(peer.rules)]
+    verdict, default = ('drop', 'Default-Drop') if peer.rules else ('accept', 'Default-Allow')
+    for direction in ('src', 'dst'):
+        lines.append(f"{_nft_address(peer, direction, address_set)} counter {verdict} "
+                     f"{_nft_comment(f'{default}:{label}')}")
+    return lines
+
+
+def _nft_elements(items: List[str]) -> List[str]:
+    return [f"        elements = {{ {', '.join(items)} }}"] if items else []
+
+
+def compile_nftables(plan: FirewallPlan, use_sets: bool = True, accounting: bool = False) -> str:
+    """
+    `nft -f` input that atomically replaces the app's table
+    Peers are dispatched through two verdict maps keyed by address (one
+    hash lookup per packet however many peers there are) into their own
+    chain, or with use_sets into a policy chain shared by every peer with
+    the same rule list, whose rules match a named set of its peers.
+    accounting adds named counters tx_<peer id> / rx_<peer id>, picked by
+    two address maps for every forwarded packet before any verdict.
+    Traffic between non-peer addresses jumps to the chains of rules with an
+    explicit source, as in dispatch_chains.
+    """
+    groups = group_policies(plan) if use_sets else {}
+    targets = {peer.id: f"policy_{group.chain[len(POLICY_CHAIN_PREFIX):]}"
+               for group in groups.values() for peer in group.peers}
+    interface = plan.vpn_interface
+    dispatch = [f"{peer.address} : jump {targets.get(peer.id, f'peer_{peer.id}')}" for peer in plan.peers]
+    nft_targets = {peer.id: targets.get(peer.id, f'peer_{peer.id}') for peer in plan.peers}
+    jumps = list(dict.fromkeys(f"ip saddr {ipv4_prefix(source)} jump {nft_targets[peer_id]}"
+                               for peer_id, source in rule_sources(plan)))
+
+    lines = [f"table ip {NFT_TABLE}", f"delete table ip {NFT_TABLE}", f"table ip {NFT_TABLE} {{"]
+    for name in ('peer_src', 'peer_dst'):
+        lines += [f"    map {name} {{", "        type ipv4_addr : verdict"] + _nft_elements(dispatch) + ["    }"]
+    if accounting:
+        for direction in ('tx', 'rx'):
+            lines += [f"    counter {direction}_{peer.id} {{ packets 0 bytes 0 }}" for peer in plan.peers]
+            lines += [f"    map peer_{direction} {{", "        type ipv4_addr : counter"]
+            lines += _nft_elements([f'{peer.address} : "{direction}_{peer.id}"' for peer in plan.peers]) + ["    }"]
+    for group in groups.values():
+        name = f"policy_{group.chain[len(POLICY_CHAIN_PREFIX):]}"
+        lines += [f"    set {name} {{", "        type ipv4_addr"]
+        lines += _nft_elements([peer.address for peer in group.peers]) + ["    }"]
+
+    def chain(name, statements):
+        lines.extend([f"    chain {name} {{"] + [f"        {statement}" for statement in statements] + ["    }"])
+
+    chain('forward', [
+        "type filter hook forward priority filter; policy accept;",
+    ] + ([
+        "counter name ip saddr map @peer_tx",
+        "counter name ip daddr map @peer_rx",
+    ] if accounting else []) + [
+        f'iifname "{interface}" ct state established,related accept',
+        f'oifname "{interface}" ct state established,related accept',
+        "ip saddr vmap @peer_src",
+        "ip daddr vmap @peer_dst",
+    ] + jumps)
+    chain('input', ["type filter hook input priority filter; policy accept;", 'iifname "lo" accept'])
+    chain('output', ["type filter hook output priority filter; policy accept;", 'oifname "lo" accept'])
+    for group in groups.values():
+        name = f"policy_{group.chain[len(POLICY_CHAIN_PREFIX):]}"
+        chain(name, nft_peer_rules(group.peers[0], plan, name, address_set=name))
+    for peer in plan.peers:
+        if peer.id not in targets:
+            chain(f"peer_{peer.id}", nft_peer_rules(peer, plan, peer.name))
+    lines.append("}")
+    return '\n'.join(lines) + '\n'
+
+
+def count_nft_rules(text: str) -> int:
+    """Rule statements in compiled nft input (map and set elements not included)"""
+    return sum(1 for line in text.splitlines()
+               if line.startswith('        ') and not line.lstrip().startswith(('type ', 'elements ')))
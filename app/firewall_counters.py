@@ -0,0 +1,274 @@
+"""
+Firewall counters
+Packet and byte counters of the installed ruleset, read in one privileged
+call (`iptables-save -c` plus `ipset save` in the same helper round trip, or
+`nft list table`) and mapped back to the database:
+
+- every rule carries its FirewallRule ids in its comment ("Rule:<ids>:<name>",
+  several ids when the optimizer merged rules), so its counters are reported
+  under each of those ids; a rule in a shared policy chain is labelled by
+  its position ("Policy:<position>:<name>") and reported under the rule at
+  that position of every peer in the policy, counting their traffic together
+- per-peer traffic comes from the accounting ipsets (counters per member)
+  or the nft named counters tx_<id> / rx_<id>; unlike `wg show` transfer
+  counters these are not reset when the interface is restarted
+
+A rewrite of a chain or of the nft table resets its counters. The collector
+keeps the last raw value of every counter and carries what was counted
+before a reset forward, so totals only grow for the life of the process,
+and turns the difference between two samples into rates.
+"""
+
+import os
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+
+from app.change_tracking import register_listener
+from app.firewall_compiler import (ACCOUNTING_SETS, PLAN_TABLES, POLICY_CHAIN_PREFIX, group_policies,
+                                   load_firewall_plan, load_peer_addresses)
+from app.iptables_manager import get_iptables_manager
+
+SAVED_RULE = re.compile(r'^\[(\d+):(\d+)\] -A (\S+) (.*)$')
+SAVED_COMMENT = re.compile(r'--comment (?:"([^"]*)"|(\S+))')
+NFT_BLOCK = re.compile(r'^(chain|counter) (\S+) \{')
+NFT_COUNTER = re.compile(r'packets (\d+) bytes (\d+)')
+NFT_COMMENT = re.compile(r'comment "([^"]*)"')
+RULE_LABEL = re.compile(r'^Rule:([-\d,]+):(.*)$')  # linked template rules have negative ids
+POLICY_LABEL = re.compile(r'^Policy:(\d+):(.*)$')
+DEFAULT_LABEL = re.compile(r'^Default-(Drop|Allow):(.*)$')
+PEER_COUNTER = re.compile(r'^(tx|rx)_(\d+)$')
+SHARED_CHAIN_PREFIXES = (POLICY_CHAIN_PREFIX, 'policy_')
+
+# ('rule', first id) | ('policy', chain, position) | ('default', chain, label) | ('peer', id, 'tx'|'rx')
+# -> [packets, bytes]
+Counters = Dict[tuple, list]
+
+
+def _add(counters: Counters, key: tuple, packets: int, bytes_: int):
+    entry = counters.setdefault(key, [0, 0])
+    entry[0] += packets
+    entry[1] += bytes_
+
+
+def _record_rule(counters: Counters, info: Dict[tuple, dict], chain: str, label: str, packets: int, bytes_: int):
+    """Counters of one rule by its comment; rules without an app label are ignored"""
+    rule, policy = RULE_LABEL.match(label), POLICY_LABEL.match(label)
+    if rule:
+        rule_ids = [int(rule_id) for rule_id in rule.group(1).split(',') if rule_id]
+        if not rule_ids:
+            return
+        key = ('rule', rule_ids[0])
+        info[key] = {"rule_ids": rule_ids, "name": rule.group(2), "chain": chain, "shared": False}
+    elif policy and chain.startswith(SHARED_CHAIN_PREFIXES):
+        key = ('policy', chain, int(policy.group(1)))
+        info[key] = {"rule_ids": [], "name": policy.group(2), "chain": chain, "shared": True}
+    else:
+        default = DEFAULT_LABEL.match(label)
+        if not default:
+            return
+        key = ('default', chain, default.group(2))
+        info[key] = {"chain": chain, "label": default.group(2),
+                     "verdict": "DROP" if default.group(1) == 'Drop' else "ACCEPT"}
+    _add(counters, key, packets, bytes_)
+
+
+def parse_iptables_counters(saved: str, ipset_saved: Optional[str] = None,
+                            peers_by_address: Optional[Dict[str, int]] = None) -> Tuple[Counters, Dict[tuple, dict]]:
+    """Counters from `iptables-save -c -t filter` and `ipset save` output"""
+    counters: Counters = {}
+    info: Dict[tuple, dict] = {}
+    in_filter = False
+    for line in (saved or '').splitlines():
+        line = line.strip()
+        if line.startswith('*'):
+            in_filter = line == '*filter'
+            continue
+        match = SAVED_RULE.match(line) if in_filter else None
+        comment = SAVED_COMMENT.search(match.group(4)) if match else None
+        if comment:
+            _record_rule(counters, info, match.group(3), comment.group(1) or comment.group(2),
+                         int(match.group(1)), int(match.group(2)))
+
+    directions = {name: direction for direction, name in ACCOUNTING_SETS.items()}
+    peers_by_address = peers_by_address or {}
+    for line in (ipset_saved or '').splitlines():
+        parts = line.split()
+        if (len(parts) >= 7 and parts[0] == 'add' and parts[1] in directions
+                and parts[3] == 'packets' and parts[5] == 'bytes' and parts[2] in peers_by_address):
+            _add(counters, ('peer', peers_by_address[parts[2]], directions[parts[1]]), int(parts[4]), int(parts[6]))
+    return counters, info
+
+
+def parse_nft_counters(listing: str) -> Tuple[Counters, Dict[tuple, dict]]:
+    """Counters from `nft list table` output: rule counters by comment, named counters per peer"""
+    counters: Counters = {}
+    info: Dict[tuple, dict] = {}
+    chain = counter = None
+    for line in (listing or '').splitlines():
+        line = line.strip()
+        block = NFT_BLOCK.match(line)
+        if block:
+            if block.group(1) == 'chain':
+                chain, counter = block.group(2), None
+            else:
+                counter = PEER_COUNTER.match(block.group(2))
+        if counter:
+            values = NFT_COUNTER.search(line)
+            if values:
+                _add(counters, ('peer', int(counter.group(2)), counter.group(1)),
+                     int(values.group(1)), int(values.group(2)))
+            if line.endswith('}'):
+                counter = None
+            continue
+        values = NFT_COUNTER.search(line) if chain else None
+        comment = NFT_COMMENT.search(line) if values else None
+        if comment:
+            _record_rule(counters, info, chain, comment.group(1), int(values.group(1)), int(values.group(2)))
+    return counters, info
+
+
+def parse_counters(raw: dict, peers_by_address: Optional[Dict[str, int]] = None) -> Tuple[Counters, Dict[tuple, dict]]:
+    """A manager's read_counters() result in parsed form"""
+    if raw.get("format") == "nft":
+        return parse_nft_counters(raw.get("rules"))
+    return parse_iptables_counters(raw.get("rules"), raw.get("ipsets"), peers_by_address)
+
+
+class CounterCollector:
+    """Monotonic totals and rates from successive samples of one backend"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.raw: Dict[tuple, Tuple[int, int]] = {}      # last value read from the kernel
+        self.offsets: Dict[tuple, Tuple[int, int]] = {}  # counted before resets
+        self.totals: Dict[tuple, Tuple[int, int]] = {}
+        self.sampled_at: Optional[float] = None
+
+    def _total(self, key: tuple, packets: int, bytes_: int) -> Tuple[int, int]:
+        previous = self.raw.get(key)
+        offset = self.offsets.get(key, (0, 0))
+        if previous and (packets < previous[0] or bytes_ < previous[1]):
+            offset = (offset[0] + previous[0], offset[1] + previous[1])
+            self.offsets[key] = offset
+        self.raw[key] = (packets, bytes_)
+        return packets + offset[0], bytes_ + offset[1]
+
+    def record(self, counters: Counters, info: Dict[tuple, dict], now: Optional[float] = None) -> dict:
+        """Add a parsed sample; returns rules by rule id, default verdicts and peers by peer id"""
+        now = time.monotonic() if now is None else now
+        result = {"rules": {}, "defaults": [], "peers": {}}
+        with self.lock:
+            interval = now - self.sampled_at if self.sampled_at is not None else None
+            for key in sorted(counters, key=repr):
+                packets, bytes_ = self._total(key, *counters[key])
+                previous = self.totals.get(key)
+                self.totals[key] = (packets, bytes_)
+                rates = (None, None)
+                if interval and previous:
+                    rates = (round((packets - previous[0]) / interval, 2), round((bytes_ - previous[1]) / interval, 2))
+
+                if key[0] == 'peer':
+                    direction = key[2]
+                    result["peers"].setdefault(str(key[1]), {}).update({
+                        f"{direction}_packets": packets, f"{direction}_bytes": bytes_,
+                        f"{direction}_packets_per_s": rates[0], f"{direction}_bytes_per_s": rates[1],
+                    })
+                    continue
+                entry = dict(info.get(key, {}), packets=packets, bytes=bytes_,
+                             packets_per_s=rates[0], bytes_per_s=rates[1])
+                if key[0] in ('rule', 'policy'):
+                    for rule_id in entry["rule_ids"]:
+                        result["rules"][str(rule_id)] = entry
+                else:
+                    result["defaults"].append(entry)
+            self.sampled_at = now
+        result["interval_s"] = round(interval, 3) if interval else None
+        return result
+
+
+class PolicyRuleIds:
+    """Shared policy chain -> rule ids at each position across its peers, rebuilt after plan changes"""
+
+    TABLES = PLAN_TABLES
+
+    def __init__(self):
+        self.index = None
+        self.lock = threading.Lock()
+
+    def invalidate(self, changes=None):
+        self.index = None
+
+    def _build(self) -> Dict[str, list]:
+        index = {}
+        for chain, group in group_policies(load_firewall_plan()).items():
+            positions = [[] for _ in group.peers[0].rules]
+            for peer in group.peers:
+                for position, rule in enumerate(peer.rules):
+                    positions[position] += (rule.id,) + rule.merged_ids
+            index[chain] = index[f"policy_{chain[len(POLICY_CHAIN_PREFIX):]}"] = positions
+        return index
+
+    def get(self) -> Dict[str, list]:
+        index = self.index
+        if index is None:
+            with self.lock:
+                if self.index is None:
+                    self.index = self._build()
+                index = self.index
+        return index
+
+
+policy_rule_ids = PolicyRuleIds()
+register_listener(policy_rule_ids.invalidate, tables=PolicyRuleIds.TABLES)
+
+
+def resolve_policy_rules(info: Dict[tuple, dict]):
+    """Fill in the rule ids of policy chain rules; loads the plan only when there are any"""
+    keys = [key for key in info if key[0] == 'policy']
+    if not keys:
+        return
+    index = policy_rule_ids.get()
+    for key in keys:
+        positions = index.get(key[1], [])
+        info[key]["rule_ids"] = sorted(positions[key[2]]) if key[2] < len(positions) else []
+
+
+_collectors: Dict[str, CounterCollector] = {}
+_collectors_lock = threading.Lock()
+
+
+def get_counter_collector(backend: str) -> CounterCollector:
+    with _collectors_lock:
+        return _collectors.setdefault(backend, CounterCollector())
+
+
+def reset_counter_collectors():
+    with _collectors_lock:
+        _collectors.clear()
+
+
+def collect_firewall_counters(vpn_interface: str = 'wg0', backend: Optional[str] = None) -> Dict[str, any]:
+    """
+    Read the selected backend's counters once and add them to its collector
+    Needs an app context: per-peer ipset counters are keyed by address and
+    mapped to peers with one query, shared policy rules through a cached plan.
+    """
+    backend = (backend or os.getenv("FIREWALL_BACKEND", "restore")).lower()
+    try:
+        raw = get_iptables_manager(vpn_interface, backend).read_counters()
+        peers_by_address = {address: peer_id for peer_id, address in load_peer_addresses()} if raw.get("ipsets") else {}
+        counters, info = parse_counters(raw, peers_by_address)
+        resolve_policy_rules(info)
+        result = get_counter_collector(backend).record(counters, info)
+        return {
+            "status": "success",
+            "backend": backend,
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "accounting": any(key[0] == 'peer' for key in counters),
+            **result,
+        }
+    except Exception as e:
+        return {"status": "error", "message": f"Error reading firewall counters: {str(e)}"}
@@ -0,0 +1,272 @@
+"""
+Offline firewall policy evaluation
+Answers "would this packet pass?" for (src, dst, protocol, port) from the
+database state, without reading or touching the kernel ruleset.
+
+Every distinct rule list is compiled once into bitmask indexes (bit i =
+rule i in priority order): binary prefix tries over source and destination
+prefixes and, per protocol, a port interval map. A query ORs the masks
+along the two address paths, ANDs them with the protocol, port and
+interface masks and takes the lowest bit left: the first matching rule.
+
+Decisions follow the compiled ruleset (app.firewall_compiler): a packet
+from a peer address is decided by that peer's rules, otherwise a packet to
+a peer address by that peer's rules and default. A packet between two
+non-peer addresses is decided by the first rule with an explicit source
+that matches it, taking peers in id order; if none does, it is not handled
+by the app. A packet enters through the VPN interface when its source is in
+the VPN subnet or a peer, and leaves through it when its destination is.
+Connection tracking is not modelled: queries describe the first packet of
+a connection. Rules that cannot be parsed never match.
+"""
+
+import ipaddress
+import threading
+from bisect import bisect_right
+from typing import Dict, List, Optional
+
+from app.change_tracking import register_listener
+from app.firewall_compiler import PLAN_TABLES, FirewallPlan, PlannedPeer, load_firewall_plan, policy_key
+from app.firewall_optimizer import lift_rule
+
+PROTOCOLS = ('tcp', 'udp', 'icmp')
+MAX_BATCH = 1000  # queries per /api/v1/firewall/evaluate request
+
+
+class PrefixTrie:
+    """Binary trie over IPv4 prefixes; every node holds the mask of the rules on that exact prefix"""
+
+    __slots__ = ('root',)
+
+    def __init__(self):
+        self.root = [None, None, 0]  # child 0, child 1, mask
+
+    def insert(self, network: ipaddress.IPv4Network, bit: int):
+        node, address = self.root, int(network.network_address)
+        for depth in range(network.prefixlen):
+            branch = (address >> (31 - depth)) & 1
+            if node[branch] is None:
+                node[branch] = [None, None, 0]
+            node = node[branch]
+        node[2] |= bit
+
+    def lookup(self, address: int) -> int:
+        """Mask of every rule whose prefix contains the address"""
+        node, mask, depth = self.root, 0, 0
+        while node is not None:
+            mask |= node[2]
+            if depth == 32:
+                break
+            node = node[(address >> (31 - depth)) & 1]
+            depth += 1
+        return mask
+
+
+class PortMap:
+    """Port -> mask of rules matching it, as sorted interval starts with one mask per interval"""
+
+    __slots__ = ('starts', 'masks')
+
+    def __init__(self, entries):
+        """entries: (PortSet or None for every port, bit)"""
+        bounds = {1, 65536}
+        for ports, _ in entries:
+            for start, end in (ports.intervals if ports else ()):
+                bounds.update((start, end + 1))
+        self.starts = sorted(bounds)[:-1]
+        self.masks = []
+        for start in self.starts:
+            mask = 0
+            for ports, bit in entries:
+                if ports is None or ports.contains(start):
+                    mask |= bit
+            self.masks.append(mask)
+
+    def lookup(self, port: int) -> int:
+        return self.masks[bisect_right(self.starts, port) - 1]
+
+
+class RuleIndex:
+    """Bitmask indexes over one rule list"""
+
+    def __init__(self, rules, vpn_subnet: str):
+        self.own_source = 0
+        self.sources = PrefixTrie()
+        self.destinations = PrefixTrie()
+        self.protocols = {protocol: 0 for protocol in PROTOCOLS}
+        self.any_protocol = 0
+        self.portless = {'tcp': 0, 'udp': 0}
+        self.inbound = self.outbound = 0
+        port_entries = {'tcp': [], 'udp': []}
+
+        for position, rule in enumerate(rules):
+            ir, bit = lift_rule(position, rule, vpn_subnet), 1 << position
+            if ir.opaque:
+                continue
+            if ir.source is None:
+                self.own_source |= bit
+            else:
+                self.sources.insert(ir.source, bit)
+            self.destinations.insert(ir.destination or ipaddress.IPv4Network('0.0.0.0/0'), bit)
+            if ir.protocol == 'any':
+                self.any_protocol |= bit
+            else:
+                self.protocols[ir.protocol] = self.protocols.get(ir.protocol, 0) | bit
+            if ir.protocol in port_entries:
+                port_entries[ir.protocol].append((ir.ports, bit))
+                if ir.ports is None:
+                    self.portless[ir.protocol] |= bit
+            if ir.outbound:
+                self.outbound |= bit
+            else:
+                self.inbound |= bit
+
+        self.ports = {protocol: PortMap(entries) for protocol, entries in port_entries.items()}
+
+    def first_match(self, src: int, own_source: bool, dst: int, protocol: str, port: Optional[int],
+                    enters_vpn: bool, leaves_vpn: bool) -> Optional[int]:
+        """Position of the first rule matching the packet, or None"""
+        mask = (self.own_source if own_source else 0) | self.sources.lookup(src)
+        mask &= self.destinations.lookup(dst)
+        mask &= self.protocols.get(protocol, 0) | self.any_protocol
+        if protocol in self.ports:
+            ports = self.ports[protocol].lookup(port) if port is not None else self.portless[protocol]
+            mask &= ports | self.any_protocol
+        mask &= (self.inbound if enters_vpn else 0) | (0 if leaves_vpn else self.outbound)
+        if not mask:
+            return None
+        return (mask & -mask).bit_length() - 1
+
+
+class FirewallEvaluator:
+    """Verdicts for packets against a FirewallPlan (built from the unoptimized plan, so matches name real rows)"""
+
+    def __init__(self, plan: FirewallPlan):
+        self.plan = plan
+        vpn_subnet = ipaddress.IPv4Network(plan.vpn_subnet, strict=False)
+        self.vpn_range = (int(vpn_subnet.network_address), int(vpn_subnet.broadcast_address))
+        self.peers: Dict[int, PlannedPeer] = {}
+        self.indexes: Dict[int, RuleIndex] = {}
+        shared: Dict[tuple, RuleIndex] = {}
+        for peer in plan.peers:
+            try:
+                address = int(ipaddress.IPv4Address(peer.address.split('/')[0]))
+            except ValueError:
+                continue
+            key = policy_key(peer)
+            if key not in shared:
+                shared[key] = RuleIndex(peer.rules, plan.vpn_subnet)
+            self.peers[address] = peer
+            self.indexes[address] = shared[key]
+        self.policies = len(shared)
+
+        # Peers with explicit-source rules, in dispatch order; bit k of a trie mask = source_peers[k]
+        self.source_peers: List[int] = []
+        self.source_trie = PrefixTrie()
+        for address, peer in self.peers.items():
+            for position, rule in enumerate(peer.rules):
+                ir = lift_rule(position, rule, plan.vpn_subnet)
+                if rule.source and not ir.opaque:
+                    if not self.source_peers or self.source_peers[-1] != address:
+                        self.source_peers.append(address)
+                    self.source_trie.insert(ir.source, 1 << (len(self.source_peers) - 1))
+
+    def _on_vpn(self, address: int) -> bool:
+        return address in self.peers or self.vpn_range[0] <= address <= self.vpn_range[1]
+
+    def evaluate(self, src: str, dst: str, protocol: str = 'tcp', port: Optional[int] = None) -> dict:
+        """
+        Verdict for one packet
+        Raises ValueError for addresses that are not IPv4, unknown protocols
+        and ports outside 1-65535.
+        """
+        source, destination = int(ipaddress.IPv4Address(src)), int(ipaddress.IPv4Address(dst))
+        protocol = (protocol or '').lower()
+        if protocol not in PROTOCOLS:
+            raise ValueError(f"protocol must be one of: {', '.join(PROTOCOLS)}")
+        if port is not None:
+            port = int(port)
+            if not 1 <= port <= 65535:
+                raise ValueError("port must be between 1 and 65535")
+        if protocol == 'icmp':
+            port = None
+
+        enters_vpn, leaves_vpn = self._on_vpn(source), self._on_vpn(destination)
+        if source in self.peers:
+            address, direction = source, 'source'
+        elif destination in self.peers:
+            address, direction = destination, 'destination'
+        else:
+            address, position = self._source_rule_match(source, destination, protocol, port, enters_vpn, leaves_vpn)
+            if address is None:
+                return {"verdict": "ACCEPT", "reason": "unmanaged", "peer": None, "direction": None, "rule": None}
+            direction = 'rule_source'
+
+        peer = self.peers[address]
+        if direction != 'rule_source':
+            position = self.indexes[address].first_match(
+                source, direction == 'source', destination, protocol, port, enters_vpn, leaves_vpn)
+        result = {"peer": {"id": peer.id, "name": peer.name, "address": peer.address}, "direction": direction}
+        if position is None:
+            result.update(verdict="DROP" if peer.rules else "ACCEPT",
+                          reason="default_drop" if peer.rules else "default_allow", rule=None)
+        else:
+            rule = peer.rules[position]
+            result.update(verdict="ACCEPT" if rule.action == 'ALLOW' else "DROP", reason="rule",
+                          rule={"id": rule.id, "name": rule.name, "priority": rule.priority})
+        return result
+
+    def _source_rule_match(self, source: int, destination: int, protocol: str, port: Optional[int],
+                           enters_vpn: bool, leaves_vpn: bool):
+        """(peer address, rule position) of the first explicit-source rule matching a non-peer packet"""
+        candidates = self.source_trie.lookup(source)
+        while candidates:
+            bit = candidates & -candidates
+            address = self.source_peers[bit.bit_length() - 1]
+            position = self.indexes[address].first_match(source, False, destination, protocol, port,
+                                                         enters_vpn, leaves_vpn)
+            if position is not None:
+                return address, position
+            candidates ^= bit
+        return None, None
+
+    def evaluate_many(self, queries: List[dict]) -> List[dict]:
+        """Batch form: per query either the verdict or {"error": message}"""
+        results = []
+        for query in queries:
+            try:
+                results.append(self.evaluate(query.get('src'), query.get('dst'), query.get('protocol', 'tcp'),
+                                             query.get('port')))
+            except (ValueError, TypeError, AttributeError) as e:
+                results.append({"error": str(e)})
+        return results
+
+
+class PolicyEvaluatorCache:
+    """Process-wide evaluator over the database, rebuilt after commits touching peers, rules or templates"""
+
+    TABLES = PLAN_TABLES
+
+    def __init__(self):
+        self.evaluator = None
+        self.lock = threading.Lock()
+
+    def invalidate(self, changes=None):
+        self.evaluator = None
+
+    def get(self) -> FirewallEvaluator:
+        evaluator = self.evaluator
+        if evaluator is None:
+            with self.lock:
+                if self.evaluator is None:
+                    self.evaluator = FirewallEvaluator(load_firewall_plan(optimize=False))
+                evaluator = self.evaluator
+        return evaluator
+
+
+policy_evaluator = PolicyEvaluatorCache()
+register_listener(policy_evaluator.invalidate, tables=PolicyEvaluatorCache.TABLES)
+
+
+def get_policy_evaluator() -> FirewallEvaluator:
+    return policy_evaluator.get()
@@ -0,0 +1,222 @@
+"""
+Firewall rule optimizer
+Lifts a peer's rule list into a typed intermediate representation (source
+and destination prefixes, destination ports as interval sets) and runs
+order-preserving passes over it before the compiler renders it:
+
+- shadow removal: a rule whose every packet already matches an earlier
+  rule never decides anything and is dropped
+- port grouping: neighbouring rules that differ only in destination ports
+  become one rule with a port set (iptables multiport, nft anonymous set)
+- CIDR collapse: neighbouring rules that differ only in destination are
+  merged into the fewest covering prefixes
+
+Only neighbouring rules with the same verdict are merged, so no packet
+changes verdict. Rules that cannot be parsed are kept verbatim and act as
+a barrier for merging.
+
+The passes work on rule positions, never on the peer's own address, so
+every peer with the same rule list optimizes the same way and results can
+be shared between them.
+"""
+
+import ipaddress
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+MULTIPORT_MAX = 15  # xt_multiport ports per rule, a range takes two
+
+Prefix = ipaddress.IPv4Network
+
+
+class PortSet(NamedTuple):
+    """Destination ports as sorted, disjoint, non-adjacent inclusive intervals"""
+    intervals: Tuple[Tuple[int, int], ...]
+
+    @classmethod
+    def from_intervals(cls, intervals: Iterable[Tuple[int, int]]) -> 'PortSet':
+        merged: List[List[int]] = []
+        for start, end in sorted(intervals):
+            if merged and start <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        return cls(tuple((start, end) for start, end in merged))
+
+    @classmethod
+    def parse(cls, text: Optional[str]) -> Optional['PortSet']:
+        """'80', '20-22' or '80,443' (':' accepted for ranges); None means every port"""
+        if not text or text.strip() == 'any':
+            return None
+        intervals = []
+        for part in text.replace(' ', '').split(','):
+            start, _, end = part.replace(':', '-').partition('-')
+            start, end = int(start), int(end or start)
+            if not 1 <= start <= end <= 65535:
+                raise ValueError(f"Invalid port interval: {part}")
+            intervals.append((start, end))
+        return cls.from_intervals(intervals)
+
+    def union(self, other: 'PortSet') -> 'PortSet':
+        return PortSet.from_intervals(self.intervals + other.intervals)
+
+    def covers(self, other: 'PortSet') -> bool:
+        return all(any(start <= low and high <= end for start, end in self.intervals)
+                   for low, high in other.intervals)
+
+    def contains(self, port: int) -> bool:
+        return any(start <= port <= end for start, end in self.intervals)
+
+    @property
+    def slots(self) -> int:
+        return sum(1 if start == end else 2 for start, end in self.intervals)
+
+    def render(self, separator: str = '-') -> str:
+        """port_range syntax ('80,8000-8080'); separator ':' gives iptables syntax"""
+        return ','.join(str(start) if start == end else f"{start}{separator}{end}" for start, end in self.intervals)
+
+    def iptables_args(self) -> List[str]:
+        if len(self.intervals) > 1:
+            return ['-m', 'multiport', '--dports', self.render(':')]
+        return ['--dport', self.render(':')]
+
+
+class IRRule(NamedTuple):
+    members: Tuple[int, ...]   # positions of the source rules; the first one names the result
+    action: str
+    outbound: bool             # internet rule: matched on leaving through another interface
+    source: Optional[Prefix]   # None: the peer's own address
+    destination: Optional[Prefix]  # None: anywhere
+    protocol: str
+    ports: Optional[PortSet]   # None: every port
+    opaque: bool = False       # could not be parsed, rendered from the source rule as is
+
+
+class Removal(NamedTuple):
+    position: int   # source rule that no longer exists on its own
+    reason: str     # 'shadowed', 'merged_ports' or 'merged_destinations'
+    by: int         # source rule that now decides its packets
+
+
+def _prefix(text: Optional[str]) -> Optional[Prefix]:
+    if not text:
+        return None
+    network = ipaddress.ip_network(text.strip(), strict=False)
+    if network.version != 4:
+        raise ValueError(f"Not an IPv4 prefix: {text}")
+    return network
+
+
+def lift_rule(position: int, rule, vpn_subnet: str) -> IRRule:
+    """One planned rule (see firewall_compiler.PlannedRule) in the typed form"""
+    try:
+        destination = _prefix(rule.destination)
+        if destination is None and rule.rule_type == 'peer_comm':
+            destination = _prefix(vpn_subnet)
+        if destination is not None and destination.prefixlen == 0:
+            destination = None
+        ports = PortSet.parse(rule.port_range) if rule.protocol in ('tcp', 'udp') else None
+        return IRRule((position,), rule.action, rule.rule_type == 'internet', _prefix(rule.source),
+                      destination, rule.protocol, ports)
+    except ValueError:
+        return IRRule((position,), rule.action, rule.rule_type == 'internet', None, None, rule.protocol,
+                      None, opaque=True)
+
+
+def _prefix_covers(outer: Optional[Prefix], inner: Optional[Prefix], none_is_any: bool) -> bool:
+    if outer is None:
+        return none_is_any or inner is None
+    if outer.prefixlen == 0:
+        return True
+    return inner is not None and inner.subnet_of(outer)
+
+
+def covers(earlier: IRRule, later: IRRule) -> bool:
+    """Every packet matching `later` also matches `earlier`"""
+    if earlier.opaque or later.opaque or earlier.outbound != later.outbound:
+        return False
+    # A rule on the peer's own address covers no explicit source prefix: it may not hold the peer
+    if not _prefix_covers(earlier.source, later.source, none_is_any=False):
+        return False
+    if not _prefix_covers(earlier.destination, later.destination, none_is_any=True):
+        return False
+    if earlier.protocol != 'any' and earlier.protocol != later.protocol:
+        return False
+    if earlier.ports is None:
+        return True
+    return later.ports is not None and earlier.ports.covers(later.ports)
+
+
+def remove_shadowed(rules: List[IRRule], removals: List[Removal]) -> List[IRRule]:
+    kept: List[IRRule] = []
+    for rule in rules:
+        by = next((earlier for earlier in kept if covers(earlier, rule)), None)
+        if by is None:
+            kept.append(rule)
+        else:
+            removals.extend(Removal(position, 'shadowed', by.members[0]) for position in rule.members)
+    return kept
+
+
+def group_ports(rules: List[IRRule], removals: List[Removal]) -> List[IRRule]:
+    grouped: List[IRRule] = []
+    for rule in rules:
+        previous = grouped[-1] if grouped else None
+        if (previous is not None and not previous.opaque and not rule.opaque
+                and previous.ports is not None and rule.ports is not None
+                and previous._replace(members=(), ports=None) == rule._replace(members=(), ports=None)
+                and previous.ports.union(rule.ports).slots <= MULTIPORT_MAX):
+            grouped[-1] = previous._replace(members=previous.members + rule.members,
+                                            ports=previous.ports.union(rule.ports))
+            removals.extend(Removal(position, 'merged_ports', previous.members[0]) for position in rule.members)
+        else:
+            grouped.append(rule)
+    return grouped
+
+
+def collapse_destinations(rules: List[IRRule], removals: List[Removal]) -> List[IRRule]:
+    collapsed: List[IRRule] = []
+    run: List[IRRule] = []
+
+    def flush():
+        if len(run) > 1:
+            networks = list(ipaddress.collapse_addresses(rule.destination for rule in run))
+            if len(networks) < len(run):
+                for network in networks:
+                    inside = [rule for rule in run if rule.destination.subnet_of(network)]
+                    members = tuple(position for rule in inside for position in rule.members)
+                    collapsed.append(inside[0]._replace(members=members, destination=network))
+                    removals.extend(Removal(position, 'merged_destinations', members[0])
+                                    for position in members[len(inside[0].members):])
+                run.clear()
+                return
+        collapsed.extend(run)
+        run.clear()
+
+    for rule in rules:
+        mergeable = not rule.opaque and rule.destination is not None
+        if run and not (mergeable and run[0]._replace(members=(), destination=None) ==
+                        rule._replace(members=(), destination=None)):
+            flush()
+        if mergeable:
+            run.append(rule)
+        else:
+            collapsed.append(rule)
+    flush()
+    return collapsed
+
+
+def optimize_rules(rules, vpn_subnet: str) -> Tuple[List[IRRule], List[Removal]]:
+    """
+    Run the passes over one peer's rules (in evaluation order) until none
+    of them changes anything; returns the surviving rules and what became
+    of every source rule that no longer stands on its own
+    """
+    current = [lift_rule(position, rule, vpn_subnet) for position, rule in enumerate(rules)]
+    removals: List[Removal] = []
+    while True:
+        count = len(current)
+        current = remove_shadowed(current, removals)
+        current = collapse_destinations(current, removals)
+        current = group_ports(current, removals)
+        if len(current) == count:
+            return current, removals
@@ -0,0 +1,142 @@
+"""
+Conditional GET support
+A process-wide data revision is bumped after every commit that touched
+peers, allowed IPs, firewall rules or the tables feeding generated configs.
+Endpoints derive an ETag from the revision, the request URL and, for
+live data, a fingerprint of the WireGuard status snapshot. A matching
+If-None-Match gets a 304 before the view runs; an unchanged response that is
+requested again is served from the serialized-body cache.
+
+The revision lives in this process only; the boot nonce in every ETag keeps
+tags from a previous process from ever matching.
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+from flask import Response, g, make_response, request
+
+from app.change_tracking import register_listener
+
+HTTP_CACHE_ENTRIES = int(os.getenv("HTTP_CACHE_ENTRIES", "256"))
+
+REVISION_TABLES = ('peers', 'allowed_ips', 'firewall_rules', 'firewall_templates', 'firewall_template_rules',
+                   'route_profiles', 'address_pools', 'peer_tags')
+
+_BOOT = os.urandom(4).hex()
+_lock = threading.Lock()
+_revision = 0
+_bodies = OrderedDict()  # etag -> (body, status, headers)
+
+
+def get_revision() -> int:
+    return _revision
+
+
+def bump_revision(changes=None):
+    """Change-tracking listener: any committed change to a tracked table invalidates all tags"""
+    global _revision
+    with _lock:
+        _revision += 1
+        _bodies.clear()
+
+
+register_listener(bump_revision, tables=REVISION_TABLES)
+
+
+def status_snapshot_version(wg_status) -> str:
+    """
+    Fingerprint of the live WireGuard status
+    Besides the raw values, the handshake age and connection duration are
+    hashed as rendered ("3 min ago", "2h 5m"), so the version moves when
+    the time-relative fields of a response would read differently, while
+    an idle interface keeps the same version between those steps.
+    """
+    from app.wireguard_status import format_duration, format_time_ago
+    digest = hashlib.sha256()
+    for public_key in sorted(wg_status):
+        data = wg_status[public_key]
+        handshake = data.get('latest_handshake')
+        digest.update(repr((
+            public_key, data.get('is_connected'), data.get('endpoint'), data.get('client_ip'),
+            int(handshake.timestamp()) if handshake else None, format_time_ago(handshake),
+            format_duration(data.get('connection_duration_seconds')),
+            data.get('transfer_rx'), data.get('transfer_tx'), data.get('persistent_keepalive'),
+        )).encode())
+    return digest.hexdigest()[:16]
+
+
+def make_etag(*parts) -> str:
+    digest = hashlib.sha256(repr((_BOOT, request.full_path) + parts).encode())
+    return digest.hexdigest()[:32]
+
+
+def _store(etag, response):
+    with _lock:
+        _bodies[etag] = (response.get_data(), response.status_code, list(response.headers.items()))
+        _bodies.move_to_end(etag)
+        while len(_bodies) > HTTP_CACHE_ENTRIES:
+            _bodies.popitem(last=False)
+
+
+def _cached(etag):
+    with _lock:
+        entry = _bodies.get(etag)
+        if entry is not None:
+            _bodies.move_to_end(etag)
+        return entry
+
+
+def conditional(version=None, weak=False):
+    """
+    Decorator for GET views whose output depends only on committed data, the
+    URL and optionally `version(*args, **kwargs)` (e.g. a live snapshot
+    fingerprint; returning None or raising disables caching for that
+    request, and the view reports the error itself).
+    weak marks the tag W/: for live data that is equivalent, not
+    byte-identical, across snapshots and processes.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            revision = _revision
+            try:
+                extra = version(*args, **kwargs) if version else ''
+            except Exception as e:
+                print(f"⚠️ Not caching {request.path}: {e}")
+                extra = None
+            if extra is None:
+                return view(*args, **kwargs)
+
+            etag = make_etag(revision, extra)
+            matches = request.if_none_match.contains_weak if weak else request.if_none_match.contains
+            if matches(etag) or request.if_none_match.star_tag:
+                response = Response(status=304)
+                response.set_etag(etag, weak=weak)
+                return response
+
+            cached = _cached(etag)
+            if cached is not None:
+                body, status, headers = cached
+                return Response(body, status=status, headers=headers)
+
+            response = view(*args, **kwargs)
+            if not isinstance(response, Response):
+                response = make_response(response)
+            if response.status_code == 200 and not response.direct_passthrough:
+                response.set_etag(etag, weak=weak)
+                if revision == _revision:  # nothing was committed while the view ran
+                    _store(etag, response)
+            return response
+        return wrapper
+    return decorator
+
+
+def wireguard_status_version(*args, **kwargs):
+    """Version function for views built on get_wireguard_status(); the snapshot is kept for the view"""
+    from app.wireguard_status import get_wireguard_status
+    g.wg_status = get_wireguard_status()
+    return status_snapshot_version(g.wg_status)
@@ -0,0 +1,278 @@
+"""
+VPN address allocator
+Keeps one bitmap per subnet (1 bit per address), or a sparse offset set for
+IPv6-sized prefixes, so the next free address is found without loading
+every peer. Bitmaps are built from the database on
+first use and then kept current through commit-time change tracking.
+"""
+
+import ipaddress
+import threading
+from typing import Callable, Iterable, Optional
+
+from app import db
+from app.change_tracking import UNKNOWN, register_listener
+from app.models import Peer
+
+
+SPARSE_THRESHOLD = 2 ** 24  # subnets larger than this (IPv6) use the sparse allocator
+
+
+def _system_offsets(network):
+    """Offsets that are never handed out: the server (.1 / ::1) plus what network.hosts() skips"""
+    size = network.num_addresses
+    offsets = {1} if size > 1 else set()
+    if network.version == 4 and network.prefixlen < 31:
+        offsets |= {0, size - 1}  # network and broadcast
+    elif network.version == 6 and network.prefixlen < 127:
+        offsets.add(0)  # Subnet-Router anycast
+    return offsets
+
+
+class SubnetBitmap:
+    """
+    Allocation bitmap for one subnet (1 bit per address)
+    The system offsets start out reserved, mirroring network.hosts() minus
+    the server address. `hint` is the first byte that may still contain a
+    free bit, so repeated next_free() calls skip the full prefix of the
+    bitmap (amortized O(1)).
+    """
+
+    def __init__(self, network):
+        self.network = ipaddress.ip_network(network, strict=False)
+        self.first = int(self.network.network_address)
+        self.size = self.network.num_addresses
+        self.bitmap = bytearray((self.size + 7) // 8)
+        self.used = 0
+        self.hint = 0
+
+        # Padding bits past the end of the subnet are never free
+        for index in range(self.size, len(self.bitmap) * 8):
+            self.bitmap[index >> 3] |= 1 << (index & 7)
+
+        self.system = _system_offsets(self.network)
+        for index in self.system:
+            self._set(index)
+
+    def _index(self, address) -> Optional[int]:
+        try:
+            value = int(ipaddress.ip_address(address))
+        except ValueError:
+            return None
+        index = value - self.first
+        return index if 0 <= index < self.size else None
+
+    def _set(self, index) -> bool:
+        mask = 1 << (index & 7)
+        if self.bitmap[index >> 3] & mask:
+            return False
+        self.bitmap[index >> 3] |= mask
+        self.used += 1
+        return True
+
+    def reserve(self, address) -> bool:
+        """Mark an address as taken; False if it is outside the subnet or already taken"""
+        index = self._index(address)
+        return index is not None and self._set(index)
+
+    def release(self, address) -> bool:
+        index = self._index(address)
+        if index is None or index in self.system:
+            return False
+        mask = 1 << (index & 7)
+        if not self.bitmap[index >> 3] & mask:
+            return False
+        self.bitmap[index >> 3] &= ~mask
+        self.used -= 1
+        self.hint = min(self.hint, index >> 3)
+        return True
+
+    def is_free(self, address) -> bool:
+        index = self._index(address)
+        return index is not None and not self.bitmap[index >> 3] & (1 << (index & 7))
+
+    def next_free(self) -> Optional[str]:
+        """Lowest free address, or None if the subnet is exhausted"""
+        bitmap = self.bitmap
+        length = len(bitmap)
+        position = self.hint
+        while position < length and bitmap[position] == 0xFF:
+            position += 1
+        self.hint = position
+        if position == length:
+            return None
+        byte = bitmap[position]
+        bit = (~byte & (byte + 1)).bit_length() - 1  # lowest clear bit
+        return str(self.network.network_address + (position * 8 + bit))
+
+    @property
+    def free(self) -> int:
+        return self.size - self.used
+
+    def stats(self):
+        return {
+            'subnet': str(self.network),
+            'kind': 'bitmap',
+            'size': self.size,
+            'assigned': self.used - len(self.system),
+            'free': self.free,
+        }
+
+
+class SparseSubnet(SubnetBitmap):
+    """
+    Allocator for subnets too large for a bitmap (an IPv6 /64 has 2^64 addresses)
+    Only taken offsets are stored. Allocation stays dense from the bottom of
+    the prefix, so the cursor walks over at most the taken run and next_free()
+    is amortized O(1) like the bitmap.
+    """
+
+    def __init__(self, network):
+        self.network = ipaddress.ip_network(network, strict=False)
+        self.first = int(self.network.network_address)
+        self.size = self.network.num_addresses
+        self.system = _system_offsets(self.network)
+        self.taken = set(self.system)
+        self.hint = 0
+
+    @property
+    def used(self):
+        return len(self.taken)
+
+    def _set(self, index) -> bool:
+        if index in self.taken:
+            return False
+        self.taken.add(index)
+        return True
+
+    def release(self, address) -> bool:
+        index = self._index(address)
+        if index is None or index in self.system or index not in self.taken:
+            return False
+        self.taken.discard(index)
+        self.hint = min(self.hint, index)
+        return True
+
+    def is_free(self, address) -> bool:
+        index = self._index(address)
+        return index is not None and index not in self.taken
+
+    def next_free(self) -> Optional[str]:
+        index = self.hint
+        while index < self.size and index in self.taken:
+            index += 1
+        self.hint = index
+        if index >= self.size:
+            return None
+        return str(self.network.network_address + index)
+
+    def stats(self):
+        stats = super().stats()
+        stats['kind'] = 'sparse'
+        return stats
+
+
+def subnet_allocator(network):
+    """Bitmap for normal subnets, sparse offsets for huge ones"""
+    network = ipaddress.ip_network(network, strict=False)
+    return SparseSubnet(network) if network.num_addresses > SPARSE_THRESHOLD else SubnetBitmap(network)
+
+
+def _load_assigned_ips() -> Iterable[str]:
+    addresses = []
+    for ipv4, ipv6 in db.session.query(Peer.assigned_ip, Peer.assigned_ipv6).all():
+        addresses.extend(ip for ip in (ipv4, ipv6) if ip)
+    return addresses
+
+
+def _is_assigned(address: str) -> bool:
+    column = Peer.assigned_ipv6 if ':' in address else Peer.assigned_ip
+    return db.session.query(Peer.id).filter(column == address).first() is not None
+
+
+class IPAllocator:
+    """Per-subnet bitmaps over every assigned peer address (soft-deleted peers keep theirs)"""
+
+    def __init__(self, loader: Callable[[], Iterable[str]] = _load_assigned_ips,
+                 is_assigned: Optional[Callable[[str], bool]] = _is_assigned):
+        self.loader = loader
+        self.is_assigned = is_assigned
+        self.subnets = {}
+        self.lock = threading.RLock()
+
+    def invalidate(self):
+        """Forget all bitmaps; they are rebuilt from the database on next use"""
+        with self.lock:
+            self.subnets.clear()
+
+    def rebuild(self, subnet):
+        with self.lock:
+            bitmap = subnet_allocator(subnet)
+            for address in self.loader():
+                bitmap.reserve(address)
+            self.subnets[str(bitmap.network)] = bitmap
+            return bitmap
+
+    def bitmap(self, subnet) -> SubnetBitmap:
+        """Allocator for the subnet, built from the database on first use"""
+        network = ipaddress.ip_network(subnet, strict=False)
+        with self.lock:
+            bitmap = self.subnets.get(str(network))
+            return bitmap if bitmap is not None else self.rebuild(network)
+
+    def next_available(self, subnet) -> Optional[str]:
+        """
+        Lowest free address in the subnet
+        Each candidate is confirmed with one indexed lookup, which also sees
+        peers flushed but not yet committed in this transaction and rows
+        written by other processes; such addresses are reserved and skipped.
+        """
+        with self.lock:
+            bitmap = self.bitmap(subnet)
+            while True:
+                candidate = bitmap.next_free()
+                if candidate is None or self.is_assigned is None or not self.is_assigned(candidate):
+                    return candidate
+                bitmap.reserve(candidate)
+
+    def reserve(self, address):
+        with self.lock:
+            for bitmap in self.subnets.values():
+                bitmap.reserve(address)
+
+    def release(self, address):
+        with self.lock:
+            for bitmap in self.subnets.values():
+                bitmap.release(address)
+
+    def apply_changes(self, changes):
+        """Change-tracking listener for the peers table"""
+        with self.lock:
+            for change in changes:
+                if change.op == 'bulk' or UNKNOWN in (change.previous.get('assigned_ip'),
+                                                      change.previous.get('assigned_ipv6')):
+                    self.subnets.clear()
+                    return
+                if change.op == 'insert':
+                    self.reserve(change.values.get('assigned_ip'))
+                    self.reserve(change.values.get('assigned_ipv6'))
+                elif change.op == 'delete':
+                    self.release(change.values.get('assigned_ip'))
+                    self.release(change.values.get('assigned_ipv6'))
+                elif change.op == 'update':
+                    for column in ('assigned_ip', 'assigned_ipv6'):
+                        if column in change.previous:
+                            self.release(change.previous[column])
+                            self.reserve(change.values.get(column))
+
+    def stats(self):
+        with self.lock:
+            return [bitmap.stats() for bitmap in self.subnets.values()]
+
+
+allocator = IPAllocator()
+register_listener(allocator.apply_changes, tables=[Peer.__tablename__])
+
+
+def get_ip_allocator() -> IPAllocator:
+    return allocator
@@ -5,6 +5,7 @@ Provides direct manipulation of iptables rules for WireGuard VPN management
 
 import os
 import logging
+import time
 from typing import List, Dict, Optional, Tuple
 from datetime import datetime
 
@@ -22,7 +23,11 @@ except ImportError:
     IPTABLES_AVAILABLE = False
     logging.warning("python-iptables not available, falling back to subprocess")
 
-from app.models import Peer, FirewallRule
+from app.firewall_compiler import (CHAINS, NFT_TABLE, PlannedPeer, PlannedRule, compile_nftables, compile_reconcile,
+                                   compile_restore, count_nft_rules, count_rules, load_firewall_plan,
+                                   load_peer_addresses, load_rule_sources, parse_live_state, peer_chain, rule_label)
+from app.firewall_optimizer import PortSet
+from app.privileged_helper import run_privileged, run_privileged_batch
 
 
 class IptablesManager:
@@ -54,14 +59,11 @@ class IptablesManager:
     def backup_rules(self) -> Dict[str, str]:
         """Create a backup of current iptables rules"""
         try:
-            import subprocess
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             backup_file = f"iptables_backup_{timestamp}.txt"
             
-            result = subprocess.run(
-                ["iptables-save"], 
-                capture_output=True, text=True, check=True
-            )
+            result = run_privileged("iptables_save")
+            result.check_returncode()
             
             with open(backup_file, 'w') as f:
                 f.write(result.stdout)
@@ -86,7 +88,11 @@ class IptablesManager:
             return {"status": "success", "rules": "\n".join(rules_output)}
         except Exception as e:
             return {"status": "error", "message": f"Error getting iptables rules: {str(e)}"}
-    
+
+    def read_counters(self) -> Dict[str, Optional[str]]:
+        """Raw packet/byte counters of the installed rules (see app.firewall_counters)"""
+        return _read_iptables_counters(with_ipsets=False)
+
     def _format_rule_for_display(self, rule, line_num: int) -> str:
         """Format an iptables rule for display"""
         try:
@@ -187,12 +193,9 @@ class IptablesManager:
     def apply_peer_rules(self, peer_id: Optional[int] = None, dry_run: bool = False) -> Dict[str, any]:
         """Apply iptables rules for peers using python-iptables"""
         try:
-            # Get peers to process
-            if peer_id:
-                peers = [Peer.query.get(peer_id)]
-                peers = [p for p in peers if p is not None]
-            else:
-                peers = Peer.query.filter_by(is_active=True).all()
+            # Active peers with their active rules, in two queries however many peers there are
+            plan = load_firewall_plan([peer_id] if peer_id else None, self.vpn_interface, self.vpn_subnet)
+            peers = plan.peers
             
             if dry_run:
                 # Generate rules for preview
@@ -237,7 +240,7 @@ class IptablesManager:
         except Exception as e:
             return {"status": "error", "message": f"Error in apply_peer_rules: {str(e)}"}
     
-    def _generate_rules_preview(self, peers: List[Peer]) -> List[str]:
+    def _generate_rules_preview(self, peers: Tuple[PlannedPeer, ...]) -> List[str]:
         """Generate a preview of iptables rules that would be applied"""
         rules = []
         
@@ -253,42 +256,33 @@ class IptablesManager:
         
         # Peer-specific rules
         for peer in peers:
-            if not peer.assigned_ip:
-                continue
-            
-            rules.append(f"# Rules for peer: {peer.name} ({peer.assigned_ip})")
-            
-            # Get firewall rules for this peer
-            firewall_rules = FirewallRule.query.filter_by(
-                peer_id=peer.id,
-                is_active=True
-            ).order_by(FirewallRule.priority).all()
+            rules.append(f"# Rules for peer: {peer.name} ({peer.address})")
             
-            if not firewall_rules:
+            if not peer.rules:
                 # Default: Allow all traffic
                 rules.extend([
-                    f"iptables -A FORWARD -s {peer.assigned_ip}/32 -j ACCEPT",
-                    f"iptables -A FORWARD -d {peer.assigned_ip}/32 -j ACCEPT"
+                    f"iptables -A FORWARD -s {peer.address}/32 -j ACCEPT",
+                    f"iptables -A FORWARD -d {peer.address}/32 -j ACCEPT"
                 ])
             else:
                 # Custom rules
-                for rule in firewall_rules:
-                    iptables_rule = self._convert_firewall_rule_to_iptables_preview(rule, peer.assigned_ip)
+                for rule in peer.rules:
+                    iptables_rule = self._convert_firewall_rule_to_iptables_preview(rule, peer.address)
                     if iptables_rule:
                         rules.append(iptables_rule)
                 
                 # Default drop
                 rules.extend([
-                    f"iptables -A FORWARD -s {peer.assigned_ip}/32 -j DROP",
-                    f"iptables -A FORWARD -d {peer.assigned_ip}/32 -j DROP"
+                    f"iptables -A FORWARD -s {peer.address}/32 -j DROP",
+                    f"iptables -A FORWARD -d {peer.address}/32 -j DROP"
                 ])
             
             rules.append("")
         
         return rules
     
-    def _convert_firewall_rule_to_iptables_preview(self, rule: FirewallRule, peer_ip: str) -> str:
-        """Convert a FirewallRule to iptables command preview"""
+    def _convert_firewall_rule_to_iptables_preview(self, rule: PlannedRule, peer_ip: str) -> str:
+        """Convert a planned FirewallRule to iptables command preview"""
         cmd_parts = ["iptables", "-A", "FORWARD"]
         
         # Source IP
@@ -300,31 +294,33 @@ class IptablesManager:
         # Destination IP
         if rule.destination:
             cmd_parts.extend(["-d", rule.destination])
-        elif rule.rule_type.value == 'internet':
+        elif rule.rule_type == 'internet':
             cmd_parts.extend(["-d", "0.0.0.0/0"])
-        elif rule.rule_type.value == 'peer_comm':
+        elif rule.rule_type == 'peer_comm':
             cmd_parts.extend(["-d", self.vpn_subnet])
         
         # Protocol
-        if rule.protocol and rule.protocol.value != 'any':
-            cmd_parts.extend(["-p", rule.protocol.value])
-            
-            # Port range
-            if rule.port_range and rule.port_range != 'any' and rule.protocol.value in ['tcp', 'udp']:
-                cmd_parts.extend(["--dport", rule.port_range])
+        if rule.protocol != 'any':
+            cmd_parts.extend(["-p", rule.protocol])
+            
+            # Port range (comma lists need multiport)
+            if rule.protocol in ['tcp', 'udp']:
+                ports = PortSet.parse(rule.port_range)
+                if ports:
+                    cmd_parts.extend(ports.iptables_args())
         
         # Interface constraints
-        if rule.rule_type.value == 'internet':
+        if rule.rule_type == 'internet':
             cmd_parts.extend(["-o", f"!{self.vpn_interface}"])
         else:
             cmd_parts.extend(["-i", self.vpn_interface])
         
         # Action
-        action = "ACCEPT" if rule.action.value == "ALLOW" else "DROP"
+        action = "ACCEPT" if rule.action == "ALLOW" else "DROP"
         cmd_parts.extend(["-j", action])
         
         # Comment
-        cmd_parts.extend(["-m", "comment", "--comment", f"Rule:{rule.name}"])
+        cmd_parts.extend(["-m", "comment", "--comment", rule_label(rule)])
         
         return " ".join(cmd_parts)
     
@@ -370,54 +366,45 @@ class IptablesManager:
         
         return rules_added
     
-    def _add_peer_rules(self, table: iptc.Table, peer: Peer) -> int:
+    def _add_peer_rules(self, table: iptc.Table, peer: PlannedPeer) -> int:
         """Add rules for a specific peer"""
-        if not peer.assigned_ip:
-            return 0
-        
         forward_chain = iptc.Chain(table, "FORWARD")
         rules_added = 0
         
         try:
-            # Get firewall rules for this peer
-            firewall_rules = FirewallRule.query.filter_by(
-                peer_id=peer.id,
-                is_active=True
-            ).order_by(FirewallRule.priority).all()
-            
-            if not firewall_rules:
+            if not peer.rules:
                 # Default: Allow all traffic for this peer
                 rule1 = iptc.Rule()
-                rule1.src = f"{peer.assigned_ip}/32"
+                rule1.src = f"{peer.address}/32"
                 rule1.create_target("ACCEPT")
                 rule1.create_match("comment").comment = f"Default-Allow:{peer.name}"
                 forward_chain.insert_rule(rule1)
                 rules_added += 1
                 
                 rule2 = iptc.Rule()
-                rule2.dst = f"{peer.assigned_ip}/32"
+                rule2.dst = f"{peer.address}/32"
                 rule2.create_target("ACCEPT")
                 rule2.create_match("comment").comment = f"Default-Allow:{peer.name}"
                 forward_chain.insert_rule(rule2)
                 rules_added += 1
             else:
                 # Apply custom firewall rules
-                for fw_rule in firewall_rules:
-                    rule = self._create_iptables_rule_from_firewall_rule(fw_rule, peer.assigned_ip)
+                for fw_rule in peer.rules:
+                    rule = self._create_iptables_rule_from_firewall_rule(fw_rule, peer.address)
                     if rule:
                         forward_chain.insert_rule(rule)
                         rules_added += 1
                 
                 # Add default drop rule for this peer
                 rule1 = iptc.Rule()
-                rule1.src = f"{peer.assigned_ip}/32"
+                rule1.src = f"{peer.address}/32"
                 rule1.create_target("DROP")
                 rule1.create_match("comment").comment = f"Default-Drop:{peer.name}"
                 forward_chain.insert_rule(rule1)
                 rules_added += 1
                 
                 rule2 = iptc.Rule()
-                rule2.dst = f"{peer.assigned_ip}/32"
+                rule2.dst = f"{peer.address}/32"
                 rule2.create_target("DROP")
                 rule2.create_match("comment").comment = f"Default-Drop:{peer.name}"
                 forward_chain.insert_rule(rule2)
@@ -428,8 +415,8 @@ class IptablesManager:
         
         return rules_added
     
-    def _create_iptables_rule_from_firewall_rule(self, fw_rule: FirewallRule, peer_ip: str):
-        """Create an iptables Rule object from a FirewallRule"""
+    def _create_iptables_rule_from_firewall_rule(self, fw_rule: PlannedRule, peer_ip: str):
+        """Create an iptables Rule object from a planned FirewallRule"""
         if not IPTABLES_AVAILABLE:
             return None
         try:
@@ -444,32 +431,36 @@ class IptablesManager:
             # Destination IP
             if fw_rule.destination:
                 rule.dst = fw_rule.destination
-            elif fw_rule.rule_type.value == 'internet':
+            elif fw_rule.rule_type == 'internet':
                 rule.dst = "0.0.0.0/0"
-            elif fw_rule.rule_type.value == 'peer_comm':
+            elif fw_rule.rule_type == 'peer_comm':
                 rule.dst = self.vpn_subnet
             
             # Protocol
-            if fw_rule.protocol and fw_rule.protocol.value != 'any':
-                rule.protocol = fw_rule.protocol.value
+            if fw_rule.protocol != 'any':
+                rule.protocol = fw_rule.protocol
                 
-                # Port range (only for TCP/UDP)
-                if fw_rule.port_range and fw_rule.port_range != 'any' and fw_rule.protocol.value in ['tcp', 'udp']:
-                    match = rule.create_match(fw_rule.protocol.value)
-                    match.dport = fw_rule.port_range
+                # Port range (only for TCP/UDP; comma lists need multiport)
+                ports = PortSet.parse(fw_rule.port_range) if fw_rule.protocol in ['tcp', 'udp'] else None
+                if ports and len(ports.intervals) > 1:
+                    match = rule.create_match("multiport")
+                    match.dports = ports.render(':')
+                elif ports:
+                    match = rule.create_match(fw_rule.protocol)
+                    match.dport = ports.render(':')
             
             # Interface constraints
-            if fw_rule.rule_type.value == 'internet':
+            if fw_rule.rule_type == 'internet':
                 rule.out_interface = f"!{self.vpn_interface}"
             else:
                 rule.in_interface = self.vpn_interface
             
             # Action
-            action = "ACCEPT" if fw_rule.action.value == "ALLOW" else "DROP"
+            action = "ACCEPT" if fw_rule.action == "ALLOW" else "DROP"
             rule.create_target(action)
             
             # Comment
-            rule.create_match("comment").comment = f"Rule:{fw_rule.name}"
+            rule.create_match("comment").comment = rule_label(fw_rule)
             
             return rule
         except Exception as e:
@@ -479,7 +470,7 @@ class IptablesManager:
 
 # Fallback to subprocess-based implementation if python-iptables is not available
 class SubprocessIptablesManager:
-    """Fallback implementation using subprocess calls"""
+    """Fallback implementation using the iptables command line tools via the privileged helper"""
     
     def __init__(self, vpn_interface: str = 'wg0'):
         self.vpn_interface = vpn_interface
@@ -487,31 +478,24 @@ class SubprocessIptablesManager:
     
     def validate_access(self) -> Dict[str, str]:
         """Check if we have permission to modify iptables"""
-        import subprocess
         try:
-            result = subprocess.run(
-                ["iptables", "-L", "-n"], 
-                capture_output=True, text=True, check=True
-            )
+            result = run_privileged("iptables_list", chain="FORWARD")
+            if result.error == "not_found":
+                return {"status": "error", "message": "iptables not found on system"}
+            if result.returncode != 0:
+                return {"status": "error", "message": f"No iptables access: {result.stderr}"}
             return {"status": "success", "message": "iptables access confirmed"}
-        except subprocess.CalledProcessError as e:
-            return {"status": "error", "message": f"No iptables access: {e.stderr}"}
-        except FileNotFoundError:
-            return {"status": "error", "message": "iptables not found on system"}
         except Exception as e:
             return {"status": "error", "message": f"Error checking iptables access: {str(e)}"}
     
     def backup_rules(self) -> Dict[str, str]:
         """Create a backup of current iptables rules"""
-        import subprocess
         try:
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             backup_file = f"iptables_backup_{timestamp}.txt"
             
-            result = subprocess.run(
-                ["iptables-save"], 
-                capture_output=True, text=True, check=True
-            )
+            result = run_privileged("iptables_save")
+            result.check_returncode()
             
             with open(backup_file, 'w') as f:
                 f.write(result.stdout)
@@ -522,17 +506,17 @@ class SubprocessIptablesManager:
     
     def get_current_rules(self) -> Dict[str, str]:
         """Get current iptables rules"""
-        import subprocess
         try:
-            result = subprocess.run(
-                ["iptables", "-L", "FORWARD", "-n", "-v", "--line-numbers"], 
-                capture_output=True, text=True, check=True
-            )
+            result = run_privileged("iptables_list", chain="FORWARD")
+            if result.returncode != 0:
+                return {"status": "error", "message": f"Failed to get iptables rules: {result.stderr}"}
             return {"status": "success", "rules": result.stdout}
-        except subprocess.CalledProcessError as e:
-            return {"status": "error", "message": f"Failed to get iptables rules: {e.stderr}"}
         except Exception as e:
             return {"status": "error", "message": f"Error getting iptables rules: {str(e)}"}
+
+    def read_counters(self) -> Dict[str, Optional[str]]:
+        """Raw packet/byte counters of the installed rules (see app.firewall_counters)"""
+        return _read_iptables_counters(with_ipsets=False)
     
     def apply_peer_rules(self, peer_id: Optional[int] = None, dry_run: bool = False) -> Dict[str, any]:
         """Apply iptables rules using subprocess"""
@@ -547,9 +531,296 @@ class SubprocessIptablesManager:
             return apply_iptables_rules(peer_id, dry_run)
 
 
+def _read_iptables_counters(with_ipsets: bool) -> Dict[str, Optional[str]]:
+    """`iptables-save -c` of the filter table (and `ipset save`) in one helper round trip"""
+    ops = [("iptables_save", {"table": "filter", "counters": True})] + ([("ipset_save", {})] if with_ipsets else [])
+    results = run_privileged_batch(ops)
+    if not results[0].ok:
+        raise RuntimeError(f"iptables-save failed: {(results[0].stderr or '').strip()}")
+    ipsets = results[1].stdout if with_ipsets and results[1].ok else None
+    return {"format": "iptables", "rules": results[0].stdout, "ipsets": ipsets}
+
+
+def _accounting_enabled() -> bool:
+    return os.getenv("FIREWALL_ACCOUNTING", "true").lower() == "true"
+
+
+def _dry_run_result(text: str, plan, started: float) -> Dict[str, any]:
+    result = {
+        "status": "success",
+        "rules": text.splitlines(),
+        "message": "Dry run completed",
+        "compile_ms": round((time.monotonic() - started) * 1000, 1),
+    }
+    return _plan_report(result, plan)
+
+
+def _plan_report(response: Dict[str, any], plan) -> Dict[str, any]:
+    """Add the optimizer summary and the rules left out of the plan to an API response"""
+    if plan.optimization:
+        response["optimization"] = plan.optimization.to_dict()
+    if plan.skipped:
+        response["skipped_rules"] = list(plan.skipped)
+    return response
+
+
+class RestoreIptablesManager(SubprocessIptablesManager):
+    """
+    Compiles FirewallRules into iptables-restore --noflush input for the
+    app's own chains and applies it in one atomic commit. Only peer chains
+    whose fingerprint differs from the installed one are rewritten.
+    """
+
+    def _plan(self, peer_ids=None):
+        return load_firewall_plan(peer_ids, self.vpn_interface, self.vpn_subnet)
+
+    def _restore(self, text: str, test: bool = False) -> Dict[str, any]:
+        result = run_privileged("iptables_restore", rules=text, noflush=True, test=test)
+        if not result.ok:
+            return {"status": "error", "message": f"iptables-restore failed: {(result.stderr or '').strip()}"}
+        return {"status": "success"}
+
+    def _ipset_restore(self, text: str) -> Dict[str, any]:
+        result = run_privileged("ipset_restore", rules=text)
+        if not result.ok:
+            return {"status": "error", "message": f"ipset restore failed: {(result.stderr or '').strip()}"}
+        return {"status": "success"}
+
+    def live_state(self):
+        """
+        Current filter table and app ipsets, read in one helper round trip
+        Returns (LiveState, use_ipsets); ipsets are skipped when disabled or
+        the ipset tool is not installed.
+        """
+        wanted_ipsets = os.getenv("FIREWALL_IPSET", "true").lower() == "true"
+        ops = [("iptables_save", {"table": "filter"})] + ([("ipset_save", {})] if wanted_ipsets else [])
+        results = run_privileged_batch(ops)
+        if not results[0].ok:
+            raise RuntimeError(f"iptables-save failed: {(results[0].stderr or '').strip()}")
+        use_ipsets = wanted_ipsets and results[1].ok
+        if wanted_ipsets and not use_ipsets:
+            logging.warning(f"ipset not usable, peers are not grouped: {(results[1].stderr or '').strip()}")
+        ipsets = results[1].stdout if use_ipsets else None
+        return parse_live_state(results[0].stdout, self.vpn_interface, ipsets), use_ipsets
+
+    def compile(self, peer_ids=None, force: bool = False):
+        """
+        Diff the desired rules against the installed ones
+        peer_ids limits which peers' rules are loaded and compared (None = all);
+        peers that have no chain yet are always included. Policy grouping
+        needs every peer's rules, so it loads them all.
+        """
+        live, use_ipsets = self.live_state()
+        addresses = load_peer_addresses()
+        sources = None
+        if use_ipsets:
+            peer_ids = None
+        elif peer_ids is not None:
+            missing = {peer_id for peer_id, _ in addresses if peer_chain(peer_id) not in live.chains}
+            peer_ids = set(peer_ids) | missing
+            sources = load_rule_sources(self.vpn_interface, self.vpn_subnet)
+        return compile_reconcile(self._plan(peer_ids), live, addresses, force=force, use_ipsets=use_ipsets,
+                                 accounting=_accounting_enabled(), sources=sources)
+
+    def validate_ruleset(self) -> Dict[str, any]:
+        """Let iptables-restore --test parse the full ruleset without committing it"""
+        try:
+            live, use_ipsets = self.live_state()
+            text = compile_reconcile(self._plan(), live, force=True, use_ipsets=use_ipsets,
+                                     accounting=_accounting_enabled()).text
+            return self._restore(text, test=True)
+        except Exception as e:
+            return {"status": "error", "message": f"Error validating rules: {str(e)}"}
+
+    def reconcile(self, peer_ids=None, force: bool = False) -> Dict[str, any]:
+        """Bring the installed rules in line with the database in one transaction"""
+        try:
+            started = time.monotonic()
+            plan = self.compile(peer_ids, force=force)
+            compile_ms = round((time.monotonic() - started) * 1000, 1)
+            if plan.empty:
+                return _plan_report({"status": "success", "message": "Firewall rules already up to date",
+                                     "changed_peers": [], "applied_rules": 0, "compile_ms": compile_ms}, plan)
+
+            if plan.ipset_prepare:
+                result = self._ipset_restore(plan.ipset_prepare)
+                if result["status"] != "success":
+                    return result
+            if plan.text:
+                result = self._restore(plan.text)
+                if result["status"] != "success":
+                    return result
+
+            applied_count = count_rules(plan.text)
+            response = {
+                "status": "success",
+                "message": f"Applied {applied_count} iptables rules for {len(plan.changed_peers)} peers "
+                           f"and {len(plan.changed_policies)} shared policies in one transaction",
+                "applied_rules": applied_count,
+                "changed_peers": plan.changed_peers,
+                "changed_policies": plan.changed_policies,
+                "removed_chains": plan.removed_chains,
+                "dispatch_changed": plan.dispatch_changed,
+                "compile_ms": compile_ms,
+            }
+            _plan_report(response, plan)
+            if plan.ipset_cleanup:
+                # The rules are already correct; a leftover member or set is only garbage
+                cleanup = self._ipset_restore(plan.ipset_cleanup)
+                if cleanup["status"] != "success":
+                    response["warning"] = cleanup["message"]
+            response["duration_ms"] = round((time.monotonic() - started) * 1000, 1)
+            return response
+        except Exception as e:
+            return {"status": "error", "message": f"Error reconciling firewall rules: {str(e)}"}
+
+    def apply_peer_rules(self, peer_id: Optional[int] = None, dry_run: bool = False) -> Dict[str, any]:
+        """Rewrite the chains of one peer, or of every peer, regardless of fingerprints"""
+        if dry_run:
+            try:
+                started = time.monotonic()
+                use_ipsets = os.getenv("FIREWALL_IPSET", "true").lower() == "true" and not peer_id
+                plan = self._plan([peer_id] if peer_id else None)
+                text = compile_restore(plan, use_ipsets=use_ipsets, accounting=_accounting_enabled())
+                return _dry_run_result(text, plan, started)
+            except Exception as e:
+                return {"status": "error", "message": f"Error in apply_peer_rules: {str(e)}"}
+        return self.reconcile([peer_id] if peer_id else None, force=True)
+
+    def read_counters(self) -> Dict[str, Optional[str]]:
+        """Rule counters and the accounting sets' per-peer counters, in one helper round trip"""
+        return _read_iptables_counters(with_ipsets=True)
+
+    def clear_wireguard_rules(self) -> Dict[str, str]:
+        """Empty the app chains; peer chains stay but are no longer jumped to"""
+        text = '\n'.join(['*filter'] + [f":{chain} - [0:0]" for chain in CHAINS.values()] +
+                         [f"-F {chain}" for chain in CHAINS.values()] + ['COMMIT']) + '\n'
+        result = self._restore(text)
+        if result["status"] == "success":
+            result["message"] = "Cleared WireGuard chains"
+        return result
+
+
+class NftablesManager(SubprocessIptablesManager):
+    """
+    nftables backend: the whole ruleset is one table, dispatched by verdict
+    maps keyed by peer address and replaced atomically with `nft -f`
+    """
+
+    def _plan(self, peer_ids=None):
+        return load_firewall_plan(peer_ids, self.vpn_interface, self.vpn_subnet)
+
+    def _use_sets(self):
+        return os.getenv("FIREWALL_IPSET", "true").lower() == "true"
+
+    def _compile(self, plan):
+        return compile_nftables(plan, self._use_sets(), _accounting_enabled())
+
+    def _apply(self, text: str, check: bool = False) -> Dict[str, any]:
+        result = run_privileged("nft_apply", rules=text, check=check)
+        if not result.ok:
+            return {"status": "error", "message": f"nft failed: {(result.stderr or '').strip()}"}
+        return {"status": "success"}
+
+    def validate_access(self) -> Dict[str, str]:
+        """Check that nft accepts a (no-op) transaction"""
+        result = run_privileged("nft_apply", rules=f"table ip {NFT_TABLE}\n", check=True)
+        if result.error == "not_found":
+            return {"status": "error", "message": "nft not found on system"}
+        if not result.ok:
+            return {"status": "error", "message": f"No nftables access: {result.stderr}"}
+        return {"status": "success", "message": "nftables access confirmed"}
+
+    def backup_rules(self) -> Dict[str, str]:
+        """Save the app's nft table"""
+        try:
+            backup_file = f"nftables_backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.nft"
+            result = run_privileged("nft_list", table=NFT_TABLE)
+            result.check_returncode()
+            with open(backup_file, 'w') as f:
+                f.write(result.stdout)
+            return {"status": "success", "backup_file": backup_file, "message": f"Backup saved to {backup_file}"}
+        except Exception as e:
+            return {"status": "error", "message": f"Error creating backup: {str(e)}"}
+
+    def get_current_rules(self) -> Dict[str, str]:
+        result = run_privileged("nft_list", table=NFT_TABLE)
+        if not result.ok:
+            return {"status": "error", "message": f"Failed to get nftables rules: {result.stderr}"}
+        return {"status": "success", "rules": result.stdout}
+
+    def read_counters(self) -> Dict[str, Optional[str]]:
+        """The app's table with rule counters and named per-peer counters"""
+        result = run_privileged("nft_list", table=NFT_TABLE)
+        if not result.ok:
+            raise RuntimeError(f"nft list failed: {(result.stderr or '').strip()}")
+        return {"format": "nft", "rules": result.stdout, "ipsets": None}
+
+    def validate_ruleset(self) -> Dict[str, any]:
+        """Let nft -c check the compiled table without committing it"""
+        try:
+            return self._apply(self._compile(self._plan()), check=True)
+        except Exception as e:
+            return {"status": "error", "message": f"Error validating rules: {str(e)}"}
+
+    def reconcile(self, peer_ids=None, force: bool = False) -> Dict[str, any]:
+        """
+        Replace the table in one transaction
+        nft swaps the whole table atomically in the kernel, so a targeted
+        apply costs one compile of the plan and one netlink batch.
+        """
+        try:
+            started = time.monotonic()
+            plan = self._plan()
+            text = self._compile(plan)
+            compile_ms = round((time.monotonic() - started) * 1000, 1)
+            result = self._apply(text)
+            if result["status"] != "success":
+                return result
+            applied_count = count_nft_rules(text)
+            response = {
+                "status": "success",
+                "message": f"Applied {applied_count} nftables rules in one transaction",
+                "applied_rules": applied_count,
+                "compile_ms": compile_ms,
+                "duration_ms": round((time.monotonic() - started) * 1000, 1),
+            }
+            return _plan_report(response, plan)
+        except Exception as e:
+            return {"status": "error", "message": f"Error applying nftables rules: {str(e)}"}
+
+    def apply_peer_rules(self, peer_id: Optional[int] = None, dry_run: bool = False) -> Dict[str, any]:
+        if dry_run:
+            try:
+                started = time.monotonic()
+                plan = self._plan([peer_id] if peer_id else None)
+                return _dry_run_result(self._compile(plan), plan, started)
+            except Exception as e:
+                return {"status": "error", "message": f"Error in apply_peer_rules: {str(e)}"}
+        return self.reconcile()
+
+    def clear_wireguard_rules(self) -> Dict[str, str]:
+        result = self._apply(f"table ip {NFT_TABLE}\ndelete table ip {NFT_TABLE}\n")
+        if result["status"] == "success":
+            result["message"] = f"Removed nftables table {NFT_TABLE}"
+        return result
+
+
+FIREWALL_BACKENDS = ('restore', 'nftables', 'iptc')
+
+
 # Factory function to get the appropriate manager
-def get_iptables_manager(vpn_interface: str = 'wg0'):
-    """Get the appropriate iptables manager based on availability"""
+def get_iptables_manager(vpn_interface: str = 'wg0', backend: Optional[str] = None):
+    """
+    Get the firewall manager selected by `backend` or FIREWALL_BACKEND
+    restore (default): atomic iptables-restore; nftables: nft table with
+    verdict maps; iptc: python-iptables with the subprocess fallback
+    """
+    backend = (backend or os.getenv("FIREWALL_BACKEND", "restore")).lower()
+    if backend == "restore":
+        return RestoreIptablesManager(vpn_interface)
+    if backend == "nftables":
+        return NftablesManager(vpn_interface)
     if IPTABLES_AVAILABLE:
         try:
             return IptablesManager(vpn_interface)
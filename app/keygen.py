@@ -0,0 +1,193 @@
+"""
+WireGuard key generation
+In-process X25519 keypairs and preshared keys, replacing `wg genkey`,
+`wg pubkey` and `wg genpsk` subprocess calls. Public keys are derived with
+the `cryptography` package (a requirement); the pure-Python RFC 7748
+ladder is only a logged fallback for environments without it: it is slow
+and Python integers give no constant-time guarantee.
+"""
+
+import base64
+import logging
+import os
+import threading
+from collections import deque
+
+try:
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey
+    CRYPTOGRAPHY_AVAILABLE = True
+except ImportError:
+    CRYPTOGRAPHY_AVAILABLE = False
+    logging.warning("cryptography not installed, deriving WireGuard public keys with the slow pure-Python "
+                    "X25519 fallback (not constant-time); install the pinned requirements")
+
+KEY_POOL_SIZE = int(os.getenv("KEYGEN_POOL_SIZE", "64"))  # 0 disables the background pool
+KEY_POOL_LOW_WATERMARK = int(os.getenv("KEYGEN_POOL_LOW_WATERMARK", str(KEY_POOL_SIZE // 4)))
+
+# Curve25519 (RFC 7748, section 5)
+_P = 2 ** 255 - 19
+_A24 = 121665
+_BASE_POINT = 9
+_MASK = 2 ** 256 - 1  # field elements fit in 256 bits
+
+
+def _clamp(scalar: bytes) -> int:
+    k = bytearray(scalar)
+    k[0] &= 248
+    k[31] &= 127
+    k[31] |= 64
+    return int.from_bytes(k, "little")
+
+
+def _cswap(swap: int, a: int, b: int):
+    """RFC 7748 conditional swap with a mask instead of a branch on the key bit"""
+    dummy = (-swap & _MASK) & (a ^ b)
+    return a ^ dummy, b ^ dummy
+
+
+def _x25519(scalar: bytes, u: int) -> bytes:
+    """Montgomery ladder scalar multiplication"""
+    k = _clamp(scalar)
+    x1 = u
+    x2, z2, x3, z3 = 1, 0, u, 1
+    swap = 0
+    for t in reversed(range(255)):
+        bit = (k >> t) & 1
+        swap ^= bit
+        x2, x3 = _cswap(swap, x2, x3)
+        z2, z3 = _cswap(swap, z2, z3)
+        swap = bit
+
+        a = (x2 + z2) % _P
+        aa = a * a % _P
+        b = (x2 - z2) % _P
+        bb = b * b % _P
+        e = (aa - bb) % _P
+        c = (x3 + z3) % _P
+        d = (x3 - z3) % _P
+        da = d * a % _P
+        cb = c * b % _P
+        x3 = (da + cb) % _P
+        x3 = x3 * x3 % _P
+        z3 = (da - cb) % _P
+        z3 = x1 * (z3 * z3 % _P) % _P
+        x2 = aa * bb % _P
+        z2 = e * (aa + _A24 * e) % _P
+    x2, x3 = _cswap(swap, x2, x3)
+    z2, z3 = _cswap(swap, z2, z3)
+    return (x2 * pow(z2, _P - 2, _P) % _P).to_bytes(32, "little")
+
+
+def _encode(raw: bytes) -> str:
+    return base64.b64encode(raw).decode()
+
+
+def _decode_key(key: str) -> bytes:
+    raw = base64.b64decode(key, validate=True)
+    if len(raw) != 32:
+        raise ValueError("WireGuard keys must be 32 bytes")
+    return raw
+
+
+def generate_private_key() -> str:
+    """Base64 private key, clamped like `wg genkey`"""
+    return _encode(_clamp(os.urandom(32)).to_bytes(32, "little"))
+
+
+def public_key_from_private(private_key: str) -> str:
+    """Derive the base64 public key, like `wg pubkey`"""
+    raw = _decode_key(private_key)
+    if CRYPTOGRAPHY_AVAILABLE:
+        public = X25519PrivateKey.from_private_bytes(raw).public_key()
+        return _encode(public.public_bytes(serialization.Encoding.Raw, serialization.PublicFormat.Raw))
+    return _encode(_x25519(raw, _BASE_POINT))
+
+
+def generate_keypair():
+    """Return a new (private_key, public_key) pair as base64 strings"""
+    private_key = generate_private_key()
+    return private_key, public_key_from_private(private_key)
+
+
+def generate_preshared_key() -> str:
+    """Base64 preshared key from the OS CSPRNG, like `wg genpsk`"""
+    return _encode(os.urandom(32))
+
+
+class KeyPool:
+    """
+    Pre-generated keypairs refilled by a background thread
+    get_keypair() never waits on the refill thread: an empty pool falls back
+    to generating inline, so the pool only ever removes latency.
+    """
+
+    def __init__(self, size=KEY_POOL_SIZE, low_watermark=KEY_POOL_LOW_WATERMARK, generator=generate_keypair):
+        self.size = size
+        self.low_watermark = max(0, min(low_watermark, size - 1))
+        self.generator = generator
+        self.keypairs = deque()
+        self.refill_needed = threading.Event()
+        self.hits = 0
+        self.misses = 0
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self.size > 0 and (self._thread is None or not self._thread.is_alive()):
+                self._thread = threading.Thread(target=self._refill_loop, name="keygen-pool", daemon=True)
+                self._thread.start()
+        self.refill_needed.set()
+        return self
+
+    def _refill_loop(self):
+        while True:
+            self.refill_needed.wait()
+            self.refill_needed.clear()
+            self.fill()
+
+    def fill(self):
+        """Top the pool up to its size (synchronously)"""
+        while len(self.keypairs) < self.size:
+            self.keypairs.append(self.generator())
+
+    def get_keypair(self):
+        try:
+            keypair = self.keypairs.popleft()
+            self.hits += 1
+        except IndexError:
+            keypair = self.generator()
+            self.misses += 1
+        if len(self.keypairs) <= self.low_watermark:
+            self.refill_needed.set()
+        return keypair
+
+    def stats(self):
+        return {
+            "size": self.size,
+            "available": len(self.keypairs),
+            "hits": self.hits,
+            "misses": self.misses,
+            "backend": "cryptography" if CRYPTOGRAPHY_AVAILABLE else "python",
+        }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_key_pool():
+    """Shared keypair pool, started on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = KeyPool().start()
+        return _pool
+
+
+def get_keypair():
+    """Keypair from the shared pool (or generated inline when the pool is disabled)"""
+    if KEY_POOL_SIZE <= 0:
+        return generate_keypair()
+    return get_key_pool().get_keypair()
@@ -0,0 +1,141 @@
+"""
+Lightweight schema migrations
+db.create_all() only creates missing tables; this module adds the columns and
+seed data introduced after a database was first created and records every
+applied step in the migrations table.
+"""
+
+import ipaddress
+import os
+
+from sqlalchemy import inspect, text
+
+from app import db
+from app.cidr import address_key, network_keys
+from app.models import AddressPool, AllowedIP, Migration, Peer, RouteProfile
+
+
+def _seed_route_profiles():
+    """Create the built-in split-tunnel profiles"""
+    system_profiles = [
+        ("full-tunnel", "Route all traffic through the VPN", ""),
+        ("exclude-private", "Route everything except RFC1918, link-local and ULA networks (local LAN stays local)",
+         "10.0.0.0/8,172.16.0.0/12,192.168.0.0/16,169.254.0.0/16,fc00::/7,fe80::/10"),
+    ]
+    for name, description, excluded in system_profiles:
+        if not RouteProfile.query.filter_by(name=name).first():
+            db.session.add(RouteProfile(name=name, description=description,
+                                        excluded_networks=excluded, is_system=True))
+
+
+def _seed_address_pools():
+    """Turn VPN_SUBNET / VPN_SUBNET_V6 into the default address pools"""
+    db.session.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS uq_peer_assigned_ipv6 ON peers (assigned_ipv6)"))
+    defaults = [("default-v4", os.getenv("VPN_SUBNET", "10.0.0.0/24")),
+                ("default-v6", os.getenv("VPN_SUBNET_V6", ""))]
+    for name, network in defaults:
+        if network and not AddressPool.query.filter_by(name=name).first():
+            db.session.add(AddressPool(name=name, network=network, is_default=True,
+                                       description="Created from environment configuration"))
+
+
+def backfill_network_keys(batch_size=1000):
+    """
+    Recompute the derived address/range key columns from the string columns
+    Attribute events keep them current for ORM writes; run this after bulk
+    SQL that changed addresses directly. Returns the number of rows updated.
+    """
+    updated = 0
+    peers = db.session.query(Peer.id, Peer.assigned_ip, Peer.assigned_ipv6).all()
+    rows = []
+    for peer_id, ipv4, ipv6 in peers:
+        keys = []
+        for address in (ipv4, ipv6):
+            try:
+                keys.append(address_key(int(ipaddress.ip_address(address.split('/')[0]))) if address else None)
+            except ValueError:
+                keys.append(None)
+        rows.append({'id': peer_id, 'assigned_ip_key': keys[0], 'assigned_ipv6_key': keys[1]})
+
+    for start in range(0, len(rows), batch_size):
+        db.session.execute(db.update(Peer), rows[start:start + batch_size])
+    updated += len(rows)
+
+    rows = []
+    for allowed_id, network in db.session.query(AllowedIP.id, AllowedIP.ip_network).all():
+        try:
+            family, range_start, range_end = network_keys(network)
+        except ValueError:
+            family = range_start = range_end = None
+        rows.append({'id': allowed_id, 'family': family, 'range_start': range_start, 'range_end': range_end})
+
+    for start in range(0, len(rows), batch_size):
+        db.session.execute(db.update(AllowedIP), rows[start:start + batch_size])
+    updated += len(rows)
+
+    return updated
+
+
+def _add_network_key_indexes():
+    """Create the key indexes on existing tables and fill the new columns"""
+    for statement in (
+        "CREATE INDEX IF NOT EXISTS idx_peer_assigned_ip_key ON peers (assigned_ip_key)",
+        "CREATE INDEX IF NOT EXISTS idx_peer_assigned_ipv6_key ON peers (assigned_ipv6_key)",
+        "CREATE INDEX IF NOT EXISTS idx_allowed_ip_range ON allowed_ips (family, range_start, range_end)",
+    ):
+        db.session.execute(text(statement))
+    backfill_network_keys()
+
+
+def _add_peer_listing_index():
+    """Index behind the (created_at, id) ordering of the peer listing"""
+    db.session.execute(text("CREATE INDEX IF NOT EXISTS idx_peer_created ON peers (created_at, id)"))
+
+
+# (version, description, [(table, column, column DDL)], data migration or None)
+MIGRATIONS = [
+    ("004_route_profiles", "Add split-tunnel route profiles",
+     [("peers", "route_profile_id", "INTEGER REFERENCES route_profiles(id) ON DELETE SET NULL")],
+     _seed_route_profiles),
+    ("005_address_pools", "Add named address pools and IPv6 peer addresses",
+     [("peers", "assigned_ipv6", "VARCHAR(39)")],
+     _seed_address_pools),
+    ("006_network_keys", "Add indexed integer keys for addresses and allowed IP ranges",
+     [("peers", "assigned_ip_key", "BLOB"),
+      ("peers", "assigned_ipv6_key", "BLOB"),
+      ("allowed_ips", "family", "INTEGER"),
+      ("allowed_ips", "range_start", "BLOB"),
+      ("allowed_ips", "range_end", "BLOB")],
+     _add_network_key_indexes),
+    ("007_peer_listing_index", "Add index for keyset pagination by creation time",
+     [],
+     _add_peer_listing_index),
+    ("008_firewall_template_links", "Link peers to firewall templates by reference",
+     [("peers", "firewall_template_id", "INTEGER REFERENCES firewall_templates(id) ON DELETE SET NULL")],
+     None),
+]
+
+
+def apply_migrations():
+    """Apply all pending migrations; returns the list of applied versions"""
+    applied = []
+
+    for version, description, columns, data_migration in MIGRATIONS:
+        if Migration.is_applied(version):
+            continue
+
+        inspector = inspect(db.engine)
+        for table, column, ddl in columns:
+            existing = {col['name'] for col in inspector.get_columns(table)}
+            if column not in existing:
+                db.session.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+
+        if data_migration:
+            data_migration()
+
+        db.session.add(Migration(version=version, description=description))
+        db.session.commit()
+        applied.append(version)
+        print(f"✓ Applied migration {version}: {description}")
+
+    return applied
@@ -1,4 +1,5 @@
 from app import db
+from app.cidr import address_key, network_keys
 from datetime import datetime, timezone
 from sqlalchemy import event, Index
 from enum import Enum
@@ -42,6 +43,10 @@ class Peer(db.Model):
     public_key = db.Column(db.String(44), nullable=False, unique=True)  # WG keys are exactly 44 chars
     preshared_key = db.Column(db.String(44), nullable=True)  # Optional for enhanced security
     assigned_ip = db.Column(db.String(18), nullable=False, unique=True)  # IPv4 CIDR max length
+    assigned_ipv6 = db.Column(db.String(39), nullable=True, unique=True)  # Optional IPv6 address (dual-stack)
+    # Derived 16-byte big-endian keys for indexed lookups, kept in sync by attribute events
+    assigned_ip_key = db.Column(db.LargeBinary(16), nullable=True)
+    assigned_ipv6_key = db.Column(db.LargeBinary(16), nullable=True)
     endpoint = db.Column(db.String(255), nullable=True)
     persistent_keepalive = db.Column(db.Integer, nullable=True)
     
@@ -49,6 +54,14 @@ class Peer(db.Model):
     is_active = db.Column(db.Boolean, default=True, nullable=False)
     deleted_at = db.Column(db.DateTime, nullable=True)  # Soft delete
     
+    # Client-side routing (split tunnel); NULL = route everything through the VPN
+    route_profile_id = db.Column(db.Integer, db.ForeignKey('route_profiles.id', ondelete='SET NULL'), nullable=True)
+    route_profile = db.relationship('RouteProfile', backref=db.backref('peers', lazy='dynamic'))
+
+    # Firewall template applied by reference: its rules are added to the peer's own rules
+    firewall_template_id = db.Column(db.Integer, db.ForeignKey('firewall_templates.id', ondelete='SET NULL'), nullable=True)
+    firewall_template = db.relationship('FirewallTemplate', backref=db.backref('linked_peers', lazy='dynamic'))
+    
     # Timestamps
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
     updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc), nullable=False)
@@ -58,8 +71,12 @@ class Peer(db.Model):
         Index('idx_peer_name', 'name'),
         Index('idx_peer_public_key', 'public_key'),
         Index('idx_peer_assigned_ip', 'assigned_ip'),
+        Index('idx_peer_assigned_ipv6', 'assigned_ipv6'),
+        Index('idx_peer_assigned_ip_key', 'assigned_ip_key'),
+        Index('idx_peer_assigned_ipv6_key', 'assigned_ipv6_key'),
         Index('idx_peer_active', 'is_active'),
         Index('idx_peer_deleted', 'deleted_at'),
+        Index('idx_peer_created', 'created_at', 'id'),  # keyset pagination by creation time
     )
     
     # Soft delete property
@@ -94,15 +111,28 @@ class Peer(db.Model):
         self.deleted_at = None
         db.session.commit()
     
+    @property
+    def address_list(self):
+        """Assigned tunnel addresses as host routes, one per family"""
+        addresses = [f"{self.assigned_ip}/32"]
+        if self.assigned_ipv6:
+            addresses.append(f"{self.assigned_ipv6}/128")
+        return addresses
+    
     @property
     def combined_allowed_ips(self):
         """Combine assigned IP with allowed IP ranges"""
-        ips = [f"{self.assigned_ip}/32"]
+        ips = list(self.address_list)
         # Get IPs from new table structure
         for allowed_ip in self.allowed_ip_ranges:
             ips.append(allowed_ip.ip_network)
         return ','.join(ips)
     
+    @property
+    def tag_list(self):
+        """Tag names of this peer"""
+        return sorted(peer_tag.tag for peer_tag in self.tags)
+    
     @property
     def allowed_networks_list(self):
         """Get list of allowed IP networks for this peer"""
@@ -119,6 +149,10 @@ class AllowedIP(db.Model):
     peer_id = db.Column(db.Integer, db.ForeignKey('peers.id', ondelete='CASCADE'), nullable=False)
     ip_network = db.Column(db.String(43), nullable=False)  # IPv6 CIDR can be up to 43 chars
     description = db.Column(db.String(255), nullable=True)  # Optional description
+    # Derived range columns (family + 16-byte big-endian start/end) for SQL-side range queries
+    family = db.Column(db.Integer, nullable=True)
+    range_start = db.Column(db.LargeBinary(16), nullable=True)
+    range_end = db.Column(db.LargeBinary(16), nullable=True)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
     
     # Relationship to Peer with better performance settings
@@ -132,12 +166,108 @@ class AllowedIP(db.Model):
     __table_args__ = (
         Index('idx_allowed_ip_peer', 'peer_id'),
         Index('idx_allowed_ip_network', 'ip_network'),
+        Index('idx_allowed_ip_range', 'family', 'range_start', 'range_end'),
     )
     
     def __repr__(self):
         return f'<AllowedIP {self.ip_network} for Peer {self.peer_id}>'
 
 
+class PeerTag(db.Model):
+    """Free-form label used to select groups of peers (department, site, device type)"""
+    __tablename__ = 'peer_tags'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    peer_id = db.Column(db.Integer, db.ForeignKey('peers.id', ondelete='CASCADE'), nullable=False)
+    tag = db.Column(db.String(50), nullable=False)
+    
+    peer = db.relationship('Peer',
+                          backref=db.backref('tags',
+                                            lazy='dynamic',
+                                            cascade='all, delete-orphan'))
+    
+    # Indexes
+    __table_args__ = (
+        db.UniqueConstraint('peer_id', 'tag', name='uq_peer_tag'),
+        Index('idx_peer_tag_tag', 'tag', 'peer_id'),
+    )
+    
+    def __repr__(self):
+        return f'<PeerTag {self.tag} for Peer {self.peer_id}>'
+
+
+class RouteProfile(db.Model):
+    """Client routing profile: route everything through the VPN except the excluded ranges"""
+    __tablename__ = 'route_profiles'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False, unique=True)
+    description = db.Column(db.String(500), nullable=True)
+    excluded_networks = db.Column(db.Text, nullable=False, default='')  # Comma separated CIDRs
+    include_ipv6 = db.Column(db.Boolean, default=True, nullable=False)  # Also route ::/0 minus exclusions
+    is_system = db.Column(db.Boolean, default=False, nullable=False)
+    
+    # Timestamps
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc), nullable=False)
+    
+    # Indexes
+    __table_args__ = (
+        Index('idx_route_profile_name', 'name'),
+    )
+    
+    @property
+    def excluded_networks_list(self):
+        """Get list of excluded CIDRs"""
+        return [network.strip() for network in (self.excluded_networks or '').split(',') if network.strip()]
+    
+    def __repr__(self):
+        return f'<RouteProfile {self.name}>'
+
+
+class AddressPool(db.Model):
+    """Named VPN address prefix peers are allocated from (one or more per family)"""
+    __tablename__ = 'address_pools'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False, unique=True)
+    network = db.Column(db.String(43), nullable=False, unique=True)  # CIDR, IPv4 or IPv6
+    family = db.Column(db.Integer, nullable=False)  # 4 or 6, derived from network
+    description = db.Column(db.String(500), nullable=True)
+    is_default = db.Column(db.Boolean, default=False, nullable=False)  # Used when no pool is requested
+    is_active = db.Column(db.Boolean, default=True, nullable=False)
+    
+    # Timestamps
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc), nullable=False)
+    
+    # Indexes
+    __table_args__ = (
+        Index('idx_address_pool_family', 'family', 'is_active'),
+    )
+    
+    @property
+    def ip_network(self):
+        return ipaddress.ip_network(self.network, strict=False)
+    
+    def to_dict(self):
+        """Convert address pool to dictionary for API responses"""
+        return {
+            'id': self.id,
+            'name': self.name,
+            'network': self.network,
+            'family': self.family,
+            'description': self.description,
+            'is_default': self.is_default,
+            'is_active': self.is_active,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+    
+    def __repr__(self):
+        return f'<AddressPool {self.name} ({self.network})>'
+
+
 class FirewallRule(db.Model):
     __tablename__ = 'firewall_rules'
     
@@ -278,10 +408,9 @@ class FirewallTemplate(db.Model):
         """Get all user-defined templates"""
         return cls.query.filter_by(is_system=False, is_active=True).all()
     
-    def increment_usage(self):
-        """Increment usage counter"""
-        self.usage_count += 1
-        db.session.commit()
+    def increment_usage(self, count=1):
+        """Add to the usage counter; committed with the caller's transaction"""
+        self.usage_count = (self.usage_count or 0) + count
 
 
 class FirewallTemplateRule(db.Model):
@@ -477,6 +606,30 @@ def validate_assigned_ip(target, value, oldvalue, initiator):
             ipaddress.ip_address(ip_only)
         except ValueError:
             raise ValueError(f"Invalid IP address format: {value}")
+    target.assigned_ip_key = address_key(int(ipaddress.ip_address(value.split('/')[0]))) if value else None
+
+@event.listens_for(Peer.assigned_ipv6, 'set')
+def validate_assigned_ipv6(target, value, oldvalue, initiator):
+    """Validate IPv6 address format"""
+    if value:
+        try:
+            if ipaddress.ip_address(value.split('/')[0]).version != 6:
+                raise ValueError
+        except ValueError:
+            raise ValueError(f"Invalid IPv6 address format: {value}")
+    target.assigned_ipv6_key = address_key(int(ipaddress.ip_address(value.split('/')[0]))) if value else None
+
+@event.listens_for(AddressPool.network, 'set')
+def validate_pool_network(target, value, oldvalue, initiator):
+    """Validate the pool prefix and keep the family column in sync"""
+    if value:
+        try:
+            network = ipaddress.ip_network(value, strict=False)
+        except ValueError:
+            raise ValueError(f"Invalid address pool network: {value}")
+        if network.num_addresses < 4:
+            raise ValueError(f"Address pool {value} is too small")
+        target.family = network.version
 
 @event.listens_for(AllowedIP.ip_network, 'set')
 def validate_ip_network(target, value, oldvalue, initiator):
@@ -486,6 +639,19 @@ def validate_ip_network(target, value, oldvalue, initiator):
             ipaddress.ip_network(value, strict=False)
         except ValueError:
             raise ValueError(f"Invalid IP network format: {value}")
+        target.family, target.range_start, target.range_end = network_keys(value)
+    else:
+        target.family = target.range_start = target.range_end = None
+
+@event.listens_for(RouteProfile.excluded_networks, 'set')
+def validate_excluded_networks(target, value, oldvalue, initiator):
+    """Validate excluded CIDR list format"""
+    for network in (value or '').split(','):
+        if network.strip():
+            try:
+                ipaddress.ip_network(network.strip(), strict=False)
+            except ValueError:
+                raise ValueError(f"Invalid excluded network format: {network.strip()}")
 
 @event.listens_for(Peer.name, 'set')
 def validate_peer_name(target, value, oldvalue, initiator):
@@ -531,4 +697,16 @@ def validate_port_range(target, value, oldvalue, initiator):
                 if not (1 <= port <= 65535):
                     raise ValueError("Port must be between 1 and 65535")
             except ValueError:
-                raise ValueError(f"Invalid port format: {value}")
\ No newline at end of file
+                raise ValueError(f"Invalid port format: {value}")
+@event.listens_for(FirewallRule.source, 'set')
+@event.listens_for(FirewallRule.destination, 'set')
+@event.listens_for(FirewallTemplateRule.source, 'set')
+@event.listens_for(FirewallTemplateRule.destination, 'set')
+def validate_rule_network(target, value, oldvalue, initiator):
+    """Validate rule source/destination: the firewall backends only filter IPv4"""
+    if value:
+        try:
+            if ipaddress.ip_network(value, strict=False).version != 4:
+                raise ValueError
+        except ValueError:
+            raise ValueError(f"Invalid IPv4 network for {initiator.key}: {value}")
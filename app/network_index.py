@@ -0,0 +1,136 @@
+"""
+In-memory interval index of every network in use
+Address pools, assigned peer addresses and allowed IP ranges are stored as
+integer (start, end) intervals per family, so "what overlaps this network"
+is a binary search instead of a scan over all peers. The index is rebuilt
+lazily after any commit that touched peers, allowed IPs or pools.
+"""
+
+import threading
+from bisect import bisect_right
+from typing import Iterable, List, NamedTuple, Optional
+
+from app import db
+from app.change_tracking import register_listener
+from app.cidr import network_interval
+from app.models import AddressPool, AllowedIP, Peer
+
+
+class IndexedNetwork(NamedTuple):
+    """Payload of one interval: kind is 'pool', 'assigned' or 'allowed'"""
+    kind: str
+    network: str
+    peer_id: Optional[int] = None
+    peer_name: Optional[str] = None
+
+
+class IntervalIndex:
+    """
+    Static interval index: intervals sorted by start plus a running maximum
+    of the end points. A query bisects to the last interval starting at or
+    before the query end, then walks left only while the running maximum
+    still reaches the query start: O(log n + k) for k results.
+    """
+
+    def __init__(self, intervals: Iterable = ()):
+        self.families = {}
+        by_family = {}
+        for family, start, end, payload in intervals:
+            by_family.setdefault(family, []).append((start, end, payload))
+
+        for family, items in by_family.items():
+            items.sort(key=lambda item: (item[0], item[1]))
+            starts = [start for start, _, _ in items]
+            max_ends = []
+            running = -1
+            for _, end, _ in items:
+                running = max(running, end)
+                max_ends.append(running)
+            self.families[family] = (starts, max_ends, items)
+
+    def __len__(self):
+        return sum(len(items) for _, _, items in self.families.values())
+
+    def overlapping(self, family: int, start: int, end: int) -> List:
+        """Payloads of all intervals overlapping [start, end], in ascending start order"""
+        if family not in self.families:
+            return []
+        starts, max_ends, items = self.families[family]
+        found = []
+        position = bisect_right(starts, end) - 1
+        while position >= 0 and max_ends[position] >= start:
+            item_start, item_end, payload = items[position]
+            if item_end >= start:
+                found.append(payload)
+            position -= 1
+        found.reverse()
+        return found
+
+    def overlapping_network(self, network) -> List:
+        return self.overlapping(*network_interval(network))
+
+    def entries(self):
+        """All (family, start, end, payload) intervals, e.g. for a full sweep"""
+        for family, (_, _, items) in self.families.items():
+            for start, end, payload in items:
+                yield family, start, end, payload
+
+
+def _load_intervals():
+    """One query per table; invalid strings are skipped like the old validation did"""
+    intervals = []
+
+    def add(network, payload):
+        try:
+            intervals.append(network_interval(network) + (payload,))
+        except ValueError:
+            pass
+
+    for (network,) in db.session.query(AddressPool.network).filter_by(is_active=True).all():
+        add(network, IndexedNetwork('pool', network))
+
+    for peer_id, name, ipv4, ipv6 in db.session.query(Peer.id, Peer.name, Peer.assigned_ip, Peer.assigned_ipv6).all():
+        for address in (ipv4, ipv6):
+            if address:
+                add(address.split('/')[0], IndexedNetwork('assigned', address, peer_id, name))
+
+    rows = db.session.query(AllowedIP.ip_network, Peer.id, Peer.name).join(Peer, AllowedIP.peer_id == Peer.id).all()
+    for network, peer_id, name in rows:
+        add(network, IndexedNetwork('allowed', network, peer_id, name))
+
+    return intervals
+
+
+class NetworkIndex:
+    """Process-wide IntervalIndex over the database, rebuilt after relevant commits"""
+
+    TABLES = (Peer.__tablename__, AllowedIP.__tablename__, AddressPool.__tablename__)
+
+    def __init__(self, loader=_load_intervals):
+        self.loader = loader
+        self.index = None
+        self.lock = threading.Lock()
+
+    def invalidate(self, changes=None):
+        self.index = None
+
+    def get(self) -> IntervalIndex:
+        index = self.index
+        if index is None:
+            with self.lock:
+                if self.index is None:
+                    self.index = IntervalIndex(self.loader())
+                index = self.index
+        return index
+
+    def overlapping(self, network, exclude_peer_id=None) -> List[IndexedNetwork]:
+        return [entry for entry in self.get().overlapping_network(network)
+                if exclude_peer_id is None or entry.peer_id != exclude_peer_id]
+
+
+network_index = NetworkIndex()
+register_listener(network_index.invalidate, tables=NetworkIndex.TABLES)
+
+
+def get_network_index() -> NetworkIndex:
+    return network_index
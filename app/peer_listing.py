@@ -0,0 +1,222 @@
+"""
+Peer listing queries
+Keyset (cursor) pagination, filters and sparse field projection for the peer
+API and the index page. Every page is one indexed range scan on the sort
+column plus at most one batched query per related collection, so response
+time does not grow with the size of the peers table.
+"""
+
+import base64
+import ipaddress
+import json
+from datetime import datetime
+
+from flask import g, has_request_context
+
+from app import db
+from app.cidr import network_keys
+from app.models import AllowedIP, Peer, PeerTag
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+COLUMNS = {
+    'id': Peer.id,
+    'name': Peer.name,
+    'public_key': Peer.public_key,
+    'preshared_key': Peer.preshared_key,
+    'assigned_ip': Peer.assigned_ip,
+    'assigned_ipv6': Peer.assigned_ipv6,
+    'endpoint': Peer.endpoint,
+    'persistent_keepalive': Peer.persistent_keepalive,
+    'is_active': Peer.is_active,
+    'deleted_at': Peer.deleted_at,
+    'route_profile_id': Peer.route_profile_id,
+    'firewall_template_id': Peer.firewall_template_id,
+    'created_at': Peer.created_at,
+    'updated_at': Peer.updated_at,
+}
+RELATED_FIELDS = ('allowed_ips', 'tags')
+DEFAULT_FIELDS = tuple(COLUMNS) + ('allowed_ips',)
+SORT_FIELDS = ('id', 'name', 'created_at')
+
+
+def _bool_param(value, name):
+    if value is None or value == '':
+        return None
+    lowered = str(value).lower()
+    if lowered in ('1', 'true', 'yes'):
+        return True
+    if lowered in ('0', 'false', 'no'):
+        return False
+    raise ValueError(f"{name} must be true or false")
+
+
+def parse_fields(value):
+    """Validate a comma separated fields= projection (None = default fields)"""
+    if not value:
+        return DEFAULT_FIELDS
+    fields = tuple(dict.fromkeys(field.strip() for field in value.split(',') if field.strip()))
+    unknown = [field for field in fields if field not in COLUMNS and field not in RELATED_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return fields
+
+
+def encode_cursor(sort, value, peer_id):
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([sort, value, peer_id], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor, sort):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        cursor_sort, value, peer_id = json.loads(raw)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    if cursor_sort != sort:
+        raise ValueError("Cursor does not match the requested sort order")
+    if sort == 'created_at':
+        value = datetime.fromisoformat(value)
+    return value, int(peer_id)
+
+
+def _escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _connected_public_keys():
+    from app.wireguard_status import get_wireguard_status
+    wg_status = g.get('wg_status') if has_request_context() else None  # snapshot already taken for the ETag
+    if wg_status is None:
+        wg_status = get_wireguard_status()
+    return [key for key, status in wg_status.items() if status.get('is_connected')]
+
+
+def apply_filters(query, active=None, deleted=None, connected=None, name=None, subnet=None, tag=None):
+    """Add the listing filters to a query over peers"""
+    active = _bool_param(active, 'active')
+    deleted = _bool_param(deleted, 'deleted')
+    connected = _bool_param(connected, 'connected')
+
+    if active is not None:
+        query = query.filter(Peer.is_active == active)
+    if deleted is not None:
+        query = query.filter(Peer.deleted_at.isnot(None) if deleted else Peer.deleted_at.is_(None))
+    if name:
+        # Prefix match on the indexed name column
+        query = query.filter(Peer.name.like(_escape_like(name) + '%', escape='\\'))
+    if subnet:
+        try:
+            family, start_key, end_key = network_keys(ipaddress.ip_network(subnet, strict=False))
+        except ValueError:
+            raise ValueError(f"Invalid subnet: {subnet}")
+        key_column = Peer.assigned_ip_key if family == 4 else Peer.assigned_ipv6_key
+        query = query.filter(key_column >= start_key, key_column <= end_key)
+    if tag:
+        query = query.filter(Peer.id.in_(db.session.query(PeerTag.peer_id).filter(PeerTag.tag == tag)))
+    if connected is not None:
+        keys = _connected_public_keys()
+        query = query.filter(Peer.public_key.in_(keys) if connected else Peer.public_key.notin_(keys))
+    return query
+
+
+def _serialize(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _related(field, peer_ids):
+    """One query for a related collection of the whole page"""
+    values = {peer_id: [] for peer_id in peer_ids}
+    if not peer_ids:
+        return values
+    if field == 'allowed_ips':
+        rows = db.session.query(AllowedIP.peer_id, AllowedIP.ip_network).filter(
+            AllowedIP.peer_id.in_(peer_ids)).order_by(AllowedIP.peer_id, AllowedIP.created_at, AllowedIP.id)
+    else:
+        rows = db.session.query(PeerTag.peer_id, PeerTag.tag).filter(
+            PeerTag.peer_id.in_(peer_ids)).order_by(PeerTag.peer_id, PeerTag.tag)
+    for peer_id, value in rows:
+        values[peer_id].append(value)
+    return values
+
+
+def list_peers(limit=None, cursor=None, sort='id', order='asc', fields=None, serialize=True, **filters):
+    """
+    One page of peers (serialize=False keeps datetimes for templates)
+    Returns {"data": [...], "pagination": {"limit", "next_cursor", "has_more", "sort", "order"}}
+    """
+    if sort not in SORT_FIELDS:
+        raise ValueError(f"sort must be one of: {', '.join(SORT_FIELDS)}")
+    if order not in ('asc', 'desc'):
+        raise ValueError("order must be asc or desc")
+    try:
+        limit = min(max(int(limit or DEFAULT_PAGE_SIZE), 1), MAX_PAGE_SIZE)
+    except (TypeError, ValueError):
+        raise ValueError("limit must be a number")
+    fields = fields if isinstance(fields, tuple) else parse_fields(fields)
+
+    # Only the requested columns are selected, plus what the cursor needs
+    selected = [field for field in fields if field in COLUMNS]
+    needed = list(dict.fromkeys(selected + ['id', sort]))
+    query = apply_filters(db.session.query(*(COLUMNS[field].label(field) for field in needed)), **filters)
+
+    sort_column = COLUMNS[sort]
+    if cursor:
+        value, last_id = decode_cursor(cursor, sort)
+        if sort == 'id':
+            query = query.filter(Peer.id > last_id if order == 'asc' else Peer.id < last_id)
+        elif order == 'asc':
+            query = query.filter(db.or_(sort_column > value, db.and_(sort_column == value, Peer.id > last_id)))
+        else:
+            query = query.filter(db.or_(sort_column < value, db.and_(sort_column == value, Peer.id < last_id)))
+
+    if order == 'asc':
+        query = query.order_by(sort_column.asc(), Peer.id.asc())
+    else:
+        query = query.order_by(sort_column.desc(), Peer.id.desc())
+
+    rows = query.limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    peer_ids = [row.id for row in rows]
+    related = {field: _related(field, peer_ids) for field in fields if field in RELATED_FIELDS}
+
+    data = []
+    for row in rows:
+        mapping = row._mapping
+        item = {}
+        for field in fields:
+            if field in related:
+                item[field] = related[field][row.id]
+            else:
+                item[field] = _serialize(mapping[field]) if serialize else mapping[field]
+        data.append(item)
+
+    last = rows[-1] if rows else None
+    return {
+        'data': data,
+        'pagination': {
+            'limit': limit,
+            'sort': sort,
+            'order': order,
+            'has_more': has_more,
+            'next_cursor': encode_cursor(sort, getattr(last, sort), last.id) if has_more else None,
+        },
+    }
+
+
+def get_peer_data(peer_id, fields=None):
+    """Single peer in the listing format, or None"""
+    fields = fields if isinstance(fields, tuple) else parse_fields(fields)
+    query = db.session.query(*(COLUMNS[field].label(field) for field in
+                               dict.fromkeys([field for field in fields if field in COLUMNS] + ['id'])))
+    row = query.filter(Peer.id == peer_id).first()
+    if row is None:
+        return None
+    related = {field: _related(field, [row.id]) for field in fields if field in RELATED_FIELDS}
+    return {field: related[field][row.id] if field in related else _serialize(row._mapping[field])
+            for field in fields}
@@ -0,0 +1,243 @@
+"""
+In-memory peer search index
+Trigram postings over peer names, tunnel addresses and endpoints (configured
+and last seen) answer substring queries by intersecting a few small sets.
+Sorted value lists answer prefix queries by bisection, so broad typeahead
+queries stop after the first page of prefix matches.
+Loaded once, then kept current through commit-time change tracking: changed
+peers are marked stale and re-read in one query before the next search.
+"""
+
+import heapq
+import threading
+from bisect import bisect_left, insort
+from typing import Dict, List, NamedTuple, Optional
+
+from app import db
+from app.change_tracking import register_listener
+from app.models import Peer, PeerStatistics
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 200
+
+# matched_field reports the first matching field in this order
+SEARCH_FIELDS = ('name', 'assigned_ip', 'assigned_ipv6', 'public_key', 'endpoint', 'last_endpoint')
+TRIGRAM_FIELDS = ('name', 'assigned_ip', 'assigned_ipv6', 'endpoint', 'last_endpoint')
+
+
+class SearchDocument(NamedTuple):
+    id: int
+    name: str
+    public_key: str
+    assigned_ip: Optional[str]
+    assigned_ipv6: Optional[str]
+    endpoint: Optional[str]
+    last_endpoint: Optional[str]
+    is_active: bool
+
+    def to_dict(self):
+        return self._asdict()
+
+
+def trigrams(text: str):
+    """Distinct lowercase trigrams of a string (short strings yield none)"""
+    text = text.lower()
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class PeerSearchIndex:
+    """Trigram + key-prefix index over all peers"""
+
+    def __init__(self):
+        self.documents: Dict[int, SearchDocument] = {}
+        self.postings: Dict[str, set] = {}
+        self.keys: List = []  # sorted (public_key, peer_id)
+        self.values: List = []  # sorted (lowercase field value, peer_id) for prefix queries
+        self.texts: Dict[int, str] = {}  # searchable fields joined and lowercased, to verify candidates
+        self.last_endpoints: Dict[int, str] = {}
+        self.stale = set()
+        self.loaded = False
+        self.lock = threading.RLock()
+
+    # Maintenance
+
+    def invalidate(self):
+        with self.lock:
+            self.loaded = False
+
+    def apply_changes(self, changes):
+        """Change-tracking listener for peers and peer statistics"""
+        with self.lock:
+            for change in changes:
+                if change.op == 'bulk':
+                    self.loaded = False
+                    return
+                if change.table == PeerStatistics.__tablename__:
+                    peer_id = change.values.get('peer_id')
+                    if change.op == 'insert' and change.values.get('last_endpoint') and peer_id is not None:
+                        self.last_endpoints[peer_id] = change.values['last_endpoint']
+                        self.stale.add(peer_id)
+                elif change.identity is not None:
+                    self.stale.add(change.identity)
+
+    @staticmethod
+    def _discard(items, entry):
+        position = bisect_left(items, entry)
+        if position < len(items) and items[position] == entry:
+            del items[position]
+
+    def _remove(self, peer_id):
+        document = self.documents.pop(peer_id, None)
+        self.texts.pop(peer_id, None)
+        if document is None:
+            return
+        for field in TRIGRAM_FIELDS:
+            value = getattr(document, field)
+            if not value:
+                continue
+            self._discard(self.values, (value.lower(), peer_id))
+            for gram in trigrams(value):
+                postings = self.postings.get(gram)
+                if postings is not None:
+                    postings.discard(peer_id)
+                    if not postings:
+                        del self.postings[gram]
+        self._discard(self.keys, (document.public_key, peer_id))
+
+    def _add(self, document: SearchDocument, keep_sorted=True):
+        add = insort if keep_sorted else list.append
+        self.documents[document.id] = document
+        self.texts[document.id] = '\0'.join((getattr(document, field) or '').lower() for field in TRIGRAM_FIELDS)
+        for field in TRIGRAM_FIELDS:
+            value = getattr(document, field)
+            if not value:
+                continue
+            add(self.values, (value.lower(), document.id))
+            for gram in trigrams(value):
+                self.postings.setdefault(gram, set()).add(document.id)
+        add(self.keys, (document.public_key, document.id))
+
+    def _query_peers(self, peer_ids=None):
+        query = db.session.query(Peer.id, Peer.name, Peer.public_key, Peer.assigned_ip, Peer.assigned_ipv6,
+                                 Peer.endpoint, Peer.is_active)
+        if peer_ids is not None:
+            query = query.filter(Peer.id.in_(peer_ids))
+        return query.all()
+
+    def _load(self):
+        # Latest recorded endpoint per peer, one grouped query
+        latest = db.session.query(db.func.max(PeerStatistics.id)).filter(
+            PeerStatistics.last_endpoint.isnot(None)).group_by(PeerStatistics.peer_id)
+        self.last_endpoints = dict(db.session.query(PeerStatistics.peer_id, PeerStatistics.last_endpoint)
+                                   .filter(PeerStatistics.id.in_(latest)).all())
+        self.documents, self.texts, self.postings, self.keys, self.values = {}, {}, {}, [], []
+        for row in self._query_peers():
+            self._add(SearchDocument(*row[:6], self.last_endpoints.get(row[0]), row[6]), keep_sorted=False)
+        self.values.sort()
+        self.keys.sort()
+        self.stale.clear()
+        self.loaded = True
+
+    def _refresh(self):
+        if not self.loaded:
+            self._load()
+            return
+        if not self.stale:
+            return
+        stale = sorted(self.stale)
+        self.stale.clear()
+        for offset in range(0, len(stale), 500):
+            chunk = stale[offset:offset + 500]
+            rows = {row[0]: row for row in self._query_peers(chunk)}
+            for peer_id in chunk:
+                self._remove(peer_id)
+                if peer_id in rows:
+                    row = rows[peer_id]
+                    self._add(SearchDocument(*row[:6], self.last_endpoints.get(peer_id), row[6]))
+                else:
+                    self.last_endpoints.pop(peer_id, None)
+
+    # Queries
+
+    @staticmethod
+    def _prefixed(items, prefix):
+        position = bisect_left(items, (prefix,))
+        while position < len(items) and items[position][0].startswith(prefix):
+            yield items[position][1]
+            position += 1
+
+    def _candidates(self, query: str):
+        grams = trigrams(query)
+        if not grams:
+            return set()
+        postings = sorted((self.postings.get(gram, set()) for gram in grams), key=len)
+        candidates = set(postings[0])
+        for other in postings[1:]:
+            candidates &= other
+            if not candidates:
+                break
+        return candidates
+
+    def _matched_field(self, document, query, lowered):
+        for field in SEARCH_FIELDS:
+            value = getattr(document, field)
+            if not value:
+                continue
+            if field == 'public_key' and value.startswith(query):
+                return field
+            if field != 'public_key' and lowered in value.lower():
+                return field
+        return None
+
+    def search(self, query: str, limit: int = DEFAULT_LIMIT, active: Optional[bool] = None):
+        """
+        Peers matching `query`, best matches first
+        Prefix matches (exact values first, then in value order) come before
+        substring matches (by name). Queries shorter than three characters
+        match prefixes only. Broad queries stop as soon as `limit` prefix
+        matches are found.
+        """
+        query = (query or '').strip()
+        if not query:
+            return []
+        lowered = query.lower()
+        with self.lock:
+            self._refresh()
+            found = []
+            seen = set()
+
+            def take(peer_ids):
+                for peer_id in peer_ids:
+                    if len(found) >= limit:
+                        return
+                    if peer_id in seen:
+                        continue
+                    seen.add(peer_id)
+                    if active is None or self.documents[peer_id].is_active == active:
+                        found.append(peer_id)
+
+            take(self._prefixed(self.values, lowered))
+            take(self._prefixed(self.keys, query))
+
+            if len(found) < limit and len(lowered) >= 3:
+                candidates = self._candidates(lowered) - seen
+                if len(lowered) > 3:  # a single trigram match is already a substring match
+                    candidates = [peer_id for peer_id in candidates if lowered in self.texts[peer_id]]
+                take(heapq.nsmallest(limit - len(found), candidates, key=lambda peer_id: self.documents[peer_id].name))
+
+            return [dict(self.documents[peer_id].to_dict(),
+                         matched_field=self._matched_field(self.documents[peer_id], query, lowered))
+                    for peer_id in found]
+
+    def stats(self):
+        with self.lock:
+            return {'loaded': self.loaded, 'documents': len(self.documents),
+                    'trigrams': len(self.postings), 'stale': len(self.stale)}
+
+
+search_index = PeerSearchIndex()
+register_listener(search_index.apply_changes, tables=[Peer.__tablename__, PeerStatistics.__tablename__])
+
+
+def get_peer_search_index() -> PeerSearchIndex:
+    return search_index
@@ -0,0 +1,442 @@
+#!/usr/bin/env python3
+"""
+Privileged Helper
+Small root daemon that runs the allowlisted wg/iptables/ipset/nft/conntrack/ping
+operations on behalf of the web app over a Unix socket, so request handlers
+and the status loop never fork privileged tools themselves.
+
+Protocol: one JSON document per line in each direction.
+    request:  {"ops": [{"op": "wg_show", "args": {"interface": "wg0"}}, ...], "parallel": false}
+    response: {"results": [{"op": ..., "returncode": 0, "stdout": ..., "stderr": ..., "duration_ms": ...}, ...]}
+
+Connections are kept open by the client, a batch is answered with a single
+response, and identical read-only operations that are already in flight are
+coalesced into one execution. Like config_watcher.py this module does not
+import the `app` package, so the daemon starts without Flask or the database.
+"""
+
+import ipaddress
+import json
+import os
+import re
+import select
+import socket
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+SOCKET_PATH = os.getenv("PRIVILEGED_HELPER_SOCKET", "/run/wireguard-admin/helper.sock")
+SOCKET_GROUP = os.getenv("PRIVILEGED_HELPER_GROUP", "")  # group allowed to connect (0660)
+# Run operations in-process when the daemon is not reachable (development, tests;
+# the container image turns this off, the web app there is not root)
+ALLOW_FALLBACK = os.getenv("PRIVILEGED_HELPER_FALLBACK", "true").lower() == "true"
+CLIENT_TIMEOUT = float(os.getenv("PRIVILEGED_HELPER_TIMEOUT", "30"))  # seconds
+# iptables-save/-restore binaries (a stand-in can be configured for testing)
+IPTABLES_SAVE_BIN = os.getenv("IPTABLES_SAVE_BIN", "iptables-save")
+IPTABLES_RESTORE_BIN = os.getenv("IPTABLES_RESTORE_BIN", "iptables-restore")
+IPSET_BIN = os.getenv("IPSET_BIN", "ipset")
+NFT_BIN = os.getenv("NFT_BIN", "nft")
+MAX_BATCH = 256
+MAX_WORKERS = 16
+
+INTERFACE_PATTERN = re.compile(r"^[A-Za-z0-9_.-]{1,15}$")
+WG_SHOW_FIELDS = {"", "latest-handshakes", "transfer", "endpoints", "allowed-ips", "dump", "peers"}
+IPTABLES_TABLES = {"filter", "nat", "mangle", "raw"}
+IPTABLES_CHAIN_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,28}$")
+NFT_TABLE_PATTERN = re.compile(r"^[A-Za-z0-9_]{1,32}$")
+
+
+class OperationError(ValueError):
+    """Raised for unknown operations or arguments that fail validation"""
+
+
+class RequestSentError(ConnectionError):
+    """The connection failed after a request was written: its operations may have run"""
+
+
+def _interface(args):
+    interface = str(args.get("interface", "wg0"))
+    if not INTERFACE_PATTERN.match(interface):
+        raise OperationError(f"Invalid interface name: {interface!r}")
+    return interface
+
+
+def _wg_show(args):
+    field = str(args.get("field", ""))
+    if field not in WG_SHOW_FIELDS:
+        raise OperationError(f"Unsupported wg show field: {field!r}")
+    return ["wg", "show", _interface(args)] + ([field] if field else []), None, 10
+
+
+def _wg_genpsk(args):
+    return ["wg", "genpsk"], None, 5
+
+
+def _iptables_list(args):
+    chain = str(args.get("chain", "FORWARD"))
+    if not IPTABLES_CHAIN_PATTERN.match(chain):
+        raise OperationError(f"Invalid chain name: {chain!r}")
+    return ["iptables", "-L", chain, "-n", "-v", "--line-numbers"], None, 10
+
+
+def _iptables_save(args):
+    argv = [IPTABLES_SAVE_BIN]
+    if args.get("counters"):
+        argv.append("-c")
+    table = args.get("table")
+    if table:
+        if table not in IPTABLES_TABLES:
+            raise OperationError(f"Invalid table: {table!r}")
+        argv += ["-t", table]
+    return argv, None, 15
+
+
+def _iptables_restore(args):
+    rules = args.get("rules")
+    if not isinstance(rules, str) or not rules.strip():
+        raise OperationError("iptables_restore requires a non-empty 'rules' string")
+    argv = [IPTABLES_RESTORE_BIN]
+    if args.get("noflush"):
+        argv.append("--noflush")
+    if args.get("test"):
+        argv.append("--test")
+    return argv, rules, 30
+
+
+def _ipset_save(args):
+    return [IPSET_BIN, "save"], None, 15
+
+
+def _ipset_restore(args):
+    rules = args.get("rules")
+    if not isinstance(rules, str) or not rules.strip():
+        raise OperationError("ipset_restore requires a non-empty 'rules' string")
+    return [IPSET_BIN, "restore", "-exist"], rules, 30
+
+
+def _nft_list(args):
+    table = str(args.get("table", ""))
+    if not NFT_TABLE_PATTERN.match(table):
+        raise OperationError(f"Invalid nft table: {table!r}")
+    return [NFT_BIN, "list", "table", "ip", table], None, 15
+
+
+def _nft_apply(args):
+    rules = args.get("rules")
+    if not isinstance(rules, str) or not rules.strip():
+        raise OperationError("nft_apply requires a non-empty 'rules' string")
+    return [NFT_BIN] + (["-c"] if args.get("check") else []) + ["-f", "-"], rules, 30
+
+
+def _conntrack_list(args):
+    port = int(args.get("dport", 51820))
+    if not 0 < port < 65536:
+        raise OperationError(f"Invalid port: {port}")
+    return ["conntrack", "-L", "-p", "udp", "--dport", str(port)], None, 3
+
+
+def _ping(args):
+    try:
+        address = ipaddress.ip_address(str(args.get("address", "")))
+    except ValueError:
+        raise OperationError(f"Invalid ping address: {args.get('address')!r}")
+    timeout = min(max(float(args.get("timeout", 0.5)), 0.1), 5.0)
+    return ["ping", "-c", "1", "-W", str(max(1, int(round(timeout)))), str(address)], None, timeout + 0.5
+
+
+# op name -> (argv builder, read-only?)  Read-only ops may be coalesced while in flight.
+OPERATIONS = {
+    "wg_show": (_wg_show, True),
+    "wg_genpsk": (_wg_genpsk, False),
+    "iptables_list": (_iptables_list, True),
+    "iptables_save": (_iptables_save, True),
+    "iptables_restore": (_iptables_restore, False),
+    "ipset_save": (_ipset_save, True),
+    "ipset_restore": (_ipset_restore, False),
+    "nft_list": (_nft_list, True),
+    "nft_apply": (_nft_apply, False),
+    "conntrack_list": (_conntrack_list, True),
+    "ping": (_ping, True),
+}
+
+
+class HelperResult:
+    """Structured result of one operation, shaped like subprocess.CompletedProcess"""
+
+    def __init__(self, op, returncode, stdout="", stderr="", duration_ms=0.0, error=None):
+        self.op = op
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.duration_ms = duration_ms
+        self.error = error  # 'invalid', 'not_found', 'timeout' or 'transport'
+
+    @property
+    def ok(self):
+        return self.returncode == 0
+
+    def check_returncode(self):
+        if self.returncode != 0:
+            raise subprocess.CalledProcessError(self.returncode, self.op, self.stdout, self.stderr)
+
+    def to_dict(self):
+        return {
+            "op": self.op,
+            "returncode": self.returncode,
+            "stdout": self.stdout,
+            "stderr": self.stderr,
+            "duration_ms": self.duration_ms,
+            "error": self.error,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get("op"), data.get("returncode", -1), data.get("stdout", ""),
+                   data.get("stderr", ""), data.get("duration_ms", 0.0), data.get("error"))
+
+
+def execute(op, args=None):
+    """Validate and run a single operation in this process"""
+    args = args or {}
+    started = time.monotonic()
+    if op not in OPERATIONS:
+        return HelperResult(op, -1, stderr=f"Unknown operation: {op}", error="invalid")
+    try:
+        argv, stdin, timeout = OPERATIONS[op][0](args)
+    except (OperationError, TypeError, ValueError) as e:
+        return HelperResult(op, -1, stderr=str(e), error="invalid")
+
+    try:
+        completed = subprocess.run(argv, input=stdin, capture_output=True, text=True, timeout=timeout)
+        result = HelperResult(op, completed.returncode, completed.stdout, completed.stderr)
+    except FileNotFoundError:
+        result = HelperResult(op, 127, stderr=f"{argv[0]} not found in PATH", error="not_found")
+    except subprocess.TimeoutExpired:
+        result = HelperResult(op, -1, stderr=f"{argv[0]} timed out after {timeout}s", error="timeout")
+    result.duration_ms = round((time.monotonic() - started) * 1000, 1)
+    return result
+
+
+class Coalescer:
+    """Share the result of identical read-only operations that run concurrently"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = {}
+
+    def run(self, op, args):
+        if not OPERATIONS.get(op, (None, False))[1]:
+            return execute(op, args)
+
+        key = (op, json.dumps(args, sort_keys=True))
+        with self.lock:
+            entry = self.in_flight.get(key)
+            leader = entry is None
+            if leader:
+                entry = self.in_flight[key] = {"done": threading.Event(), "result": None}
+
+        if not leader:
+            entry["done"].wait()
+            return entry["result"]
+
+        try:
+            entry["result"] = execute(op, args)
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+            entry["done"].set()
+        return entry["result"]
+
+
+def run_batch(ops, parallel=False, runner=execute, executor=None):
+    """Run a list of {"op", "args"} dicts; results keep the request order"""
+    if len(ops) > MAX_BATCH:
+        # One result per op, so callers pairing ops with results never mislabel them
+        return [HelperResult(item.get("op"), -1, stderr=f"Batch exceeds {MAX_BATCH} operations", error="invalid")
+                for item in ops]
+    calls = [(item.get("op"), item.get("args") or {}) for item in ops]
+    if parallel and len(calls) > 1:
+        if executor is not None:
+            return list(executor.map(lambda call: runner(*call), calls))
+        with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(calls))) as pool:
+            return list(pool.map(lambda call: runner(*call), calls))
+    return [runner(op, args) for op, args in calls]
+
+
+# ---------------------------------------------------------------------------
+# Daemon
+# ---------------------------------------------------------------------------
+
+class HelperRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                results = run_batch(request.get("ops", []), bool(request.get("parallel")),
+                                    self.server.coalescer.run, self.server.executor)
+                response = {"results": [result.to_dict() for result in results]}
+            except (ValueError, AttributeError) as e:
+                response = {"error": f"Malformed request: {e}"}
+            self.wfile.write(json.dumps(response).encode() + b"\n")
+            self.wfile.flush()
+
+
+class HelperServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path):
+        self.coalescer = Coalescer()
+        self.executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+        super().__init__(path, HelperRequestHandler)
+
+
+def _log(message):
+    print(f"{datetime.now().isoformat(timespec='seconds')} {message}", flush=True)
+
+
+def serve(path=SOCKET_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.exists(path):
+        os.unlink(path)
+
+    server = HelperServer(path)
+    os.chmod(path, 0o660)
+    if SOCKET_GROUP:
+        import grp
+        os.chown(path, -1, grp.getgrnam(SOCKET_GROUP).gr_gid)
+
+    _log(f"🔐 Privileged helper listening on {path} ({', '.join(sorted(OPERATIONS))})")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+# ---------------------------------------------------------------------------
+# Client
+# ---------------------------------------------------------------------------
+
+class HelperClient:
+    """Keeps one connection per thread to the helper daemon"""
+
+    def __init__(self, path=SOCKET_PATH, timeout=CLIENT_TIMEOUT, fallback=ALLOW_FALLBACK):
+        self.path = path
+        self.timeout = timeout
+        self.fallback = fallback
+        self.local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is not None and select.select([conn[0]], [], [], 0)[0]:
+            # Readable between requests: the daemon closed it (restart), drop it before writing
+            self._close()
+            conn = None
+        if conn is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.path)
+            conn = self.local.conn = (sock, sock.makefile("rb"))
+        return conn
+
+    def _close(self):
+        conn = getattr(self.local, "conn", None)
+        self.local.conn = None
+        if conn:
+            try:
+                conn[1].close()
+                conn[0].close()
+            except OSError:
+                pass
+
+    def _send(self, payload, resend=False):
+        """
+        One request/response round trip
+        A request that could not be written is retried once on a fresh
+        connection. Once written it may have run, so it is only sent again
+        with resend (read-only batches); otherwise RequestSentError is raised.
+        """
+        for attempt in range(2):
+            sent = False
+            try:
+                sock, reader = self._connection()
+                sock.sendall(payload)
+                sent = True
+                line = reader.readline()
+                if not line:
+                    raise ConnectionError("helper closed the connection")
+                return json.loads(line)
+            except (OSError, ConnectionError, ValueError) as e:
+                self._close()
+                if sent and not resend:
+                    raise RequestSentError(f"connection lost after the request was sent: {e}") from e
+                if attempt:
+                    raise
+
+    def run_batch(self, ops, parallel=False):
+        """
+        Run several operations with one round trip per MAX_BATCH of them
+        Returns one HelperResult per operation, in order.
+        """
+        ops = [{"op": op, "args": args or {}} for op, args in ops]
+        results = []
+        for offset in range(0, len(ops), MAX_BATCH):
+            results += self._run_chunk(ops[offset:offset + MAX_BATCH], parallel)
+        return results
+
+    def _run_chunk(self, ops, parallel):
+        payload = json.dumps({"ops": ops, "parallel": parallel}).encode() + b"\n"
+        read_only = all(OPERATIONS.get(item["op"], (None, False))[1] for item in ops)
+        try:
+            response = self._send(payload, resend=read_only)
+        except RequestSentError as e:
+            # Never run a batch that may already have been applied a second time
+            return [HelperResult(item["op"], -1, stderr=f"Privileged helper failed: {e}", error="transport")
+                    for item in ops]
+        except (OSError, ConnectionError, ValueError) as e:
+            if self.fallback:
+                return run_batch(ops, parallel)
+            return [HelperResult(item["op"], -1, stderr=f"Privileged helper unavailable: {e}", error="transport")
+                    for item in ops]
+
+        if "error" in response:
+            return [HelperResult(item["op"], -1, stderr=response["error"], error="invalid") for item in ops]
+        return [HelperResult.from_dict(result) for result in response["results"]]
+
+    def run(self, op, **args):
+        return self.run_batch([(op, args)])[0]
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_helper_client():
+    """Shared client used by the app modules"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HelperClient()
+        return _client
+
+
+def run_privileged(op, **args):
+    """Run one allowlisted operation through the helper daemon"""
+    return get_helper_client().run(op, **args)
+
+
+def run_privileged_batch(ops, parallel=False):
+    """Run [(op, args), ...] through the helper daemon in a single request"""
+    return get_helper_client().run_batch(ops, parallel)
+
+
+if __name__ == "__main__":
+    try:
+        serve(sys.argv[1] if len(sys.argv) > 1 else SOCKET_PATH)
+    except KeyboardInterrupt:
+        sys.exit(0)
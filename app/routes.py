@@ -1,36 +1,69 @@
-from flask import request, jsonify, render_template, Response, redirect, url_for, flash
+from flask import request, jsonify, render_template, Response, redirect, url_for, flash, g
 from app import app, db
-from app.models import Peer, AllowedIP, FirewallRule
-from app.utils import generate_wg0_conf, validate_peer_data, get_next_available_ip, validate_multiple_allowed_ips, apply_iptables_rules, get_current_iptables_rules, validate_iptables_access, backup_iptables_rules, restore_iptables_rules, generate_iptables_rules, generate_peer_qr_code
+from app.models import Peer, AllowedIP, FirewallRule, FirewallTemplate, RouteProfile, AddressPool
+from app.utils import generate_wg0_conf, validate_peer_data, validate_multiple_allowed_ips, apply_iptables_rules, get_current_iptables_rules, validate_iptables_access, backup_iptables_rules, restore_iptables_rules, preview_firewall_rules, generate_peer_qr_code, get_allowed_ips_aggregation_report, get_client_allowed_ips, generate_peer_config_text, allocate_peer_addresses, get_address_pools, get_pool_networks, find_address_owners, find_overlapping_networks, apply_firewall_changes
+from app.cidr import exclude_networks
+from app.keygen import generate_preshared_key
+from app.ip_allocator import get_ip_allocator
+from app.conflict_scanner import scan_conflicts
+from app.bulk import apply_firewall_template, bulk_peer_action, parse_csv_rows, provision_peers
+from app import peer_listing
+from app.http_cache import conditional, wireguard_status_version
+from app.iptables_manager import FIREWALL_BACKENDS
+from app.firewall_evaluator import MAX_BATCH as MAX_EVALUATE_BATCH, get_policy_evaluator
+from app.firewall_counters import collect_firewall_counters
+from app.peer_search import DEFAULT_LIMIT as DEFAULT_SEARCH_LIMIT, MAX_LIMIT as MAX_SEARCH_LIMIT, get_peer_search_index
+from sqlalchemy.exc import IntegrityError
 from app.wireguard_status import get_wireguard_status, get_peer_connection_status, format_bytes, format_time_ago, format_duration
-import subprocess
 import os
 import re
+import json
+import ipaddress
+import time
 
 # Web Interface Routes
+INDEX_PAGE_FIELDS = ('id', 'name', 'public_key', 'assigned_ip', 'assigned_ipv6', 'is_active', 'created_at')
+
 @app.route('/', methods=['GET'])
 def list_peers():
-    peers = Peer.query.all()
-    return render_template('peers/index.html', peers=peers)
+    try:
+        page = peer_listing.list_peers(limit=request.args.get('limit'), cursor=request.args.get('cursor'),
+                                       sort=request.args.get('sort', 'id'), order=request.args.get('order', 'asc'),
+                                       fields=INDEX_PAGE_FIELDS, serialize=False)
+    except ValueError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('list_peers'))
+    stats = {
+        'total_peers': Peer.query.count(),
+        'active_configs': Peer.query.filter(Peer.endpoint.isnot(None), Peer.endpoint != '').count(),
+    }
+    return render_template('peers/index.html', peers=page['data'], pagination=page['pagination'], stats=stats)
 
 @app.route('/peers/new', methods=['GET'])
 def new_peer():
     try:
-        next_ip = get_next_available_ip()
-        return render_template('peers/form.html', peer=None, next_available_ip=next_ip)
+        next_ip, next_ipv6 = allocate_peer_addresses()
+        return render_template('peers/form.html', peer=None, next_available_ip=next_ip,
+                               next_available_ipv6=next_ipv6, address_pools=get_address_pools())
     except Exception as e:
         flash(f'Error getting next available IP: {str(e)}', 'error')
         return render_template('peers/form.html', peer=None, next_available_ip=None)
 
 @app.route('/api/v1/next-ip', methods=['GET'])
 def get_next_ip():
-    """Get the next available IP address"""
+    """Get the next available IP address (and IPv6 address when an IPv6 pool exists)"""
     try:
-        next_ip = get_next_available_ip()
+        next_ip, next_ipv6 = allocate_peer_addresses(request.args.get('pool'), request.args.get('pool_v6'))
         return jsonify({
             'status': 'success',
-            'ip': next_ip
+            'ip': next_ip,
+            'ipv6': next_ipv6
         })
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
     except Exception as e:
         return jsonify({
             'status': 'error',
@@ -79,9 +112,10 @@ def create_peer():
             flash('Peer with this public key already exists', 'error')
             return render_template('peers/form.html', peer=None), 400
 
-        # Auto-assign IP address
+        # Auto-assign one address per family from the selected (or default) pools
         try:
-            assigned_ip = get_next_available_ip()
+            assigned_ip, assigned_ipv6 = allocate_peer_addresses(data.get('address_pool') or None,
+                                                                 data.get('address_pool_v6') or None)
         except ValueError as e:
             flash(str(e), 'error')
             return render_template('peers/form.html', peer=None), 400
@@ -96,7 +130,7 @@ def create_peer():
                 return render_template('peers/form.html', peer=None), 400
 
         # Generate preshared key
-        preshared_key = subprocess.check_output("wg genpsk", shell=True).decode().strip()
+        preshared_key = generate_preshared_key()
         
         # Create new peer
         new_peer = Peer(
@@ -104,6 +138,7 @@ def create_peer():
             public_key=data['public_key'],
             preshared_key=preshared_key,
             assigned_ip=assigned_ip,
+            assigned_ipv6=assigned_ipv6,
             endpoint=data.get('endpoint') if data.get('endpoint') else None,
             persistent_keepalive=int(data['persistent_keepalive']) if data.get('persistent_keepalive') else None,
             is_active=True
@@ -169,7 +204,8 @@ def create_peer():
 @app.route('/peers/<int:peer_id>', methods=['GET'])
 def show_peer(peer_id):
     peer = Peer.query.get_or_404(peer_id)
-    return render_template('peers/show.html', peer=peer, config=app.config)
+    return render_template('peers/show.html', peer=peer, config=app.config,
+                           client_config=generate_peer_config_text(peer.id))
 
 @app.route('/peers/<int:peer_id>/edit', methods=['GET'])
 def edit_peer(peer_id):
@@ -272,6 +308,7 @@ def update_peer(peer_id):
         
         db.session.commit()
         generate_wg0_conf()
+        firewall = apply_firewall_changes([peer_id])
         
         success_msg = 'Peer updated successfully'
         if ip_data:
@@ -279,6 +316,8 @@ def update_peer(peer_id):
         if firewall_rules_created > 0:
             success_msg += f' and {firewall_rules_created} firewall rule(s)'
         flash(success_msg, 'success')
+        if firewall and firewall['status'] != 'success':
+            flash(f"Firewall not updated: {firewall['message']}", 'warning')
         return redirect(url_for('show_peer', peer_id=peer_id))
         
     except Exception as e:
@@ -309,6 +348,7 @@ def delete_peer(peer_id):
         return redirect(url_for('list_peers'))
 
 @app.route('/peers/<int:peer_id>/config', methods=['GET'])
+@conditional()
 def download_peer_config(peer_id):
     peer = Peer.query.get_or_404(peer_id)
     
@@ -318,7 +358,7 @@ def download_peer_config(peer_id):
 
     # Use assigned_ip for client address if available, otherwise use combined_allowed_ips or fallback to allowed_ips
     if hasattr(peer, 'assigned_ip') and peer.assigned_ip:
-        client_address = f"{peer.assigned_ip}/32"
+        client_address = ', '.join(peer.address_list)
     elif hasattr(peer, 'combined_allowed_ips'):
         client_address = peer.combined_allowed_ips
     else:
@@ -332,7 +372,7 @@ Address = {client_address}
 PublicKey = {server_public_key}
 PresharedKey = {peer.preshared_key}
 Endpoint = {server_public_ip}:{listen_port}
-AllowedIPs = 0.0.0.0/0
+AllowedIPs = {get_client_allowed_ips(peer)}
 PersistentKeepalive = {peer.persistent_keepalive or 25}
 """
 
@@ -450,21 +490,36 @@ def api_deactivate_peer(peer_id):
 
 # API Routes
 @app.route('/api/v1/peers', methods=['GET'])
+@conditional(lambda: wireguard_status_version() if request.args.get('connected') else '')  # live filter: include the status snapshot
 def api_list_peers():
-    peers = Peer.query.all()
+    """
+    List peers one page at a time
+    Query: limit, cursor (from pagination.next_cursor), sort (id|name|created_at), order,
+    fields (comma separated projection), filters active, deleted, connected, name (prefix), subnet, tag
+    """
+    try:
+        page = peer_listing.list_peers(
+            limit=request.args.get('limit'),
+            cursor=request.args.get('cursor'),
+            sort=request.args.get('sort', 'id'),
+            order=request.args.get('order', 'asc'),
+            fields=request.args.get('fields'),
+            active=request.args.get('active'),
+            deleted=request.args.get('deleted'),
+            connected=request.args.get('connected'),
+            name=request.args.get('name'),
+            subnet=request.args.get('subnet'),
+            tag=request.args.get('tag'),
+        )
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
     return jsonify({
         'status': 'success',
-        'data': [{
-            'id': peer.id,
-            'name': peer.name,
-            'public_key': peer.public_key,
-            'preshared_key': peer.preshared_key,
-            'allowed_ips': peer.allowed_ips,
-            'endpoint': peer.endpoint,
-            'persistent_keepalive': peer.persistent_keepalive,
-            'created_at': peer.created_at.isoformat(),
-            'updated_at': peer.updated_at.isoformat()
-        } for peer in peers]
+        'data': page['data'],
+        'pagination': page['pagination']
     })
 
 @app.route('/api/v1/peers', methods=['POST'])
@@ -501,7 +556,7 @@ def api_create_peer():
             }), 400
 
         # Generate preshared key and create peer
-        preshared_key = subprocess.check_output("wg genpsk", shell=True).decode().strip()
+        preshared_key = generate_preshared_key()
         
         new_peer = Peer(
             name=data['name'],
@@ -538,10 +593,100 @@ def api_create_peer():
             'message': f'Error creating peer: {str(e)}'
         }), 500
 
+@app.route('/api/v1/peers/bulk', methods=['POST'])
+def api_bulk_create_peers():
+    """
+    Create many peers at once from JSON ({"mode": ..., "peers": [...]}) or CSV
+    (text/csv body or a "file" upload, mode via ?mode=). Peers without a
+    public key get a server-generated keypair.
+    """
+    try:
+        mode = request.args.get('mode', 'atomic')
+        if request.mimetype == 'text/csv':
+            rows = parse_csv_rows(request.get_data(as_text=True))
+        elif 'file' in request.files:
+            rows = parse_csv_rows(request.files['file'].read().decode('utf-8-sig'))
+        else:
+            data = request.get_json(silent=True)
+            if isinstance(data, dict):
+                mode = data.get('mode', mode)
+                data = data.get('peers')
+            rows = data
+
+        result = provision_peers(rows, mode=mode)
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+    except IntegrityError as e:
+        return jsonify({
+            'status': 'error',
+            'message': f'Peers conflict with concurrently created peers: {str(e.orig)}'
+        }), 409
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': f'Error creating peers: {str(e)}'
+        }), 500
+
+    status_code = {'success': 201, 'partial': 207}.get(result['status'], 400)
+    return jsonify(result), status_code
+
+@app.route('/api/v1/peers/bulk/<action>', methods=['POST'])
+def api_bulk_peer_action(action):
+    """Activate, deactivate or delete peers selected by {"ids": [...], "name_pattern": "sales-*", "tag": "sales"}"""
+    try:
+        data = request.get_json(silent=True) or {}
+        result = bulk_peer_action(action, ids=data.get('ids'), name_pattern=data.get('name_pattern'), tag=data.get('tag'))
+        return jsonify(result)
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': f'Error running bulk {action}: {str(e)}'
+        }), 500
+
+@app.route('/api/v1/peers/search', methods=['GET'])
+def api_search_peers():
+    """Typeahead search over name, public key prefix, assigned IPs and endpoints (?q=&limit=&active=)"""
+    try:
+        limit = min(max(int(request.args.get('limit', DEFAULT_SEARCH_LIMIT)), 1), MAX_SEARCH_LIMIT)
+        active = request.args.get('active')
+        active = None if active in (None, '') else active.lower() in ('1', 'true', 'yes')
+    except ValueError:
+        return jsonify({
+            'status': 'error',
+            'message': 'limit must be a number'
+        }), 400
+    try:
+        query = request.args.get('q', '')
+        return jsonify({
+            'status': 'success',
+            'query': query,
+            'data': get_peer_search_index().search(query, limit=limit, active=active)
+        })
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': f'Error searching peers: {str(e)}'
+        }), 500
+
 @app.route('/api/v1/peers/<int:peer_id>', methods=['GET'])
+@conditional()
 def api_get_peer(peer_id):
-    peer = Peer.query.get(peer_id)
-    if not peer:
+    try:
+        data = peer_listing.get_peer_data(peer_id, request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+    if data is None:
         return jsonify({
             'status': 'error',
             'message': 'Peer not found'
@@ -549,17 +694,7 @@ def api_get_peer(peer_id):
         
     return jsonify({
         'status': 'success',
-        'data': {
-            'id': peer.id,
-            'name': peer.name,
-            'public_key': peer.public_key,
-            'preshared_key': peer.preshared_key,
-            'allowed_ips': peer.allowed_ips,
-            'endpoint': peer.endpoint,
-            'persistent_keepalive': peer.persistent_keepalive,
-            'created_at': peer.created_at.isoformat(),
-            'updated_at': peer.updated_at.isoformat()
-        }
+        'data': data
     })
 
 @app.route('/api/v1/peers/<int:peer_id>', methods=['PUT'])
@@ -664,6 +799,7 @@ def api_delete_peer(peer_id):
         }), 500
 
 @app.route('/api/v1/peers/<int:peer_id>/config', methods=['GET'])
+@conditional()
 def api_get_peer_config(peer_id):
     peer = Peer.query.get(peer_id)
     if not peer:
@@ -678,13 +814,13 @@ def api_get_peer_config(peer_id):
 
     config = f"""[Interface]
 PrivateKey = <PLACEHOLDER_FOR_CLIENT_PRIVATE_KEY>
-Address = {peer.allowed_ips}
+Address = {', '.join(peer.address_list)}
 
 [Peer]
 PublicKey = {server_public_key}
 PresharedKey = {peer.preshared_key}
 Endpoint = {server_public_ip}:{listen_port}
-AllowedIPs = 0.0.0.0/0
+AllowedIPs = {get_client_allowed_ips(peer)}
 PersistentKeepalive = {peer.persistent_keepalive or 25}
 """
 
@@ -696,6 +832,215 @@ PersistentKeepalive = {peer.persistent_keepalive or 25}
         }
     })
 
+# Split-tunnel route profiles
+def _route_profile_to_dict(profile):
+    families = (4, 6) if profile.include_ipv6 else (4,)
+    return {
+        'id': profile.id,
+        'name': profile.name,
+        'description': profile.description,
+        'excluded_networks': profile.excluded_networks_list,
+        'include_ipv6': profile.include_ipv6,
+        'is_system': profile.is_system,
+        'allowed_ips': exclude_networks(profile.excluded_networks_list, include=get_pool_networks(), families=families),
+        'peer_count': profile.peers.count()
+    }
+
+@app.route('/api/v1/route-profiles', methods=['GET'])
+def api_list_route_profiles():
+    """List split-tunnel route profiles with their computed client AllowedIPs"""
+    profiles = RouteProfile.query.order_by(RouteProfile.name).all()
+    return jsonify({
+        'status': 'success',
+        'data': [_route_profile_to_dict(profile) for profile in profiles]
+    })
+
+@app.route('/api/v1/route-profiles', methods=['POST'])
+def api_create_route_profile():
+    """Create a split-tunnel route profile"""
+    data = request.get_json()
+    if not data or not data.get('name'):
+        return jsonify({
+            'status': 'error',
+            'message': 'name is required'
+        }), 400
+
+    if RouteProfile.query.filter_by(name=data['name']).first():
+        return jsonify({
+            'status': 'error',
+            'message': 'Route profile with this name already exists'
+        }), 400
+
+    excluded = data.get('excluded_networks', [])
+    if isinstance(excluded, str):
+        excluded = excluded.split(',')
+
+    try:
+        profile = RouteProfile(
+            name=data['name'],
+            description=data.get('description'),
+            excluded_networks=','.join(network.strip() for network in excluded if network.strip()),
+            include_ipv6=data.get('include_ipv6', True)
+        )
+        db.session.add(profile)
+        db.session.commit()
+
+        return jsonify({
+            'status': 'success',
+            'message': 'Route profile created successfully',
+            'data': _route_profile_to_dict(profile)
+        }), 201
+
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'status': 'error',
+            'message': f'Error creating route profile: {str(e)}'
+        }), 500
+
+@app.route('/api/v1/peers/<int:peer_id>/route-profile', methods=['PUT'])
+def api_set_peer_route_profile(peer_id):
+    """Attach a route profile to a peer (null = full tunnel)"""
+    peer = Peer.query.get(peer_id)
+    if not peer:
+        return jsonify({
+            'status': 'error',
+            'message': 'Peer not found'
+        }), 404
+
+    data = request.get_json() or {}
+    profile_id = data.get('route_profile_id')
+    if profile_id is not None and not RouteProfile.query.get(profile_id):
+        return jsonify({
+            'status': 'error',
+            'message': 'Route profile not found'
+        }), 404
+
+    try:
+        peer.route_profile_id = profile_id
+        db.session.commit()
+
+        return jsonify({
+            'status': 'success',
+            'message': f'Route profile updated for peer "{peer.name}"',
+            'data': {
+                'peer_id': peer.id,
+                'route_profile_id': peer.route_profile_id,
+                'allowed_ips': get_client_allowed_ips(peer)
+            }
+        })
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'status': 'error',
+            'message': f'Error updating route profile: {str(e)}'
+        }), 500
+
+# Address pools
+@app.route('/api/v1/address-pools', methods=['GET'])
+def api_list_address_pools():
+    """List address pools with their allocation statistics"""
+    allocator = get_ip_allocator()
+    pools = AddressPool.query.order_by(AddressPool.family, AddressPool.name).all()
+    data = []
+    for pool in pools:
+        pool_data = pool.to_dict()
+        pool_data['usage'] = allocator.bitmap(pool.network).stats()
+        data.append(pool_data)
+    return jsonify({
+        'status': 'success',
+        'data': data
+    })
+
+@app.route('/api/v1/address-pools', methods=['POST'])
+def api_create_address_pool():
+    """Create an IPv4 or IPv6 address pool"""
+    data = request.get_json()
+    if not data or not data.get('name') or not data.get('network'):
+        return jsonify({
+            'status': 'error',
+            'message': 'name and network are required'
+        }), 400
+
+    if AddressPool.query.filter_by(name=data['name']).first():
+        return jsonify({
+            'status': 'error',
+            'message': 'Address pool with this name already exists'
+        }), 400
+
+    try:
+        network = ipaddress.ip_network(data['network'], strict=False)
+        for existing in AddressPool.query.all():
+            if existing.ip_network.version == network.version and existing.ip_network.overlaps(network):
+                return jsonify({
+                    'status': 'error',
+                    'message': f'Network overlaps address pool "{existing.name}" ({existing.network})'
+                }), 400
+
+        pool = AddressPool(
+            name=data['name'],
+            network=str(network),
+            description=data.get('description'),
+            is_default=bool(data.get('is_default', False))
+        )
+        if pool.is_default:
+            AddressPool.query.filter_by(family=network.version, is_default=True).update({'is_default': False})
+        db.session.add(pool)
+        db.session.commit()
+
+        return jsonify({
+            'status': 'success',
+            'message': 'Address pool created successfully',
+            'data': pool.to_dict()
+        }), 201
+
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'status': 'error',
+            'message': f'Error creating address pool: {str(e)}'
+        }), 500
+
+@app.route('/api/v1/ip-lookup', methods=['GET'])
+def api_ip_lookup():
+    """Find the peers owning an address (?address=) or overlapping a network (?network=)"""
+    address = request.args.get('address', '').strip()
+    network = request.args.get('network', '').strip()
+    if not address and not network:
+        return jsonify({
+            'status': 'error',
+            'message': 'address or network parameter is required'
+        }), 400
+
+    try:
+        matches = find_address_owners(address) if address else find_overlapping_networks(network)
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+
+    return jsonify({
+        'status': 'success',
+        'data': {
+            'query': address or network,
+            'matches': matches,
+            'owner': matches[0] if address and matches else None
+        }
+    })
+
 # Legacy routes for backward compatibility
 @app.route('/new', methods=['GET'])
 def add_peer_form():
@@ -726,22 +1071,117 @@ def api_firewall_status():
 
 @app.route('/api/v1/firewall/rules/generate', methods=['GET'])
 def api_generate_firewall_rules():
-    """Generate iptables rules without applying them (dry run)"""
+    """Generate firewall rules without applying them (dry run); ?backend=restore|nftables|iptc"""
     peer_id = request.args.get('peer_id', type=int)
+    backend = request.args.get('backend')
+    if backend and backend not in FIREWALL_BACKENDS:
+        return jsonify({
+            'status': 'error',
+            'message': f"backend must be one of: {', '.join(FIREWALL_BACKENDS)}"
+        }), 400
     
     try:
-        rules = generate_iptables_rules(peer_id)
-        return jsonify({
+        preview = preview_firewall_rules(peer_id, backend=backend)
+        rules = preview['rules'] if preview['status'] == 'success' else [f"# Error generating rules: {preview['message']}"]
+        response = {
             'status': 'success',
             'rules': rules,
             'message': f'Generated {len(rules)} rules'
-        })
+        }
+        for key in ('compile_ms', 'optimization', 'skipped_rules'):
+            if key in preview:
+                response[key] = preview[key]
+        if backend:
+            response['backend'] = backend
+        return jsonify(response)
     except Exception as e:
         return jsonify({
             'status': 'error',
             'message': f'Error generating rules: {str(e)}'
         }), 500
 
+@app.route('/api/v1/firewall/templates/<int:template_id>/apply', methods=['POST'])
+def api_apply_firewall_template(template_id):
+    """
+    Apply a template to peers selected by {"ids": [...], "name_pattern": "sales-*", "tag": "sales"}
+    "mode": "copy" (default, "replace": true drops the peers' rules first), "link" or "unlink"
+    """
+    template = db.session.get(FirewallTemplate, template_id)
+    if template is None:
+        return jsonify({
+            'status': 'error',
+            'message': f'Firewall template {template_id} not found'
+        }), 404
+    try:
+        data = request.get_json(silent=True) or {}
+        result = apply_firewall_template(template, mode=data.get('mode', 'copy'), ids=data.get('ids'),
+                                         name_pattern=data.get('name_pattern'), tag=data.get('tag'),
+                                         replace=bool(data.get('replace', False)))
+        return jsonify(result)
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': f'Error applying firewall template: {str(e)}'
+        }), 500
+
+@app.route('/api/v1/firewall/counters', methods=['GET'])
+def api_firewall_counters():
+    """Packet/byte counters and rates per FirewallRule id and per peer; ?backend=restore|nftables|iptc"""
+    backend = request.args.get('backend')
+    if backend and backend not in FIREWALL_BACKENDS:
+        return jsonify({
+            'status': 'error',
+            'message': f"backend must be one of: {', '.join(FIREWALL_BACKENDS)}"
+        }), 400
+
+    result = collect_firewall_counters(backend=backend)
+    if result['status'] != 'success':
+        return jsonify(result), 500
+    peer_id = request.args.get('peer_id', type=int)
+    if peer_id is not None:
+        result['peers'] = {key: value for key, value in result['peers'].items() if key == str(peer_id)}
+    return jsonify(result)
+
+
+@app.route('/api/v1/firewall/evaluate', methods=['POST'])
+def api_evaluate_firewall():
+    """
+    Would these packets pass? One query {"src", "dst", "protocol", "port"}
+    or {"queries": [...]}; evaluated against the database state, not the kernel
+    """
+    try:
+        data = request.get_json(silent=True)
+        queries = data.get('queries', [data]) if isinstance(data, dict) else None
+        if not isinstance(queries, list) or not queries:
+            raise ValueError('Expected a query object or {"queries": [...]}')
+        if len(queries) > MAX_EVALUATE_BATCH:
+            raise ValueError(f'At most {MAX_EVALUATE_BATCH} queries per request')
+
+        evaluator = get_policy_evaluator()
+        started = time.perf_counter()
+        results = evaluator.evaluate_many(queries)
+        return jsonify({
+            'status': 'success',
+            'results': results,
+            'evaluated': len(results),
+            'duration_us': round((time.perf_counter() - started) * 1e6, 1)
+        })
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': f'Error evaluating firewall policy: {str(e)}'
+        }), 500
+
 @app.route('/api/v1/firewall/rules/apply', methods=['POST'])
 def api_apply_firewall_rules():
     """Apply iptables rules to the system"""
@@ -865,7 +1305,7 @@ def api_create_firewall_rule(peer_id):
         db.session.add(new_rule)
         db.session.commit()
         
-        return jsonify({
+        response = {
             'status': 'success',
             'message': 'Firewall rule created successfully',
             'data': {
@@ -874,8 +1314,18 @@ def api_create_firewall_rule(peer_id):
                 'rule_type': new_rule.rule_type,
                 'action': new_rule.action
             }
-        }), 201
+        }
+        firewall = apply_firewall_changes([peer_id])
+        if firewall:
+            response['firewall'] = firewall
+        return jsonify(response), 201
         
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({
@@ -925,11 +1375,21 @@ def api_update_firewall_rule(rule_id):
         
         db.session.commit()
         
-        return jsonify({
+        response = {
             'status': 'success',
             'message': 'Firewall rule updated successfully'
-        })
+        }
+        firewall = apply_firewall_changes([rule.peer_id])
+        if firewall:
+            response['firewall'] = firewall
+        return jsonify(response)
         
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({
@@ -949,13 +1409,18 @@ def api_delete_firewall_rule(rule_id):
     
     try:
         rule_name = rule.name
+        peer_id = rule.peer_id
         db.session.delete(rule)
         db.session.commit()
         
-        return jsonify({
+        response = {
             'status': 'success',
             'message': f'Firewall rule "{rule_name}" deleted successfully'
-        })
+        }
+        firewall = apply_firewall_changes([peer_id])
+        if firewall:
+            response['firewall'] = firewall
+        return jsonify(response)
         
     except Exception as e:
         db.session.rollback()
@@ -966,11 +1431,12 @@ def api_delete_firewall_rule(rule_id):
 
 # WireGuard Live Status API
 @app.route('/api/v1/wireguard/status', methods=['GET'])
+@conditional(wireguard_status_version, weak=True)
 def api_wireguard_status():
     """Get live WireGuard connection status for all peers"""
     try:
-        # Get WireGuard status
-        wg_status = get_wireguard_status()
+        # WireGuard status snapshot taken for the ETag (read here if that failed)
+        wg_status = g.wg_status if 'wg_status' in g else get_wireguard_status()
         
         # Get all peers from database
         peers = Peer.query.all()
@@ -1010,6 +1476,76 @@ def api_wireguard_status():
             'message': f'Error getting WireGuard status: {str(e)}'
         }), 500
 
+@app.route('/api/v1/wireguard/allowed-ips/aggregation', methods=['GET'])
+def api_allowed_ips_aggregation():
+    """Report how many AllowedIPs entries CIDR aggregation saves in wg0.conf"""
+    try:
+        return jsonify({
+            'status': 'success',
+            'data': get_allowed_ips_aggregation_report()
+        })
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': f'Error building aggregation report: {str(e)}'
+        }), 500
+
+@app.route('/api/v1/network/conflicts', methods=['GET'])
+def api_network_conflicts():
+    """Scan all pools, assigned addresses and allowed IP ranges for overlaps"""
+    try:
+        report = scan_conflicts()
+        severity = request.args.get('severity')
+        if severity:
+            report['conflicts'] = [conflict for conflict in report['conflicts'] if conflict['severity'] == severity]
+        return jsonify({
+            'status': 'success',
+            'data': report
+        })
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': f'Error scanning for address conflicts: {str(e)}'
+        }), 500
+
+@app.route('/api/v1/wireguard/apply-events', methods=['POST'])
+def api_wireguard_apply_event():
+    """Receive an apply result from the config reconciler and push it to WebSocket clients"""
+    if request.remote_addr not in ('127.0.0.1', '::1'):
+        return jsonify({
+            'status': 'error',
+            'message': 'Apply events are only accepted from localhost'
+        }), 403
+
+    data = request.get_json()
+    if not data:
+        return jsonify({
+            'status': 'error',
+            'message': 'Invalid JSON data'
+        }), 400
+
+    from app import socketio
+    socketio.emit('config_apply_result', data)
+    return jsonify({'status': 'success'})
+
+@app.route('/api/v1/wireguard/apply-status', methods=['GET'])
+def api_wireguard_apply_status():
+    """Get the last config apply result recorded by the reconciler"""
+    state_file = os.getenv("WG_APPLY_STATE_FILE", "instance/wg-apply-state.json")
+    try:
+        with open(state_file) as f:
+            state = json.load(f)
+    except (FileNotFoundError, ValueError):
+        state = {}
+
+    return jsonify({
+        'status': 'success',
+        'data': {
+            'applied_revision': state.get('applied_revision'),
+            'last_result': state.get('last_result')
+        }
+    })
+
 @app.route('/api/v1/wireguard/force-update', methods=['POST'])
 def api_force_wireguard_update():
     """Force an immediate WebSocket status update"""
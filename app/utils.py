@@ -1,11 +1,16 @@
 from app import db
-from app.models import Peer
+from app.models import Peer, AllowedIP, AddressPool
 import os
 import re
 import ipaddress
 import qrcode
 import io
 import base64
+from app.cidr import address_key, aggregate_peer_networks, exclude_networks, find_overlapping_pairs, network_interval, network_keys
+from app.privileged_helper import run_privileged
+from app.ip_allocator import get_ip_allocator
+from app.network_index import get_network_index
+from app.firewall_compiler import planned_rule, rule_label
 try:
     from app.iptables_manager import get_iptables_manager
 except (ImportError, AttributeError):
@@ -16,21 +21,37 @@ def generate_wg0_conf():
     vpn_server_ip = os.getenv("VPN_SERVER_IP", "10.0.0.1")  # VPN internal server IP
     listen_port = os.getenv("LISTEN_PORT")
 
+    server_addresses = [vpn_server_ip]
+    server_ipv6 = get_server_ipv6()
+    if server_ipv6:
+        server_addresses.append(server_ipv6)
+
     config = f"""[Interface]
-Address = {vpn_server_ip}
+Address = {', '.join(server_addresses)}
 PrivateKey = {server_private_key}
 ListenPort = {listen_port}
 """
 
     # Only include active peers
     peers = Peer.query.filter_by(is_active=True).all()
+    allowed_ips = {peer.id: get_peer_allowed_networks(peer) for peer in peers}
+
+    # Optional aggregation stage: collapse adjacent/contained ranges per peer
+    if os.getenv("AGGREGATE_ALLOWED_IPS", "false").lower() == 'true':
+        allowed_ips, report = aggregate_peer_networks(allowed_ips)
+        if report['entries_saved']:
+            print(f"📉 Aggregated AllowedIPs: {report['entries_before']} → {report['entries_after']} entries")
+        for conflict in report['conflicts']:
+            print(f"⚠️  AllowedIPs conflict: peer {conflict['peer_a']} {conflict['network_a']} "
+                  f"overlaps peer {conflict['peer_b']} {conflict['network_b']}")
+
     for peer in peers:
         config += f"""
 # Peer: {peer.id}, {peer.name}
 [Peer]
 PublicKey = {peer.public_key}
 PresharedKey = {peer.preshared_key}
-AllowedIPs = {peer.combined_allowed_ips}
+AllowedIPs = {','.join(allowed_ips[peer.id])}
 """
         if peer.endpoint:
             config += f"Endpoint = {peer.endpoint}\n"
@@ -41,52 +62,111 @@ AllowedIPs = {peer.combined_allowed_ips}
             config += "PersistentKeepalive = 25\n"  # Default to 25 seconds if not set
 
     # Write to application directory
-    with open("wg0.conf", "w") as f:
+    with open(os.getenv("WG_CONFIG_PATH", "wg0.conf"), "w") as f:
         f.write(config)
     
     # Also write to WireGuard system directory if running in container/production
+    system_config = os.getenv("WG_SYSTEM_CONFIG", "/etc/wireguard/wg0.conf")
     try:
-        if os.path.exists("/etc/wireguard"):
-            with open("/etc/wireguard/wg0.conf", "w") as f:
+        if os.path.exists(os.path.dirname(system_config)):
+            with open(system_config, "w") as f:
                 f.write(config)
             # Set correct permissions for WireGuard
-            os.chmod("/etc/wireguard/wg0.conf", 0o600)
+            os.chmod(system_config, 0o600)
     except (PermissionError, OSError):
         # Continue if we can't write to system directory (development mode)
         pass
 
     return "wg0.conf generated successfully."
 
+def get_peer_allowed_networks(peer):
+    """Server-side AllowedIPs of a peer: its assigned /32 (and /128) plus all allowed IP ranges"""
+    return peer.address_list + peer.allowed_networks_list
+
+def get_allowed_ips_aggregation_report():
+    """Report how many AllowedIPs entries aggregation would save for the active peers"""
+    peers = Peer.query.filter_by(is_active=True).all()
+    _, report = aggregate_peer_networks({peer.id: get_peer_allowed_networks(peer) for peer in peers})
+
+    names = {peer.id: peer.name for peer in peers}
+    for entry in report['aggregated_peers']:
+        entry['peer_name'] = names[entry['peer']]
+    for conflict in report['conflicts']:
+        conflict['peer_a_name'] = names[conflict['peer_a']]
+        conflict['peer_b_name'] = names[conflict['peer_b']]
+    report['enabled'] = os.getenv("AGGREGATE_ALLOWED_IPS", "false").lower() == 'true'
+    return report
+
+def _env_pool_networks(family):
+    """Pools implied by VPN_SUBNET / VPN_SUBNET_V6 when none are configured in the database"""
+    network = os.getenv("VPN_SUBNET", "10.0.0.0/24") if family == 4 else os.getenv("VPN_SUBNET_V6", "")
+    return [network] if network else []
+
+def get_address_pools(family=None):
+    """Active address pools, default pools first"""
+    query = AddressPool.query.filter_by(is_active=True)
+    if family:
+        query = query.filter_by(family=family)
+    return query.order_by(AddressPool.is_default.desc(), AddressPool.name).all()
+
+def get_pool_networks(family=None):
+    """CIDRs of all active pools (falls back to the environment subnets)"""
+    networks = []
+    for pool_family in ((family,) if family else (4, 6)):
+        pools = get_address_pools(pool_family)
+        if pools:
+            networks.extend(pool.network for pool in pools)
+        else:
+            networks.extend(_env_pool_networks(pool_family))
+    return networks
+
+def resolve_pool_network(family, pool_name=None):
+    """Network to allocate from: the named pool, else the default pool of the family (None if there is none)"""
+    if pool_name:
+        pool = AddressPool.query.filter_by(name=pool_name, is_active=True).first()
+        if not pool or pool.family != family:
+            raise ValueError(f"Unknown IPv{family} address pool: {pool_name}")
+        return pool.network
+    pools = get_address_pools(family)
+    if pools:
+        return pools[0].network
+    networks = _env_pool_networks(family)
+    return networks[0] if networks else None
+
+def get_server_ipv6():
+    """Server tunnel IPv6 address (VPN_SERVER_IPV6, else ::1 of the default IPv6 pool)"""
+    configured = os.getenv("VPN_SERVER_IPV6")
+    if configured:
+        return configured
+    network = resolve_pool_network(6)
+    return str(ipaddress.ip_network(network, strict=False).network_address + 1) if network else None
+
 def get_next_available_ip(subnet=None):
     """Get the next available IP address in the VPN subnet"""
     if not subnet:
-        subnet = os.getenv("VPN_SUBNET", "10.0.0.0/24")
+        subnet = resolve_pool_network(4) or os.getenv("VPN_SUBNET", "10.0.0.0/24")
     
     try:
         network = ipaddress.ip_network(subnet, strict=False)
     except ValueError:
         raise ValueError(f"Invalid subnet: {subnet}")
     
-    # Get all assigned IPs from database
-    assigned_ips = set()
-    peers = Peer.query.all()
-    for peer in peers:
-        if hasattr(peer, 'assigned_ip') and peer.assigned_ip:
-            try:
-                assigned_ips.add(ipaddress.ip_address(peer.assigned_ip))
-            except ValueError:
-                continue
-    
-    # Reserve first IP for server (usually .1)
-    server_ip = network.network_address + 1
-    assigned_ips.add(server_ip)
-    
-    # Find the lowest available IP
-    for ip in network.hosts():
-        if ip not in assigned_ips:
-            return str(ip)
-    
-    raise ValueError(f"No available IP addresses in subnet {subnet}")
+    # Lowest free address from the allocator bitmap (server .1 is reserved)
+    next_ip = get_ip_allocator().next_available(network)
+    if next_ip is None:
+        raise ValueError(f"No available IP addresses in subnet {subnet}")
+    return next_ip
+
+def get_next_available_ipv6(subnet=None):
+    """Next free IPv6 address, or None when no IPv6 pool is configured"""
+    subnet = subnet or resolve_pool_network(6)
+    if not subnet:
+        return None
+    return get_next_available_ip(subnet)
+
+def allocate_peer_addresses(pool=None, pool_v6=None):
+    """Pick one address per configured family: returns (ipv4, ipv6 or None)"""
+    return get_next_available_ip(resolve_pool_network(4, pool)), get_next_available_ipv6(resolve_pool_network(6, pool_v6))
 
 def validate_additional_ips(ips_string):
     """Validate additional allowed IPs string"""
@@ -116,55 +196,38 @@ def validate_additional_ips(ips_string):
     
     return valid_ips
 
+def _overlap_error(ip_network, entry):
+    if entry.kind == 'assigned':
+        return f"IP network {ip_network} overlaps with peer '{entry.peer_name}' assigned IP {entry.network}"
+    return f"IP network {ip_network} overlaps with peer '{entry.peer_name}' allowed IP {entry.network}"
+
 def validate_allowed_ip_network(ip_network, peer_id=None, vpn_subnet=None):
     """
     Validate a single allowed IP network
     Returns (is_valid, error_message)
     """
-    from app.models import Peer, AllowedIP
-    
     try:
         # Parse the IP network
         network = ipaddress.ip_network(ip_network, strict=False)
     except ValueError:
         return False, f"Invalid IP network format: {ip_network}"
     
-    # Get VPN subnet
-    if not vpn_subnet:
-        vpn_subnet = os.getenv("VPN_SUBNET", "10.0.0.0/24")
-    
-    try:
-        vpn_network = ipaddress.ip_network(vpn_subnet, strict=False)
-    except ValueError:
-        return False, f"Invalid VPN subnet configuration: {vpn_subnet}"
-    
-    # Check if IP is in VPN subnet (not allowed for user-defined IPs)
-    if network.overlaps(vpn_network):
-        return False, f"IP network {ip_network} overlaps with VPN subnet {vpn_subnet}. User-defined IPs must be outside the VPN subnet."
-    
-    # Check for overlaps with other peers' allowed IPs
-    peers = Peer.query.all()
-    for peer in peers:
-        if peer_id and peer.id == peer_id:
-            continue  # Skip current peer when editing
-            
-        # Check assigned IP
-        if peer.assigned_ip:
-            try:
-                peer_assigned = ipaddress.ip_network(f"{peer.assigned_ip}/32")
-                if network.overlaps(peer_assigned):
-                    return False, f"IP network {ip_network} overlaps with peer '{peer.name}' assigned IP {peer.assigned_ip}"
-            except ValueError:
-                pass
+    # VPN subnets: the given one, else every address pool
+    vpn_subnets = [vpn_subnet] if vpn_subnet else get_pool_networks()
+    for subnet in vpn_subnets:
+        try:
+            vpn_network = ipaddress.ip_network(subnet, strict=False)
+        except ValueError:
+            return False, f"Invalid VPN subnet configuration: {subnet}"
         
-        # Check allowed IP ranges
-        for allowed_ip in peer.allowed_ip_ranges:
-            try:
-                existing_network = ipaddress.ip_network(allowed_ip.ip_network, strict=False)
-                if network.overlaps(existing_network):
-                    return False, f"IP network {ip_network} overlaps with peer '{peer.name}' allowed IP {allowed_ip.ip_network}"
-            except ValueError:
-                continue
+        # Check if IP is in VPN subnet (not allowed for user-defined IPs)
+        if network.overlaps(vpn_network):
+            return False, f"IP network {ip_network} overlaps with VPN subnet {subnet}. User-defined IPs must be outside the VPN subnet."
+    
+    # Check for overlaps with other peers' assigned and allowed IPs (interval index lookup)
+    for entry in get_network_index().overlapping(network, exclude_peer_id=peer_id):
+        if entry.kind != 'pool':
+            return False, _overlap_error(ip_network, entry)
     
     return True, ""
 
@@ -174,70 +237,93 @@ def validate_multiple_allowed_ips(ip_networks, peer_id=None):
     Returns (all_valid, error_messages_list)
     """
     errors = []
-    vpn_subnet = os.getenv("VPN_SUBNET", "10.0.0.0/24")
+    vpn_networks = []
+    for subnet in get_pool_networks():
+        try:
+            vpn_networks.append((ipaddress.ip_network(subnet, strict=False), subnet))
+        except ValueError:
+            return False, [f"Invalid VPN subnet configuration: {subnet}"]
     
-    # Check each IP individually
-    for ip_network in ip_networks:
-        if not ip_network.strip():
-            continue
-            
-        is_valid, error = validate_allowed_ip_network(ip_network.strip(), peer_id, vpn_subnet)
-        if not is_valid:
-            errors.append(error)
+    index = get_network_index()
+    intervals = []
     
-    # Check for overlaps within the same peer's IPs
-    networks = []
-    for ip_network in ip_networks:
-        if not ip_network.strip():
+    # Single pass: parse, check pools and the index, collect intervals for the self-overlap sweep
+    for position, ip_network in enumerate(ip_networks):
+        ip_network = ip_network.strip()
+        if not ip_network:
             continue
         try:
-            network = ipaddress.ip_network(ip_network.strip(), strict=False)
-            networks.append((network, ip_network.strip()))
+            network = ipaddress.ip_network(ip_network, strict=False)
         except ValueError:
+            errors.append(f"Invalid IP network format: {ip_network}")
+            continue
+        intervals.append(network_interval(network) + ((position, ip_network),))
+        
+        vpn_conflict = next((subnet for vpn_network, subnet in vpn_networks if network.overlaps(vpn_network)), None)
+        if vpn_conflict:
+            errors.append(f"IP network {ip_network} overlaps with VPN subnet {vpn_conflict}. User-defined IPs must be outside the VPN subnet.")
             continue
+        
+        conflict = next((entry for entry in index.overlapping(network, exclude_peer_id=peer_id) if entry.kind != 'pool'), None)
+        if conflict:
+            errors.append(_overlap_error(ip_network, conflict))
     
-    # Check for self-overlaps
-    for i, (net1, ip1) in enumerate(networks):
-        for j, (net2, ip2) in enumerate(networks):
-            if i >= j:
-                continue
-            if net1.overlaps(net2):
-                errors.append(f"IP networks {ip1} and {ip2} overlap with each other")
+    # Check for overlaps within the same peer's IPs (sort-and-sweep instead of all pairs)
+    for (_, ip1), (_, ip2) in sorted(tuple(sorted(pair)) for pair in find_overlapping_pairs(intervals)):
+        errors.append(f"IP networks {ip1} and {ip2} overlap with each other")
     
     return len(errors) == 0, errors
 
 def get_all_used_networks():
     """Get all currently used IP networks in the system"""
-    from app.models import Peer, AllowedIP
-    
-    used_networks = []
-    vpn_subnet = os.getenv("VPN_SUBNET", "10.0.0.0/24")
+    used_networks = [ipaddress.ip_network(subnet, strict=False) for subnet in get_pool_networks()]
     
-    # Add VPN subnet
-    try:
-        used_networks.append(ipaddress.ip_network(vpn_subnet))
-    except ValueError:
-        pass
-    
-    # Add all peer assigned IPs
-    peers = Peer.query.all()
-    for peer in peers:
-        if peer.assigned_ip:
-            try:
-                used_networks.append(ipaddress.ip_network(f"{peer.assigned_ip}/32"))
-            except ValueError:
-                continue
-        
-        # Add allowed IP ranges
-        for allowed_ip in peer.allowed_ip_ranges:
-            try:
-                used_networks.append(ipaddress.ip_network(allowed_ip.ip_network))
-            except ValueError:
-                continue
+    # Add all peer assigned IPs and allowed IP ranges
+    for _, _, items in get_network_index().get().families.values():
+        for _, _, entry in items:
+            if entry.kind != 'pool':
+                used_networks.append(ipaddress.ip_network(entry.network, strict=False))
     
     return used_networks
 
 
+def _network_matches(family, start_key, end_key, exclude_peer_id=None):
+    """
+    Assigned addresses and allowed ranges intersecting [start_key, end_key]
+    One UNION ALL statement; each branch is served by the key indexes.
+    """
+    assigned_key = Peer.assigned_ip_key if family == 4 else Peer.assigned_ipv6_key
+    assigned_column = Peer.assigned_ip if family == 4 else Peer.assigned_ipv6
+    assigned = db.select(
+        Peer.id.label('peer_id'), Peer.name.label('peer_name'),
+        db.literal('assigned').label('kind'), assigned_column.label('network')
+    ).where(assigned_key >= start_key, assigned_key <= end_key)
+    allowed = db.select(
+        Peer.id.label('peer_id'), Peer.name.label('peer_name'),
+        db.literal('allowed').label('kind'), AllowedIP.ip_network.label('network')
+    ).join(Peer, AllowedIP.peer_id == Peer.id).where(
+        AllowedIP.family == family, AllowedIP.range_start <= end_key, AllowedIP.range_end >= start_key
+    )
+    if exclude_peer_id is not None:
+        assigned = assigned.where(Peer.id != exclude_peer_id)
+        allowed = allowed.where(Peer.id != exclude_peer_id)
+
+    matches = [dict(row._mapping) for row in db.session.execute(db.union_all(assigned, allowed))]
+    # Exact assignments first, then the most specific range
+    matches.sort(key=lambda match: (match['kind'] != 'assigned', -ipaddress.ip_network(match['network'], strict=False).prefixlen))
+    return matches
+
+def find_address_owners(address):
+    """Peers owning an address, via its assigned address or an allowed range containing it"""
+    ip = ipaddress.ip_address(address)
+    key = address_key(int(ip))
+    return _network_matches(ip.version, key, key)
+
+def find_overlapping_networks(network, exclude_peer_id=None):
+    """Assigned addresses and allowed ranges overlapping a network, answered in SQL"""
+    family, start_key, end_key = network_keys(network)
+    return _network_matches(family, start_key, end_key, exclude_peer_id)
+
 def validate_peer_data(data, peer_id=None):
     """
     Validate peer data for creation or update
@@ -316,18 +402,19 @@ def is_valid_ip_network(network):
     except ValueError:
         return False
 
-def generate_iptables_rules(peer_id=None, vpn_interface='wg0'):
-    """Generate iptables rules for a specific peer or all peers using new iptables manager"""
+def preview_firewall_rules(peer_id=None, vpn_interface='wg0', backend=None):
+    """Dry run of the selected backend: rules plus compile time and optimizer report where available"""
     try:
-        manager = get_iptables_manager(vpn_interface)
-        result = manager.apply_peer_rules(peer_id, dry_run=True)
-        
-        if result["status"] == "success":
-            return result["rules"]
-        else:
-            return [f"# Error generating rules: {result['message']}"]
+        return get_iptables_manager(vpn_interface, backend).apply_peer_rules(peer_id, dry_run=True)
     except Exception as e:
-        return [f"# Error: {str(e)}"]
+        return {"status": "error", "message": str(e)}
+
+def generate_iptables_rules(peer_id=None, vpn_interface='wg0', backend=None):
+    """Generate firewall rules for a specific peer or all peers (dry run of the selected backend)"""
+    result = preview_firewall_rules(peer_id, vpn_interface, backend)
+    if result["status"] == "success":
+        return result["rules"]
+    return [f"# Error generating rules: {result['message']}"]
 
 # Legacy function kept for backward compatibility but now uses new iptables manager
 def convert_firewall_rule_to_iptables(rule, peer_ip, vpn_interface='wg0'):
@@ -335,14 +422,14 @@ def convert_firewall_rule_to_iptables(rule, peer_ip, vpn_interface='wg0'):
     try:
         manager = get_iptables_manager(vpn_interface)
         if hasattr(manager, '_convert_firewall_rule_to_iptables_preview'):
-            return manager._convert_firewall_rule_to_iptables_preview(rule, peer_ip)
+            return manager._convert_firewall_rule_to_iptables_preview(planned_rule(rule), peer_ip)
         else:
             # Fallback to basic implementation
             cmd_parts = ["iptables", "-A", "FORWARD"]
             cmd_parts.extend(["-s", f"{peer_ip}/32"])
             action = "ACCEPT" if rule.action.value == "ALLOW" else "DROP"
             cmd_parts.extend(["-j", action])
-            cmd_parts.extend(["-m", "comment", "--comment", f"Rule:{rule.name}"])
+            cmd_parts.extend(["-m", "comment", "--comment", rule_label(planned_rule(rule))])
             return " ".join(cmd_parts)
     except Exception as e:
         return f"# Error converting rule: {str(e)}"
@@ -356,6 +443,26 @@ def apply_iptables_rules(peer_id=None, dry_run=False):
     except Exception as e:
         return {"status": "error", "message": f"Error applying iptables rules: {str(e)}"}
 
+def apply_firewall_changes(peer_ids=None):
+    """
+    Targeted firewall apply after a commit that changed these peers' rules or
+    addresses; only their chains (and the dispatch chain if needed) are rewritten.
+    Returns None when firewall management is disabled.
+    """
+    if os.getenv("ENABLE_FIREWALL_MANAGEMENT", "false").lower() != 'true':
+        return None
+    try:
+        manager = get_iptables_manager(os.getenv("VPN_INTERFACE", "wg0"))
+        if hasattr(manager, 'reconcile'):
+            result = manager.reconcile(peer_ids)
+        else:
+            result = manager.apply_peer_rules()
+    except Exception as e:
+        result = {"status": "error", "message": f"Error applying firewall changes: {str(e)}"}
+    if result["status"] != "success":
+        print(f"⚠️ Firewall apply failed: {result['message']}")
+    return result
+
 def get_current_iptables_rules():
     """Get current iptables rules using new iptables manager"""
     try:
@@ -385,8 +492,6 @@ def backup_iptables_rules():
 
 def restore_iptables_rules(backup_file):
     """Restore iptables rules from backup"""
-    import subprocess
-    
     try:
         if not os.path.exists(backup_file):
             return {"status": "error", "message": f"Backup file {backup_file} not found"}
@@ -394,11 +499,7 @@ def restore_iptables_rules(backup_file):
         with open(backup_file, 'r') as f:
             backup_content = f.read()
         
-        result = subprocess.run(
-            ["iptables-restore"], 
-            input=backup_content, text=True, 
-            capture_output=True, check=True
-        )
+        result = run_privileged("iptables_restore", rules=backup_content)
         
         if result.returncode == 0:
             return {"status": "success", "message": f"Rules restored from {backup_file}"}
@@ -407,6 +508,22 @@ def restore_iptables_rules(backup_file):
     except Exception as e:
         return {"status": "error", "message": f"Error restoring rules: {str(e)}"}
 
+def get_client_allowed_ips(peer):
+    """
+    Client-side AllowedIPs for a peer
+    Full tunnel by default; with a route profile everything except the excluded
+    ranges is routed, while the VPN subnet always stays inside the tunnel
+    """
+    profile = peer.route_profile
+    if not profile:
+        return "0.0.0.0/0, ::/0" if peer.assigned_ipv6 else "0.0.0.0/0"
+
+    families = (4, 6) if profile.include_ipv6 else (4,)
+    routes = exclude_networks(profile.excluded_networks_list, include=get_pool_networks(), families=families)
+    if 6 not in families and peer.assigned_ipv6:
+        routes += get_pool_networks(6)  # the IPv6 VPN prefix stays reachable without a v6 default route
+    return ", ".join(routes)
+
 def generate_peer_config_text(peer_id):
     """Generate WireGuard configuration text for a peer"""
     from app.models import Peer
@@ -419,10 +536,12 @@ def generate_peer_config_text(peer_id):
     server_public_ip = os.getenv("SERVER_PUBLIC_IP", "127.0.0.1")  # Public IP for client endpoint
     listen_port = os.getenv("LISTEN_PORT")
     
-    # Build the address line with assigned IP and additional allowed IPs
+    # Build the address line with assigned IPs and additional allowed IPs
     address_parts = []
     if peer.assigned_ip:
         address_parts.append(f"{peer.assigned_ip}/32")
+    if peer.assigned_ipv6:
+        address_parts.append(f"{peer.assigned_ipv6}/128")
     
     # Add additional allowed IP ranges if any
     if peer.allowed_ip_ranges:
@@ -439,7 +558,7 @@ Address = {address_line}
 PublicKey = {server_public_key}
 PresharedKey = {peer.preshared_key}
 Endpoint = {server_public_ip}:{listen_port}
-AllowedIPs = 0.0.0.0/0
+AllowedIPs = {get_client_allowed_ips(peer)}
 PersistentKeepalive = {peer.persistent_keepalive or 25}"""
     
     return config
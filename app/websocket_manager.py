@@ -3,6 +3,7 @@
 WebSocket Manager for Real-time WireGuard Status Updates
 """
 
+import os
 import threading
 import time
 import json
@@ -13,6 +14,7 @@ import eventlet
 from app import socketio, db
 from app import app
 from app.models import Peer
+from app.firewall_counters import collect_firewall_counters
 from app.wireguard_status import get_wireguard_status, format_bytes, format_time_ago, format_duration
 
 
@@ -23,6 +25,7 @@ class WebSocketManager:
         self.connected_clients = set()
         self.peer_traffic_history = {}  # Store last 20 data points per peer
         self.last_peer_status = {}  # Store last status for change detection
+        self.last_counters_at = 0.0  # monotonic time of the last firewall_counters emit
         
     def start(self):
         """Start the WebSocket manager and background status updates"""
@@ -52,6 +55,7 @@ class WebSocketManager:
             try:
                 if self.connected_clients:
                     self._emit_status_update()
+                    self._emit_firewall_counters()
                 eventlet.sleep(0.5)  # Update every 500ms for real-time responsiveness
             except Exception as e:
                 print(f"❌ Error in status update loop: {e}")
@@ -173,6 +177,23 @@ class WebSocketManager:
         except Exception as e:
             print(f"❌ Error emitting status update: {e}")
     
+    def _emit_firewall_counters(self):
+        """Emit rule and per-peer firewall counters every FIREWALL_COUNTERS_INTERVAL seconds"""
+        interval = float(os.getenv("FIREWALL_COUNTERS_INTERVAL", "10"))
+        if interval <= 0 or os.getenv("ENABLE_FIREWALL_MANAGEMENT", "false").lower() != 'true':
+            return
+        now = time.monotonic()
+        if now - self.last_counters_at < interval:
+            return
+        self.last_counters_at = now
+
+        with app.app_context():
+            counters = collect_firewall_counters()
+        if counters['status'] == 'success':
+            socketio.emit('firewall_counters', counters)
+        else:
+            print(f"❌ {counters['message']}")
+
     def _has_status_changed(self, current_status):
         """Check if peer status has changed since last update"""
         if not self.last_peer_status:
@@ -242,11 +263,17 @@ class WebSocketManager:
             peer_id = data.get('peer_id')
             action = data.get('action')  # 'activate' or 'deactivate'
             
+            # Group actions: one commit, one reload and one consolidated event
+            if any(data.get(key) for key in ('peer_ids', 'name_pattern', 'tag')):
+                from app.bulk import bulk_peer_action
+                with app.app_context():
+                    return bulk_peer_action(action, ids=data.get('peer_ids'),
+                                            name_pattern=data.get('name_pattern'), tag=data.get('tag'))
+            
             if not peer_id or not action:
                 return {'status': 'error', 'message': 'Missing peer_id or action'}
                 
-            from app import db, socketio
-            with db.app.app_context():
+            with app.app_context():
                 peer = Peer.query.get(peer_id)
                 if not peer:
                     return {'status': 'error', 'message': 'Peer not found'}
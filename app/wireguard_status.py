@@ -10,6 +10,8 @@ import os
 from datetime import datetime, timezone
 from typing import Dict, List, Optional
 
+from app.privileged_helper import run_privileged, run_privileged_batch
+
 # Configuration - Following Go wireguard-ui reference: 3-minute handshake rule
 HANDSHAKE_TIMEOUT = int(os.getenv('WG_HANDSHAKE_TIMEOUT', '180'))  # 3 minutes = 180 seconds
 PING_TIMEOUT = float(os.getenv('WG_PING_TIMEOUT', '0.5'))  # seconds  
@@ -65,15 +67,7 @@ def check_peer_connectivity(peer_ip: str, timeout: float = 0.5) -> bool:
         True if peer responds to ping, False otherwise
     """
     try:
-        # Use ping with short timeout for quick response
-        result = subprocess.run(
-            ['ping', '-c', '1', '-W', str(int(timeout * 1000)), peer_ip],
-            capture_output=True,
-            timeout=timeout + 0.5  # Slightly longer timeout for the process
-        )
-        return result.returncode == 0
-    except (subprocess.TimeoutExpired, subprocess.CalledProcessError, FileNotFoundError):
-        return False
+        return run_privileged('ping', address=peer_ip, timeout=timeout).ok
     except Exception:
         return False
 
@@ -88,10 +82,7 @@ def get_conntrack_connections(interface_port: int = 51820) -> Dict[str, Dict]:
     
     try:
         # Get UDP connections on WireGuard port
-        result = subprocess.run(
-            ['conntrack', '-L', '-p', 'udp', '--dport', str(interface_port)],
-            capture_output=True, text=True, timeout=3
-        )
+        result = run_privileged('conntrack_list', dport=interface_port)
         
         if result.returncode == 0:
             print(f"📊 Conntrack query successful, parsing {len(result.stdout.strip().split(chr(10)))} entries...")
@@ -148,11 +139,11 @@ def get_conntrack_connections(interface_port: int = 51820) -> Dict[str, Dict]:
                     except (ValueError, IndexError) as e:
                         print(f"  ⚠️ Error parsing conntrack line: {e}")
                         continue
+        elif result.error in ('not_found', 'timeout'):
+            print(f"❌ Conntrack not available or timeout: {result.stderr}")
         else:
             print(f"⚠️ Conntrack query failed: {result.stderr}")
             
-    except (subprocess.TimeoutExpired, FileNotFoundError) as e:
-        print(f"❌ Conntrack not available or timeout: {e}")
     except Exception as e:
         print(f"❌ Unexpected error with conntrack: {e}")
     
@@ -176,7 +167,16 @@ def enhance_connectivity_detection(peer_data: Dict[str, Dict], interface: str =
     if ENABLE_CONNTRACK:
         conntrack_connections = get_conntrack_connections()
     
-    # Optional Method 2: Enhanced ping testing
+    # Optional Method 2: Enhanced ping testing - one parallel batch instead of a ping per peer
+    ping_results = {}
+    if ENABLE_PING_CHECK:
+        targets = [peer.get('client_ip') for peer in peer_data.values()
+                   if peer.get('endpoint') and peer.get('client_ip')]
+        targets = list(dict.fromkeys(targets))
+        results = run_privileged_batch([('ping', {'address': ip, 'timeout': PING_TIMEOUT}) for ip in targets],
+                                       parallel=True)
+        ping_results = {ip: result.ok for ip, result in zip(targets, results)}
+    
     for public_key, peer in peer_data.items():
         if not peer.get('endpoint'):
             continue
@@ -197,7 +197,7 @@ def enhance_connectivity_detection(peer_data: Dict[str, Dict], interface: str =
         
         # Add ping data if enabled (only for debugging, not used in primary logic)
         if ENABLE_PING_CHECK and client_ip:
-            external_reachable = check_peer_connectivity(client_ip, PING_TIMEOUT)
+            external_reachable = ping_results.get(client_ip, False)
             peer['external_ping'] = external_reachable
             print(f"  🏓 {public_key[:20]}... ping test: {'✅ Reachable' if external_reachable else '❌ Unreachable'}")
         else:
@@ -455,30 +455,23 @@ def get_wireguard_status(interface: str = 'wg0') -> Dict[str, Dict]:
     Returns peer connection information from 'wg show' + additional checks
     """
     try:
-        print(f"🔍 Executing: wg show {interface} latest-handshakes", flush=True)
-        # Use 'latest-handshakes' for more precise timing info
-        result = subprocess.run(
-            ['wg', 'show', interface, 'latest-handshakes'],
-            capture_output=True,
-            text=True,
-            check=True
-        )
+        print(f"🔍 Executing: wg show {interface} latest-handshakes + wg show {interface}", flush=True)
+        # Use 'latest-handshakes' for more precise timing info; both queries share one helper round trip
+        handshakes_result, result = run_privileged_batch([
+            ('wg_show', {'interface': interface, 'field': 'latest-handshakes'}),
+            ('wg_show', {'interface': interface}),
+        ])
+        if handshakes_result.error == 'not_found' or result.error == 'not_found':
+            raise FileNotFoundError('wg')
+        result.check_returncode()
         
-        if result.returncode == 0 and result.stdout.strip():
+        if handshakes_result.returncode == 0 and handshakes_result.stdout.strip():
             # Parse latest-handshakes output first
-            handshake_data = parse_latest_handshakes(result.stdout)
+            handshake_data = parse_latest_handshakes(handshakes_result.stdout)
             print(f"📋 Latest handshakes: {handshake_data}")
         else:
             handshake_data = {}
         
-        # Now get full status
-        print(f"🔍 Executing: wg show {interface}", flush=True)
-        result = subprocess.run(
-            ['wg', 'show', interface],
-            capture_output=True,
-            text=True,
-            check=True
-        )
         print(f"✅ WireGuard command successful, output length: {len(result.stdout)} chars")
         if result.stdout.strip():
             print(f"📋 WireGuard output preview:\n{result.stdout[:200]}{'...' if len(result.stdout) > 200 else ''}")
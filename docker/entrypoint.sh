@@ -12,6 +12,9 @@ export VPN_SERVER_IP=${VPN_SERVER_IP:-10.0.0.1}
 export SERVER_PUBLIC_IP=${SERVER_PUBLIC_IP:-127.0.0.1}
 export LISTEN_PORT=${LISTEN_PORT:-51820}
 export VPN_SUBNET=${VPN_SUBNET:-10.0.0.0/24}
+export VPN_SUBNET_V6=${VPN_SUBNET_V6:-}
+export VPN_SERVER_IPV6=${VPN_SERVER_IPV6:-}
+export IPV6_FORWARD_POLICY=${IPV6_FORWARD_POLICY:-drop}
 
 # Generate WireGuard keys if not provided
 if [ -z "$SERVER_PRIVATE_KEY" ] || [ -z "$SERVER_PUBLIC_KEY" ]; then
@@ -42,6 +45,8 @@ VPN_SERVER_IP=$VPN_SERVER_IP
 SERVER_PUBLIC_IP=$SERVER_PUBLIC_IP
 LISTEN_PORT=$LISTEN_PORT
 VPN_SUBNET=$VPN_SUBNET
+VPN_SUBNET_V6=$VPN_SUBNET_V6
+VPN_SERVER_IPV6=$VPN_SERVER_IPV6
 FLASK_ENV=production
 FLASK_DEBUG=false
 EOF
@@ -93,6 +98,10 @@ else
     echo "Warning: wg0.conf not found"
 fi
 
+# The web app runs as wgadmin: give it the database, logs, backups and its wg0.conf
+mkdir -p /app/instance
+chown -R wgadmin:wgadmin /app/instance /app/logs /app/backups /app/wg0.conf
+
 # Enable IP forwarding
 echo "Enabling IP forwarding..."
 echo 'net.ipv4.ip_forward = 1' > /etc/sysctl.d/99-wireguard.conf
@@ -105,6 +114,24 @@ iptables -A INPUT -p udp --dport $LISTEN_PORT -j ACCEPT
 iptables -A FORWARD -i wg0 -j ACCEPT
 iptables -A FORWARD -o wg0 -j ACCEPT
 
+# Dual-stack: forward and masquerade the IPv6 VPN prefix as well
+if [ -n "$VPN_SUBNET_V6" ]; then
+    echo "Enabling IPv6 forwarding for $VPN_SUBNET_V6..."
+    echo 'net.ipv6.conf.all.forwarding = 1' >> /etc/sysctl.d/99-wireguard.conf
+    echo 1 > /proc/sys/net/ipv6/conf/all/forwarding || echo "Warning: could not enable IPv6 forwarding"
+    ip6tables -t nat -A POSTROUTING -s $VPN_SUBNET_V6 ! -d $VPN_SUBNET_V6 -j MASQUERADE || echo "Warning: ip6tables NAT not available"
+    # Peer firewall rules are compiled for IPv4 only: new IPv6 connections
+    # through the tunnel are dropped unless IPV6_FORWARD_POLICY=accept
+    ip6tables -A FORWARD -i wg0 -m conntrack --ctstate ESTABLISHED,RELATED -j ACCEPT || true
+    ip6tables -A FORWARD -o wg0 -m conntrack --ctstate ESTABLISHED,RELATED -j ACCEPT || true
+    if [ "$IPV6_FORWARD_POLICY" = "accept" ]; then
+        echo "Warning: IPv6 from peers is forwarded without applying their firewall rules"
+        ip6tables -A FORWARD -i wg0 -j ACCEPT || true
+    fi
+    ip6tables -A FORWARD -i wg0 -j DROP || echo "Warning: could not drop IPv6 forwarding for wg0"
+    ip6tables -A FORWARD -o wg0 -j DROP || echo "Warning: could not drop IPv6 forwarding for wg0"
+fi
+
 # Start WireGuard interface
 echo "Starting WireGuard interface..."
 if ! wg-quick up wg0 2>/dev/null; then
@@ -1,11 +1,11 @@
 import os
-import subprocess
 from flask_sqlalchemy import SQLAlchemy
 from dotenv import load_dotenv
 import os
 
 from app import app, db
 from app.models import Peer
+from app.keygen import generate_keypair
 
 # Load environment variables
 load_dotenv()
@@ -19,9 +19,7 @@ def setup_database(app):
 
 # WireGuard key generation
 def generate_keys():
-    private_key = subprocess.check_output("wg genkey", shell=True).decode().strip()
-    public_key = subprocess.check_output(f"echo {private_key} | wg pubkey", shell=True).decode().strip()
-    return private_key, public_key
+    return generate_keypair()
 
 # Initial setup
 def setup_wireguard():
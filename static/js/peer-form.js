@@ -284,12 +284,20 @@ function refreshIP() {
     ipInput.value = 'Loading...';
     if (refreshBtn) refreshBtn.classList.add('fa-spin');
     
-    // Fetch next available IP
-    fetch('/api/v1/next-ip')
+    // Fetch next available IP from the selected pools
+    const params = new URLSearchParams();
+    const pool = document.getElementById('address_pool');
+    const poolV6 = document.getElementById('address_pool_v6');
+    if (pool) params.set('pool', pool.value);
+    if (poolV6) params.set('pool_v6', poolV6.value);
+
+    fetch(`/api/v1/next-ip?${params}`)
         .then(response => response.json())
         .then(data => {
             if (data.status === 'success') {
                 ipInput.value = data.ip;
+                const ipv6Input = document.getElementById('assigned_ipv6');
+                if (ipv6Input) ipv6Input.value = data.ipv6 || '';
             } else {
                 ipInput.value = 'Error loading IP';
                 console.error('Error:', data.message);
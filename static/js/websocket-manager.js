@@ -82,6 +82,13 @@ class WebSocketManager {
         this.socket.on('peer_action_response', (data) => {
             console.log('Peer action response:', data);
         });
+
+        this.socket.on('config_apply_result', (data) => {
+            console.log(`⚙️ Config revision ${(data.revision || '').slice(0, 12)} applied via ${data.method} in ${data.apply_ms}ms`);
+            if (data.status !== 'success') {
+                this.showToast(`WireGuard apply failed: ${data.message}`, 'danger');
+            }
+        });
     }
 
     scheduleReconnect() {
@@ -404,27 +411,16 @@ class WebSocketManager {
     }
 
     handlePeerActionResult(data) {
+        if (data.peer_ids) {
+            this.handleBulkPeerActionResult(data);
+            return;
+        }
+
         const peerId = data.peer_id;
         
         if (data.status === 'success') {
             // Update the toggle switch if it exists
-            const toggle = document.getElementById(`peer-toggle-${peerId}`);
-            if (toggle) {
-                toggle.checked = data.is_active;
-                toggle.disabled = false;
-                
-                const label = document.querySelector(`label[for="peer-toggle-${peerId}"] span`);
-                if (label) {
-                    if (data.is_active) {
-                        label.textContent = 'Active';
-                        label.className = 'text-success fw-bold';
-                    } else {
-                        label.textContent = 'Inactive';
-                        label.className = 'text-warning fw-bold';
-                    }
-                }
-            }
-            
+            this.updatePeerToggle(peerId, data.is_active);
             this.showToast(data.message, 'success');
         } else {
             // Revert toggle on error
@@ -438,6 +434,38 @@ class WebSocketManager {
         }
     }
 
+    handleBulkPeerActionResult(data) {
+        // One consolidated event for a whole group of peers
+        if (data.action === 'delete') {
+            if (data.changed > 0) {
+                window.location.reload();
+            }
+            return;
+        }
+        data.changed_peer_ids.forEach(peerId => this.updatePeerToggle(peerId, data.is_active));
+        this.showToast(data.message, 'success');
+    }
+
+    updatePeerToggle(peerId, isActive) {
+        const toggle = document.getElementById(`peer-toggle-${peerId}`);
+        if (!toggle) {
+            return;
+        }
+        toggle.checked = isActive;
+        toggle.disabled = false;
+        
+        const label = document.querySelector(`label[for="peer-toggle-${peerId}"] span`);
+        if (label) {
+            if (isActive) {
+                label.textContent = 'Active';
+                label.className = 'text-success fw-bold';
+            } else {
+                label.textContent = 'Inactive';
+                label.className = 'text-warning fw-bold';
+            }
+        }
+    }
+
     showConnectionStatus(status) {
         // Update all connection dots to show WebSocket status
         document.querySelectorAll('.connection-dot').forEach(dot => {
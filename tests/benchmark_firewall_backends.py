@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Firewall backends at scale: compile time, rule count and apply/check time
+for iptables-restore (with and without ipsets) and nftables, plus the
+offline policy evaluator's build and query time
+Usage: python tests/benchmark_firewall_backends.py [peers]
+"""
+
+import os
+import random
+import shutil
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+os.environ['TESTING'] = 'True'
+
+from app import app, db
+from app.firewall_compiler import (compile_nftables, compile_restore, count_nft_rules, count_rules,
+                                   load_firewall_plan)
+from app.firewall_evaluator import FirewallEvaluator
+from app.models import FirewallRule, Peer, Protocol, RuleAction, RuleType
+
+# A handful of shared policies plus a bespoke rule on every tenth peer
+TEMPLATES = [
+    [("http", RuleType.INTERNET, RuleAction.ALLOW, Protocol.TCP, "80", None),
+     ("https", RuleType.INTERNET, RuleAction.ALLOW, Protocol.TCP, "443", None)],
+    [("dns", RuleType.INTERNET, RuleAction.ALLOW, Protocol.UDP, "53", None),
+     ("lan", RuleType.CUSTOM, RuleAction.DENY, Protocol.ANY, None, "192.168.0.0/16")],
+    [("ssh", RuleType.PEER_COMM, RuleAction.ALLOW, Protocol.TCP, "22", None)],
+    [],
+]
+
+
+def populate(count):
+    peers = [Peer(name=f"bench-{i}", public_key=f"{i:042d}A=",
+                  assigned_ip=f"10.{(i + 2) // 65536 % 256}.{(i + 2) // 256 % 256}.{(i + 2) % 256}")
+             for i in range(count)]
+    db.session.add_all(peers)
+    db.session.flush()
+    rules = []
+    for i, peer in enumerate(peers):
+        for name, rule_type, action, protocol, ports, destination in TEMPLATES[i % len(TEMPLATES)]:
+            rules.append(FirewallRule(peer_id=peer.id, name=name, rule_type=rule_type, action=action,
+                                      protocol=protocol, port_range=ports, destination=destination))
+        if i % 10 == 0:
+            rules.append(FirewallRule(peer_id=peer.id, name=f"custom-{i}", rule_type=RuleType.CUSTOM,
+                                      action=RuleAction.ALLOW, destination=f"172.16.{i % 256}.0/24"))
+    db.session.add_all(rules)
+    db.session.commit()
+
+
+def timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - started
+
+
+def check(command, text):
+    result, elapsed = timed(lambda: subprocess.run(command, input=text, capture_output=True, text=True))
+    if result.returncode != 0:
+        return f"failed ({result.stderr.strip().splitlines()[-1] if result.stderr.strip() else result.returncode})"
+    return f"{elapsed * 1000:,.0f} ms"
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    with app.app_context():
+        db.create_all()
+        populate(count)
+
+        plan, load_time = timed(lambda: load_firewall_plan(optimize=True))
+        report = plan.optimization
+        print(f"{count} peers, {report.rules_in} rules ({report.rules_out} after optimizing in "
+              f"{report.duration_ms:,.0f} ms), plan loaded in {load_time * 1000:,.0f} ms")
+
+        backends = [
+            ("iptables-restore", lambda: compile_restore(plan), count_rules,
+             ["iptables-restore", "--test", "--noflush"]),
+            ("iptables-restore + ipset", lambda: compile_restore(plan, use_ipsets=True), count_rules, None),
+            ("nftables", lambda: compile_nftables(plan, use_sets=False), count_nft_rules, ["nft", "-c", "-f", "-"]),
+            ("nftables + sets", lambda: compile_nftables(plan), count_nft_rules, ["nft", "-c", "-f", "-"]),
+        ]
+        for label, compile_fn, counter, command in backends:
+            text, elapsed = timed(compile_fn)
+            print(f"  {label:<26} compile {elapsed * 1000:>8,.0f} ms  {counter(text):>8,} rules  "
+                  f"{len(text) / 1024:>8,.0f} KiB")
+            if command is None:
+                print(f"  {'':<26} check needs the ipsets installed, skipping")
+            elif shutil.which(command[0]):
+                print(f"  {'':<26} check {check(command, text)}")
+            else:
+                print(f"  {'':<26} `{command[0]}` not found, skipping the check")
+
+        evaluator, elapsed = timed(lambda: FirewallEvaluator(load_firewall_plan(optimize=False)))
+        print(f"  {'evaluator':<26} build   {elapsed * 1000:>8,.0f} ms  {evaluator.policies:>8,} rule lists")
+        rng = random.Random(1)
+        addresses = [peer.address for peer in plan.peers] + ["1.1.1.1", "192.168.3.4", "172.16.10.1"]
+        queries = [(rng.choice(addresses), rng.choice(addresses), rng.choice(["tcp", "udp"]),
+                    rng.choice([22, 53, 80, 443])) for _ in range(20000)]
+        _, elapsed = timed(lambda: [evaluator.evaluate(*query) for query in queries])
+        print(f"  {'':<26} query   {elapsed / len(queries) * 1e6:>8,.1f} us")
+
+
+if __name__ == "__main__":
+    main()
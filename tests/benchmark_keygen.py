@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Key generation throughput: in-process keygen vs. the `wg` subprocess path
+Usage: python tests/benchmark_keygen.py [count]
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.keygen import CRYPTOGRAPHY_AVAILABLE, KeyPool, generate_keypair, generate_preshared_key
+
+
+def subprocess_keypair():
+    private_key = subprocess.check_output("wg genkey", shell=True).decode().strip()
+    public_key = subprocess.check_output(f"echo {private_key} | wg pubkey", shell=True).decode().strip()
+    return private_key, public_key
+
+
+def subprocess_psk():
+    return subprocess.check_output("wg genpsk", shell=True).decode().strip()
+
+
+def measure(label, fn, count):
+    started = time.perf_counter()
+    for _ in range(count):
+        fn()
+    elapsed = time.perf_counter() - started
+    print(f"  {label:<32} {count / elapsed:>12,.0f} keys/s  ({elapsed / count * 1000:.3f} ms/key)")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    print(f"Backend: {'cryptography' if CRYPTOGRAPHY_AVAILABLE else 'pure Python X25519'}, {count} iterations")
+
+    measure("keypair (in-process)", generate_keypair, count)
+    measure("preshared key (in-process)", generate_preshared_key, count)
+
+    pool = KeyPool(size=count)
+    pool.fill()
+    measure("keypair (pre-filled pool)", pool.get_keypair, count)
+
+    if shutil.which("wg"):
+        subprocess_count = min(count, 200)
+        measure("keypair (wg genkey | wg pubkey)", subprocess_keypair, subprocess_count)
+        measure("preshared key (wg genpsk)", subprocess_psk, subprocess_count)
+    else:
+        print("  `wg` not found, skipping the subprocess baseline")
+
+
+if __name__ == "__main__":
+    main()
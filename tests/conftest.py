@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Shared test configuration for the VPN management application
+"""
+
+import atexit
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+# Use an in-memory database and testing mode before the app is imported
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+os.environ['TESTING'] = 'True'
+
+# Generated WireGuard configs go to a scratch directory, never the checkout or /etc/wireguard
+WG_CONFIG_DIR = tempfile.mkdtemp(prefix='wireguard-admin-tests-')
+atexit.register(shutil.rmtree, WG_CONFIG_DIR, ignore_errors=True)
+os.environ['WG_CONFIG_PATH'] = os.path.join(WG_CONFIG_DIR, 'wg0.conf')
+os.environ['WG_SYSTEM_CONFIG'] = os.path.join(WG_CONFIG_DIR, 'system', 'wg0.conf')
+
+
+# Mock iptables if not available
+class MockIptc:
+    class Rule:
+        pass
+    class Chain:
+        pass
+    class Table:
+        pass
+
+if 'iptc' not in sys.modules:
+    sys.modules['iptc'] = MockIptc()
+
+from app import app, db
+from app.ip_allocator import get_ip_allocator
+from app.network_index import get_network_index
+from app.peer_search import get_peer_search_index
+from app.firewall_evaluator import policy_evaluator
+from app.firewall_counters import policy_rule_ids, reset_counter_collectors
+from app.http_cache import bump_revision
+from app import privileged_helper
+
+FAKE_IPTABLES = os.path.join(os.path.dirname(__file__), 'fake_iptables.py')
+
+
+@pytest.fixture
+def client():
+    """Create test client with a fresh schema"""
+    app.config['TESTING'] = True
+
+    with app.test_client() as client:
+        with app.app_context():
+            db.drop_all()  # the startup migrations may have seeded the in-memory database
+            db.create_all()
+            get_ip_allocator().invalidate()
+            get_network_index().invalidate()
+            get_peer_search_index().invalidate()
+            policy_evaluator.invalidate()
+            policy_rule_ids.invalidate()
+            reset_counter_collectors()
+            bump_revision()
+            yield client
+            db.session.remove()
+            db.drop_all()
+
+
+@pytest.fixture
+def fake_iptables(tmp_path, monkeypatch):
+    """Point the helper at the stand-in binaries; returns a reader for the resulting chains"""
+    for name in ('iptables-save', 'iptables-restore', 'ipset'):
+        os.symlink(FAKE_IPTABLES, tmp_path / name)
+    state = tmp_path / 'filter.json'
+    monkeypatch.setenv('FAKE_IPTABLES_STATE', str(state))
+    monkeypatch.setenv('FIREWALL_IPSET', 'false')
+    monkeypatch.setattr(privileged_helper, 'IPSET_BIN', str(tmp_path / 'ipset'))
+    monkeypatch.setattr(privileged_helper, 'IPTABLES_SAVE_BIN', str(tmp_path / 'iptables-save'))
+    monkeypatch.setattr(privileged_helper, 'IPTABLES_RESTORE_BIN', str(tmp_path / 'iptables-restore'))
+
+    def chains(initial=None):
+        if initial is not None:
+            state.write_text(json.dumps(initial))
+        return json.loads(state.read_text())
+    chains.log = tmp_path / 'filter.json.log'
+    chains.sets = lambda: json.loads((tmp_path / 'filter.json.sets').read_text())
+    chains.traffic = tmp_path / 'filter.json.traffic'
+    return chains
@@ -6,7 +6,6 @@ This script populates all tables with test data for development and testing
 
 import os
 import sys
-import subprocess
 from datetime import datetime, timezone, timedelta
 import random
 
@@ -14,6 +13,7 @@ import random
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 from app import app, db
+from app.keygen import generate_preshared_key, get_keypair
 from app.models import (
     Peer, AllowedIP, FirewallRule, FirewallTemplate, FirewallTemplateRule,
     AuditLog, PeerStatistics, Migration,
@@ -21,18 +21,9 @@ from app.models import (
 )
 
 def generate_wg_key():
-    """Generate a WireGuard key pair"""
-    try:
-        private_key = subprocess.check_output("wg genkey", shell=True).decode().strip()
-        public_key = subprocess.check_output(f"echo {private_key} | wg pubkey", shell=True).decode().strip()
-        preshared_key = subprocess.check_output("wg genpsk", shell=True).decode().strip()
-        return private_key, public_key, preshared_key
-    except:
-        # Fallback if wg command is not available
-        import base64
-        import secrets
-        key = base64.b64encode(secrets.token_bytes(32)).decode()
-        return key, key, key
+    """Generate a WireGuard key pair and preshared key"""
+    private_key, public_key = get_keypair()
+    return private_key, public_key, generate_preshared_key()
 
 def create_dummy_data():
     """Create comprehensive dummy data for all tables"""
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Stand-in for iptables-save / iptables-restore (filter table only) and
+ipset save / restore
+Dispatches on the name it is invoked as and keeps the ruleset in the JSON
+file named by FAKE_IPTABLES_STATE (ipsets in FAKE_IPTABLES_STATE + '.sets'). A restore is applied to a copy and only
+written back after COMMIT, so a rejected line leaves the state untouched
+like the kernel's atomic table replace. Every restore input is appended to
+FAKE_IPTABLES_STATE + '.log'.
+
+Counters (`iptables-save -c`, members of sets created with `counters`) are
+read from FAKE_IPTABLES_STATE + '.traffic': {"rules": {"<chain> <rule>":
+[packets, bytes]}, "sets": {"<set>": {"<member>": [packets, bytes]}}};
+anything not listed counts zero.
+
+Point the privileged helper at it with IPTABLES_SAVE_BIN / IPTABLES_RESTORE_BIN
+/ IPSET_BIN (symlinks named iptables-save, iptables-restore and ipset).
+"""
+
+import json
+import os
+import shlex
+import sys
+
+BUILTIN = ('INPUT', 'FORWARD', 'OUTPUT')
+
+
+def load(path):
+    if not os.path.exists(path):
+        return {chain: [] for chain in BUILTIN}
+    with open(path) as f:
+        return json.load(f)
+
+
+def load_traffic(state):
+    return load_json(state + '.traffic', {"rules": {}, "sets": {}})
+
+
+def save(chains, counters=None):
+    lines = ['*filter']
+    lines += [f":{chain} {'ACCEPT' if chain in BUILTIN else '-'} [0:0]" for chain in chains]
+    for chain, rules in chains.items():
+        for rule in rules:
+            if counters is None:
+                lines.append(f"-A {chain} {rule}")
+            else:
+                packets, bytes_ = counters.get(f"{chain} {rule}", (0, 0))
+                lines.append(f"[{packets}:{bytes_}] -A {chain} {rule}")
+    lines.append('COMMIT')
+    print('\n'.join(lines))
+
+
+def restore(chains, text, noflush, sets):
+    chains = {chain: list(rules) for chain, rules in chains.items()}
+    if not noflush:
+        chains = {chain: [] for chain in BUILTIN}
+    committed = False
+    for number, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line or line.startswith('#') or line == '*filter':
+            continue
+        if line == 'COMMIT':
+            committed = True
+            continue
+        if line.startswith(':'):
+            chains[line[1:].split()[0]] = []  # declaring an existing chain flushes it
+            continue
+        tokens = shlex.split(line)
+        command, chain = tokens[0], tokens[1]
+        if chain not in chains:
+            raise ValueError(f"line {number}: chain {chain} does not exist")
+        if command == '-F':
+            chains[chain] = []
+        elif command == '-X':
+            if chains[chain] or any(rule.endswith(f"-j {chain}") for rules in chains.values() for rule in rules):
+                raise ValueError(f"line {number}: chain {chain} is not empty or still referenced")
+            del chains[chain]
+            continue
+        elif command == '-A':
+            chains[chain].append(line.split(' ', 2)[2])
+        elif command == '-I':
+            position = int(tokens[2]) - 1
+            chains[chain].insert(position, line.split(' ', 3)[3])
+        elif command == '-D':
+            spec = line.split(' ', 2)[2]
+            if spec not in chains[chain]:
+                raise ValueError(f"line {number}: rule to delete not found")
+            chains[chain].remove(spec)
+        else:
+            raise ValueError(f"line {number}: unsupported command {command}")
+        if '--match-set' in tokens and tokens[tokens.index('--match-set') + 1] not in sets:
+            raise ValueError(f"line {number}: set {tokens[tokens.index('--match-set') + 1]} does not exist")
+        if tokens[-2] == '-j' and tokens[-1] not in ('ACCEPT', 'DROP', 'RETURN') and tokens[-1] not in chains:
+            raise ValueError(f"line {number}: unknown target {tokens[-1]}")
+    if not committed:
+        raise ValueError("missing COMMIT")
+    return chains
+
+
+def ipset_restore(sets, chains, text, counted):
+    sets = {name: set(members) for name, members in sets.items()}
+    for number, line in enumerate(text.splitlines(), 1):
+        parts = line.split()
+        if not parts:
+            continue
+        command, name = parts[0], parts[1]
+        if command == 'create':
+            sets.setdefault(name, set())
+            if 'counters' in parts:
+                counted.add(name)
+            continue
+        if name not in sets:
+            raise ValueError(f"line {number}: set {name} does not exist")
+        if command == 'add':
+            sets[name].add(parts[2])
+        elif command == 'del':
+            sets[name].discard(parts[2])
+        elif command == 'destroy':
+            if any(f"--match-set {name} " in rule for rules in chains.values() for rule in rules):
+                raise ValueError(f"line {number}: set {name} is in use by a kernel component")
+            del sets[name]
+            counted.discard(name)
+        else:
+            raise ValueError(f"line {number}: unsupported command {command}")
+    return {name: sorted(members) for name, members in sets.items()}
+
+
+def ipset_main(state, chains):
+    sets = load_sets(state)
+    counted = set(load_json(state + '.counted', []))
+    if sys.argv[1] == 'save':
+        traffic = load_traffic(state)["sets"]
+        for name, members in sets.items():
+            print(f"create {name} hash:ip family inet hashsize 1024 maxelem 65536" + (" counters" if name in counted else ""))
+            for member in members:
+                if name in counted:
+                    packets, bytes_ = traffic.get(name, {}).get(member, (0, 0))
+                    print(f"add {name} {member} packets {packets} bytes {bytes_}")
+                else:
+                    print(f"add {name} {member}")
+        return 0
+    try:
+        sets = ipset_restore(sets, chains, sys.stdin.read(), counted)
+    except (ValueError, IndexError) as e:
+        print(f"ipset v7.15: {e}", file=sys.stderr)
+        return 1
+    with open(state + '.sets', 'w') as f:
+        json.dump(sets, f)
+    with open(state + '.counted', 'w') as f:
+        json.dump(sorted(counted), f)
+    return 0
+
+
+def load_json(path, default):
+    if not os.path.exists(path):
+        return default
+    with open(path) as f:
+        return json.load(f)
+
+
+def load_sets(state):
+    return load_json(state + '.sets', {})
+
+
+def main():
+    state = os.environ['FAKE_IPTABLES_STATE']
+    chains = load(state)
+    if os.path.basename(sys.argv[0]) == 'ipset':
+        return ipset_main(state, chains)
+    if os.path.basename(sys.argv[0]) == 'iptables-save':
+        save(chains, load_traffic(state)["rules"] if '-c' in sys.argv else None)
+        return 0
+
+    text = sys.stdin.read()
+    with open(state + '.log', 'a') as f:
+        f.write(text)
+    try:
+        chains = restore(chains, text, '--noflush' in sys.argv, load_sets(state))
+    except (ValueError, IndexError) as e:
+        print(f"iptables-restore: {e}", file=sys.stderr)
+        return 1
+    if '--test' not in sys.argv:
+        with open(state, 'w') as f:
+            json.dump(chains, f)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
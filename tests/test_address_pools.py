@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Tests for named address pools and dual-stack peers
+"""
+
+from app import db
+from app.ip_allocator import SparseSubnet
+from app.models import AddressPool, Peer
+from app.utils import allocate_peer_addresses, generate_peer_config_text, get_peer_allowed_networks
+
+
+def test_sparse_allocator_on_a_64():
+    """IPv6 /64 pools hand out addresses from the bottom without iterating the prefix"""
+    pool = SparseSubnet("fd42:42::/64")
+    assert pool.next_free() == "fd42:42::2"
+    pool.reserve("fd42:42::2")
+    pool.reserve("fd42:42::3")
+    assert pool.next_free() == "fd42:42::4"
+    pool.release("fd42:42::2")
+    assert pool.next_free() == "fd42:42::2"
+    assert not pool.release("fd42:42::1")  # server address
+
+
+def test_dual_stack_allocation_and_configs(client):
+    """Peers get one address per family and both appear in server and client configs"""
+    db.session.add(AddressPool(name="v4", network="10.0.0.0/24", is_default=True))
+    db.session.add(AddressPool(name="v4-lab", network="10.9.0.0/24"))
+    db.session.add(AddressPool(name="v6", network="fd42:42::/64", is_default=True))
+    db.session.commit()
+
+    ipv4, ipv6 = allocate_peer_addresses()
+    assert (ipv4, ipv6) == ("10.0.0.2", "fd42:42::2")
+    assert allocate_peer_addresses(pool="v4-lab")[0] == "10.9.0.2"
+
+    peer = Peer(name="phone", public_key="P" * 43 + "=", assigned_ip=ipv4, assigned_ipv6=ipv6)
+    db.session.add(peer)
+    db.session.commit()
+    assert allocate_peer_addresses() == ("10.0.0.3", "fd42:42::3")
+
+    assert get_peer_allowed_networks(peer) == ["10.0.0.2/32", "fd42:42::2/128"]
+    config = generate_peer_config_text(peer.id)
+    assert "Address = 10.0.0.2/32, fd42:42::2/128" in config
+    assert "AllowedIPs = 0.0.0.0/0, ::/0" in config
+
+    response = client.get('/api/v1/next-ip?pool=v6')
+    assert response.status_code == 400
+
+
+def test_create_pool_rejects_overlap(client):
+    response = client.post('/api/v1/address-pools', json={'name': 'a', 'network': 'fd00:1::/64'})
+    assert response.status_code == 201
+    assert response.get_json()['data']['family'] == 6
+    response = client.post('/api/v1/address-pools', json={'name': 'b', 'network': 'fd00:1::/80'})
+    assert response.status_code == 400
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Tests for bulk peer provisioning
+"""
+
+from unittest import mock
+
+from app import app, db, socketio
+from app.iptables_manager import RestoreIptablesManager
+from app.keygen import public_key_from_private
+from app.models import AddressPool, AllowedIP, Peer
+
+
+def _key(letter):
+    return letter * 42 + "A="
+
+
+def test_atomic_batch_creates_everything_with_one_reload(client):
+    db.session.add(Peer(name="existing", public_key=_key("E"), assigned_ip="10.0.0.2"))
+    db.session.commit()
+
+    with mock.patch('app.bulk.generate_wg0_conf') as reload:
+        response = client.post('/api/v1/peers/bulk', json={'peers': [
+            {'name': 'laptop-1', 'public_key': _key("A"), 'allowed_ips': ['192.168.10.0/24']},
+            {'name': 'laptop-2', 'allowed_ips': '192.168.11.0/24; 192.168.12.0/24'},
+            {'name': 'laptop-3', 'public_key': _key("C"), 'persistent_keepalive': 0},
+        ]})
+    assert response.status_code == 201
+    assert reload.call_count == 1
+
+    results = response.get_json()['results']
+    assert [row['assigned_ip'] for row in results] == ["10.0.0.3", "10.0.0.4", "10.0.0.5"]
+    assert public_key_from_private(results[1]['private_key']) == results[1]['public_key']
+    assert 'private_key' not in results[0]
+    assert AllowedIP.query.count() == 3
+    assert Peer.query.filter_by(name='laptop-3').one().persistent_keepalive == 0
+
+
+def test_atomic_batch_rejects_all_on_any_error(client):
+    db.session.add(Peer(name="existing", public_key=_key("E"), assigned_ip="10.0.0.2"))
+    db.session.commit()
+
+    response = client.post('/api/v1/peers/bulk', json={'peers': [
+        {'name': 'ok', 'public_key': _key("A"), 'allowed_ips': ['192.168.10.0/24']},
+        {'name': 'existing', 'public_key': _key("B")},
+        {'name': 'dup-key', 'public_key': _key("A")},
+        {'name': 'overlap', 'allowed_ips': ['192.168.10.128/25']},
+        {'name': 'in-vpn', 'allowed_ips': ['10.0.0.0/28']},
+    ]})
+    assert response.status_code == 400
+    results = response.get_json()['results']
+    assert [row['status'] for row in results] == ['skipped', 'error', 'error', 'error', 'error']
+    assert "already exists" in results[1]['errors'][0]
+    assert "row 0" in results[2]['errors'][0] and "row 0" in results[3]['errors'][0]
+    assert "VPN subnet" in results[4]['errors'][0]
+    assert Peer.query.count() == 1
+
+    # Nothing stays reserved in the allocator
+    response = client.post('/api/v1/peers/bulk', json=[{'name': 'next', 'public_key': _key("N")}])
+    assert response.get_json()['results'][0]['assigned_ip'] == "10.0.0.3"
+
+
+def test_best_effort_csv(client):
+    csv_body = (
+        "name,public_key,allowed_ips,persistent_keepalive\n"
+        f"csv-1,{_key('A')},172.16.1.0/24;172.16.2.0/24,25\n"
+        "bad name,,,\n"
+        f"csv-2,{_key('B')},,not-a-number\n"
+        "csv-3,,,\n"
+    )
+    response = client.post('/api/v1/peers/bulk?mode=best_effort', data=csv_body, content_type='text/csv')
+    assert response.status_code == 207
+    body = response.get_json()
+    assert body['summary'] == {'requested': 4, 'created': 2, 'failed': 2}
+    assert [row['status'] for row in body['results']] == ['created', 'error', 'error', 'created']
+    assert sorted(peer.name for peer in Peer.query.all()) == ['csv-1', 'csv-3']
+    assert Peer.query.filter_by(name='csv-3').one().assigned_ip == "10.0.0.3"
+
+
+def test_exhausted_pool_fails_only_the_rows_that_do_not_fit(client):
+    db.session.add_all([AddressPool(name="v4", network="10.0.0.0/24", is_default=True),
+                        AddressPool(name="tiny", network="10.9.0.0/30")])
+    db.session.commit()
+    rows = [{'name': f'lab-{i}', 'public_key': _key(letter), 'address_pool': 'tiny'} for i, letter in enumerate("AEI")]
+    rows.append({'name': 'office', 'public_key': _key("M")})
+
+    response = client.post('/api/v1/peers/bulk', json={'peers': rows})
+    assert response.status_code == 400 and "No available IP addresses" in response.get_json()['message']
+    assert Peer.query.count() == 0
+
+    response = client.post('/api/v1/peers/bulk?mode=best_effort', json={'peers': rows})
+    results = response.get_json()['results']
+    assert response.status_code == 207
+    assert [row['status'] for row in results] == ['created', 'error', 'error', 'created']
+    assert results[0]['assigned_ip'] == "10.9.0.2" and results[3]['assigned_ip'] == "10.0.0.2"
+    assert results[1]['errors'] == ["No available IP addresses in subnet 10.9.0.0/30"]
+
+
+def test_bulk_lifecycle_actions(client):
+    response = client.post('/api/v1/peers/bulk', json=[
+        {'name': 'sales-1', 'public_key': _key("A"), 'tags': ['sales'], 'allowed_ips': ['192.168.20.0/24']},
+        {'name': 'sales-2', 'public_key': _key("E"), 'tags': 'sales;emea'},
+        {'name': 'ops_1', 'public_key': _key("I"), 'tags': ['ops']},
+        {'name': 'opsx1', 'public_key': _key("M")},
+    ])
+    assert response.status_code == 201
+
+    with mock.patch('app.bulk.generate_wg0_conf') as reload, mock.patch('app.bulk.socketio.emit') as emit:
+        result = client.post('/api/v1/peers/bulk/deactivate', json={'tag': 'sales'}).get_json()
+        assert (result['matched'], result['changed']) == (2, 2)
+        assert reload.call_count == 1 and emit.call_count == 1
+        assert emit.call_args[0][0] == 'peer_action_result'
+
+        # Already inactive peers are matched but not changed; tag and pattern combine
+        result = client.post('/api/v1/peers/bulk/deactivate', json={'tag': 'emea', 'name_pattern': 'sales-*'}).get_json()
+        assert (result['matched'], result['changed']) == (1, 0)
+        assert reload.call_count == 1
+
+    assert [peer.is_active for peer in Peer.query.order_by(Peer.id)] == [False, False, True, True]
+
+    # '_' in a pattern is literal, '?' is the single-character wildcard
+    assert client.post('/api/v1/peers/bulk/delete', json={'name_pattern': 'ops_?'}).get_json()['matched'] == 1
+
+    sales_ids = [peer.id for peer in Peer.query.filter(Peer.name.like('sales-%'))]
+    result = client.post('/api/v1/peers/bulk/delete', json={'ids': sales_ids}).get_json()
+    assert result['changed'] == 2
+    assert [peer.name for peer in Peer.query.all()] == ['opsx1']
+    assert AllowedIP.query.count() == 0
+
+    assert client.post('/api/v1/peers/bulk/delete', json={}).status_code == 400
+    assert client.post('/api/v1/peers/bulk/restart', json={'ids': [1]}).status_code == 400
+
+
+def test_group_action_over_websocket(client):
+    client.post('/api/v1/peers/bulk', json=[
+        {'name': f'kiosk-{i}', 'public_key': _key(letter), 'tags': ['kiosk']} for i, letter in enumerate("AEI")])
+    socket = socketio.test_client(app, flask_test_client=client)
+    socket.get_received()
+
+    with mock.patch('app.bulk.generate_wg0_conf') as reload:
+        socket.emit('peer_action', {'action': 'deactivate', 'tag': 'kiosk'})
+        responses = [event['args'][0] for event in socket.get_received() if event['name'] == 'peer_action_response']
+    assert responses[0]['status'] == 'success' and (responses[0]['matched'], responses[0]['changed']) == (3, 3)
+    assert reload.call_count == 1
+    db.session.expire_all()
+    assert not any(peer.is_active for peer in Peer.query)
+    socket.disconnect()
+
+
+def test_bulk_actions_remove_firewall_chains(client, fake_iptables, monkeypatch):
+    monkeypatch.setenv('ENABLE_FIREWALL_MANAGEMENT', 'true')
+    client.post('/api/v1/peers/bulk', json=[
+        {'name': f'desk-{i}', 'public_key': _key(letter)} for i, letter in enumerate("AEI")])
+    ids = [peer.id for peer in Peer.query.order_by(Peer.id)]
+    RestoreIptablesManager('wg0').apply_peer_rules()
+    assert {f'WGP-{peer_id}' for peer_id in ids} <= set(fake_iptables())
+
+    with mock.patch('app.bulk.socketio.emit') as emit:
+        result = client.post('/api/v1/peers/bulk/delete', json={'ids': ids[:1]}).get_json()
+    assert result['firewall']['status'] == 'success' and emit.call_args[0][1]['firewall'] == result['firewall']
+    result = client.post('/api/v1/peers/bulk/deactivate', json={'ids': ids[1:2]}).get_json()
+    assert result['firewall']['removed_chains'] == [f'WGP-{ids[1]}']
+
+    chains = fake_iptables()
+    assert f'WGP-{ids[0]}' not in chains and f'WGP-{ids[1]}' not in chains and f'WGP-{ids[2]}' in chains
+    assert not any('10.0.0.2/' in line or '10.0.0.3/' in line for line in chains['WIREGUARD_FORWARD'])
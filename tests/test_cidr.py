@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Tests for CIDR aggregation and overlap detection
+"""
+
+import ipaddress
+
+from app.cidr import (
+    aggregate_networks, aggregate_peer_networks, exclude_networks, find_overlapping_pairs, network_interval
+)
+
+
+def test_aggregate_adjacent_and_contained():
+    """Adjacent /28s collapse and contained ranges disappear"""
+    networks = [f"192.168.1.{i * 16}/28" for i in range(16)] + ["192.168.1.64/26", "10.0.0.2/32"]
+    assert [str(n) for n in aggregate_networks(networks)] == ["10.0.0.2/32", "192.168.1.0/24"]
+
+
+def test_aggregate_keeps_families_separate():
+    """IPv4 and IPv6 networks are collapsed independently"""
+    result = aggregate_networks(["fd00::/65", "fd00:0:0:0:8000::/65", "10.1.0.0/17", "10.1.128.0/17"])
+    assert [str(n) for n in result] == ["10.1.0.0/16", "fd00::/64"]
+
+
+def test_find_overlapping_pairs():
+    """Only intervals that actually overlap are reported"""
+    intervals = [
+        network_interval("10.0.0.0/24") + ("a",),
+        network_interval("10.0.0.128/25") + ("b",),
+        network_interval("10.0.1.0/24") + ("c",),
+        network_interval("fd00::/64") + ("d",),
+    ]
+    assert find_overlapping_pairs(intervals) == [("a", "b")]
+
+
+def test_aggregate_peer_networks_report():
+    """Report counts saved entries and flags ranges crossing peers"""
+    aggregated, report = aggregate_peer_networks({
+        1: ["10.0.0.2/32", "192.168.0.0/25", "192.168.0.128/25"],
+        2: ["10.0.0.3/32", "192.168.0.64/26"],
+    })
+    assert aggregated[1] == ["10.0.0.2/32", "192.168.0.0/24"]
+    assert report['entries_before'] == 5
+    assert report['entries_after'] == 4
+    assert report['entries_saved'] == 1
+    assert len(report['conflicts']) == 1
+    assert {report['conflicts'][0]['peer_a'], report['conflicts'][0]['peer_b']} == {1, 2}
+
+
+def test_exclude_networks_rfc1918():
+    """Split tunnel keeps the VPN subnet and routes nothing inside the excluded LANs"""
+    routes = exclude_networks(["10.0.0.0/8", "172.16.0.0/12", "192.168.0.0/16"],
+                              include=["10.0.0.0/24"], families=[4])
+    networks = [ipaddress.ip_network(route) for route in routes]
+
+    assert ipaddress.ip_network("10.0.0.0/24") in networks
+    assert not any(n.overlaps(ipaddress.ip_network("192.168.0.0/16")) for n in networks)
+    assert sum(n.num_addresses for n in networks) == 2 ** 32 - 2 ** 24 - 2 ** 20 - 2 ** 16 + 2 ** 8
+    assert len(routes) == len(aggregate_networks(routes))
+
+
+def test_exclude_networks_ipv6_and_memoized():
+    """IPv6 complement is minimal and repeated profiles hit the cache"""
+    first = exclude_networks(["fc00::/7"], families=[6])
+    second = exclude_networks(["fc00::/7"], families=[6])
+    assert first == ["::/1", "8000::/2", "c000::/3", "e000::/4", "f000::/5", "f800::/6", "fe00::/7"]
+    assert first == second
+    assert exclude_networks([], families=[4, 6]) == ["0.0.0.0/0", "::/0"]
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Tests for the WireGuard configuration reconciler
+"""
+
+from types import SimpleNamespace
+
+import pytest
+
+from app import config_watcher
+from app.config_watcher import AdaptiveDebouncer, Reconciler, load_state, watch
+
+
+def test_debounce_adapts_to_bursts():
+    """Bursts widen the quiet period, single writes shrink it again"""
+    debouncer = AdaptiveDebouncer(minimum=0.1, maximum=2.0, max_delay=5.0)
+    for t in (0.0, 0.05, 0.1):
+        debouncer.event(now=t)
+    assert debouncer.timeout(now=0.1) == pytest.approx(0.1)
+    assert debouncer.settle() == 0.0
+    assert debouncer.window == 0.2
+
+    debouncer.event(now=10.0)
+    debouncer.settle()
+    assert debouncer.window == 0.1
+
+
+def test_debounce_bounded_by_max_delay():
+    """A writer that never stops cannot postpone the apply forever"""
+    debouncer = AdaptiveDebouncer(minimum=1.0, maximum=1.0, max_delay=2.0)
+    for t in (0.0, 0.9, 1.8):
+        debouncer.event(now=t)
+    assert debouncer.timeout(now=1.8) == pytest.approx(0.2)
+
+
+def test_steady_writes_still_apply_after_max_delay(monkeypatch):
+    """The watch loop enforces max_delay even when every wakeup brings a new event"""
+    clock = SimpleNamespace(now=0.0)
+    monkeypatch.setattr(config_watcher, "time", SimpleNamespace(monotonic=lambda: clock.now))
+
+    class Writer:
+        def wait(self, timeout):
+            clock.now += 0.1  # a write every 100ms, well inside the quiet period
+            return True
+
+    applied = []
+    reconciler = SimpleNamespace(unsent=[], reconcile=lambda first_event: applied.append((first_event, clock.now)))
+    watch(Writer(), AdaptiveDebouncer(minimum=0.5, maximum=2.0, max_delay=2.0), reconciler,
+          running=lambda: clock.now < 5.0)
+    assert [round(at, 1) for _, at in applied] == [2.1, 4.2]
+    assert applied[0][0] == pytest.approx(0.1)
+
+
+def test_reconcile_skips_applied_revision(tmp_path, monkeypatch):
+    """Unchanged revisions are not re-applied and results are persisted"""
+    config = tmp_path / "wg0.conf"
+    config.write_text("[Interface]\nListenPort = 51820\n")
+    monkeypatch.setattr(config_watcher, "CONFIG_PATH", str(config))
+
+    applied = []
+    reconciler = Reconciler(apply=lambda: applied.append(1) or ("syncconf", None),
+                            notify_url="http://127.0.0.1:9/unreachable",
+                            state_file=str(tmp_path / "state.json"))
+
+    result = reconciler.reconcile()
+    assert result['status'] == 'success'
+    assert reconciler.reconcile() is None
+    assert len(applied) == 1
+    assert reconciler.unsent  # kept for delivery once the app is reachable
+
+    config.write_text("[Interface]\nListenPort = 51821\n")
+    assert reconciler.reconcile()['revision'] != result['revision']
+    assert load_state(str(tmp_path / "state.json"))['applied_revision'] == config_watcher.config_revision(str(config))
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Tests for the fleet-wide address conflict scanner
+"""
+
+import time
+
+from app import app, db
+from app.cidr import network_interval
+from app.conflict_scanner import scan_conflicts
+from app.models import AllowedIP, Peer
+from app.network_index import IndexedNetwork
+
+
+def test_classifies_conflicts(client):
+    """Rows written behind validation's back show up; in-pool peer addresses do not"""
+    alpha = Peer(name="alpha", public_key="A" * 43 + "=", assigned_ip="10.0.0.2")
+    bravo = Peer(name="bravo", public_key="B" * 43 + "=", assigned_ip="10.0.0.3")
+    db.session.add_all([alpha, bravo])
+    db.session.flush()
+    db.session.add_all([
+        AllowedIP(peer_id=alpha.id, ip_network="192.168.0.0/16"),
+        AllowedIP(peer_id=alpha.id, ip_network="192.168.4.0/24"),
+        AllowedIP(peer_id=bravo.id, ip_network="192.168.8.0/24"),
+        AllowedIP(peer_id=bravo.id, ip_network="10.0.0.2/32"),
+    ])
+    db.session.commit()
+
+    report = client.get('/api/v1/network/conflicts').get_json()['data']
+    assert report['summary'] == {
+        'redundant_allowed_range': 1,
+        'allowed_range_overlap': 1,
+        'allowed_range_in_pool': 1,
+        'address_routed_to_other_peer': 1,
+    }
+    assert (report['errors'], report['warnings']) == (3, 1)
+
+    errors = client.get('/api/v1/network/conflicts?severity=error').get_json()['data']['conflicts']
+    assert len(errors) == 3
+
+    result = app.test_cli_runner().invoke(args=['scan-conflicts'])
+    assert result.exit_code == 1
+    assert "address_routed_to_other_peer" in result.output
+
+
+def test_scales_to_100k_networks():
+    intervals = []
+    for i in range(100000):
+        network = f"10.{i // 65536}.{(i // 256) % 256}.{i % 256}/32"
+        intervals.append(network_interval(network) + (IndexedNetwork('assigned', network, i, f"peer{i}"),))
+    duplicate = "10.0.0.7/32"
+    intervals.append(network_interval(duplicate) + (IndexedNetwork('assigned', duplicate, -1, "dup"),))
+
+    started = time.perf_counter()
+    report = scan_conflicts(intervals)
+    assert time.perf_counter() - started < 5
+    assert report['summary'] == {'duplicate_address': 1}
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Tests for firewall packet/byte counters
+"""
+
+import json
+
+from app import db
+from app.firewall_compiler import compile_nftables, load_firewall_plan
+from app.firewall_counters import CounterCollector, parse_nft_counters
+from app.iptables_manager import RestoreIptablesManager
+from app.models import FirewallRule, Peer, Protocol, RuleAction, RuleType
+
+
+def _peers():
+    kiosks = [Peer(name=f"kiosk-{i}", public_key=f"{i:042d}A=", assigned_ip=f"10.0.0.{i + 10}") for i in range(3)]
+    web = Peer(name="web", public_key="W" * 42 + "A=", assigned_ip="10.0.0.2")
+    db.session.add_all(kiosks + [web])
+    db.session.flush()
+    for kiosk in kiosks:
+        db.session.add(FirewallRule(peer_id=kiosk.id, name="https", rule_type=RuleType.INTERNET,
+                                    action=RuleAction.ALLOW, protocol=Protocol.TCP, port_range="443"))
+    db.session.add_all([
+        FirewallRule(peer_id=web.id, name="http", rule_type=RuleType.INTERNET, action=RuleAction.ALLOW,
+                     protocol=Protocol.TCP, port_range="80", priority=10),
+        FirewallRule(peer_id=web.id, name="https", rule_type=RuleType.INTERNET, action=RuleAction.ALLOW,
+                     protocol=Protocol.TCP, port_range="443", priority=20),
+    ])
+    db.session.commit()
+    return kiosks, web
+
+
+def test_counters_map_to_rule_ids_and_peers(client, fake_iptables, monkeypatch):
+    monkeypatch.setenv('FIREWALL_IPSET', 'true')
+    kiosks, web = _peers()
+    assert RestoreIptablesManager('wg0').reconcile()['status'] == 'success'
+
+    def traffic(scale):
+        rules = {}
+        for chain, lines in fake_iptables().items():
+            for line in lines:
+                if '"Rule:' in line or '"Policy:' in line or 'Default-Drop' in line:
+                    rules[f"{chain} {line}"] = [3 * scale, 300 * scale]
+        sets = {'wgx-acct-tx': {'10.0.0.2': [10 * scale, 1000 * scale]},
+                'wgx-acct-rx': {'10.0.0.2': [20 * scale, 2000 * scale]}}
+        fake_iptables.traffic.write_text(json.dumps({"rules": rules, "sets": sets}))
+
+    traffic(1)
+    data = client.get('/api/v1/firewall/counters').get_json()
+    assert data['status'] == 'success' and data['accounting'] and data['interval_s'] is None
+
+    http, https = (FirewallRule.query.filter_by(peer_id=web.id, name=name).one().id for name in ('http', 'https'))
+    merged = data['rules'][str(http)]
+    assert merged == data['rules'][str(https)] and merged['rule_ids'] == [http, https]
+    assert (merged['packets'], merged['bytes'], merged['shared']) == (3, 300, False)
+
+    kiosk_rules = [FirewallRule.query.filter_by(peer_id=kiosk.id).one().id for kiosk in kiosks]
+    shared = data['rules'][str(kiosk_rules[0])]
+    assert shared['shared'] and shared['rule_ids'] == kiosk_rules and shared['packets'] == 3
+    assert all(entry['verdict'] == 'DROP' and entry['packets'] == 6 for entry in data['defaults'])
+    assert data['peers'][str(web.id)]['tx_bytes'] == 1000 and data['peers'][str(web.id)]['rx_packets'] == 20
+
+    # A chain rewrite resets the kernel counters: totals keep growing
+    traffic(2)
+    client.get('/api/v1/firewall/counters')
+    traffic(1)
+    data = client.get(f'/api/v1/firewall/counters?peer_id={web.id}').get_json()
+    assert data['rules'][str(http)]['packets'] == 6 + 3
+    assert list(data['peers']) == [str(web.id)] and data['peers'][str(web.id)]['tx_bytes'] == 3000
+    assert data['rules'][str(http)]['packets_per_s'] is not None
+    assert client.get('/api/v1/firewall/counters?backend=pf').status_code == 400
+
+
+def test_nft_listing_counters(client):
+    kiosks, web = _peers()
+    text = compile_nftables(load_firewall_plan(), accounting=True)
+    assert f'counter tx_{web.id} {{ packets 0 bytes 0 }}' in text
+    assert f'10.0.0.2 : "rx_{web.id}"' in text and 'counter name ip saddr map @peer_tx' in text
+
+    listing = "\n".join([
+        "table ip wireguard_admin {",
+        f"\tcounter tx_{web.id} {{",
+        "\t\tpackets 12 bytes 3400",
+        "\t}",
+        "\tchain peer_4 {",
+        '\t\tip saddr 10.0.0.2 tcp dport { 80, 443 } oifname != "wg0" counter packets 5 bytes 600 accept '
+        'comment "Rule:4,5:http+https"',
+        '\t\tip saddr 10.0.0.2 counter packets 1 bytes 60 drop comment "Default-Drop:web"',
+        "\t}",
+        "\tchain policy_abc {",
+        '\t\tip saddr @policy_abc tcp dport 443 counter packets 7 bytes 700 accept comment "Policy:0:https"',
+        "\t}",
+        "}",
+    ])
+    counters, info = parse_nft_counters(listing)
+    assert counters[('peer', web.id, 'tx')] == [12, 3400]
+    assert counters[('rule', 4)] == [5, 600] and info[('rule', 4)]['rule_ids'] == [4, 5]
+    assert counters[('policy', 'policy_abc', 0)] == [7, 700] and info[('policy', 'policy_abc', 0)]['shared']
+    assert counters[('default', 'peer_4', 'web')] == [1, 60]
+
+
+def test_collector_rates_and_resets():
+    collector = CounterCollector()
+    info = {('rule', 1): {"rule_ids": [1]}}
+    first = collector.record({('rule', 1): [100, 1000]}, info, now=10.0)
+    assert first['rules']['1']['packets_per_s'] is None
+    second = collector.record({('rule', 1): [150, 1500]}, info, now=20.0)
+    assert second['rules']['1']['packets_per_s'] == 5.0 and second['interval_s'] == 10.0
+    third = collector.record({('rule', 1): [20, 200]}, info, now=30.0)  # counters were reset
+    assert (third['rules']['1']['packets'], third['rules']['1']['bytes']) == (170, 1700)
+    assert third['rules']['1']['bytes_per_s'] == 20.0
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Tests for the offline firewall policy evaluator
+"""
+
+import ipaddress
+import random
+import shlex
+
+from app import db
+from app.firewall_compiler import compile_restore, load_firewall_plan
+from app.firewall_evaluator import FirewallEvaluator, get_policy_evaluator
+from app.models import FirewallRule, Peer, Protocol, RuleAction, RuleType
+
+
+def _peers():
+    web = Peer(name="web", public_key="W" * 42 + "A=", assigned_ip="10.0.0.2")
+    laptop = Peer(name="laptop", public_key="L" * 42 + "A=", assigned_ip="10.0.0.3")
+    db.session.add_all([web, laptop])
+    db.session.flush()
+    db.session.add_all([
+        FirewallRule(peer_id=web.id, name="ssh-lan", rule_type=RuleType.CUSTOM, action=RuleAction.DENY,
+                     destination="192.168.1.0/24", protocol=Protocol.TCP, port_range="20-22", priority=10),
+        FirewallRule(peer_id=web.id, name="lan", rule_type=RuleType.CUSTOM, action=RuleAction.ALLOW,
+                     destination="192.168.0.0/16", priority=20),
+        FirewallRule(peer_id=web.id, name="https", rule_type=RuleType.INTERNET, action=RuleAction.ALLOW,
+                     protocol=Protocol.TCP, port_range="80,443", priority=30),
+        FirewallRule(peer_id=web.id, name="monitoring", rule_type=RuleType.CUSTOM, action=RuleAction.ALLOW,
+                     source="172.16.0.0/12", protocol=Protocol.ICMP, priority=40),
+        FirewallRule(peer_id=web.id, name="guest-lan", rule_type=RuleType.INTERNET, action=RuleAction.DENY,
+                     source="192.168.50.0/24", priority=50),
+    ])
+    db.session.commit()
+    return web, laptop
+
+
+def test_verdicts_name_the_deciding_rule(client):
+    web, laptop = _peers()
+    evaluator = get_policy_evaluator()
+
+    def check(src, dst, protocol, port, verdict, rule=None, reason='rule'):
+        result = evaluator.evaluate(src, dst, protocol, port)
+        assert (result['verdict'], result['rule'] and result['rule']['name'], result['reason']) == \
+            (verdict, rule, reason), (src, dst, protocol, port)
+        return result
+
+    check('10.0.0.2', '192.168.1.5', 'tcp', 22, 'DROP', 'ssh-lan')
+    check('10.0.0.2', '192.168.1.5', 'tcp', 23, 'ACCEPT', 'lan')
+    check('10.0.0.2', '192.168.7.1', 'udp', None, 'ACCEPT', 'lan')
+    check('10.0.0.2', '1.1.1.1', 'tcp', 443, 'ACCEPT', 'https')
+    check('10.0.0.2', '1.1.1.1', 'tcp', 8080, 'DROP', reason='default_drop')
+    check('10.0.0.2', '10.0.0.3', 'tcp', 443, 'DROP', reason='default_drop')  # not internet: stays on wg0
+    check('10.0.0.3', '10.0.0.2', 'tcp', 22, 'ACCEPT', reason='default_allow')  # laptop has no rules
+
+    # Towards web from outside: web's rules decide (monitoring is inbound on wg0 only), then its default
+    result = check('172.16.4.4', '10.0.0.2', 'icmp', None, 'DROP', reason='default_drop')
+    assert result['direction'] == 'destination' and result['peer']['id'] == web.id
+
+    # Between non-peer addresses, rules with an explicit source still apply
+    result = check('192.168.50.7', '1.1.1.1', 'tcp', 443, 'DROP', 'guest-lan')
+    assert result['direction'] == 'rule_source' and result['peer']['id'] == web.id
+    assert check('8.8.8.8', '9.9.9.9', 'tcp', 80, 'ACCEPT', reason='unmanaged')['peer'] is None
+
+
+def test_rule_changes_invalidate_the_cached_evaluator(client):
+    web, _ = _peers()
+    assert get_policy_evaluator().evaluate('10.0.0.2', '1.1.1.1', 'udp', 53)['verdict'] == 'DROP'
+    db.session.add(FirewallRule(peer_id=web.id, name="dns", rule_type=RuleType.INTERNET, action=RuleAction.ALLOW,
+                                protocol=Protocol.UDP, port_range="53", priority=1))
+    db.session.commit()
+    assert get_policy_evaluator().evaluate('10.0.0.2', '1.1.1.1', 'udp', 53)['rule']['name'] == 'dns'
+
+
+def test_evaluate_endpoint_batches(client):
+    _peers()
+    response = client.post('/api/v1/firewall/evaluate', json={'queries': [
+        {'src': '10.0.0.2', 'dst': '192.168.1.9', 'protocol': 'tcp', 'port': 21},
+        {'src': '10.0.0.2', 'dst': 'nowhere'},
+        {'src': '10.0.0.2', 'dst': '1.1.1.1', 'protocol': 'sctp'},
+    ]})
+    data = response.get_json()
+    assert response.status_code == 200 and data['evaluated'] == 3
+    assert data['results'][0]['verdict'] == 'DROP' and data['results'][0]['rule']['name'] == 'ssh-lan'
+    assert 'error' in data['results'][1] and 'protocol' in data['results'][2]['error']
+
+    single = client.post('/api/v1/firewall/evaluate', json={'src': '10.0.0.3', 'dst': '1.1.1.1'}).get_json()
+    assert single['results'][0]['verdict'] == 'ACCEPT'
+    assert client.post('/api/v1/firewall/evaluate', json=[1, 2]).status_code == 400
+    assert client.post('/api/v1/firewall/evaluate', json={'queries': [{}] * 1001}).status_code == 400
+
+
+class RestoreInterpreter:
+    """Walks iptables-restore output (filter table) for one packet, first packet of a connection"""
+
+    def __init__(self, text, vpn_subnet, peers):
+        self.chains, self.sets = {}, {}
+        for line in text.splitlines():
+            if line.startswith('# ipset add '):
+                _, _, _, name, member = line.split()
+                self.sets.setdefault(name, set()).add(member)
+            elif line.startswith('-A '):
+                tokens = shlex.split(line)
+                self.chains.setdefault(tokens[1], []).append(tokens[2:])
+        self.vpn_subnet = ipaddress.ip_network(vpn_subnet)
+        self.peers = peers
+
+    def _on_vpn(self, address):
+        return address in self.peers or ipaddress.ip_address(address) in self.vpn_subnet
+
+    def _matches(self, tokens, src, dst, protocol, port):
+        interfaces = {'-i': 'wg0' if self._on_vpn(src) else 'eth0', '-o': 'wg0' if self._on_vpn(dst) else 'eth0'}
+        negate, position = False, 0
+        while position < len(tokens):
+            token = tokens[position]
+            value = tokens[position + 1] if position + 1 < len(tokens) else None
+            if token == '!':
+                negate, position = True, position + 1
+                continue
+            if token == '-s':
+                ok = ipaddress.ip_address(src) in ipaddress.ip_network(value)
+            elif token == '-d':
+                ok = ipaddress.ip_address(dst) in ipaddress.ip_network(value)
+            elif token in interfaces:
+                ok = interfaces[token] == value
+            elif token == '-p':
+                ok = protocol == value
+            elif token in ('--dport', '--dports'):
+                ok = port is not None and any(
+                    int(part.split(':')[0]) <= port <= int(part.split(':')[-1]) for part in value.split(','))
+            elif token == '--match-set':
+                ok = (src if tokens[position + 2] == 'src' else dst) in self.sets.get(value, ())
+                position += 1
+            elif token == '--ctstate':
+                ok = False  # NEW packets only
+            elif token == '-m' or token == '--comment':
+                ok = True
+            elif token == '-j':
+                return not negate
+            else:
+                raise AssertionError(f"unhandled token {token}")
+            if ok == negate:
+                return False
+            negate, position = False, position + 2
+        return False  # no target: fingerprint marker
+
+    def verdict(self, src, dst, protocol, port, chain='WIREGUARD_FORWARD'):
+        for tokens in self.chains.get(chain, []):
+            if self._matches(tokens, src, dst, protocol, port):
+                target = tokens[-1]
+                if target in ('ACCEPT', 'DROP'):
+                    return target
+                result = self.verdict(src, dst, protocol, port, target)
+                if result:
+                    return result
+        return None if chain != 'WIREGUARD_FORWARD' else 'ACCEPT'
+
+
+def test_compiled_restore_ruleset_agrees_with_evaluator(client, monkeypatch):
+    monkeypatch.setattr('app.firewall_compiler.DISPATCH_LEAF_SIZE', 4)
+    rng = random.Random(7)
+    peers = [Peer(name=f"p{i}", public_key=f"{i:042d}A=", assigned_ip=f"10.0.0.{i + 2}") for i in range(40)]
+    db.session.add_all(peers)
+    db.session.flush()
+    templates = [
+        [("web", RuleType.INTERNET, RuleAction.ALLOW, Protocol.TCP, "80", None, None),
+         ("tls", RuleType.INTERNET, RuleAction.ALLOW, Protocol.TCP, "443", None, None)],
+        [("ssh", RuleType.CUSTOM, RuleAction.DENY, Protocol.TCP, "22", "192.168.1.0/24", None),
+         ("lan0", RuleType.CUSTOM, RuleAction.ALLOW, Protocol.ANY, None, "192.168.0.0/24", None),
+         ("lan1", RuleType.CUSTOM, RuleAction.ALLOW, Protocol.ANY, None, "192.168.1.0/24", None),
+         ("lan-ssh", RuleType.CUSTOM, RuleAction.ALLOW, Protocol.TCP, "22", "192.168.1.0/24", None)],
+        [("peers", RuleType.PEER_COMM, RuleAction.ALLOW, Protocol.UDP, "53,123", None, None),
+         ("mgmt", RuleType.CUSTOM, RuleAction.DENY, Protocol.ANY, None, None, "172.16.0.0/12"),
+         ("guests", RuleType.INTERNET, RuleAction.DENY, Protocol.TCP, "80", None, "192.168.50.0/24")],
+        [("guest-dns", RuleType.INTERNET, RuleAction.ALLOW, Protocol.UDP, "53", None, "192.168.50.0/24"),
+         ("guest-web", RuleType.INTERNET, RuleAction.DENY, Protocol.ANY, None, None, "192.168.48.0/21")],
+        [],
+    ]
+    for i, peer in enumerate(peers):
+        for priority, (name, rule_type, action, protocol, ports, destination, source) in \
+                enumerate(templates[rng.randrange(len(templates))]):
+            db.session.add(FirewallRule(peer_id=peer.id, name=name, rule_type=rule_type, action=action,
+                                        protocol=protocol, port_range=ports, destination=destination,
+                                        source=source, priority=priority))
+    db.session.commit()
+
+    evaluator = get_policy_evaluator()
+    plan = load_firewall_plan()
+    addresses = {peer.assigned_ip for peer in peers}
+    for use_ipsets in (False, True):
+        interpreter = RestoreInterpreter(compile_restore(plan, use_ipsets=use_ipsets), plan.vpn_subnet, addresses)
+        candidates = sorted(addresses) + ['192.168.0.9', '192.168.1.9', '172.16.3.3', '1.1.1.1'] * 5 + \
+            ['192.168.50.9', '192.168.52.1'] * 5
+        for _ in range(1500):
+            src, dst = rng.choice(candidates), rng.choice(candidates)
+            protocol = rng.choice(['tcp', 'udp', 'icmp'])
+            port = rng.choice([22, 53, 80, 123, 443, 8080]) if protocol != 'icmp' else None
+            expected = evaluator.evaluate(src, dst, protocol, port)['verdict']
+            assert interpreter.verdict(src, dst, protocol, port) == expected, (use_ipsets, src, dst, protocol, port)
+
+    # The optimized plan decides like the rows it was built from
+    optimized = FirewallEvaluator(plan)
+    for _ in range(500):
+        packet = (rng.choice(candidates), rng.choice(candidates), rng.choice(['tcp', 'udp']), rng.choice([22, 53, 80]))
+        assert optimized.evaluate(*packet)['verdict'] == evaluator.evaluate(*packet)['verdict']
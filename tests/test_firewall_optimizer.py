@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Tests for the firewall rule optimizer passes
+"""
+
+import ipaddress
+import itertools
+
+from app import db
+from app.firewall_compiler import PlannedRule, compile_nftables, compile_restore, load_firewall_plan
+from app.firewall_optimizer import PortSet, lift_rule, optimize_rules
+from app.models import FirewallRule, Peer, Protocol, RuleAction, RuleType
+
+VPN_SUBNET = '10.0.0.0/24'
+
+
+def _rule(id, action='ALLOW', rule_type='custom', destination=None, protocol='tcp', ports=None, source=None):
+    return PlannedRule(id, f"r{id}", rule_type, action, source, destination, protocol, ports, 100)
+
+
+def _first_match(rules, packet):
+    """Reference semantics: the first rule (lifted) matching the packet decides"""
+    src, dst, protocol, port, outbound = packet
+    for position, rule in enumerate(rules):
+        ir = lift_rule(position, rule, VPN_SUBNET)
+        if ir.outbound != outbound:
+            continue
+        if (ir.source is None and src != 'self') or (ir.source is not None and (
+                src == 'self' or ipaddress.ip_address(src) not in ir.source)):
+            continue
+        if ir.destination is not None and ipaddress.ip_address(dst) not in ir.destination:
+            continue
+        if ir.protocol != 'any' and ir.protocol != protocol:
+            continue
+        if ir.ports is not None and not ir.ports.contains(port):
+            continue
+        return rule.action
+    return None
+
+
+def _assert_equivalent(rules, optimized):
+    packets = itertools.product(
+        ['self', '172.16.0.5'],
+        ['192.168.0.1', '192.168.1.9', '192.168.2.1', '192.168.3.200', '10.0.0.7', '8.8.8.8'],
+        ['tcp', 'udp', 'icmp'],
+        [22, 53, 80, 443, 8080, 8443],
+        [False, True],
+    )
+    for packet in packets:
+        assert _first_match(rules, packet) == _first_match(optimized, packet), packet
+
+
+def test_port_sets_normalize():
+    ports = PortSet.parse('443, 80,81-90,82')
+    assert ports.intervals == ((80, 90), (443, 443))
+    assert ports.render() == '80-90,443' and ports.render(':') == '80:90,443'
+    assert ports.iptables_args() == ['-m', 'multiport', '--dports', '80:90,443']
+    assert PortSet.parse('20-22').iptables_args() == ['--dport', '20:22']
+    assert ports.covers(PortSet.parse('85,443')) and not ports.covers(PortSet.parse('80-91'))
+    assert ports.slots == 3 and PortSet.parse('any') is None
+
+
+def test_shadowed_rules_are_removed():
+    rules = [
+        _rule(1, destination='192.168.0.0/16', protocol='any'),
+        _rule(2, action='DENY', destination='192.168.1.0/24', ports='22'),   # never reached
+        _rule(3, action='DENY', rule_type='peer_comm', protocol='udp'),
+        _rule(4, action='ALLOW', destination='10.0.0.0/25', protocol='udp', ports='53'),  # inside the vpn subnet
+        _rule(5, action='DENY', source='172.16.0.0/12', destination='192.168.1.0/24'),  # other source: kept
+    ]
+    optimized, removals = optimize_rules(rules, VPN_SUBNET)
+    assert [ir.members for ir in optimized] == [(0,), (2,), (4,)]
+    assert [(r.position, r.reason, r.by) for r in removals] == [(1, 'shadowed', 0), (3, 'shadowed', 2)]
+
+
+def test_neighbouring_rules_merge_without_changing_verdicts():
+    rules = [
+        _rule(1, rule_type='internet', ports='80'),
+        _rule(2, rule_type='internet', ports='443'),
+        _rule(3, rule_type='internet', ports='8080,8443'),
+        _rule(4, action='DENY', destination='192.168.0.0/24', protocol='any'),
+        _rule(5, action='DENY', destination='192.168.1.0/24', protocol='any'),
+        _rule(6, action='ALLOW', destination='192.168.2.0/24', protocol='any'),   # other verdict: barrier
+        _rule(7, action='DENY', destination='192.168.3.0/24', protocol='any'),
+        _rule(8, action='DENY', destination='192.168.2.0/24', protocol='any'),   # shadowed by 6
+    ]
+    optimized, removals = optimize_rules(rules, VPN_SUBNET)
+
+    assert [(ir.members, ir.ports and ir.ports.render(), str(ir.destination)) for ir in optimized] == [
+        ((0, 1, 2), '80,443,8080,8443', 'None'),
+        ((3, 4), None, '192.168.0.0/23'),
+        ((5,), None, '192.168.2.0/24'),
+        ((6,), None, '192.168.3.0/24'),
+    ]
+    assert {(r.position, r.reason) for r in removals} == {
+        (1, 'merged_ports'), (2, 'merged_ports'), (4, 'merged_destinations'), (7, 'shadowed')}
+    _assert_equivalent(rules, [rules[ir.members[0]]._replace(
+        destination=str(ir.destination) if ir.destination else rules[ir.members[0]].destination,
+        port_range=ir.ports.render() if ir.ports else None) for ir in optimized])
+
+
+def test_port_groups_stay_within_multiport_limit():
+    rules = [_rule(i, rule_type='internet', ports=str(1000 + 2 * i)) for i in range(20)]
+    optimized, _ = optimize_rules(rules, VPN_SUBNET)
+    assert [len(ir.members) for ir in optimized] == [15, 5]
+
+
+def test_unparseable_rules_are_kept_and_block_merging():
+    rules = [_rule(1, ports='80'), _rule(2, destination='not-a-network'), _rule(3, ports='443')]
+    optimized, removals = optimize_rules(rules, VPN_SUBNET)
+    assert [ir.members for ir in optimized] == [(0,), (1,), (2,)] and removals == []
+    assert optimized[1].opaque
+
+
+def test_compiled_rulesets_use_optimized_plan(client):
+    peer = Peer(name="office", public_key="O" * 42 + "A=", assigned_ip="10.0.0.2")
+    db.session.add(peer)
+    db.session.flush()
+    db.session.add_all([
+        FirewallRule(peer_id=peer.id, name="http", rule_type=RuleType.INTERNET, action=RuleAction.ALLOW,
+                     protocol=Protocol.TCP, port_range="80", priority=10),
+        FirewallRule(peer_id=peer.id, name="https", rule_type=RuleType.INTERNET, action=RuleAction.ALLOW,
+                     protocol=Protocol.TCP, port_range="443", priority=20),
+        FirewallRule(peer_id=peer.id, name="https-again", rule_type=RuleType.INTERNET, action=RuleAction.DENY,
+                     protocol=Protocol.TCP, port_range="443", priority=30),
+    ])
+    db.session.commit()
+
+    plan = load_firewall_plan()
+    assert [rule.name for rule in plan.peers[0].rules] == ["http+https"]
+    report = plan.optimization.to_dict()
+    assert (report['rules_in'], report['rules_out'], report['rules_removed']) == (3, 1, 2)
+    assert {entry['name']: entry['reason'] for entry in report['removed']} == {
+        'https': 'merged_ports', 'https-again': 'shadowed'}
+
+    http, https = (FirewallRule.query.filter_by(name=name).one().id for name in ('http', 'https'))
+    assert plan.peers[0].rules[0].merged_ids == (https,)
+    assert f'-p tcp -m multiport --dports 80,443 ! -o wg0 -m comment --comment "Rule:{http},{https}:http+https"' in \
+        compile_restore(plan)
+    assert 'tcp dport { 80, 443 }' in compile_nftables(plan)
+    assert len(load_firewall_plan(optimize=False).peers[0].rules) == 3
+
+    data = client.get('/api/v1/firewall/rules/generate').get_json()
+    assert data['optimization']['rules_removed'] == 2 and 'compile_ms' in data
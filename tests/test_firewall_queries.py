@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Query-count regression tests for firewall rule generation
+"""
+
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+from app import db
+from app.iptables_manager import IptablesManager
+from app.models import FirewallRule, Peer, Protocol, RuleAction, RuleType
+
+
+@contextmanager
+def count_queries():
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+
+
+def _add_peers(start, count):
+    peers = [Peer(name=f"peer-{i}", public_key=f"{i:042d}A=", assigned_ip=f"10.0.{i // 250}.{i % 250 + 2}")
+             for i in range(start, start + count)]
+    db.session.add_all(peers)
+    db.session.flush()
+    for peer in peers:
+        db.session.add_all([
+            FirewallRule(peer_id=peer.id, name="https", rule_type=RuleType.INTERNET, action=RuleAction.ALLOW,
+                         protocol=Protocol.TCP, port_range="80,443", priority=10),
+            FirewallRule(peer_id=peer.id, name="lan", rule_type=RuleType.CUSTOM, action=RuleAction.DENY,
+                         destination="192.168.0.0/16", priority=20),
+        ])
+    db.session.commit()
+    return peers
+
+
+@pytest.mark.parametrize('backend', ['iptc', 'restore', 'nftables'])
+def test_preview_queries_do_not_grow_with_peers(client, backend):
+    counts = []
+    for start, count in ((0, 5), (5, 95)):
+        _add_peers(start, count)
+        db.session.expire_all()
+        with count_queries() as statements:
+            data = client.get(f'/api/v1/firewall/rules/generate?backend={backend}').get_json()
+        assert data['status'] == 'success' and any(':https' in line for line in data['rules'])
+        counts.append(len(statements))
+    assert counts[0] == counts[1] <= 2
+
+
+def test_legacy_preview_loads_one_peer_without_per_rule_queries(client):
+    peer_id = _add_peers(0, 3)[1].id
+    db.session.expire_all()
+    with count_queries() as statements:
+        result = IptablesManager('wg0').apply_peer_rules(peer_id, dry_run=True)
+    assert len(statements) <= 2
+
+    rules = [line for line in result['rules'] if line.startswith('iptables')]
+    peer_rules = [line for line in rules if '10.0.0.3/32' in line]
+    assert '-p tcp -m multiport --dports 80,443 -o !wg0 -j ACCEPT' in peer_rules[0]
+    assert '-d 192.168.0.0/16' in peer_rules[1] and peer_rules[-1].endswith('-d 10.0.0.3/32 -j DROP')
+    assert not any('10.0.0.2/32' in line for line in rules)
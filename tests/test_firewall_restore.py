@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+Tests for the iptables-restore firewall backend
+"""
+
+import ipaddress
+
+from sqlalchemy import update
+
+from app import db
+from app.firewall_compiler import ReconcilePlan, compile_restore, load_firewall_plan
+from app.iptables_manager import RestoreIptablesManager
+from app.models import FirewallRule, Peer, Protocol, RuleAction, RuleType
+
+
+def _key(letter):
+    return letter * 42 + "A="
+
+
+def _peers():
+    web = Peer(name="web", public_key=_key("A"), assigned_ip="10.0.0.2")
+    laptop = Peer(name="laptop", public_key=_key("B"), assigned_ip="10.0.0.3")
+    off = Peer(name="off", public_key=_key("C"), assigned_ip="10.0.0.4", is_active=False)
+    db.session.add_all([web, laptop, off])
+    db.session.flush()
+    db.session.add_all([
+        FirewallRule(peer_id=web.id, name="late", rule_type=RuleType.INTERNET, action=RuleAction.ALLOW,
+                     protocol=Protocol.TCP, port_range="80,443", priority=200),
+        FirewallRule(peer_id=web.id, name="ssh", rule_type=RuleType.CUSTOM, action=RuleAction.DENY,
+                     destination="192.168.1.0/24", protocol=Protocol.TCP, port_range="20-22", priority=10),
+        FirewallRule(peer_id=web.id, name="peers", rule_type=RuleType.PEER_COMM, action=RuleAction.ALLOW,
+                     priority=10),
+        FirewallRule(peer_id=web.id, name="disabled", rule_type=RuleType.CUSTOM, action=RuleAction.ALLOW,
+                     priority=1, is_active=False),
+        FirewallRule(peer_id=off.id, name="ignored", rule_type=RuleType.CUSTOM, action=RuleAction.ALLOW),
+    ])
+    db.session.commit()
+    return web, laptop
+
+
+def test_compiled_ruleset_follows_priority_order(client):
+    web, laptop = _peers()
+    text = compile_restore(load_firewall_plan())
+    lines = text.splitlines()
+
+    assert text.startswith('*filter\n') and text.endswith('COMMIT\n')
+    assert '-I FORWARD 1 -j WIREGUARD_FORWARD' in lines
+    assert f'-A WIREGUARD_FORWARD -s 10.0.0.2/32 -j WGP-{web.id}' in lines
+    assert f'-A WIREGUARD_FORWARD -d 10.0.0.3/32 -j WGP-{laptop.id}' in lines
+
+    # web: priority 10 (ties by id), 200, default drop; laptop: default allow
+    rules = [line for line in lines if line.startswith(f'-A WGP-{web.id} ') and '"fp:' not in line]
+    labels = {rule.name: f'"Rule:{rule.id}:{rule.name}"' for rule in FirewallRule.query}
+    assert [labels['ssh'] in rules[0], labels['peers'] in rules[1], labels['late'] in rules[2]] == [True] * 3
+    assert '-d 192.168.1.0/24 -p tcp --dport 20:22 -i wg0' in rules[0]
+    assert '-p tcp -m multiport --dports 80,443 ! -o wg0' in rules[2]
+    assert rules[3].endswith('-s 10.0.0.2/32 -m comment --comment "Default-Drop:web" -j DROP')
+    assert len(rules) == 5
+    assert f'-A WGP-{laptop.id} -s 10.0.0.3/32 -m comment --comment "Default-Allow:laptop" -j ACCEPT' in lines
+    assert 'disabled' not in text and 'ignored' not in text
+    assert compile_restore(load_firewall_plan()) == text
+
+
+def test_apply_is_one_restore_and_idempotent(client, fake_iptables):
+    web, laptop = _peers()
+    fake_iptables({'INPUT': [], 'FORWARD': [
+        '-i eth0 -j ACCEPT',
+        '-s 10.0.0.9/32 -m comment --comment "Rule:old" -j ACCEPT',
+        '-i wg0 -m conntrack --ctstate RELATED,ESTABLISHED -j ACCEPT',
+    ], 'OUTPUT': []})
+
+    manager = RestoreIptablesManager('wg0')
+    assert manager.validate_ruleset()['status'] == 'success'
+    assert 'WIREGUARD_FORWARD' not in fake_iptables()  # --test commits nothing
+
+    result = manager.apply_peer_rules()
+    assert result['status'] == 'success', result
+    assert result['changed_peers'] == [web.id, laptop.id]
+    assert result['applied_rules'] == 8 + 5 + 2  # base + dispatch, web, laptop
+
+    chains = fake_iptables()
+    # Legacy rules are gone, unrelated rules stay, the jump comes first
+    assert chains['FORWARD'] == ['-j WIREGUARD_FORWARD', '-i eth0 -j ACCEPT']
+    assert len(chains[f'WGP-{web.id}']) == 6  # fingerprint + 3 rules + 2 defaults
+
+    # Nothing changed: no restore at all
+    result = manager.reconcile()
+    assert result['status'] == 'success' and result['changed_peers'] == []
+    assert fake_iptables() == chains
+    assert fake_iptables.log.read_text().count('COMMIT') == 2
+
+
+def test_rule_edits_rewrite_only_their_peer(client, fake_iptables, monkeypatch):
+    web, laptop = _peers()
+    manager = RestoreIptablesManager('wg0')
+    manager.apply_peer_rules()
+    before = fake_iptables()
+    monkeypatch.setenv('ENABLE_FIREWALL_MANAGEMENT', 'true')
+
+    rule = FirewallRule.query.filter_by(name='ssh').one()
+    response = client.put(f'/api/v1/firewall-rules/{rule.id}', json={'port_range': '2222'})
+    firewall = response.get_json()['firewall']
+    assert firewall['changed_peers'] == [web.id] and not firewall['dispatch_changed']
+
+    after = fake_iptables()
+    assert after[f'WGP-{laptop.id}'] == before[f'WGP-{laptop.id}']
+    assert after['WIREGUARD_FORWARD'] == before['WIREGUARD_FORWARD']
+    assert any('--dport 2222' in line for line in after[f'WGP-{web.id}'])
+
+    # A removed peer loses its dispatch jumps and its chain in the same transaction
+    db.session.delete(db.session.get(Peer, laptop.id))
+    db.session.commit()
+    result = manager.reconcile([web.id])
+    assert result['removed_chains'] == [f'WGP-{laptop.id}'] and result['changed_peers'] == []
+    assert f'WGP-{laptop.id}' not in fake_iptables()
+    assert not any('10.0.0.3' in line for line in fake_iptables()['WIREGUARD_FORWARD'])
+
+
+def test_explicit_source_rules_reach_non_peer_traffic(client, fake_iptables, monkeypatch):
+    web, laptop = _peers()
+    db.session.add(FirewallRule(peer_id=web.id, name="guests", rule_type=RuleType.INTERNET, action=RuleAction.DENY,
+                                source="192.168.50.0/24"))
+    db.session.commit()
+    manager = RestoreIptablesManager('wg0')
+    manager.apply_peer_rules()
+    # After both jump trees: only traffic between non-peer addresses gets there
+    assert fake_iptables()['WIREGUARD_FORWARD'][-1] == f'-s 192.168.50.0/24 -j WGP-{web.id}'
+
+    # A partial apply for another peer keeps the jump into web's chain
+    db.session.add(FirewallRule(peer_id=laptop.id, name="lab", rule_type=RuleType.CUSTOM, action=RuleAction.ALLOW,
+                                source="172.16.0.0/12"))
+    db.session.commit()
+    result = manager.reconcile([laptop.id])
+    assert result['changed_peers'] == [laptop.id] and result['dispatch_changed']
+    forward = [line for line in fake_iptables()['WIREGUARD_FORWARD'] if line.startswith(('-s 172', '-s 192'))]
+    assert [line.split()[-1] for line in forward] == [f'WGP-{web.id}', f'WGP-{laptop.id}']
+
+
+def test_targeted_and_full_applies_dispatch_the_same_sources(client, fake_iptables):
+    web, laptop = _peers()
+    db.session.add_all([
+        FirewallRule(peer_id=web.id, name="lan", rule_type=RuleType.CUSTOM, action=RuleAction.DENY,
+                     source="192.168.0.0/16", priority=1),
+        FirewallRule(peer_id=web.id, name="guests", rule_type=RuleType.CUSTOM, action=RuleAction.DENY,
+                     source="192.168.50.0/24", priority=2),  # shadowed by lan: optimized away
+    ])
+    db.session.commit()
+    manager = RestoreIptablesManager('wg0')
+    manager.apply_peer_rules()
+    forward = fake_iptables()['WIREGUARD_FORWARD']
+    assert not any('192.168.50.0/24' in line for line in forward)
+
+    # Alternating targeted and full applies leave the dispatch chain alone
+    for peer_ids in ([laptop.id], None, [web.id]):
+        result = manager.reconcile(peer_ids)
+        assert result['status'] == 'success' and not result.get('dispatch_changed')
+        assert fake_iptables()['WIREGUARD_FORWARD'] == forward
+
+
+def test_unrenderable_addresses_are_skipped_and_reported(client, fake_iptables):
+    web, laptop = _peers()
+    injection = "10.1.0.0/16 -j ACCEPT\n-A INPUT -j ACCEPT\n#"
+    response = client.post(f'/api/v1/peers/{web.id}/firewall-rules',
+                           json={'name': 'evil', 'rule_type': 'custom', 'action': 'ALLOW', 'destination': injection})
+    assert response.status_code == 400 and FirewallRule.query.filter_by(name='evil').count() == 0
+    rule_id = FirewallRule.query.filter_by(name='ssh').one().id
+    assert client.put(f'/api/v1/firewall-rules/{rule_id}', json={'source': '2001:db8::/32'}).status_code == 400
+
+    # Rows stored before validation existed never reach the restore input
+    db.session.add_all([
+        FirewallRule(peer_id=laptop.id, name="evil", rule_type=RuleType.CUSTOM, action=RuleAction.ALLOW),
+        FirewallRule(peer_id=laptop.id, name="v6", rule_type=RuleType.CUSTOM, action=RuleAction.DENY),
+        FirewallRule(peer_id=laptop.id, name="lan", rule_type=RuleType.CUSTOM, action=RuleAction.DENY,
+                     destination="192.168.7.1/24"),
+    ])
+    db.session.commit()
+    db.session.execute(update(FirewallRule).where(FirewallRule.name == 'evil').values(destination=injection))
+    db.session.execute(update(FirewallRule).where(FirewallRule.name == 'v6').values(source='2001:db8::/32'))
+    db.session.commit()
+
+    result = RestoreIptablesManager('wg0').apply_peer_rules()
+    assert result['status'] == 'success'
+    assert sorted(rule['name'] for rule in result['skipped_rules']) == ['evil', 'v6']
+    chains = fake_iptables()
+    assert chains['INPUT'] == ['-j WIREGUARD_INPUT'] and not any('2001:db8' in line for lines in chains.values() for line in lines)
+    assert any('-d 192.168.7.0/24' in line for line in chains[f'WGP-{laptop.id}'])
+    assert client.get('/api/v1/firewall/rules/generate?backend=restore').get_json()['skipped_rules'][0]['peer_id'] == laptop.id
+
+
+def test_rejected_ruleset_changes_nothing(client, fake_iptables):
+    web, _ = _peers()
+    manager = RestoreIptablesManager('wg0')
+    assert manager.apply_peer_rules()['status'] == 'success'
+    before = fake_iptables()
+
+    # The stand-in rejects the unknown target, like a kernel rejecting a bad match
+    manager.compile = lambda *args, **kwargs: ReconcilePlan('*filter\n-A WIREGUARD_FORWARD -j NOWHERE\nCOMMIT\n',
+                                                           [web.id], [], False)
+    result = manager.apply_peer_rules()
+    assert result['status'] == 'error' and 'unknown target' in result['message']
+    assert fake_iptables() == before
+
+
+def test_dry_run_does_not_touch_the_kernel(client, fake_iptables):
+    web, _ = _peers()
+    result = RestoreIptablesManager('wg0').apply_peer_rules(web.id, dry_run=True)
+    assert result['status'] == 'success'
+    assert any('Default-Drop:web' in line for line in result['rules'])
+    assert not any('laptop' in line for line in result['rules'])
+    assert not fake_iptables.log.exists()
+
+
+def _walk(chains, address, flag='-s'):
+    """Follow the dispatch jumps for one address; returns (peer chain, rules evaluated)"""
+    chain, evaluated = 'WIREGUARD_FORWARD', 0
+    while not chain.startswith(('WGP-', 'WGX-')):
+        for rule in chains[chain]:
+            evaluated += 1
+            tokens = rule.split()
+            if tokens[0] == flag and ipaddress.ip_address(address) in ipaddress.ip_network(tokens[1]):
+                chain = tokens[-1]
+                break
+        else:
+            return None, evaluated
+    return chain, evaluated
+
+
+def test_dispatch_is_a_jump_tree(client, fake_iptables):
+    peers = [Peer(name=f"peer-{i}", public_key=f"{i:042d}A=", assigned_ip=f"10.0.{i // 250}.{i % 250 + 2}")
+             for i in range(600)]
+    db.session.add_all(peers)
+    db.session.commit()
+    manager = RestoreIptablesManager('wg0')
+    assert manager.reconcile()['status'] == 'success'
+
+    chains = fake_iptables()
+    assert not any('/32' in rule for rule in chains['WIREGUARD_FORWARD'])
+    for peer in peers[::37]:
+        chain, evaluated = _walk(chains, peer.assigned_ip)
+        assert chain == f"WGP-{peer.id}"
+        assert evaluated < 40  # instead of up to 1200 with one jump per address
+        assert _walk(chains, peer.assigned_ip, '-d')[0] == chain
+
+    # A new peer rewrites its own chain and the tree chains on its path only
+    db.session.add(Peer(name="late", public_key="L" * 42 + "A=", assigned_ip="10.0.5.9"))
+    db.session.commit()
+    result = manager.reconcile()
+    text = fake_iptables.log.read_text().split('*filter')[-1]
+    rewritten = [line for line in text.splitlines() if line.startswith(':')]
+    assert len(result['changed_peers']) == 1
+    assert len(rewritten) < 20
+    assert _walk(fake_iptables(), "10.0.5.9")[0] == f"WGP-{result['changed_peers'][0]}"
+
+
+def test_peers_sharing_a_policy_share_one_chain_and_ipset(client, fake_iptables, monkeypatch):
+    monkeypatch.setenv('FIREWALL_IPSET', 'true')
+    peers = [Peer(name=f"kiosk-{i}", public_key=f"{i:042d}A=", assigned_ip=f"10.0.0.{i + 10}") for i in range(6)]
+    db.session.add_all(peers)
+    db.session.flush()
+    for peer in peers:
+        db.session.add_all([
+            FirewallRule(peer_id=peer.id, name="web", rule_type=RuleType.INTERNET, action=RuleAction.ALLOW,
+                         protocol=Protocol.TCP, port_range="443", priority=10),
+            FirewallRule(peer_id=peer.id, name="dns", rule_type=RuleType.CUSTOM, action=RuleAction.ALLOW,
+                         destination="10.0.0.1/32", protocol=Protocol.UDP, port_range="53", priority=20),
+        ])
+    db.session.commit()
+
+    manager = RestoreIptablesManager('wg0')
+    result = manager.reconcile()
+    assert result['status'] == 'success', result
+    assert result['changed_peers'] == [] and len(result['changed_policies']) == 1
+
+    policy = result['changed_policies'][0]
+    address_set = 'wgx-' + policy[4:]
+    chains = fake_iptables()
+    assert not any(chain.startswith('WGP-') for chain in chains)
+    # Each rule once for the whole group instead of once per peer
+    assert len(chains[policy]) == 1 + 2 + 2
+    assert f'-m set --match-set {address_set} src' in chains[policy][1]
+    assert sorted(fake_iptables.sets()[address_set]) == sorted(peer.assigned_ip for peer in peers)
+    assert _walk(chains, '10.0.0.12')[0] == policy
+
+    # A peer whose rules diverge leaves the set and gets its own chain
+    rule = FirewallRule.query.filter_by(peer_id=peers[0].id, name="web").one()
+    rule.port_range = "8443"
+    db.session.commit()
+    result = manager.reconcile([peers[0].id])
+    assert result['changed_peers'] == [peers[0].id] and result['changed_policies'] == []
+    assert '10.0.0.10' not in fake_iptables.sets()[address_set]
+    assert _walk(fake_iptables(), '10.0.0.10')[0] == f"WGP-{peers[0].id}"
+
+    # When the group falls below two peers its chain and set are removed
+    FirewallRule.query.filter(FirewallRule.peer_id.in_([peer.id for peer in peers[1:5]]),
+                              FirewallRule.name == "dns").delete(synchronize_session=False)
+    db.session.commit()
+    result = manager.reconcile()
+    assert result['status'] == 'success' and 'warning' not in result
+    assert policy in result['removed_chains']
+    assert address_set not in fake_iptables.sets()
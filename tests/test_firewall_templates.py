@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Tests for applying firewall templates to many peers
+"""
+
+from sqlalchemy import event
+
+from app import db
+from app.firewall_compiler import load_firewall_plan
+from app.models import (FirewallRule, FirewallTemplate, FirewallTemplateRule, Peer, PeerTag, Protocol,
+                        RuleAction, RuleType)
+
+
+def _template(name="web"):
+    template = FirewallTemplate(name=name)
+    db.session.add(template)
+    db.session.flush()
+    db.session.add_all([
+        FirewallTemplateRule(template_id=template.id, name="dns", rule_type=RuleType.INTERNET,
+                             action=RuleAction.ALLOW, protocol=Protocol.UDP, port_range="53", order=0),
+        FirewallTemplateRule(template_id=template.id, name="https", rule_type=RuleType.INTERNET,
+                             action=RuleAction.ALLOW, protocol=Protocol.TCP, port_range="443", order=1),
+    ])
+    db.session.commit()
+    return template
+
+
+def _peers(count, tag='office'):
+    peers = [Peer(name=f"{tag}-{i}", public_key=f"{tag[0]}{i:041d}A=", assigned_ip=f"10.0.{i // 250}.{i % 250 + 2}")
+             for i in range(count)]
+    db.session.add_all(peers)
+    db.session.flush()
+    db.session.add_all([PeerTag(peer_id=peer.id, tag=tag) for peer in peers])
+    db.session.commit()
+    return [peer.id for peer in peers]
+
+
+def test_copy_inserts_in_bulk_and_applies_once(client, fake_iptables, monkeypatch):
+    monkeypatch.setenv('ENABLE_FIREWALL_MANAGEMENT', 'true')
+    template_id = _template().id
+    peer_ids = _peers(60)
+    db.session.add(FirewallRule(peer_id=peer_ids[0], name="old", rule_type=RuleType.CUSTOM, action=RuleAction.DENY))
+    db.session.commit()
+
+    statements = []
+    record = lambda conn, cursor, statement, *args: statements.append(statement)  # noqa: E731
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        response = client.post(f'/api/v1/firewall/templates/{template_id}/apply',
+                               json={'tag': 'office', 'replace': True})
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+    data = response.get_json()
+    assert response.status_code == 200 and data['rules_created'] == 120 and data['changed'] == 60
+    assert data['firewall']['status'] == 'success'
+    assert sum(statement.startswith('INSERT INTO firewall_rules') for statement in statements) == 1
+    assert fake_iptables.log.read_text().count('COMMIT') == 1
+
+    assert FirewallRule.query.count() == 120 and not FirewallRule.query.filter_by(name="old").count()
+    rules = FirewallRule.query.filter_by(peer_id=peer_ids[5]).order_by(FirewallRule.priority).all()
+    assert [(rule.name, rule.priority) for rule in rules] == [("dns", 100), ("https", 101)]
+    assert db.session.get(FirewallTemplate, template_id).usage_count == 60
+
+
+def test_linked_peers_follow_template_edits(client):
+    web, mail = _template().id, _template("mail").id
+    peer_ids = _peers(3)
+    db.session.add(FirewallRule(peer_id=peer_ids[0], name="own", rule_type=RuleType.CUSTOM, action=RuleAction.DENY,
+                                destination="192.168.0.0/16", priority=10))
+    db.session.commit()
+
+    data = client.post(f'/api/v1/firewall/templates/{web}/apply', json={'ids': peer_ids, 'mode': 'link'}).get_json()
+    assert data['changed'] == 3 and data['rules_created'] == 0 and 'firewall' not in data
+    assert FirewallRule.query.count() == 1
+    plan = load_firewall_plan(optimize=False)
+    assert [rule.name for rule in plan.peers[0].rules] == ["own", "dns", "https"]
+    assert all(rule.id < 0 for peer in plan.peers for rule in peer.rules if rule.name != "own")
+
+    # One edit of the template reaches every linked peer
+    FirewallTemplateRule.query.filter_by(template_id=web, name="https").one().port_range = "8443"
+    db.session.commit()
+    assert all(peer.rules[-1].port_range == "8443" for peer in load_firewall_plan(optimize=False).peers)
+
+    # Relinking moves the usage count; linking again changes nothing
+    client.post(f'/api/v1/firewall/templates/{mail}/apply', json={'ids': peer_ids[:2], 'mode': 'link'})
+    again = client.post(f'/api/v1/firewall/templates/{mail}/apply', json={'ids': peer_ids[:2], 'mode': 'link'})
+    assert again.get_json()['changed'] == 0
+    assert [db.session.get(FirewallTemplate, template_id).usage_count for template_id in (web, mail)] == [1, 2]
+    client.post(f'/api/v1/firewall/templates/{web}/apply', json={'ids': peer_ids, 'mode': 'unlink'})
+    assert db.session.get(FirewallTemplate, web).usage_count == 0
+    assert db.session.get(Peer, peer_ids[2]).firewall_template_id is None
+
+
+def test_template_apply_errors(client):
+    template_id = _template().id
+    _peers(1)
+    assert client.post('/api/v1/firewall/templates/999/apply', json={'tag': 'office'}).status_code == 404
+    assert client.post(f'/api/v1/firewall/templates/{template_id}/apply',
+                       json={'tag': 'office', 'mode': 'merge'}).status_code == 400
+    assert client.post(f'/api/v1/firewall/templates/{template_id}/apply', json={}).status_code == 400
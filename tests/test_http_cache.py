@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Tests for ETags and conditional GETs
+"""
+
+from datetime import datetime, timezone
+from unittest import mock
+
+from app import db
+from app.models import AllowedIP, Peer
+
+
+def _status(rx):
+    return {"P" * 43 + "=": {'is_connected': True, 'endpoint': '198.51.100.7:51820', 'transfer_rx': rx,
+                             'transfer_tx': 10, 'latest_handshake': datetime(2026, 1, 1, tzinfo=timezone.utc)}}
+
+
+def test_peer_endpoints_revalidate(client):
+    peer = Peer(name="alpha", public_key="P" * 43 + "=", assigned_ip="10.0.0.2")
+    db.session.add(peer)
+    db.session.commit()
+
+    for url in ('/api/v1/peers', f'/api/v1/peers/{peer.id}', f'/peers/{peer.id}/config',
+                f'/api/v1/peers/{peer.id}/config'):
+        first = client.get(url)
+        etag = first.headers['ETag']
+        assert first.status_code == 200 and not etag.startswith('W/')
+
+        repeat = client.get(url, headers={'If-None-Match': etag})
+        assert repeat.status_code == 304 and repeat.get_data() == b''
+
+        # Served from the body cache without running the view again
+        with mock.patch('app.peer_listing.db.session.query', side_effect=AssertionError), \
+                mock.patch('app.routes.Peer.query', new_callable=mock.PropertyMock, side_effect=AssertionError):
+            cached = client.get(url)
+        assert cached.get_data() == first.get_data() and cached.headers['ETag'] == etag
+        assert cached.headers['Content-Type'] == first.headers['Content-Type']
+
+    etag = client.get('/api/v1/peers').headers['ETag']
+    db.session.add(AllowedIP(peer_id=peer.id, ip_network="192.168.7.0/24"))
+    db.session.commit()
+    response = client.get('/api/v1/peers', headers={'If-None-Match': etag})
+    assert response.status_code == 200 and response.headers['ETag'] != etag
+    assert response.get_json()['data'][0]['allowed_ips'] == ["192.168.7.0/24"]
+
+    # The tag depends on the query string
+    assert client.get('/api/v1/peers?limit=5').headers['ETag'] != response.headers['ETag']
+
+
+def test_status_tag_follows_live_snapshot(client):
+    db.session.add(Peer(name="alpha", public_key="P" * 43 + "=", assigned_ip="10.0.0.2"))
+    db.session.commit()
+
+    with mock.patch('app.wireguard_status.get_wireguard_status', return_value=_status(100)):
+        first = client.get('/api/v1/wireguard/status')
+        assert first.get_json()['connected_peers'] == 1 and first.headers['ETag'].startswith('W/')
+        assert client.get('/api/v1/wireguard/status',
+                          headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+
+    with mock.patch('app.wireguard_status.get_wireguard_status', return_value=_status(200)):
+        changed = client.get('/api/v1/wireguard/status', headers={'If-None-Match': first.headers['ETag']})
+        assert changed.status_code == 200
+        assert changed.get_json()['data']['1']['transfer_rx'] == 200
+
+
+class _Clock(datetime):
+    """datetime whose now() is set by the test"""
+    current = None
+
+    @classmethod
+    def now(cls, tz=None):
+        return cls.current
+
+
+def test_status_tag_follows_handshake_age(client):
+    db.session.add(Peer(name="alpha", public_key="P" * 43 + "=", assigned_ip="10.0.0.2"))
+    db.session.commit()
+
+    _Clock.current = datetime(2026, 1, 1, 0, 0, 30, tzinfo=timezone.utc)
+    with mock.patch('app.wireguard_status.get_wireguard_status', return_value=_status(100)), \
+            mock.patch('app.wireguard_status.datetime', _Clock):
+        first = client.get('/api/v1/wireguard/status')
+        assert first.get_json()['data']['1']['latest_handshake'] == "Just now"
+        _Clock.current = datetime(2026, 1, 1, 0, 5, tzinfo=timezone.utc)
+        later = client.get('/api/v1/wireguard/status', headers={'If-None-Match': first.headers['ETag']})
+    assert later.status_code == 200 and later.get_json()['data']['1']['latest_handshake'] == "5 min ago"
+
+
+def test_status_errors_stay_json(client):
+    with mock.patch('app.wireguard_status.get_wireguard_status', side_effect=RuntimeError("wg hung")), \
+            mock.patch('app.routes.get_wireguard_status', side_effect=RuntimeError("wg hung")):
+        response = client.get('/api/v1/wireguard/status')
+    assert response.status_code == 500 and 'ETag' not in response.headers
+    assert response.get_json() == {'status': 'error', 'message': 'Error getting WireGuard status: wg hung'}
+
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Tests for the bitmap IP allocator
+"""
+
+import ipaddress
+import random
+
+from app import db
+from app.ip_allocator import IPAllocator, SubnetBitmap
+from app.models import Peer
+from app.utils import get_next_available_ip
+
+
+def legacy_next_ip(subnet, assigned):
+    """The original linear scan over network.hosts()"""
+    network = ipaddress.ip_network(subnet, strict=False)
+    taken = {ipaddress.ip_address(ip) for ip in assigned} | {network.network_address + 1}
+    for ip in network.hosts():
+        if ip not in taken:
+            return str(ip)
+    return None
+
+
+def test_matches_linear_scan():
+    """Random reserve/release sequences agree with the legacy scan"""
+    rng = random.Random(42)
+    for subnet in ("10.0.0.0/24", "10.8.0.0/22", "192.168.5.0/29", "10.1.1.0/31", "10.1.1.7/32"):
+        network = ipaddress.ip_network(subnet)
+        addresses = [str(ip) for ip in network]
+        bitmap = SubnetBitmap(subnet)
+        assigned = set()
+        for _ in range(400):
+            if assigned and rng.random() < 0.3:
+                ip = rng.choice(sorted(assigned))
+                assigned.discard(ip)
+                bitmap.release(ip)
+            else:
+                candidate = bitmap.next_free()
+                assert candidate == legacy_next_ip(subnet, assigned)
+                if candidate is None:
+                    break
+                assigned.add(candidate)
+                bitmap.reserve(candidate)
+            if rng.random() < 0.1:
+                ip = rng.choice(addresses)
+                if bitmap.reserve(ip):
+                    assigned.add(ip)
+
+
+def test_server_and_broadcast_never_released():
+    bitmap = SubnetBitmap("10.0.0.0/24")
+    assert not bitmap.release("10.0.0.1")
+    assert not bitmap.release("10.0.0.255")
+    assert bitmap.next_free() == "10.0.0.2"
+
+
+def test_skips_addresses_taken_elsewhere():
+    """Candidates already in the database (other workers, pending flushes) are skipped"""
+    allocator = IPAllocator(loader=lambda: ["10.0.0.2"], is_assigned=lambda ip: ip == "10.0.0.3")
+    assert allocator.next_available("10.0.0.0/24") == "10.0.0.4"
+    assert not allocator.bitmap("10.0.0.0/24").is_free("10.0.0.3")
+
+
+def test_tracks_commits(client):
+    """Create, delete and IP changes update the bitmap after commit; soft delete keeps the address"""
+    def add(name, ip):
+        peer = Peer(name=name, public_key=name[0].upper() * 43 + "=", assigned_ip=ip)
+        db.session.add(peer)
+        db.session.commit()
+        return peer
+
+    assert get_next_available_ip() == "10.0.0.2"
+    first = add("alpha", "10.0.0.2")
+    second = add("bravo", get_next_available_ip())
+    assert second.assigned_ip == "10.0.0.3"
+    assert get_next_available_ip() == "10.0.0.4"
+
+    second.soft_delete()
+    assert get_next_available_ip() == "10.0.0.4"
+
+    db.session.delete(first)
+    db.session.commit()
+    assert get_next_available_ip() == "10.0.0.2"
+
+    second.assigned_ip = "10.0.0.9"
+    db.session.commit()
+    assert get_next_available_ip() == "10.0.0.2"
+    add("charlie", "10.0.0.2")
+    assert get_next_available_ip() == "10.0.0.3"
+
+    # Rolled-back flushes must not leave phantom reservations
+    db.session.add(Peer(name="delta", public_key="D" * 43 + "=", assigned_ip="10.0.0.3"))
+    db.session.flush()
+    db.session.rollback()
+    assert get_next_available_ip() == "10.0.0.3"
+
+    Peer.query.filter_by(name="charlie").delete()
+    db.session.commit()
+    assert get_next_available_ip() == "10.0.0.2"
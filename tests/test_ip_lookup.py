@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Tests for the indexed address/range key columns and /api/v1/ip-lookup
+"""
+
+from app import db
+from app.cidr import address_key
+from app.migrations import backfill_network_keys
+from app.models import AllowedIP, Peer
+
+
+def _setup():
+    peer = Peer(name="branch", public_key="B" * 43 + "=", assigned_ip="10.0.0.2", assigned_ipv6="fd42::2")
+    other = Peer(name="lab", public_key="L" * 43 + "=", assigned_ip="10.0.0.3")
+    db.session.add_all([peer, other])
+    db.session.flush()
+    db.session.add_all([
+        AllowedIP(peer_id=peer.id, ip_network="192.168.0.0/16"),
+        AllowedIP(peer_id=other.id, ip_network="172.16.4.0/24"),
+        AllowedIP(peer_id=peer.id, ip_network="2001:db8::/48"),
+    ])
+    db.session.commit()
+    return peer, other
+
+
+def test_keys_follow_attribute_changes(client):
+    peer, _ = _setup()
+    assert peer.assigned_ip_key == address_key(0x0A000002)
+    allowed = peer.allowed_ip_ranges.filter_by(ip_network="192.168.0.0/16").first()
+    assert (allowed.family, allowed.range_end) == (4, address_key(0xC0A8FFFF))
+
+    peer.assigned_ip = "10.0.0.9"
+    db.session.commit()
+    assert peer.assigned_ip_key == address_key(0x0A000009)
+
+    # Bulk SQL bypasses the events; the backfill repairs the keys
+    Peer.query.filter_by(id=peer.id).update({'assigned_ip': '10.0.0.10'})
+    db.session.commit()
+    backfill_network_keys()
+    db.session.commit()
+    db.session.refresh(peer)
+    assert peer.assigned_ip_key == address_key(0x0A00000A)
+
+
+def test_ip_lookup_endpoint(client):
+    _setup()
+    data = client.get('/api/v1/ip-lookup?address=192.168.3.7').get_json()['data']
+    assert data['owner']['peer_name'] == "branch"
+    assert data['owner']['network'] == "192.168.0.0/16"
+
+    data = client.get('/api/v1/ip-lookup?address=10.0.0.3').get_json()['data']
+    assert (data['owner']['peer_name'], data['owner']['kind']) == ("lab", "assigned")
+
+    data = client.get('/api/v1/ip-lookup?address=2001:db8:0:5::1').get_json()['data']
+    assert data['owner']['peer_name'] == "branch"
+
+    data = client.get('/api/v1/ip-lookup?network=10.0.0.0/24').get_json()['data']
+    assert sorted(match['network'] for match in data['matches']) == ["10.0.0.2", "10.0.0.3"]
+    assert client.get('/api/v1/ip-lookup?address=8.8.8.8').get_json()['data']['owner'] is None
+    assert client.get('/api/v1/ip-lookup?address=nope').status_code == 400
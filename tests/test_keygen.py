@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+"""
+Tests for in-process WireGuard key generation
+"""
+
+import base64
+
+from app.keygen import KeyPool, _x25519, generate_keypair, generate_preshared_key, public_key_from_private
+
+
+def test_x25519_rfc7748_vector():
+    """Pure-Python fallback ladder matches the RFC 7748 test vector"""
+    scalar = bytes.fromhex("a546e36bf0527c9d3b16154b82465edd62144c0ac1fc5a18506a2244ba449ac4")
+    u = int.from_bytes(bytes.fromhex("e6db6867583030db3594c1a424b15f7c726624ec26b3353b10a903a6d0ab1c4c"),
+                       "little") & ((1 << 255) - 1)
+    assert _x25519(scalar, u).hex() == "c3da55379de9c6908e94ea4df28d084f32eccf03491c71f754b4075577a28552"
+
+
+def test_keypair_format():
+    """Keys are 32-byte base64 strings and the public key is derived deterministically"""
+    private_key, public_key = generate_keypair()
+    assert len(base64.b64decode(private_key)) == 32
+    assert public_key_from_private(private_key) == public_key
+    assert len(base64.b64decode(generate_preshared_key())) == 32
+    assert generate_preshared_key() != generate_preshared_key()
+
+
+def test_pool_falls_back_when_empty():
+    """An empty pool generates inline instead of blocking"""
+    pool = KeyPool(size=2, low_watermark=0, generator=iter(range(10)).__next__)
+    pool.fill()
+    assert [pool.get_keypair() for _ in range(3)] == [0, 1, 2]
+    assert (pool.hits, pool.misses) == (2, 1)
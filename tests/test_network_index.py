@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Tests for the interval index behind allowed-IP validation
+"""
+
+import ipaddress
+import random
+
+from app import db
+from app.cidr import network_interval
+from app.models import AllowedIP, Peer
+from app.network_index import IntervalIndex
+from app.utils import validate_allowed_ip_network, validate_multiple_allowed_ips
+
+
+def test_matches_pairwise_overlaps():
+    """Index queries return exactly what pairwise network.overlaps() finds"""
+    rng = random.Random(7)
+    networks = [ipaddress.ip_network(f"10.{rng.randrange(4)}.{rng.randrange(256)}.0/{rng.choice([16, 20, 24, 28])}",
+                                     strict=False) for _ in range(300)]
+    index = IntervalIndex(network_interval(n) + (i,) for i, n in enumerate(networks))
+    for _ in range(100):
+        query = ipaddress.ip_network(f"10.{rng.randrange(4)}.{rng.randrange(256)}.{rng.randrange(256)}/"
+                                     f"{rng.choice([18, 24, 30, 32])}", strict=False)
+        expected = {i for i, n in enumerate(networks) if n.overlaps(query)}
+        assert set(index.overlapping_network(query)) == expected
+
+
+def test_validation_uses_committed_state(client):
+    peer = Peer(name="office", public_key="O" * 43 + "=", assigned_ip="10.0.0.2")
+    db.session.add(peer)
+    db.session.commit()
+
+    assert validate_allowed_ip_network("192.168.10.0/24") == (True, "")
+    db.session.add(AllowedIP(peer_id=peer.id, ip_network="192.168.10.0/24"))
+    db.session.commit()
+
+    valid, error = validate_allowed_ip_network("192.168.10.128/25")
+    assert not valid and "peer 'office' allowed IP 192.168.10.0/24" in error
+    assert validate_allowed_ip_network("192.168.10.128/25", peer_id=peer.id) == (True, "")
+    assert "VPN subnet" in validate_allowed_ip_network("10.0.0.0/16")[1]
+
+    valid, errors = validate_multiple_allowed_ips(["172.16.0.0/24", "172.16.0.128/25", "bogus", "192.168.10.7/32"])
+    assert not valid
+    assert errors == [
+        "Invalid IP network format: bogus",
+        "IP network 192.168.10.7/32 overlaps with peer 'office' allowed IP 192.168.10.0/24",
+        "IP networks 172.16.0.0/24 and 172.16.0.128/25 overlap with each other",
+    ]
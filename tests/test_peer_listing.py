@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Tests for the paginated peer listing API
+"""
+
+from datetime import datetime, timedelta, timezone
+
+from app import db
+from app.models import AllowedIP, Peer
+
+
+def _add_peers(count):
+    base = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    for i in range(count):
+        db.session.add(Peer(name=f"peer-{i:03d}", public_key=f"{i:03d}".rjust(43, "K") + "=",
+                            assigned_ip=f"10.0.{i // 200}.{i % 200 + 2}", is_active=i % 3 != 0,
+                            created_at=base + timedelta(minutes=i // 2)))
+    db.session.flush()
+    db.session.add(AllowedIP(peer_id=1, ip_network="192.168.50.0/24"))
+    db.session.commit()
+
+
+def _all_pages(client, query):
+    names, cursor = [], None
+    while True:
+        url = f"/api/v1/peers?{query}" + (f"&cursor={cursor}" if cursor else "")
+        body = client.get(url).get_json()
+        names.extend(peer['name'] for peer in body['data'])
+        cursor = body['pagination']['next_cursor']
+        if not cursor:
+            return names
+
+
+def test_keyset_pages_cover_every_peer_once(client):
+    _add_peers(45)
+    expected = sorted(f"peer-{i:03d}" for i in range(45))
+    assert _all_pages(client, "limit=10") == expected
+    assert _all_pages(client, "limit=7&sort=name&order=desc") == expected[::-1]
+    # created_at has ties: the id tie-breaker keeps pages disjoint
+    assert _all_pages(client, "limit=4&sort=created_at") == expected
+
+
+def test_filters_and_projection(client):
+    _add_peers(45)
+    body = client.get('/api/v1/peers?fields=name,allowed_ips&limit=2').get_json()
+    assert body['data'][0] == {'name': 'peer-000', 'allowed_ips': ['192.168.50.0/24']}
+
+    inactive = client.get('/api/v1/peers?active=false&limit=100&fields=id').get_json()['data']
+    assert len(inactive) == 15
+
+    assert _all_pages(client, "name=peer-04&fields=name") == [f"peer-04{i}" for i in range(5)]
+    subnet = client.get('/api/v1/peers?subnet=10.0.0.0/28&fields=assigned_ip').get_json()['data']
+    assert [peer['assigned_ip'] for peer in subnet] == [f"10.0.0.{i}" for i in range(2, 16)]
+
+    assert client.get('/api/v1/peers?fields=password').status_code == 400
+    assert client.get('/api/v1/peers?cursor=garbage').status_code == 400
+
+    peer = client.get('/api/v1/peers/1').get_json()['data']
+    assert peer['allowed_ips'] == ['192.168.50.0/24'] and peer['name'] == 'peer-000'
+
+
+def test_index_page_is_paginated(client):
+    _add_peers(60)
+    page = client.get('/?limit=25').get_data(as_text=True)
+    assert page.count('class="form-check-input peer-toggle"') == 25
+    assert "Showing 25 of 60 peers" in page and "cursor=" in page
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Tests for the in-memory peer search index
+"""
+
+from app import db
+from app.models import Peer, PeerStatistics
+from app.peer_search import get_peer_search_index
+
+
+def _peer(name, key_prefix, ip, endpoint=None):
+    return Peer(name=name, public_key=key_prefix.ljust(43, "A") + "=", assigned_ip=ip, endpoint=endpoint)
+
+
+def test_search_fields_and_ranking(client):
+    db.session.add_all([
+        _peer("berlin-office", "xyz", "10.0.0.2", "vpn.berlin.example:51820"),
+        _peer("berlin", "Qk9", "10.0.0.3"),
+        _peer("hamburg-lab", "abc", "10.0.0.23"),
+    ])
+    db.session.commit()
+
+    names = lambda query: [peer['name'] for peer in client.get(f'/api/v1/peers/search?q={query}').get_json()['data']]
+    assert names("berlin") == ["berlin", "berlin-office"]  # exact before prefix
+    assert names("ERLI") == ["berlin", "berlin-office"]  # case-insensitive substring
+    assert names("Qk9") == ["berlin"]  # public key prefix
+    assert names("qk9") == []  # keys are case-sensitive
+    assert names("10.0.0.2") == ["berlin-office", "hamburg-lab"]
+    assert names("example:518") == ["berlin-office"]
+    assert names("ha") == ["hamburg-lab"]  # short queries match prefixes
+    assert names("ur") == []
+
+
+def test_index_follows_commits(client):
+    peer = _peer("alpha", "abc", "10.0.0.2")
+    db.session.add(peer)
+    db.session.commit()
+
+    index = get_peer_search_index()
+    assert [hit['name'] for hit in index.search("alpha")] == ["alpha"]
+
+    peer.name = "omega"
+    db.session.add(PeerStatistics(peer_id=peer.id, last_endpoint="203.0.113.9:40000"))
+    db.session.commit()
+    assert index.search("alpha") == []
+    hit, = index.search("203.0.113")
+    assert (hit['name'], hit['matched_field']) == ("omega", "last_endpoint")
+
+    db.session.delete(peer)
+    db.session.commit()
+    assert index.search("omega") == []
+    assert index.stats()['documents'] == 0
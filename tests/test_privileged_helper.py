@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Tests for the privileged helper daemon and client
+"""
+
+import socket
+import threading
+
+import pytest
+
+from app import privileged_helper
+from app.privileged_helper import HelperClient, HelperServer, execute, run_batch
+
+
+@pytest.fixture
+def echo_op(monkeypatch):
+    """Harmless stand-in operation: `cat` echoes its stdin"""
+    operations = dict(privileged_helper.OPERATIONS)
+    operations["echo"] = (lambda args: (["cat"], str(args.get("text", "")), 5), True)
+    monkeypatch.setattr(privileged_helper, "OPERATIONS", operations)
+
+
+@pytest.fixture
+def helper_socket(tmp_path, echo_op):
+    path = str(tmp_path / "helper.sock")
+    server = HelperServer(path)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield path
+    server.shutdown()
+    server.server_close()
+
+
+def test_rejects_unknown_and_invalid_operations():
+    """Only allowlisted operations with valid arguments are executed"""
+    assert execute("rm", {"path": "/"}).error == "invalid"
+    assert execute("wg_show", {"interface": "wg0; reboot"}).error == "invalid"
+    assert execute("ping", {"address": "example.com"}).error == "invalid"
+    assert execute("iptables_save", {"table": "bogus"}).error == "invalid"
+
+
+def test_batch_over_socket_keeps_order(helper_socket):
+    """A batch is answered in one round trip with results in request order"""
+    client = HelperClient(helper_socket, fallback=False)
+    results = client.run_batch([("echo", {"text": "a"}), ("echo", {"text": "b"}), ("nope", {})], parallel=True)
+    assert [r.stdout for r in results[:2]] == ["a", "b"]
+    assert results[2].error == "invalid"
+
+    # The connection is reused for the next request
+    connection = client.local.conn
+    assert client.run("echo", text="again").stdout == "again"
+    assert client.local.conn is connection
+
+
+def test_large_batches_are_split(helper_socket, monkeypatch):
+    """More ops than MAX_BATCH take several round trips; every op still gets its own result"""
+    monkeypatch.setattr(privileged_helper, "MAX_BATCH", 2)
+    ops = [{"op": "echo", "args": {"text": str(i)}} for i in range(3)]
+    assert [(r.op, r.error) for r in run_batch(ops)] == [("echo", "invalid")] * 3
+
+    client = HelperClient(helper_socket, fallback=False)
+    sent = []
+    send = client._send
+    monkeypatch.setattr(client, "_send", lambda payload, resend=False: sent.append(payload) or send(payload, resend))
+    results = client.run_batch([("echo", {"text": str(i)}) for i in range(5)])
+    assert [r.stdout for r in results] == ["0", "1", "2", "3", "4"] and len(sent) == 3
+
+
+def test_client_fallback_without_daemon(tmp_path, echo_op):
+    """Without a daemon the client runs the operation in-process, or reports a transport error"""
+    missing = str(tmp_path / "missing.sock")
+    assert HelperClient(missing, fallback=True).run("echo", text="local").stdout == "local"
+    assert HelperClient(missing, fallback=False).run("echo", text="x").error == "transport"
+
+
+def test_written_requests_are_not_sent_twice(tmp_path, monkeypatch, echo_op):
+    """A connection lost after the request was written is only retried for read-only batches"""
+    operations = dict(privileged_helper.OPERATIONS)
+    operations["apply"] = (lambda args: (["cat"], "applied", 5), False)
+    monkeypatch.setattr(privileged_helper, "OPERATIONS", operations)
+    path, received = str(tmp_path / "flaky.sock"), []
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen()
+
+    def serve():
+        # Reads every request and drops the connection without answering
+        while True:
+            conn, _ = listener.accept()
+            with conn, conn.makefile("rb") as reader:
+                received.append(reader.readline())
+
+    threading.Thread(target=serve, daemon=True).start()
+    client = HelperClient(path, fallback=True)
+    result = client.run("apply")
+    assert result.error == "transport" and result.stdout == "" and len(received) == 1
+
+    # Read-only: resent once, then run in-process
+    assert client.run("echo", text="local").stdout == "local" and len(received) == 3
+    listener.close()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Tests for split-tunnel route profiles in client configs
+"""
+
+from app import db
+from app.models import Peer, RouteProfile
+
+
+def _create_peer():
+    peer = Peer(name="laptop", public_key="A" * 43 + "=", preshared_key="B" * 43 + "=", assigned_ip="10.0.0.2")
+    db.session.add(peer)
+    db.session.commit()
+    return peer
+
+
+def test_config_defaults_to_full_tunnel(client):
+    """Peers without a profile keep routing everything"""
+    peer = _create_peer()
+    response = client.get(f'/peers/{peer.id}/config')
+    assert response.status_code == 200
+    assert b"AllowedIPs = 0.0.0.0/0\n" in response.data
+
+
+def test_route_profile_applies_to_client_configs(client):
+    """Attaching a profile changes every client config endpoint"""
+    peer = _create_peer()
+    response = client.post('/api/v1/route-profiles', json={
+        'name': 'no-lan', 'excluded_networks': '192.168.0.0/16', 'include_ipv6': False
+    })
+    assert response.status_code == 201
+    profile_id = response.get_json()['data']['id']
+
+    response = client.put(f'/api/v1/peers/{peer.id}/route-profile', json={'route_profile_id': profile_id})
+    assert response.status_code == 200
+
+    config = client.get(f'/api/v1/peers/{peer.id}/config').get_json()['data']['config']
+    assert "192.169.0.0/16" in config
+    assert "192.168.0.0" not in config
+    assert "10.0.0.0/24" not in config  # Already covered by the 0.0.0.0/1 route
+    assert "0.0.0.0/1" in client.get(f'/peers/{peer.id}/config').get_data(as_text=True)
+
+
+def test_invalid_excluded_network_rejected(client):
+    """Malformed CIDRs are refused"""
+    response = client.post('/api/v1/route-profiles', json={'name': 'bad', 'excluded_networks': ['10.0.0.300/8']})
+    assert response.status_code == 400
+    assert RouteProfile.query.count() == 0